@@ -0,0 +1,121 @@
+"""
+PDS-32: Fil d'activité consolidé - fusion k-voies des dernières lignes de chaque table
+"""
+
+import base64
+import heapq
+
+# Catégorie -> (table, colonnes, mise en forme du détail). L'ordre sert à départager
+# deux lignes de même horodatage, de façon stable entre les pages.
+CATEGORIES = {
+    'energy': (
+        'energy_data', 'power, energy_total',
+        lambda power, energy: 'Puissance: %.2fW | Énergie: %.3fkWh' % (power or 0, energy or 0)
+    ),
+    'sensor': (
+        'sensor_readings', 'temperature, humidity, light_level',
+        lambda temperature, humidity, light: 'Temp: %.1f°C | Humidité: %.1f%% | Luminosité: %d%%' % (
+            temperature or 0, humidity or 0, int(light or 0))
+    ),
+    'presence': (
+        'presence_data', 'presence',
+        lambda presence: 'Présence détectée' if presence == 1 else 'Aucune présence'
+    ),
+    'actuator': (
+        'actuator_states', 'relay1, relay2, auto_mode',
+        lambda relay1, relay2, auto: 'HVAC: %s | Lumière: %s | Auto: %s' % (
+            'ON' if relay1 == 1 else 'OFF', 'ON' if relay2 == 1 else 'OFF', 'ON' if auto == 1 else 'OFF')
+    ),
+}
+
+RANKS = {category: rank for rank, category in enumerate(CATEGORIES)}
+
+MAX_LIMIT = 100
+
+
+class ActivityError(ValueError):
+    """Paramètres du fil d'activité invalides (renvoyés en 400 par l'API)"""
+
+
+def encode_cursor(timestamp, category, row_id):
+    """Curseur opaque: clé (timestamp, catégorie, id) du dernier événement servi"""
+    return base64.urlsafe_b64encode(f"{timestamp}|{category}|{row_id}".encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, category, row_id = raw.rsplit('|', 2)
+        if category not in CATEGORIES:
+            raise ValueError(category)
+        return timestamp, category, int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ActivityError(f"Invalid cursor: {cursor}")
+
+
+def _latest(conn, category, limit, device_id, before):
+    """Au plus `limit` lignes d'une table, les plus récentes d'abord (parcours d'index)"""
+    table, columns, _ = CATEGORIES[category]
+    clauses, params = [], []
+    if before is not None:
+        timestamp, before_category, row_id = before
+        rank, before_rank = RANKS[category], RANKS[before_category]
+        # Ordre global: (timestamp, rang de catégorie, id) décroissant
+        if rank < before_rank:
+            clauses.append('timestamp <= ?')
+            params.append(timestamp)
+        elif rank > before_rank:
+            clauses.append('timestamp < ?')
+            params.append(timestamp)
+        else:
+            clauses.append('timestamp <= ? AND (timestamp, id) < (?, ?)')
+            params.extend([timestamp, timestamp, row_id])
+    if device_id:
+        clauses.append('device_id = ?')
+        params.append(device_id)
+    where = (' WHERE ' + ' AND '.join(clauses)) if clauses else ''
+    rows = conn.execute(f'''
+        SELECT timestamp, id, device_id, {columns}
+        FROM {table}{where}
+        ORDER BY timestamp DESC, id DESC
+        LIMIT ?
+    ''', params + [limit]).fetchall()
+    rank = RANKS[category]
+    # Clé de tri croissante pour heapq.merge(reverse=True)
+    return [((row[0] or '', rank, row[1]), category, row) for row in rows]
+
+
+def latest_events(conn, limit=20, categories=None, device_id=None, before=None):
+    """Derniers événements toutes tables confondues; retourne (événements, curseur suivant)
+
+    Chaque table ne fournit que ses `limit` lignes les plus récentes: le coût
+    dépend de `limit`, pas de la taille de l'historique.
+    """
+    categories = categories or list(CATEGORIES)
+    for category in categories:
+        if category not in CATEGORIES:
+            raise ActivityError(f"Invalid category: {category}")
+    limit = max(1, min(limit, MAX_LIMIT))
+
+    # Une ligne de plus que demandé pour savoir s'il existe une page suivante
+    streams = [_latest(conn, category, limit + 1, device_id, before) for category in categories]
+    merged = heapq.merge(*streams, key=lambda item: item[0], reverse=True)
+
+    events = []
+    next_cursor = None
+    for key, category, row in merged:
+        if len(events) == limit:
+            last = events[-1]
+            next_cursor = encode_cursor(last['timestamp'], last['category'], last['id'])
+            break
+        _, _, describe = CATEGORIES[category]
+        events.append({
+            'id': row[1],
+            'timestamp': row[0],
+            'category': category,
+            'device_id': row[2],
+            'details': describe(*row[3:]),
+        })
+    return events, next_cursor
@@ -0,0 +1,453 @@
+"""
+PDS-32: Moteur de règles d'alerte - seuils par appareil, hystérésis, durée minimale,
+vitesse de variation, absence de données et anomalies (anomalies.py), évalués en mémoire
+"""
+
+import fnmatch
+import json
+import os
+import threading
+import time
+
+import anomalies
+import logs
+
+log = logs.get('alerts')
+
+# Règles d'anomalie: la valeur comparée au seuil est le score d'un détecteur en flux
+ANOMALY_KINDS = tuple(anomalies.DETECTORS)
+KINDS = ('threshold', 'rate', 'missing') + ANOMALY_KINDS
+
+OPERATORS = {
+    '>': lambda value, limit: value > limit,
+    '>=': lambda value, limit: value >= limit,
+    '<': lambda value, limit: value < limit,
+    '<=': lambda value, limit: value <= limit,
+    '==': lambda value, limit: value == limit,
+}
+
+# États d'une machine (règle, appareil)
+OK, PENDING, FIRING = 'ok', 'pending', 'firing'
+
+
+class RuleError(ValueError):
+    """Fichier de règles invalide (le jeu de règles courant est conservé)"""
+
+
+class Rule:
+    """Règle déclarative; les champs d'un appareil peuvent être surchargés via `overrides`"""
+
+    FIELDS = ('op', 'value', 'hysteresis', 'for_seconds', 'per_seconds', 'timeout_seconds', 'severity',
+              'alpha', 'fast_alpha', 'warmup', 'min_std', 'tolerance')
+
+    def __init__(self, spec):
+        try:
+            self.id = spec['id']
+            self.kind = spec.get('kind', 'threshold')
+            self.source = spec['source']
+            self.metric = spec.get('metric')
+            self.alert_type = spec.get('alert_type', self.id.upper())
+            self.message = spec.get('message', self.alert_type + ' ({device_id})')
+        except (KeyError, TypeError, AttributeError) as e:
+            raise RuleError(f"Rule {spec!r}: missing field {e}")
+        if self.kind not in KINDS:
+            raise RuleError(f"Rule {self.id}: invalid kind {self.kind}")
+        if self.kind != 'missing' and not self.metric:
+            raise RuleError(f"Rule {self.id}: 'metric' is required")
+
+        self.devices = spec.get('devices') or ['*']
+        self.defaults = {
+            'op': spec.get('op', '>'),
+            'value': spec.get('value'),
+            'hysteresis': float(spec.get('hysteresis', 0)),
+            'for_seconds': float(spec.get('for_seconds', 0)),
+            'per_seconds': float(spec.get('per_seconds', 60)),
+            'timeout_seconds': float(spec.get('timeout_seconds', 300)),
+            'severity': spec.get('severity', 'WARNING'),
+            # Anomalies: lissage de la référence (et de la moyenne rapide), mesures avant
+            # le premier score, écart-type plancher, variation ignorée (valeur figée)
+            'alpha': float(spec.get('alpha', 0.01)),
+            'fast_alpha': float(spec.get('fast_alpha', 0)),
+            'warmup': int(spec.get('warmup', 60)),
+            'min_std': float(spec.get('min_std', 0)),
+            'tolerance': float(spec.get('tolerance', 0)),
+        }
+        self.overrides = spec.get('overrides', {})
+        self._params = {}
+        self._validate(self.defaults)
+        for device_id, override in self.overrides.items():
+            unknown = set(override) - set(self.FIELDS)
+            if unknown:
+                raise RuleError(f"Rule {self.id}: unknown override fields {sorted(unknown)} for {device_id}")
+            self._validate(dict(self.defaults, **override))
+        self._validate_message()
+
+    def _validate_message(self):
+        """Gabarit du message formaté à vide au chargement: une erreur (champ inconnu,
+        format incompatible) rejette le fichier au lieu d'échouer à chaque mesure"""
+        # Valeur passée à _open: durée en secondes (entière) pour 'missing', mesure ou score sinon
+        sample = 0 if self.kind == 'missing' else 0.0
+        for params in [self.defaults] + [dict(self.defaults, **o) for o in self.overrides.values()]:
+            try:
+                self.message.format(device_id='device', value=sample, threshold=params['value'])
+            except (KeyError, IndexError, ValueError, TypeError, AttributeError) as e:
+                raise RuleError(f"Rule {self.id}: invalid message template {self.message!r}: {e!r}")
+
+    def _validate(self, params):
+        if params['op'] not in OPERATORS:
+            raise RuleError(f"Rule {self.id}: invalid operator {params['op']}")
+        if self.kind != 'missing' and not isinstance(params['value'], (int, float)):
+            raise RuleError(f"Rule {self.id}: numeric 'value' is required")
+        if not (0 < params.get('alpha', 0.01) <= 1 and 0 <= params.get('fast_alpha', 0) <= 1):
+            raise RuleError(f"Rule {self.id}: 'alpha' and 'fast_alpha' must be in ]0, 1]")
+
+    def params(self, device_id):
+        """Paramètres effectifs pour un appareil (None si la règle ne le concerne pas)"""
+        try:
+            return self._params[device_id]
+        except KeyError:
+            pass
+        params = None
+        if any(fnmatch.fnmatchcase(device_id, pattern) for pattern in self.devices):
+            params = dict(self.defaults, **self.overrides.get(device_id, {}))
+            params['test'] = OPERATORS[params['op']]
+            params['clear'] = _clear_test(params['op'], params['value'], params['hysteresis'])
+        self._params[device_id] = params
+        return params
+
+
+def _clear_test(op, limit, hysteresis):
+    """Condition de retour à la normale, décalée de l'hystérésis"""
+    if limit is None:
+        return None
+    if op in ('>', '>='):
+        return lambda value: value < limit - hysteresis
+    if op in ('<', '<='):
+        return lambda value: value > limit + hysteresis
+    return lambda value: abs(value - limit) > hysteresis
+
+
+class Machine:
+    """État d'une règle pour un appareil"""
+
+    __slots__ = ('state', 'since', 'alert_id', 'last_value', 'last_at', 'seen_at', 'detector', 'score')
+
+    def __init__(self):
+        self.state = OK
+        self.since = None
+        self.alert_id = None
+        self.last_value = None
+        self.last_at = None
+        self.seen_at = None
+        # Règles d'anomalie: état du détecteur (mémoire constante) et dernier score
+        self.detector = None
+        self.score = None
+
+
+def load_rules(path):
+    """Lit et valide un fichier JSON {"rules": [...]}"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            document = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        raise RuleError(f"Cannot load {path}: {e}")
+    rules = []
+    seen = set()
+    for spec in document.get('rules', []):
+        if not spec.get('enabled', True):
+            continue
+        rule = Rule(spec)
+        if rule.id in seen:
+            raise RuleError(f"Duplicate rule id: {rule.id}")
+        seen.add(rule.id)
+        rules.append(rule)
+    return rules
+
+
+class _Opening:
+    """Alerte ouverte sous le verrou d'état; `alert`: valeur retournée par on_open"""
+
+    __slots__ = ('alert',)
+
+    def __init__(self):
+        self.alert = None
+
+
+class AlertEngine:
+    """Évalue les règles à chaque mesure; la base n'est touchée qu'à l'ouverture
+    et à la résolution d'une alerte (callbacks on_open / on_resolve)
+
+    Les callbacks sont appelés hors du verrou d'état (thread MQTT, balayage et
+    statistiques ne s'attendent pas), dans l'ordre des transitions.
+    """
+
+    def __init__(self, on_open, on_resolve, path=None, reload_interval=5, sweep_interval=1, utc_offset_hours=0):
+        self.on_open = on_open
+        self.on_resolve = on_resolve
+        self.path = path
+        self.reload_interval = reload_interval
+        self.sweep_interval = sweep_interval
+        # Heure locale des références saisonnières
+        self.utc_offset = int(utc_offset_hours) * 3600
+        self._rules = {}
+        self._by_source = {}
+        self._missing = []
+        self._machines = {}
+        self._lock = threading.RLock()
+        # Callbacks des transitions (_claim sous le verrou, _dispatch après)
+        self._actions = []
+        self._dispatch_lock = threading.Lock()
+        self._mtime = None
+        self._thread = None
+        self._stop = threading.Event()
+        self.evaluated = 0
+        self.opened = 0
+        self.resolved = 0
+        self.last_error = None
+
+    # ---------- Règles ----------
+    def set_rules(self, rules):
+        """Remplace le jeu de règles; les machines des règles conservées gardent leur état"""
+        with self._lock:
+            kept = {rule.id for rule in rules}
+            for (rule_id, device_id), machine in list(self._machines.items()):
+                if rule_id not in kept:
+                    if machine.state == FIRING:
+                        self._resolve(machine)
+                    del self._machines[(rule_id, device_id)]
+            self._rules = {rule.id: rule for rule in rules}
+            self._by_source = {}
+            for rule in rules:
+                self._by_source.setdefault(rule.source, []).append(rule)
+            self._missing = [rule for rule in rules if rule.kind == 'missing']
+            actions = self._claim()
+        if actions:
+            self._dispatch(actions)
+
+    def reload(self, force=False):
+        """Recharge le fichier s'il a changé; retourne True si les règles ont été remplacées"""
+        if not self.path:
+            return False
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            self.last_error = str(e)
+            return False
+        if not force and mtime == self._mtime:
+            return False
+        try:
+            rules = load_rules(self.path)
+        except RuleError as e:
+            # Fichier en cours d'édition ou invalide: on garde les règles actuelles
+            self.last_error = str(e)
+            self._mtime = mtime
+            log.warning("✗ Alert rules not reloaded: %s", e)
+            return False
+        self.set_rules(rules)
+        self._mtime = mtime
+        self.last_error = None
+        log.info("✓ Alert rules loaded: %d rules from %s", len(rules), self.path)
+        return True
+
+    def restore(self, open_alerts):
+        """Reprend les alertes ouvertes en base: [(alert_id, rule_id, device_id)]"""
+        with self._lock:
+            for alert_id, rule_id, device_id in open_alerts:
+                if rule_id in self._rules:
+                    machine = self._machine(rule_id, device_id or '')
+                    machine.state = FIRING
+                    machine.alert_id = alert_id
+
+    # ---------- Cycle de vie ----------
+    def start(self):
+        """Démarre le rechargement à chaud et la détection d'absence de données"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='alert-rules', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        next_reload = time.monotonic() + self.reload_interval
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                self.sweep()
+                if time.monotonic() >= next_reload:
+                    self.reload()
+                    next_reload = time.monotonic() + self.reload_interval
+            except Exception as e:
+                log.exception("✗ Alert engine error: %s", e)
+
+    def stats(self):
+        with self._lock:
+            states = {OK: 0, PENDING: 0, FIRING: 0}
+            for machine in self._machines.values():
+                states[machine.state] += 1
+            return {
+                'rules': len(self._rules),
+                'machines': states,
+                'evaluated': self.evaluated,
+                'opened': self.opened,
+                'resolved': self.resolved,
+                'path': self.path,
+                'last_error': self.last_error,
+            }
+
+    def anomalies(self, device_id=None):
+        """Dernier score et référence de chaque (règle d'anomalie, appareil)"""
+        with self._lock:
+            scores = []
+            for (rule_id, machine_device), machine in self._machines.items():
+                rule = self._rules.get(rule_id)
+                if rule is None or rule.kind not in ANOMALY_KINDS or machine.detector is None:
+                    continue
+                if device_id is not None and machine_device != device_id:
+                    continue
+                scores.append({
+                    'rule_id': rule_id,
+                    'kind': rule.kind,
+                    'source': rule.source,
+                    'metric': rule.metric,
+                    'device_id': machine_device or None,
+                    'state': machine.state,
+                    'score': None if machine.score is None else round(machine.score, 3),
+                    'threshold': (rule.params(machine_device) or rule.defaults)['value'],
+                    'at': machine.last_at,
+                    'baseline': machine.detector.describe(),
+                })
+            return scores
+
+    def describe(self):
+        with self._lock:
+            return [
+                dict(rule.defaults, id=rule.id, kind=rule.kind, source=rule.source, metric=rule.metric,
+                     alert_type=rule.alert_type, devices=rule.devices, overrides=rule.overrides)
+                for rule in self._rules.values()
+            ]
+
+    # ---------- Évaluation ----------
+    def _machine(self, rule_id, device_id):
+        key = (rule_id, device_id)
+        machine = self._machines.get(key)
+        if machine is None:
+            machine = self._machines[key] = Machine()
+        return machine
+
+    def evaluate(self, source, device_id, payload, now=None):
+        """Évalue les règles d'une source pour une mesure reçue"""
+        rules = self._by_source.get(source)
+        if not rules:
+            return
+        if now is None:
+            now = time.time()
+        device_id = device_id or ''
+        with self._lock:
+            self.evaluated += 1
+            for rule in rules:
+                params = rule.params(device_id)
+                if params is None:
+                    continue
+                machine = self._machine(rule.id, device_id)
+                machine.seen_at = now
+                if rule.kind == 'missing':
+                    if machine.state == FIRING:
+                        self._resolve(machine)
+                    continue
+
+                value = payload.get(rule.metric)
+                if not isinstance(value, (int, float)):
+                    continue
+                if rule.kind == 'rate':
+                    previous, previous_at = machine.last_value, machine.last_at
+                    machine.last_value, machine.last_at = value, now
+                    if previous is None or now <= previous_at:
+                        continue
+                    # Variation ramenée à la période de la règle
+                    measured = (value - previous) * params['per_seconds'] / (now - previous_at)
+                elif rule.kind in ANOMALY_KINDS:
+                    if machine.detector is None:
+                        machine.detector = anomalies.DETECTORS[rule.kind]()
+                    # Référence gelée pendant une alerte: l'anomalie ne devient pas la norme
+                    measured = machine.detector.score(value, now, params, machine.state == FIRING, self.utc_offset)
+                    machine.score, machine.last_at = measured, now
+                    if measured is None:
+                        continue
+                else:
+                    measured = value
+                self._step(rule, params, machine, device_id, measured, now)
+            actions = self._claim()
+        if actions:
+            self._dispatch(actions)
+
+    def _step(self, rule, params, machine, device_id, measured, now):
+        if params['test'](measured, params['value']):
+            if machine.state == OK:
+                machine.state, machine.since = PENDING, now
+            if machine.state == PENDING and now - machine.since >= params['for_seconds']:
+                self._open(rule, params, machine, device_id, measured)
+        elif machine.state == PENDING:
+            machine.state, machine.since = OK, None
+        elif machine.state == FIRING and params['clear'](measured):
+            self._resolve(machine)
+
+    def sweep(self, now=None):
+        """Détecte les appareils silencieux depuis timeout_seconds"""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            for rule in self._missing:
+                for (rule_id, device_id), machine in self._machines.items():
+                    if rule_id != rule.id or machine.state == FIRING or machine.seen_at is None:
+                        continue
+                    params = rule.params(device_id)
+                    silent = now - machine.seen_at
+                    if params and silent >= params['timeout_seconds']:
+                        self._open(rule, params, machine, device_id, round(silent))
+            actions = self._claim()
+        if actions:
+            self._dispatch(actions)
+
+    def _claim(self):
+        """Sous le verrou d'état: callbacks des transitions à appeler après sa libération.
+        Le verrou de diffusion est pris avant: ordre des callbacks = ordre des transitions"""
+        if not self._actions:
+            return None
+        actions, self._actions = self._actions, []
+        self._dispatch_lock.acquire()
+        return actions
+
+    def _dispatch(self, actions):
+        """Appelle on_open / on_resolve hors du verrou d'état (libère le verrou de diffusion)"""
+        try:
+            for action in actions:
+                try:
+                    if action[0] == 'open':
+                        _, opening, rule, device_id, severity, message = action
+                        opening.alert = self.on_open(rule, device_id, severity, message)
+                    else:
+                        alert = action[1]
+                        if isinstance(alert, _Opening):
+                            alert = alert.alert
+                        if alert is not None:
+                            self.on_resolve(alert)
+                except Exception as e:
+                    log.exception("✗ Alert %s callback failed: %s", action[0], e)
+        finally:
+            self._dispatch_lock.release()
+
+    def _open(self, rule, params, machine, device_id, value):
+        message = rule.message.format(device_id=device_id, value=value, threshold=params['value'])
+        machine.state = FIRING
+        machine.alert_id = opening = _Opening()
+        self._actions.append(('open', opening, rule, device_id, params['severity'], message))
+        self.opened += 1
+
+    def _resolve(self, machine):
+        alert_id = machine.alert_id
+        machine.state, machine.since, machine.alert_id = OK, None, None
+        if alert_id is not None:
+            self._actions.append(('resolve', alert_id))
+        self.resolved += 1
@@ -0,0 +1,332 @@
+"""
+PDS-32: Moteur d'analyse vectorisé (NumPy) - consommation sur plage, appareils et pas arbitraires
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+import tariffs
+from timeseries import SQLiteStore
+
+# Sources possibles, de la plus fine à la plus grossière: (nom, table, résolution en secondes)
+SOURCES = (
+    ('raw', 'energy_data', 1),
+    ('1m', 'energy_rollup_1m', 60),
+    ('1h', 'energy_rollup_1h', 3600),
+    ('1d', 'energy_rollup_1d', 86400),
+)
+
+BUCKET_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+PERCENTILES = (50, 90, 95, 99)
+
+# Au-delà de ce nombre de lignes estimées, on passe à une source plus agrégée
+MAX_ROWS = 200000
+
+# Nombre maximal de pas par analyse (taille des tableaux et de la réponse)
+MAX_BUCKETS = 10000
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class AnalyticsError(ValueError):
+    """Paramètres d'analyse invalides (renvoyés en 400 par l'API)"""
+
+
+def parse_bucket(value):
+    """'15m', '1h', '1d' ou un nombre de secondes -> secondes"""
+    value = (value or '1h').strip().lower()
+    try:
+        if value[-1] in BUCKET_UNITS:
+            seconds = int(value[:-1]) * BUCKET_UNITS[value[-1]]
+        else:
+            seconds = int(value)
+    except ValueError:
+        raise AnalyticsError(f"Invalid bucket: {value}")
+    if seconds <= 0:
+        raise AnalyticsError(f"Invalid bucket: {value}")
+    return seconds
+
+
+def parse_time(value, default):
+    """Horodatage UTC 'YYYY-MM-DD[ HH:MM[:SS]]' ou ISO -> datetime naïf UTC"""
+    if not value:
+        return default
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise AnalyticsError(f"Invalid time: {value}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _to_epoch(timestamps):
+    return np.array(timestamps, dtype='datetime64[s]').astype(np.int64)
+
+
+def _epoch_to_str(epoch):
+    return datetime.fromtimestamp(int(epoch), timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+def energy_deltas(device_idx, counter):
+    """Consommation entre échantillons successifs d'un même compteur
+
+    Les lignes doivent être triées par (appareil, temps). Une baisse du
+    compteur est traitée comme une remise à zéro: la consommation de
+    l'intervalle vaut alors la nouvelle valeur du compteur.
+    """
+    deltas = np.zeros(len(counter))
+    if len(counter) < 2:
+        return deltas
+    diff = np.diff(counter)
+    same_device = device_idx[1:] == device_idx[:-1]
+    reset = diff < 0
+    step = np.where(reset, counter[1:], diff)
+    step = np.where(same_device & ~np.isnan(step), step, 0.0)
+    deltas[1:] = step
+    return deltas
+
+
+def _choose_source(conn, start, end, bucket_seconds, devices, requested, store):
+    """Source la plus fine compatible avec le pas, la rétention et le budget de lignes"""
+    if requested:
+        for name, table, resolution in SOURCES:
+            if name == requested:
+                return name, table, resolution
+        raise AnalyticsError(f"Invalid source: {requested}")
+
+    start_str = start.strftime(TIMESTAMP_FORMAT)
+    end_str = end.strftime(TIMESTAMP_FORMAT)
+    device_filter, params = _device_filter(devices)
+
+    # Estimation à partir des agrégats horaires: lignes brutes et nombre de seaux
+    hour_rows, raw_rows = conn.execute(f'''
+        SELECT COUNT(*), COALESCE(SUM(samples), 0) FROM energy_rollup_1h
+        WHERE bucket >= ? AND bucket < ?{device_filter}
+    ''', [start_str[:13] + ':00:00', end_str] + params).fetchone()
+    estimates = {'raw': raw_rows, '1m': hour_rows * 60, '1h': hour_rows, '1d': hour_rows / 24}
+
+    for name, table, resolution in SOURCES:
+        if bucket_seconds % resolution:
+            continue
+        if name == 'raw':
+            first_raw = store.first_time('energy_data')
+            if first_raw is None or first_raw > start_str:
+                continue
+        # Le budget brut dépend du moteur (un stockage colonnes lit des mois de mesures)
+        if estimates[name] <= (store.max_scan_rows if name == 'raw' else MAX_ROWS):
+            return name, table, resolution
+    return SOURCES[-1]
+
+
+def _device_filter(devices):
+    if not devices:
+        return '', []
+    return f" AND device_id IN ({','.join('?' * len(devices))})", list(devices)
+
+
+def _load(conn, source, table, start, end, devices, store):
+    """Charge les colonnes utiles une seule fois, sous forme de tableaux NumPy"""
+    if source == 'raw':
+        # Mesures brutes: via le moteur de séries (tables SQLite ou segments colonnes)
+        data = store.load('energy_data', start, end, devices, ('power', 'energy_total'))
+        if data is not None:
+            data['peak_power'] = data['power']
+            data['peak_epoch'] = data['epoch']
+            data['counter'] = data.pop('energy_total')
+            data['weight'] = np.ones(len(data['epoch']))
+        return data
+
+    device_filter, device_params = _device_filter(devices)
+    params = [start.strftime(TIMESTAMP_FORMAT), end.strftime(TIMESTAMP_FORMAT)] + device_params
+    rows = conn.execute(f'''
+        SELECT device_id, bucket, power_sum, samples, power_max,
+               COALESCE(energy_delta, energy_max - energy_min), cost
+        FROM {table}
+        WHERE bucket >= ? AND bucket < ?{device_filter}
+    ''', params).fetchall()
+    if not rows:
+        return None
+
+    columns = list(zip(*rows))
+    names, device_idx = np.unique(np.array(columns[0], dtype=object).astype(str), return_inverse=True)
+    samples = np.array(columns[3], dtype=float)
+    data = {
+        'device_names': names,
+        'device_idx': device_idx,
+        'epoch': _to_epoch(columns[1]),
+        # Puissance moyenne du seau, pondérée par son nombre de mesures
+        'power': np.array(columns[2], dtype=float) / samples,
+        'weight': samples,
+        # Heure exacte du pic résolue après coup (_resolve_peak_time)
+        'peak_power': np.array(columns[4], dtype=float),
+        # Consommation du seau déjà corrigée des remises à zéro (rollups.CounterTracker)
+        'energy': np.array(columns[5], dtype=float),
+        # Coût tarifé à l'ingestion ou par re-tarification (NULL: pas encore tarifé)
+        'cost': np.array(columns[6], dtype=float),
+    }
+    data['peak_epoch'] = data['epoch']
+    return data
+
+
+def analyze(conn, devices, start, end, bucket_seconds, schedule, source=None, store=None):
+    """Statistiques de consommation sur [start, end) par pas de bucket_seconds
+
+    Une seule passe vectorisée: énergie par intervalle (avec remises à zéro),
+    coût selon le barème `schedule` (tariffs.Schedule), percentiles, pic et
+    facteur de charge, au global, par pas de temps et par appareil.
+    """
+    if end <= start:
+        raise AnalyticsError("end must be after start")
+    n_buckets = int(-(-(end - start).total_seconds() // bucket_seconds))
+    if n_buckets > MAX_BUCKETS:
+        raise AnalyticsError(f"Too many buckets ({n_buckets}, max {MAX_BUCKETS}): use a larger bucket or a shorter range")
+
+    # Mesures brutes: tables SQLite par défaut, ou moteur de séries configuré (timeseries.py)
+    store = store or SQLiteStore.from_connection(conn)
+    source, table, resolution = _choose_source(conn, start, end, bucket_seconds, devices, source, store)
+    data = _load(conn, source, table, start, end, devices, store)
+
+    start_epoch = int(start.replace(tzinfo=timezone.utc).timestamp())
+    result = {
+        'start': start.strftime(TIMESTAMP_FORMAT),
+        'end': end.strftime(TIMESTAMP_FORMAT),
+        'bucket_seconds': bucket_seconds,
+        'source': source,
+        'devices': [],
+        'totals': None,
+        'buckets': [],
+        'per_device': {},
+    }
+    if data is None:
+        return result
+
+    # Tri par (appareil, temps) puis énergie par ligne
+    order = np.lexsort((data['epoch'], data['device_idx']))
+    device_idx = data['device_idx'][order]
+    epoch = data['epoch'][order]
+    power = data['power'][order]
+    weight = data['weight'][order]
+    peak_power = data['peak_power'][order]
+    peak_epoch = data['peak_epoch'][order]
+
+    if source == 'raw':
+        deltas = energy_deltas(device_idx, data['counter'][order])
+        # Mesures brutes: tarifées à la demande (consommation du mois relue dans les agrégats)
+        costs = tariffs.price_samples(conn, schedule, data['device_names'], device_idx, epoch, deltas)
+    else:
+        deltas = np.nan_to_num(data['energy'][order])
+        costs = data['cost'][order]
+        unpriced = np.isnan(costs)
+        if unpriced.any():
+            costs[unpriced] = tariffs.price_samples(conn, schedule, data['device_names'], device_idx[unpriced],
+                                                    epoch[unpriced], deltas[unpriced])
+
+    # Rattachement aux seaux
+    bucket_of = np.clip((epoch - start_epoch) // bucket_seconds, 0, n_buckets - 1)
+
+    valid_power = ~np.isnan(power)
+    bucket_energy = np.bincount(bucket_of, weights=deltas, minlength=n_buckets)
+    bucket_cost = np.bincount(bucket_of, weights=costs, minlength=n_buckets)
+    bucket_power_sum = np.bincount(bucket_of[valid_power], weights=power[valid_power] * weight[valid_power],
+                                   minlength=n_buckets)
+    bucket_power_count = np.bincount(bucket_of[valid_power], weights=weight[valid_power], minlength=n_buckets)
+    bucket_max = np.full(n_buckets, -np.inf)
+    valid_peak = ~np.isnan(peak_power)
+    np.maximum.at(bucket_max, bucket_of[valid_peak], peak_power[valid_peak])
+
+    for i in range(n_buckets):
+        if bucket_power_count[i] == 0 and bucket_energy[i] == 0:
+            continue
+        result['buckets'].append({
+            'start': _epoch_to_str(start_epoch + i * bucket_seconds),
+            'energy_kwh': round(float(bucket_energy[i]), 4),
+            'cost': round(float(bucket_cost[i]), 4),
+            'avg_power': round(float(bucket_power_sum[i] / bucket_power_count[i]), 2) if bucket_power_count[i] else None,
+            'max_power': round(float(bucket_max[i]), 2) if np.isfinite(bucket_max[i]) else None,
+        })
+
+    result['totals'] = _summary(power[valid_power], weight[valid_power], peak_power, peak_epoch, deltas, costs)
+    if result['totals']['peak'] and valid_peak.any():
+        peak_row = np.nanargmax(peak_power)
+        result['totals']['peak']['device_id'] = str(data['device_names'][device_idx[peak_row]])
+
+    # Par appareil: les lignes sont déjà groupées par appareil après le tri
+    device_bounds = np.searchsorted(device_idx, np.arange(len(data['device_names']) + 1))
+    for d, name in enumerate(data['device_names']):
+        lo, hi = device_bounds[d], device_bounds[d + 1]
+        device_power, device_weight = power[lo:hi], weight[lo:hi]
+        valid = ~np.isnan(device_power)
+        result['per_device'][str(name)] = _summary(
+            device_power[valid], device_weight[valid], peak_power[lo:hi], peak_epoch[lo:hi],
+            deltas[lo:hi], costs[lo:hi]
+        )
+    result['devices'] = [str(name) for name in data['device_names']]
+
+    if source != 'raw':
+        if result['totals']['peak']:
+            _resolve_peak_time(conn, table, result['totals']['peak'], result['totals']['peak']['device_id'])
+        for name, summary in result['per_device'].items():
+            if summary['peak']:
+                _resolve_peak_time(conn, table, summary['peak'], name)
+    return result
+
+
+def _resolve_peak_time(conn, table, peak, device_id):
+    """Remplace le début du seau du pic par l'horodatage exact de la mesure maximale"""
+    bucket = peak['time'][:10] if table == 'energy_rollup_1d' else peak['time']
+    row = conn.execute(
+        f'SELECT power_max_at FROM {table} WHERE bucket = ? AND device_id = ?',
+        (bucket, device_id)
+    ).fetchone()
+    if row and row[0]:
+        peak['time'] = row[0]
+
+
+def weighted_percentiles(values, weights, percentiles):
+    """Percentiles (interpolation linéaire) de `values` répétées `weights` fois: égaux à
+    np.percentile pour des poids unitaires, sans matérialiser les répétitions"""
+    order = np.argsort(values)
+    values, cumulative = values[order], np.cumsum(weights[order])
+    positions = np.asarray(percentiles) / 100 * (cumulative[-1] - 1)
+    below = np.floor(positions)
+    low = values[np.searchsorted(cumulative, below, side='right')]
+    high = values[np.minimum(np.searchsorted(cumulative, below + 1, side='right'), len(values) - 1)]
+    return low + (high - low) * (positions - below)
+
+
+def _summary(power, weight, peak_power, peak_epoch, deltas, costs):
+    """Énergie, coût, puissance moyenne, percentiles, pic et facteur de charge
+
+    `weight`: nombre de mesures derrière chaque valeur de `power` (1 pour les
+    mesures brutes, samples pour une moyenne d'agrégat).
+    """
+    summary = {
+        'energy_kwh': round(float(deltas.sum()), 4),
+        'cost': round(float(costs.sum()), 4),
+        'average_power': None,
+        'percentiles': {},
+        'peak': None,
+        'load_factor': None,
+        'samples': int(weight.sum()),
+    }
+    if len(power):
+        average = float(np.average(power, weights=weight))
+        summary['average_power'] = round(average, 2)
+        # Depuis les agrégats: percentiles des moyennes de seau (les pics y sont lissés)
+        values = weighted_percentiles(power, weight, PERCENTILES)
+        summary['percentiles'] = {f"p{p}": round(float(v), 2) for p, v in zip(PERCENTILES, values)}
+    if len(peak_power) and not np.isnan(peak_power).all():
+        i = int(np.nanargmax(peak_power))
+        summary['peak'] = {'power': round(float(peak_power[i]), 2), 'time': _epoch_to_str(peak_epoch[i])}
+        if summary['average_power'] is not None and peak_power[i] > 0:
+            summary['load_factor'] = round(summary['average_power'] / float(peak_power[i]), 4)
+    return summary
+
+
+def default_range(hours=24):
+    """Plage par défaut: les dernières `hours` heures (UTC)"""
+    end = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    return end - timedelta(hours=hours), end
@@ -0,0 +1,137 @@
+"""
+PDS-32: Détection d'anomalies en flux - écart à une moyenne mobile exponentielle
+(EWMA/EWMVar), référence par heure de la journée et valeur figée, en mémoire
+constante par (règle, appareil)
+
+Les détecteurs produisent un score par mesure; le moteur de règles (alert_rules.py)
+le compare au seuil de la règle comme une valeur mesurée, avec hystérésis et
+durée minimale, et ouvre/résout les alertes dans la table alerts.
+"""
+
+import math
+
+# Écart-type plancher par défaut: une série parfaitement constante ne divise pas par zéro
+MIN_STD = 1e-6
+
+# Mesures apprises ramenées à moyenne ± CLIP_SIGMAS écarts-types: un changement de
+# niveau ne gonfle pas la variance en quelques mesures, les queues restent apprises
+CLIP_SIGMAS = 3.0
+
+
+class Ewm:
+    """Moyenne et variance exponentielles (West, 1979): O(1) par mesure"""
+
+    __slots__ = ('count', 'mean', 'var')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+
+    def update(self, value, alpha):
+        if self.count == 0:
+            self.mean = value
+        else:
+            # Moyenne/variance simples tant que la fenêtre exponentielle n'est pas remplie
+            # (sinon la variance, partie de 0, est sous-estimée pendant ~1/alpha mesures)
+            alpha = max(alpha, 1.0 / (self.count + 1))
+            diff = value - self.mean
+            increment = alpha * diff
+            self.mean += increment
+            self.var = (1 - alpha) * (self.var + diff * increment)
+        self.count += 1
+
+    def std(self, min_std=0.0):
+        return max(math.sqrt(self.var), min_std, MIN_STD)
+
+    def zscore(self, value, min_std):
+        return (value - self.mean) / self.std(min_std)
+
+    def describe(self):
+        return {'samples': self.count, 'mean': round(self.mean, 4), 'std': round(math.sqrt(self.var), 4)}
+
+
+class ZScore:
+    """Score z de chaque mesure par rapport à sa moyenne mobile
+
+    Avec `fast_alpha`, c'est une moyenne rapide qui est comparée à la référence
+    lente (elle-même apprise sur la moyenne rapide): les pics isolés sont lissés,
+    une dérive lente ressort.
+    """
+
+    __slots__ = ('baseline', 'fast')
+
+    def __init__(self):
+        self.baseline = Ewm()
+        self.fast = None
+
+    def _stats(self, at, utc_offset):
+        return self.baseline
+
+    def score(self, value, at, params, frozen, utc_offset=0):
+        """Score de `value` (None pendant le préchauffage); la référence n'apprend pas
+        des mesures d'une anomalie confirmée (`frozen`: alerte ouverte)"""
+        fast_alpha = params['fast_alpha']
+        if fast_alpha:
+            self.fast = value if self.fast is None else self.fast + fast_alpha * (value - self.fast)
+            scored = self.fast
+        else:
+            scored = value
+        stats = self._stats(at, utc_offset)
+        if stats.count < params['warmup']:
+            # La référence suit la série scorée: moyenne et écart-type à la même échelle
+            stats.update(scored, params['alpha'])
+            return None
+        std = stats.std(params['min_std'])
+        score = (scored - stats.mean) / std
+        if not frozen:
+            clip = CLIP_SIGMAS * std
+            stats.update(min(max(scored, stats.mean - clip), stats.mean + clip), params['alpha'])
+        return score
+
+    def describe(self):
+        return dict(self.baseline.describe(), fast=None if self.fast is None else round(self.fast, 4))
+
+
+class Seasonal(ZScore):
+    """Score z par rapport à la référence de la même heure locale (24 EWMA)"""
+
+    __slots__ = ('hours', 'hour')
+
+    def __init__(self):
+        super().__init__()
+        self.hours = [Ewm() for _ in range(24)]
+        self.hour = None
+
+    def _stats(self, at, utc_offset):
+        self.hour = int((at + utc_offset) // 3600) % 24
+        return self.hours[self.hour]
+
+    def describe(self):
+        stats = self.hours[self.hour] if self.hour is not None else self.baseline
+        return dict(stats.describe(), hour=self.hour, fast=None if self.fast is None else round(self.fast, 4))
+
+
+class Flatline:
+    """Durée (s) depuis laquelle la mesure reste dans `tolerance` de la même valeur"""
+
+    __slots__ = ('reference', 'since')
+
+    def __init__(self):
+        self.reference = None
+        self.since = None
+
+    def score(self, value, at, params, frozen, utc_offset=0):
+        if self.reference is None or abs(value - self.reference) > params['tolerance']:
+            self.reference, self.since = value, at
+        return at - self.since
+
+    def describe(self):
+        return {'value': self.reference, 'since': self.since}
+
+
+DETECTORS = {
+    'zscore': ZScore,
+    'seasonal': Seasonal,
+    'flatline': Flatline,
+}
@@ -2,291 +2,629 @@
 PDS-32: Backend Server - Système IoT de Gestion Énergétique
 """
 
-from flask import Flask, jsonify, request, render_template
+from flask import Flask, Response, g, jsonify, request, render_template, stream_with_context
 from flask_cors import CORS
 import paho.mqtt.client as mqtt
 import sqlite3
 import json
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+import multiprocessing
+import signal
 import threading
 import time
 import os
 
+import activity
+from alert_rules import AlertEngine
+import analytics
+import cache
+import compression
+from db import ConnectionPool, connect as db_connect
+import devices
+import payloads
+import profiling
+from events import EventBroker
+import forecast
+import history
+from ingest import IngestPipeline
+import logs
+import metrics
+import migrations
+from retention import RetentionService, default_policy
+import rollups
+import serving
+import sharding
+import tariffs
+import timeseries
+from state import (
+    FEED_QUERIES, SNAPSHOT_BUILDERS, LatestState, energy_snapshot, sensors_snapshot,
+    presence_snapshot, actuators_snapshot
+)
+
+logs.setup()
+log = logs.get('app')
+
 app = Flask(__name__)
 CORS(app)
 
 # ==================== CONFIGURATION ====================
-MQTT_BROKER = "broker.hivemq.com"
-MQTT_PORT = 1883
-MQTT_TOPICS = [
-    ("home/energy/power", 0),
-    ("home/sensors/environment", 0),
-    ("home/sensors/presence", 0),
-    ("home/actuators/status", 0),
-    ("home/status/device", 0)
-]
-
-DATA_DIR = '/app/data'
+MQTT_BROKER = os.environ.get('MQTT_BROKER', "broker.hivemq.com")
+MQTT_PORT = int(os.environ.get('MQTT_PORT', 1883))
+# Topics historiques (home/energy/power, ...) et par appareil (home/<device_id>/energy/power, ...),
+# avec suffixe d'encodage optionnel (.../energy/power/bin, /msgpack, /cbor)
+MQTT_TOPICS = payloads.subscriptions(devices.subscriptions())
+MQTT_ENCODINGS_TOPIC = "home/server/encodings"
+# Avec des workers d'ingestion: statuts pour l'API, données pour les workers
+MQTT_STATUS_TOPICS = [(topic, qos) for topic, qos in MQTT_TOPICS if 'status/device' in topic]
+MQTT_DATA_TOPICS = [(topic, qos) for topic, qos in MQTT_TOPICS if 'status/device' not in topic]
+
+# Journal des messages reçus: un message sur N (0 = aucun)
+MQTT_LOG_SAMPLE = int(os.environ.get('MQTT_LOG_SAMPLE', 100))
+
+DATA_DIR = os.environ.get('DATA_DIR', '/app/data')
 os.makedirs(DATA_DIR, exist_ok=True)
 
 DATABASE = os.path.join(DATA_DIR, 'energy_data.db')
 ELECTRICITY_TARIF = 0.15  # TND/kWh
 
-# ... GLOBAL STATES ...
-device_live_status = "offline"
-last_seen = "Jamais"
+# Barème versionné (plages horaires, saisons, tranches mensuelles; JSON rechargé à chaud)
+TARIFF_FILE = os.environ.get('TARIFF_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tariffs.json'))
+TARIFF_RELOAD = int(os.environ.get('TARIFF_RELOAD', 5))  # secondes
+# Sans fichier de barème: prix par heure locale (24 valeurs séparées par des virgules)
+TOU_PRICES = [float(p) for p in os.environ.get('TOU_PRICES', '').split(',') if p] or [ELECTRICITY_TARIF] * 24
+LOCAL_UTC_OFFSET = int(os.environ.get('LOCAL_UTC_OFFSET', 1))  # heures (Tunisie: UTC+1)
+
+# Pipeline d'ingestion (file bornée + écrivain unique)
+INGEST_QUEUE_SIZE = int(os.environ.get('INGEST_QUEUE_SIZE', 10000))
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 500))
+INGEST_MAX_LATENCY = float(os.environ.get('INGEST_MAX_LATENCY', 0.5))  # secondes
+
+# Compression à l'écriture (compression.py): présence et actionneurs écrits à chaque
+# transition, capteurs hors tolérance ('deadband', 'swinging_door' ou 'off'), et au
+# moins une ligne par appareil toutes les N secondes
+STORAGE_COMPRESSION = os.environ.get('STORAGE_COMPRESSION', '1') in ('1', 'true')
+SENSOR_COMPRESSION = os.environ.get('SENSOR_COMPRESSION', 'deadband')
+# Tolérance absolue par mesure, ou en % de la dernière valeur écrite ('humidity=2%')
+SENSOR_TOLERANCES = os.environ.get('SENSOR_TOLERANCES', 'temperature=0.3,humidity=2,light_level=5')
+COMPRESSION_HEARTBEAT = int(os.environ.get('COMPRESSION_HEARTBEAT', 300))  # secondes
+
+# Ingestion multi-processus: N workers, appareils répartis par hachage consistant,
+# une base shard par worker (0 = ingestion dans le processus de l'API)
+INGEST_WORKERS = min(int(os.environ.get('INGEST_WORKERS', 0)), sharding.MAX_SHARDS)
+SHARD_DATABASES = [sharding.shard_path(DATABASE, index) for index in range(INGEST_WORKERS)]
+
+# Flux temps réel (SSE): événements en attente max par client lent
+SSE_MAX_PENDING = int(os.environ.get('SSE_MAX_PENDING', 256))
+
+# Rétention: brut N jours, moyennes minute M jours, horaires/journalières sans limite
+RETENTION_RAW_DAYS = int(os.environ.get('RETENTION_RAW_DAYS', 7))
+RETENTION_MINUTE_DAYS = int(os.environ.get('RETENTION_MINUTE_DAYS', 90))
+RETENTION_INTERVAL = int(os.environ.get('RETENTION_INTERVAL', 3600))  # secondes
+
+# Séries brutes des analyses sur plage: 'sqlite' (tables brutes) ou 'segments'
+# (colonnes NumPy compressées par jour, conservées au-delà de la rétention brute)
+TIMESERIES_BACKEND = os.environ.get('TIMESERIES_BACKEND', 'sqlite')
+SEGMENTS_DIR = os.path.join(DATA_DIR, 'segments')
+SEGMENT_RETENTION_DAYS = int(os.environ.get('SEGMENT_RETENTION_DAYS', 730))
+
+# Prévisions de consommation (modèles par appareil sur les agrégats horaires, calculées
+# en tâche de fond): historique utilisé, heures détaillées par l'API, délai minimal
+# avant recalcul quand des données arrivent en cours d'heure
+FORECAST_DAYS = int(os.environ.get('FORECAST_DAYS', 28))
+FORECAST_HORIZON = int(os.environ.get('FORECAST_HORIZON', 48))  # heures
+FORECAST_INTERVAL = int(os.environ.get('FORECAST_INTERVAL', 900))  # secondes
+
+# Cache des réponses agrégées (invalidé à chaque commit des tables lues, TTL pour les fenêtres glissantes)
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 256))  # entrées
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 10))  # secondes
+
+# Connexions de lecture réutilisées par les routes de l'API
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+
+# Appareil considéré hors ligne sans message depuis N secondes
+DEVICE_STALE_SECONDS = int(os.environ.get('DEVICE_STALE_SECONDS', 120))
+
+# Règles d'alerte (JSON rechargé à chaud)
+ALERT_RULES_FILE = os.environ.get('ALERT_RULES_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alert_rules.json'))
+ALERT_RULES_RELOAD = int(os.environ.get('ALERT_RULES_RELOAD', 5))  # secondes
+
+# Mode production (gunicorn, plusieurs workers HTTP): un seul processus, le leader,
+# détient MQTT et l'ingestion; les autres suivent les nouvelles lignes en base
+LEADER_LOCK_FILE = os.path.join(DATA_DIR, 'leader.lock')
+INIT_LOCK_FILE = os.path.join(DATA_DIR, 'init.lock')
+LEADER_RETRY = int(os.environ.get('LEADER_RETRY', 5))  # secondes
+FEED_INTERVAL = float(os.environ.get('FEED_INTERVAL', 1.0))  # secondes
+FLASK_DEBUG = os.environ.get('FLASK_DEBUG', '0') in ('1', 'true')
+
+# Métriques Prometheus: instantané de chaque processus relu par /metrics
+METRICS_DIR = os.path.join(DATA_DIR, 'metrics')
+METRICS_INTERVAL = float(os.environ.get('METRICS_INTERVAL', 5))  # secondes
+
+# Profileur par échantillonnage (/debug/profile), désactivé par défaut
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '0') in ('1', 'true')
+PROFILE_MAX_SECONDS = int(os.environ.get('PROFILE_MAX_SECONDS', 60))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.01))  # secondes entre deux échantillons
+HTTP_PORT = int(os.environ.get('PORT', 5000))  # même variable que gunicorn.conf.py
+
 # ==================== DATABASE SETUP ====================
-def init_database():
-    """Initialise la base de données SQLite"""
-    conn = sqlite3.connect(DATABASE)
+def init_database(database=DATABASE):
+    """Initialise la base de données SQLite (migrations de schéma versionnées)"""
+    conn = db_connect(database)
     cursor = conn.cursor()
-    
-    # Table: energy_data
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS energy_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            device_id TEXT,
-            power REAL,
-            voltage REAL,
-            current REAL,
-            energy_total REAL,
-            cost REAL
-        )
-    ''')
-    
-    # Table: sensor_readings
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS sensor_readings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            device_id TEXT,
-            temperature REAL,
-            humidity REAL,
-            light_level INTEGER
-        )
-    ''')
-    
-    # Table: presence_data
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS presence_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            device_id TEXT,
-            presence BOOLEAN
-        )
-    ''')
-    
-    # Table: actuator_states
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS actuator_states (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            device_id TEXT,
-            relay1 BOOLEAN,
-            relay2 BOOLEAN,
-            auto_mode BOOLEAN
-        )
-    ''')
-    
-    # Table: alerts
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS alerts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            alert_type TEXT,
-            severity TEXT,
-            message TEXT,
-            resolved BOOLEAN DEFAULT 0
-        )
-    ''')
-    
-    # Indexes pour performance
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_energy_timestamp ON energy_data(timestamp)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sensors_timestamp ON sensor_readings(timestamp)')
-    
-    conn.commit()
-    conn.close()
-    print("✓ Database initialized")
+
+    # VACUUM incrémental pour le service de rétention (conversion unique des anciennes bases)
+    if cursor.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        cursor.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        cursor.execute('VACUUM')
+        log.info("✓ Database switched to incremental auto_vacuum")
+
+    # Tables, colonnes et index: une migration par version (PRAGMA user_version)
+    try:
+        migrations.migrate(conn)
+    finally:
+        conn.close()
+    log.info("✓ Database initialized")
+
+def init_shards():
+    """Initialise la base de chaque worker d'ingestion (même schéma, plage d'ids propre)"""
+    for index, path in enumerate(SHARD_DATABASES):
+        init_database(path)
+        conn = db_connect(path)
+        sharding.seed_id_range(conn, index)
+        conn.close()
+    if SHARD_DATABASES:
+        log.info("✓ %d ingest shards initialized", len(SHARD_DATABASES))
+
+# ==================== CONNEXIONS ====================
+def attach_shard_views(conn):
+    """Les lectures de l'API voient base principale + shards (vues UNION ALL)"""
+    sharding.attach_shards(conn, SHARD_DATABASES)
+
+db_pool = ConnectionPool(DATABASE, size=DB_POOL_SIZE, setup=attach_shard_views if SHARD_DATABASES else None)
+
+# ==================== INGESTION ====================
+ingest_pipeline = IngestPipeline(
+    DATABASE,
+    max_queue=INGEST_QUEUE_SIZE,
+    batch_size=INGEST_BATCH_SIZE,
+    max_latency=INGEST_MAX_LATENCY
+)
+
+# Barème courant; les bases écrites par ce processus sont re-tarifées quand il change
+tariff_service = tariffs.TariffService(
+    TARIFF_FILE, LOCAL_UTC_OFFSET, fallback=tariffs.Schedule.hourly(TOU_PRICES, LOCAL_UTC_OFFSET),
+    reload_interval=TARIFF_RELOAD, on_repriced=lambda: generations.bump('energy_data')
+)
+
+# Compteurs energy_total et consommation du mois par appareil, propres au thread écrivain
+energy_counters = rollups.CounterTracker()
+energy_pricer = tariffs.Pricer(lambda: tariff_service.schedule)
+
+def update_energy_rollups(conn, rows_by_table):
+    """Met à jour les agrégats (coût compris) dans la même transaction que les lignes brutes"""
+    rollups.apply(conn, rows_by_table.get('energy_data'), energy_counters, energy_pricer)
+
+ingest_pipeline.add_flush_hook(update_energy_rollups)
+ingest_pipeline.add_state(energy_counters)
+ingest_pipeline.add_state(energy_pricer)
+
+# ==================== COMPRESSION À L'ÉCRITURE ====================
+def open_compressors():
+    """Compresseur par table, propre au processus qui ingère (l'énergie, compteur cumulé, n'en a pas)"""
+    if not STORAGE_COMPRESSION:
+        return {}
+    compressors = {
+        'presence_data': compression.StreamCompressor(
+            'presence_data', ('presence',), 'state', heartbeat=COMPRESSION_HEARTBEAT),
+        'actuator_states': compression.StreamCompressor(
+            'actuator_states', ('relay1', 'relay2', 'window', 'auto_mode'), 'state', heartbeat=COMPRESSION_HEARTBEAT),
+    }
+    if SENSOR_COMPRESSION != 'off':
+        compressors['sensor_readings'] = compression.StreamCompressor(
+            'sensor_readings', ('temperature', 'humidity', 'light_level'), SENSOR_COMPRESSION,
+            compression.parse_tolerances(SENSOR_TOLERANCES), COMPRESSION_HEARTBEAT)
+    return compressors
+
+compressors = open_compressors()
+
+def submit_row(table, row):
+    """Ligne vers la file d'ingestion, si le compresseur de sa table la garde"""
+    compressor = compressors.get(table)
+    if compressor is None:
+        ingest_pipeline.submit(table, row)
+        return
+    # État du compresseur avancé seulement si la file accepte la ligne
+    compressor.offer(row, write=lambda kept: ingest_pipeline.submit(table, kept))
+
+def forget_rejected(table, rows):
+    """Hook de rejet: lignes d'un lot annulé, que le compresseur croyait écrites"""
+    compressor = compressors.get(table)
+    if compressor is not None:
+        compressor.forget(rows)
+
+ingest_pipeline.add_reject_hook(forget_rejected)
+
+def flush_compressors():
+    """Arrêt: lignes encore retenues par la porte battante, avant le vidage de la file"""
+    for table, compressor in compressors.items():
+        for row in compressor.flush():
+            ingest_pipeline.submit(table, row)
+
+def compression_stats():
+    return {table: compressor.stats() for table, compressor in compressors.items()}
+
+# ==================== CACHE DES RÉPONSES ====================
+# Générations par table: lots commités (écrivain local, workers d'ingestion, ou
+# lignes du leader vues par le suivi des workers HTTP), alertes, écritures de l'API
+generations = cache.Generations()
+response_cache = cache.ResponseCache(
+    generations, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL,
+    on_result=lambda route, result: CACHE_REQUESTS.child(route, result).inc()
+)
+
+# Tables lues par le fil d'activité (/api/history)
+ACTIVITY_TABLES = tuple(table for table, _, _ in activity.CATEGORIES.values())
+
+def bump_generations(rows_by_table):
+    """Hook de commit: invalide les réponses qui lisent les tables du lot"""
+    generations.bump(*rows_by_table)
+
+ingest_pipeline.add_commit_hook(bump_generations)
+
+@app.after_request
+def invalidate_after_write(response):
+    """Écriture via l'API (résolution, reconstruction, purge): cache de ce processus invalidé"""
+    if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+        generations.bump_all()
+    return response
+
+# ==================== SÉRIES TEMPORELLES ====================
+def open_timeseries_store(shard_index=None):
+    """Moteur des séries brutes; en mode segments, une racine par écrivain (API ou worker)"""
+    if TIMESERIES_BACKEND == 'segments':
+        if shard_index is not None:
+            return timeseries.SegmentStore(os.path.join(SEGMENTS_DIR, f"shard{shard_index}"))
+        roots = [os.path.join(SEGMENTS_DIR, 'main')]
+        roots += [os.path.join(SEGMENTS_DIR, f"shard{index}") for index in range(INGEST_WORKERS)]
+        return timeseries.SegmentStore(roots)
+    return timeseries.SQLiteStore(db_pool)
+
+timeseries_store = open_timeseries_store()
+
+def raw_store(conn):
+    """Moteur de séries pour une lecture faite dans la transaction de `conn` (moteur SQLite)"""
+    if TIMESERIES_BACKEND == 'segments':
+        return timeseries_store
+    return timeseries.SQLiteStore.from_connection(conn)
+
+# Copie de chaque lot commité vers le moteur de séries (sans effet pour SQLite)
+ingest_pipeline.add_commit_hook(timeseries_store.append)
+
+# ==================== RÉTENTION ====================
+retention_service = RetentionService(
+    [DATABASE] + SHARD_DATABASES,
+    default_policy(RETENTION_RAW_DAYS, RETENTION_MINUTE_DAYS),
+    interval=RETENTION_INTERVAL,
+    sensor_hold=compression.max_hold(COMPRESSION_HEARTBEAT),
+    sensor_linear=STORAGE_COMPRESSION and SENSOR_COMPRESSION == 'swinging_door'
+)
+if TIMESERIES_BACKEND == 'segments':
+    retention_service.add_task('segment_days_pruned', lambda: timeseries_store.prune(SEGMENT_RETENTION_DAYS))
+
+# ==================== PRÉVISIONS ====================
+# Calculées dans chaque processus HTTP (lecture via le pool), servies depuis la mémoire
+forecast_service = forecast.ForecastService(
+    db_pool.connection, lambda: tariff_service.schedule,
+    history_days=FORECAST_DAYS, horizon_hours=FORECAST_HORIZON, refresh_interval=FORECAST_INTERVAL,
+    sensor_hold=compression.max_hold(COMPRESSION_HEARTBEAT),
+    sensor_linear=STORAGE_COMPRESSION and SENSOR_COMPRESSION == 'swinging_door',
+    data_version=lambda: generations.vector(('energy_data', 'sensor_readings')),
+    on_refresh=lambda: generations.bump('forecast')
+)
+
+# Reprises de données enregistrées par les migrations (agrégats recalculés par lots)
+schema_backfill = migrations.BackfillRunner([DATABASE] + SHARD_DATABASES)
+
+# ==================== DERNIER ÉTAT ====================
+latest_state = LatestState()
+
+def rehydrate_latest_state():
+    """Charge le dernier état de chaque appareil depuis la base (une seule fois)"""
+    with db_pool.connection() as conn:
+        loaded = latest_state.rehydrate(conn)
+    log.info("✓ Latest state rehydrated (%d snapshots)", loaded)
+
+# ==================== FLUX TEMPS RÉEL ====================
+event_broker = EventBroker(max_pending=SSE_MAX_PENDING)
+
+def publish_state(kind, device_id, snapshot):
+    """Met à jour le dernier état et le diffuse aux dashboards abonnés"""
+    latest_state.update(kind, device_id, snapshot)
+    event_broker.publish(kind, dict(snapshot, device_id=device_id), key=(kind, device_id))
+
+def live_status_payload(device_id=None):
+    """État de connexion d'un appareil, ou de la flotte (réponse de /api/status/live)"""
+    if device_id:
+        device = device_registry.get(device_id)
+        online = bool(device and device['online'])
+        last_seen = device['last_seen'] if device else None
+        payload = {}
+    else:
+        summary = device_registry.summary()
+        online = summary['online'] > 0
+        last_seen = summary['last_seen']
+        payload = {'online': summary['online'], 'total': summary['total']}
+    payload.update({
+        'status': 'online' if online else 'offline',
+        'label': 'LIVE' if online else 'DOWN',
+        'last_seen': last_seen or 'Jamais'
+    })
+    return payload
+
+def publish_device(device):
+    """Diffuse un changement d'état d'appareil (en ligne, hors ligne, muet)"""
+    generations.bump('devices')
+    event_broker.publish('device', device, key=('device', device['device_id']))
+    event_broker.publish('status', live_status_payload(), key=('status',))
+
+# ==================== REGISTRE DES APPAREILS ====================
+device_registry = devices.DeviceRegistry(stale_after=DEVICE_STALE_SECONDS, on_change=publish_device)
+
+# ==================== MÉTRIQUES ====================
+# Étiquettes bornées: type de message et encodage, pas le topic (un par appareil)
+MESSAGES = metrics.Counter('pds32_mqtt_messages_total', 'Messages MQTT acceptés', ('kind', 'encoding'))
+REJECTED = metrics.Counter('pds32_mqtt_rejected_total', 'Messages MQTT illisibles', ('kind',))
+DECODE_SECONDS = metrics.Histogram('pds32_payload_decode_seconds', 'Décodage des charges utiles', ('encoding',))
+ALERT_EVALUATION_SECONDS = metrics.Histogram(
+    'pds32_alert_evaluation_seconds', "Évaluation des règles d'alerte par message", ('kind',))
+CACHE_REQUESTS = metrics.Counter(
+    'pds32_response_cache_requests_total', 'Requêtes des routes en cache par résultat', ('route', 'result'))
+HTTP_SECONDS = metrics.Histogram(
+    'pds32_http_request_seconds', "Latence des routes de l'API (jusqu'aux en-têtes pour les flux)",
+    ('route', 'method', 'status'))
+
+# Lues à chaque collecte: `ingest_pipeline` est celui du processus (API ou worker)
+metrics.Gauge('pds32_ingest_queue_depth', "Lignes en attente dans la file d'ingestion",
+              function=lambda: ingest_pipeline.stats()['queue_depth'])
+metrics.Counter('pds32_ingest_rows_total', "Lignes de la file d'ingestion par issue", ('outcome',),
+                function=lambda: {(outcome,): value for outcome, value in ingest_pipeline.stats().items()
+                                  if outcome in ('received', 'dropped', 'tasks_dropped', 'written', 'failed')})
+metrics.Counter('pds32_compression_rows_total', "Lignes capteurs/présence/actionneurs avant et après compression",
+                ('table', 'outcome'),
+                function=lambda: {(table, outcome): stats[outcome] for table, stats in compression_stats().items()
+                                  for outcome in ('received', 'written')})
+
+metrics_exporter = metrics.SnapshotExporter(METRICS_DIR, METRICS_INTERVAL)
+profiler = profiling.SamplingProfiler(PROFILE_INTERVAL)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_SECONDS.child(route, request.method, str(response.status_code)).observe(time.perf_counter() - started)
+    return response
 
 # ==================== MQTT CLIENT ====================
 mqtt_client = mqtt.Client()
 
+# Compteurs des messages reçus par encodage
+mqtt_stats = {'received': 0, 'rejected': 0, 'by_encoding': {}}
+
+# Topics de ce processus (restreints quand des workers d'ingestion reçoivent les données)
+mqtt_topics = MQTT_TOPICS
+
+def owns_device(device_id):
+    """Appareil traité par ce processus (remplacé dans chaque worker d'ingestion)"""
+    return True
+
 def on_connect(client, userdata, flags, rc):
     """Callback quand connecté au broker MQTT"""
     if rc == 0:
-        print("✓ Connected to MQTT Broker")
-        for topic, qos in MQTT_TOPICS:
+        log.info("✓ Connected to MQTT Broker")
+        for topic, qos in mqtt_topics:
             client.subscribe(topic, qos)
-            print(f"  Subscribed to: {topic}")
+            log.info("  Subscribed to: %s", topic)
+        # Annonce (retenue) des encodages acceptés, lue par les appareils au démarrage
+        client.publish(MQTT_ENCODINGS_TOPIC, json.dumps({'encodings': payloads.available_encodings()}), qos=1, retain=True)
     else:
-        print(f"✗ Failed to connect, return code {rc}")
+        log.error("✗ Failed to connect, return code %s", rc)
 
 def on_message(client, userdata, msg):
     """Callback quand un message MQTT est reçu"""
-    global device_live_status, last_seen
+    topic = msg.topic
     try:
-        # 1. On décode d'abord le message en texte brut (String)
-        raw_payload = msg.payload.decode()
-        topic = msg.topic
-        # 2. Cas spécial : Le Statut (ce n'est pas du JSON !)
-        if topic == "home/status/device":
-            device_live_status = raw_payload.strip().lower()  # Stocke "online" ou "offline"
-            print(f"📡 Device is now: {device_live_status.upper()}")
-            print(f"DEBUG: Statut reçu sur Python -> {device_live_status}")
-            if device_live_status == "online":
-                last_seen = (datetime.now() + timedelta(hours=1)).strftime("%H:%M:%S")
-
+        base_topic, encoding = payloads.split_encoding(topic)
+        device_id, kind = devices.parse_topic(base_topic)
+        if kind is None:
+            return
+        # 1. Cas spécial : Le Statut (texte brut, ou JSON avec infos firmware)
+        if kind == 'status':
+            status, payload_device_id, info = devices.parse_status(msg.payload.decode())
+            device_registry.set_status(device_id or payload_device_id, status, info)
+            log.info("📡 Device %s is now: %s", device_id or payload_device_id or device_registry.legacy_device,
+                     status.upper())
             return # On s'arrête ici pour ce topic
 
-        # 3. Pour les autres topics, on décode le JSON
-        payload = json.loads(raw_payload)
-        print(f"📨 Received [{topic}]: {payload}")
+        # Appareil d'un autre worker: ignoré avant tout décodage
+        if device_id is not None and not owns_device(device_id):
+            return
+
+        # 2. Encodage: suffixe du topic, sinon Content-Type MQTT 5, sinon JSON
+        encoding = encoding or payloads.content_type_encoding(getattr(msg, 'properties', None)) or 'json'
+        started = time.perf_counter()
+        record = payloads.decode(kind, encoding, msg.payload, device_id)
+        DECODE_SECONDS.child(encoding).observe(time.perf_counter() - started)
+        if device_id is None and not owns_device(record.device_id):
+            return
+
+        mqtt_stats['received'] += 1
+        mqtt_stats['by_encoding'][encoding] = mqtt_stats['by_encoding'].get(encoding, 0) + 1
+        MESSAGES.child(kind, encoding).inc()
+        if MQTT_LOG_SAMPLE and (mqtt_stats['received'] - 1) % MQTT_LOG_SAMPLE == 0:
+            log.debug("📨 Received [%s] (%d total): %s", topic, mqtt_stats['received'], record)
+
+        device_registry.touch(record.device_id, kind, legacy=device_id is None)
         
-        # 4. Traitement des données JSON
-        if topic == "home/energy/power":
-            store_energy_data(payload)
-            check_energy_alerts(payload)
+        # 3. Traitement de l'enregistrement typé
+        if kind == 'energy':
+            store_energy_data(record)
+        elif kind == 'sensors':
+            store_sensor_data(record)
+        elif kind == 'presence':
+            store_presence_data(record)
+        elif kind == 'actuators':
+            store_actuator_state(record)
+        started = time.perf_counter()
+        alert_engine.evaluate(kind, record.device_id, record)
+        ALERT_EVALUATION_SECONDS.child(kind).observe(time.perf_counter() - started)
             
-        elif topic == "home/sensors/environment":
-            store_sensor_data(payload)
-            check_temperature_alerts(payload)
-            
-        elif topic == "home/sensors/presence":
-            store_presence_data(payload)
-            
-        elif topic == "home/actuators/status":
-            store_actuator_state(payload)
-            
-    except json.JSONDecodeError:
-        print(f"✗ Erreur : Le message sur {topic} n'est pas un JSON valide")
+    except payloads.PayloadError as e:
+        mqtt_stats['rejected'] += 1
+        REJECTED.child(kind).inc()
+        log.warning("✗ Erreur : Message illisible sur %s: %s", topic, e)
     except Exception as e:
-        print(f"Error processing message: {e}")
+        log.exception("Error processing message: %s", e)
+
+# Dernier horodatage formaté: une seule mise en forme par seconde
+_timestamp_cache = [None, None]
+
+def utc_timestamp():
+    """Horodatage UTC au format SQLite (identique à CURRENT_TIMESTAMP)"""
+    second = int(time.time())
+    if _timestamp_cache[0] != second:
+        _timestamp_cache[1] = datetime.fromtimestamp(second, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        _timestamp_cache[0] = second
+    return _timestamp_cache[1]
 
-def store_energy_data(data):
+def store_energy_data(record):
     """Stocke les données énergétiques"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    cost = data.get('energy_total', 0) * ELECTRICITY_TARIF
-    
-    cursor.execute('''
-        INSERT INTO energy_data (device_id, power, voltage, current, energy_total, cost)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (
-        data.get('device_id'),
-        data.get('power'),
-        data.get('voltage'),
-        data.get('current'),
-        data.get('energy_total'),
-        cost
-    ))
-    
-    conn.commit()
-    conn.close()
+    timestamp = utc_timestamp()
 
-def store_sensor_data(data):
+    row = (
+        record.power,
+        record.voltage,
+        record.current,
+        record.energy_total
+    )
+    # Coût NULL: tarifé par delta de compteur dans les agrégats (rollups.apply)
+    ingest_pipeline.submit('energy_data', (timestamp, record.device_id) + row + (None,))
+    publish_state('energy', record.device_id, energy_snapshot(*row, timestamp))
+
+def store_sensor_data(record):
     """Stocke les données des capteurs"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO sensor_readings (device_id, temperature, humidity, light_level)
-        VALUES (?, ?, ?, ?)
-    ''', (
-        data.get('device_id'),
-        data.get('temperature'),
-        data.get('humidity'),
-        data.get('light_level')
-    ))
-    
-    conn.commit()
-    conn.close()
+    timestamp = utc_timestamp()
 
-def store_presence_data(data):
+    row = (
+        record.temperature,
+        record.humidity,
+        record.light_level
+    )
+    submit_row('sensor_readings', (timestamp, record.device_id) + row)
+    publish_state('sensors', record.device_id, sensors_snapshot(*row, timestamp))
+
+def store_presence_data(record):
     """Stocke les données de présence"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO presence_data (device_id, presence)
-        VALUES (?, ?)
-    ''', (
-        data.get('device_id'),
-        data.get('presence')
-    ))
-    
-    conn.commit()
-    conn.close()
+    timestamp = utc_timestamp()
 
-def store_actuator_state(data):
+    row = (record.presence,)
+    submit_row('presence_data', (timestamp, record.device_id) + row)
+    publish_state('presence', record.device_id, presence_snapshot(*row, timestamp))
+
+def store_actuator_state(record):
     """Stocke l'état des actionneurs"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    # Vérifier si la table a la colonne 'window'
-    cursor.execute("PRAGMA table_info(actuator_states)")
-    columns = [column[1] for column in cursor.fetchall()]
+    timestamp = utc_timestamp()
 
-    if 'window' not in columns:
-        # Ajouter la colonne window si elle n'existe pas
-        cursor.execute('ALTER TABLE actuator_states ADD COLUMN window BOOLEAN DEFAULT 0')
-        conn.commit()
-        print("✓ Column 'window' added to actuator_states table")
+    row = (
+        record.relay1,
+        record.relay2,
+        record.window,
+        record.auto_mode
+    )
+    submit_row('actuator_states', (timestamp, record.device_id) + row)
+    publish_state('actuators', record.device_id, actuators_snapshot(*row, timestamp))
 
-    cursor.execute('''
-        INSERT INTO actuator_states (device_id, relay1, relay2, window, auto_mode)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (
-        data.get('device_id'),
-        data.get('relay1'),
-        data.get('relay2'),
-        data.get('window', False),
-        data.get('auto_mode')
-    ))
-    
-    conn.commit()
-    conn.close()
+# Écritures d'alertes confiées à l'écrivain d'ingestion de la base principale: jamais
+# sur le thread réseau MQTT ni sous le verrou du moteur de règles (dans un worker
+# d'ingestion: écrivain dédié, voir run_ingest_worker)
+alert_writer = ingest_pipeline
 
-def check_energy_alerts(data):
-    """Vérifie et génère des alertes énergétiques"""
-    power = data.get('power', 0)
-    
-    if power > 2000:
-        create_alert("HIGH_CONSUMPTION", "WARNING", f"Consommation élevée: {power}W")
-    
-    if power == 0:
-        create_alert("POWER_FAILURE", "CRITICAL", "Aucune consommation détectée")
+class AlertRef:
+    """Alerte ouverte par le moteur de règles: id connu après le commit de l'insertion"""
 
-def check_temperature_alerts(data):
-    """Vérifie les alertes de température"""
-    temp = data.get('temperature', 0)
-    
-    if temp > 30:
-        create_alert("HIGH_TEMPERATURE", "WARNING", f"Température élevée: {temp}°C")
-    elif temp < 15:
-        create_alert("LOW_TEMPERATURE", "WARNING", f"Température basse: {temp}°C")
-
-def create_alert(alert_type, severity, message):
-    """Crée une alerte dans la base de données"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT id FROM alerts 
-        WHERE alert_type = ? AND resolved = 0 
-        AND timestamp > datetime('now', '-1 hour')
-    ''', (alert_type,))
-    
-    if cursor.fetchone() is None:
-        cursor.execute('''
-            INSERT INTO alerts (alert_type, severity, message)
-            VALUES (?, ?, ?)
-        ''', (alert_type, severity, message))
-        
-        conn.commit()
-        print(f"🚨 ALERT: [{severity}] {message}")
-    
-    conn.close()
+    __slots__ = ('id',)
+
+    def __init__(self):
+        self.id = None
+
+def write_alert(run, on_commit, wait=False):
+    """Exécute run(conn) via l'écrivain s'il tourne (ordre des écritures conservé),
+    sinon directement (processus sans ingestion, `wait`: routes de l'API)"""
+    if alert_writer.running and not wait:
+        # Jamais bloquant (thread MQTT): file des tâches pleine = écrivain bloqué, alerte perdue
+        if not alert_writer.submit_task('alerts', run, on_commit):
+            log.error("✗ Alert write dropped: ingest writer task queue full")
+        return
+    with db_pool.connection() as conn:
+        with conn:
+            run(conn)
+    generations.bump('alerts')
+    on_commit()
+
+def create_alert(alert_type, severity, message, device_id=None, rule_id=None):
+    """Crée une alerte (écriture asynchrone) et retourne sa référence (AlertRef)"""
+    timestamp = utc_timestamp()
+    alert = AlertRef()
+
+    def insert(conn):
+        alert.id = conn.execute('''
+            INSERT INTO alerts (timestamp, alert_type, severity, message, device_id, rule_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (timestamp, alert_type, severity, message, device_id, rule_id)).lastrowid
+
+    log.warning("🚨 ALERT: [%s] %s", severity, message)
+    write_alert(insert, lambda: event_broker.publish('alert', {
+        'id': alert.id,
+        'timestamp': timestamp,
+        'alert_type': alert_type,
+        'severity': severity,
+        'message': message,
+        'device_id': device_id,
+        'resolved': False
+    }))
+    return alert
+
+def mark_alert_resolved(alert, wait=False):
+    """Marque une alerte comme résolue (id en base ou AlertRef)"""
+    def update(conn):
+        alert_id = alert.id if isinstance(alert, AlertRef) else alert
+        if alert_id is not None:
+            conn.execute('UPDATE alerts SET resolved = 1 WHERE id = ?', (alert_id,))
+
+    write_alert(update, lambda: event_broker.publish('alert_resolved', {
+        'id': alert.id if isinstance(alert, AlertRef) else alert
+    }), wait)
+
+def open_rule_alert(rule, device_id, severity, message):
+    """Callback du moteur de règles: ouverture d'une alerte"""
+    return create_alert(rule.alert_type, severity, message, device_id or None, rule.id)
+
+# Moteur de règles: seuls l'ouverture et la résolution d'une alerte touchent la base
+alert_engine = AlertEngine(open_rule_alert, mark_alert_resolved, ALERT_RULES_FILE, ALERT_RULES_RELOAD,
+                           utc_offset_hours=LOCAL_UTC_OFFSET)
+
+def load_alert_rules():
+    """Charge les règles et reprend les alertes encore ouvertes en base"""
+    alert_engine.reload(force=True)
+    with db_pool.connection() as conn:
+        open_alerts = conn.execute(
+            'SELECT id, rule_id, device_id FROM alerts WHERE resolved = 0 AND rule_id IS NOT NULL'
+        ).fetchall()
+    alert_engine.restore([alert for alert in open_alerts if owns_device(alert[2])])
 
 # ==================== API ENDPOINTS ====================
 @app.route('/')
@@ -302,216 +640,124 @@ def dashboard():
 @app.route('/api/energy/current', methods=['GET'])
 def get_current_energy():
     """Récupère les données énergétiques actuelles"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT power, voltage, current, energy_total, cost, timestamp
-        FROM energy_data
-        ORDER BY timestamp DESC
-        LIMIT 1
-    ''')
-    
-    row = cursor.fetchone()
-    conn.close()
-    
-    if row:
-        return jsonify({
-            'power': row[0],
-            'voltage': row[1],
-            'current': row[2],
-            'energy_total': row[3],
-            'cost': row[4],
-            'timestamp': row[5]
-        })
+    snapshot = latest_state.get('energy', request.args.get('device_id'))
+
+    if snapshot:
+        return jsonify(snapshot)
     else:
         return jsonify({'error': 'No data available'}), 404
 
 @app.route('/api/energy/history', methods=['GET'])
+@response_cache.cached(('energy_data',), condition=lambda args: 'points' in args)
 def get_energy_history():
-    """Récupère l'historique énergétique"""
-    hours = request.args.get('hours', default=24, type=int)
-    
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT timestamp, power, energy_total, cost
-        FROM energy_data
-        WHERE timestamp > datetime('now', '-' || ? || ' hours')
-        ORDER BY timestamp ASC
-    ''', (hours,))
-    
-    rows = cursor.fetchall()
-    conn.close()
-    
-    data = []
-    for row in rows:
-        data.append({
-            'timestamp': row[0],
-            'power': row[1],
-            'energy_total': row[2],
-            'cost': row[3]
-        })
-    
-    return jsonify(data)
+    """Historique énergétique en flux
+
+    ?hours=24 ou ?start=&end=, ?device_id=, ?limit=&cursor= (pagination),
+    ?format=json|columnar|ndjson|csv, ?points=500&downsample=lttb|minmax
+    """
+    output = request.args.get('format', 'json')
+    downsample = request.args.get('downsample', 'lttb')
+    points = request.args.get('points', type=int)
+    limit = request.args.get('limit', type=int)
+
+    try:
+        if output not in history.FORMATS:
+            raise history.HistoryError(f"Invalid format: {output}")
+        if downsample not in history.DOWNSAMPLERS:
+            raise history.HistoryError(f"Invalid downsample: {downsample}")
+        # Fin par défaut: la seconde courante incluse
+        end = analytics.parse_time(request.args.get('end'), datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=1))
+        hours = request.args.get('hours', default=24, type=int)
+        start = analytics.parse_time(request.args.get('start'), end - timedelta(hours=hours))
+        after = history.decode_cursor(request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Le format columnar assemble ses colonnes en mémoire: toujours paginé
+    if limit is not None or output == 'columnar':
+        limit = max(1, min(limit or history.MAX_PAGE, history.MAX_PAGE))
+    query = history.HistoryQuery(
+        start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S'),
+        request.args.get('device_id'), after, limit
+    )
+
+    headers = {'Cache-Control': 'no-cache'}
+    if points:
+        # Sous-échantillonné: la réponse est bornée par le nombre de points
+        query.after = query.limit = None
+        next_cursor = None
+    else:
+        with db_pool.connection() as conn:
+            next_cursor = query.next_cursor(conn)
+    if next_cursor:
+        headers['X-Next-Cursor'] = next_cursor
+
+    def generate():
+        with db_pool.connection() as conn:
+            if points:
+                # Courbe: moteur de séries configuré (SQLite ou segments colonnes)
+                sampler = history.lttb if downsample == 'lttb' else history.minmax
+                rows = sampler(raw_store(conn), query, max(3, min(points, history.MAX_POINTS)))
+            else:
+                rows = history.iter_rows(conn, query)
+            if output == 'columnar':
+                yield from history.stream_columnar(rows, next_cursor)
+            else:
+                yield from history.STREAMERS[output](rows)
+
+    return Response(stream_with_context(generate()), mimetype=history.FORMATS[output], headers=headers)
 
 @app.route('/api/history', methods=['GET'])
+@response_cache.cached(ACTIVITY_TABLES)
 def get_device_history():
-    """Récupère l'historique consolidé des dernières activités"""
-    limit = request.args.get('limit', default=20, type=int)
-    limit = max(1, min(limit, 100))
+    """Récupère l'historique consolidé des dernières activités
 
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        SELECT * FROM (
-            SELECT
-                timestamp,
-                'energy' as category,
-                device_id,
-                printf('Puissance: %.2fW | Énergie: %.3fkWh | Coût: %.3f TND', power, energy_total, cost) as details
-            FROM energy_data
-
-            UNION ALL
-
-            SELECT
-                timestamp,
-                'sensor' as category,
-                device_id,
-                printf('Temp: %.1f°C | Humidité: %.1f%% | Luminosité: %d%%', temperature, humidity, light_level) as details
-            FROM sensor_readings
-
-            UNION ALL
-
-            SELECT
-                timestamp,
-                'presence' as category,
-                device_id,
-                CASE
-                    WHEN presence = 1 THEN 'Présence détectée'
-                    ELSE 'Aucune présence'
-                END as details
-            FROM presence_data
-
-            UNION ALL
-
-            SELECT
-                timestamp,
-                'actuator' as category,
-                device_id,
-                printf('HVAC: %s | Lumière: %s | Auto: %s',
-                    CASE WHEN relay1 = 1 THEN 'ON' ELSE 'OFF' END,
-                    CASE WHEN relay2 = 1 THEN 'ON' ELSE 'OFF' END,
-                    CASE WHEN auto_mode = 1 THEN 'ON' ELSE 'OFF' END
-                ) as details
-            FROM actuator_states
-        )
-        ORDER BY timestamp DESC
-        LIMIT ?
-    ''', (limit,))
+    ?limit=20, ?category=energy,sensor,presence,actuator, ?device_id=, ?cursor=
+    """
+    limit = request.args.get('limit', default=20, type=int)
+    categories = [c for c in request.args.get('category', '').split(',') if c]
 
-    history = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    try:
+        before = activity.decode_cursor(request.args.get('cursor'))
+        with db_pool.connection() as conn:
+            history_events, next_cursor = activity.latest_events(
+                conn, limit, categories, request.args.get('device_id'), before
+            )
+    except activity.ActivityError as e:
+        return jsonify({'error': str(e)}), 400
 
-    return jsonify(history)
+    response = jsonify(history_events)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
 @app.route('/api/sensors/current', methods=['GET'])
 def get_current_sensors():
     """Récupère les données des capteurs actuelles"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT temperature, humidity, light_level, timestamp
-        FROM sensor_readings
-        ORDER BY timestamp DESC
-        LIMIT 1
-    ''')
-    
-    row = cursor.fetchone()
-    conn.close()
-    
-    if row:
-        return jsonify({
-            'temperature': row[0],
-            'humidity': row[1],
-            'light_level': row[2],
-            'timestamp': row[3]
-        })
+    snapshot = latest_state.get('sensors', request.args.get('device_id'))
+
+    if snapshot:
+        return jsonify(snapshot)
     else:
         return jsonify({'error': 'No data available'}), 404
 
 @app.route('/api/presence/current', methods=['GET'])
 def get_current_presence():
     """Récupère l'état de présence actuel"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT presence, timestamp
-        FROM presence_data
-        ORDER BY timestamp DESC
-        LIMIT 1
-    ''')
-    
-    row = cursor.fetchone()
-    conn.close()
-    
-    if row:
-        return jsonify({
-            'presence': bool(row[0]),
-            'timestamp': row[1]
-        })
+    snapshot = latest_state.get('presence', request.args.get('device_id'))
+
+    if snapshot:
+        return jsonify(snapshot)
     else:
         return jsonify({'error': 'No data available'}), 404
 
 @app.route('/api/actuators/status', methods=['GET'])
 def get_actuators_status():
     """Récupère l'état des actionneurs"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    # Vérifier si la colonne window existe
-    cursor.execute("PRAGMA table_info(actuator_states)")
-    columns = [column[1] for column in cursor.fetchall()]
-    has_window = 'window' in columns
-    if has_window:
-        cursor.execute('''
-            SELECT relay1, relay2, window, auto_mode, timestamp
-            FROM actuator_states
-            ORDER BY timestamp DESC
-            LIMIT 1
-        ''')
-    else:
-        cursor.execute('''
-            SELECT relay1, relay2, auto_mode, timestamp
-            FROM actuator_states
-            ORDER BY timestamp DESC
-            LIMIT 1
-        ''')
+    snapshot = latest_state.get('actuators', request.args.get('device_id'))
 
-    row = cursor.fetchone()
-    conn.close()
-
-    if row:
-        if has_window:
-            return jsonify({
-                'relay1': bool(row[0]),
-                'relay2': bool(row[1]),
-                'window': bool(row[2]),
-                'auto_mode': bool(row[3]),
-                'timestamp': row[4]
-            })
-        else:
-            return jsonify({
-                'relay1': bool(row[0]),
-                'relay2': bool(row[1]),
-                'window': False,
-                'auto_mode': bool(row[2]),
-                'timestamp': row[3]
-            })
+    if snapshot:
+        return jsonify(snapshot)
     else:
         return jsonify({'error': 'No data available'}), 404
 
@@ -526,23 +772,21 @@ def control_relay():
     
     # Publier la commande via MQTT
     payload = json.dumps({'command': command})
-    mqtt_client.publish('home/control/command', payload)
+    publish_command('home/control/command', payload)
     
-    print(f"📤 Command sent: {command}")
+    log.info("📤 Command sent: %s", command)
     
     return jsonify({'status': 'success', 'command': command})
 
-@app.route('/api/analytics/consumption', methods=['GET'])
-def get_consumption_analytics():
-    """Analyse de consommation"""
-    conn = sqlite3.connect(DATABASE)
+def consumption_analytics(conn):
+    """Consommation aujourd'hui/hier, puissance moyenne et pic sur 24h (agrégats)"""
     cursor = conn.cursor()
     
-    # Consommation aujourd'hui
+    # Consommation aujourd'hui (agrégats journaliers, somme des appareils, coût tarifé)
     cursor.execute('''
-        SELECT MAX(energy_total) - MIN(energy_total), MAX(cost) - MIN(cost)
-        FROM energy_data
-        WHERE DATE(timestamp) = DATE('now')
+        SELECT SUM(COALESCE(energy_delta, energy_max - energy_min)), SUM(cost)
+        FROM energy_rollup_1d
+        WHERE bucket = DATE('now')
     ''')
     
     today_row = cursor.fetchone()
@@ -551,40 +795,55 @@ def get_consumption_analytics():
     
     # Consommation hier
     cursor.execute('''
-        SELECT MAX(energy_total) - MIN(energy_total), MAX(cost) - MIN(cost)
-        FROM energy_data
-        WHERE DATE(timestamp) = DATE('now', '-1 day')
+        SELECT SUM(COALESCE(energy_delta, energy_max - energy_min)), SUM(cost)
+        FROM energy_rollup_1d
+        WHERE bucket = DATE('now', '-1 day')
     ''')
     
     yesterday_row = cursor.fetchone()
     yesterday_energy = yesterday_row[0] if yesterday_row[0] else 0
     yesterday_cost = yesterday_row[1] if yesterday_row[1] else 0
     
-    # Moyenne
+    # Moyenne (agrégats minute des dernières 24h)
     cursor.execute('''
-        SELECT AVG(power)
-        FROM energy_data
-        WHERE timestamp > datetime('now', '-24 hours')
+        SELECT SUM(power_sum) / SUM(samples)
+        FROM energy_rollup_1m
+        WHERE bucket >= strftime('%Y-%m-%d %H:%M:00', 'now', '-24 hours')
     ''')
     
     avg_power = cursor.fetchone()[0] or 0
     
     # Pic
     cursor.execute('''
-        SELECT MAX(power), timestamp
-        FROM energy_data
-        WHERE timestamp > datetime('now', '-24 hours')
+        SELECT power_max, power_max_at
+        FROM energy_rollup_1m
+        WHERE bucket >= strftime('%Y-%m-%d %H:%M:00', 'now', '-24 hours')
+        ORDER BY power_max DESC
+        LIMIT 1
     ''')
     
-    peak_row = cursor.fetchone()
+    peak_row = cursor.fetchone() or (None, None)
     peak_power = peak_row[0] if peak_row[0] else 0
     peak_time = peak_row[1] if peak_row[1] else None
     
-    conn.close()
-    
-    potential_savings = today_cost * 0.15
+    # Estimation du mois et économie par report en heures moins chères: prévision en
+    # cache; avant le premier calcul, coût du mois au prorata des jours écoulés
+    snapshot = forecast_service.snapshot()
+    if snapshot is not None and snapshot['totals'] is not None:
+        monthly_estimate = snapshot['totals']['month']['estimate']['cost']
+        potential_savings = snapshot['totals']['potential_savings']
+    else:
+        cursor.execute('''
+            SELECT SUM(cost), julianday('now') - julianday('now', 'start of month'),
+                   julianday('now', 'start of month', '+1 month') - julianday('now', 'start of month')
+            FROM energy_rollup_1d
+            WHERE bucket >= DATE('now', 'start of month')
+        ''')
+        month_cost, elapsed, days = cursor.fetchone()
+        monthly_estimate = (month_cost or 0) * days / max(elapsed, 1)
+        potential_savings = 0
     
-    return jsonify({
+    return {
         'today': {
             'energy': round(today_energy, 3),
             'cost': round(today_cost, 3)
@@ -599,24 +858,49 @@ def get_consumption_analytics():
             'time': peak_time
         },
         'potential_savings': round(potential_savings, 3),
-        'monthly_estimate': round(today_cost * 30, 2)
-    })
+        'monthly_estimate': round(monthly_estimate, 2)
+    }
 
-@app.route('/api/alerts', methods=['GET'])
-def get_alerts():
-    """Récupère les alertes"""
-    conn = sqlite3.connect(DATABASE)
+@app.route('/api/analytics/consumption', methods=['GET'])
+@response_cache.cached(('energy_data', 'forecast'))
+def get_consumption_analytics():
+    """Analyse de consommation"""
+    with db_pool.connection() as conn:
+        return jsonify(consumption_analytics(conn))
+
+@app.route('/api/analytics/range', methods=['GET'])
+def get_range_analytics():
+    """Analyse de consommation sur une plage (?devices=a,b&start=...&end=...&bucket=1h)"""
+    default_start, default_end = analytics.default_range()
+    devices = [d for d in request.args.get('devices', '').split(',') if d]
+
+    try:
+        start = analytics.parse_time(request.args.get('start'), default_start)
+        end = analytics.parse_time(request.args.get('end'), default_end)
+        bucket_seconds = analytics.parse_bucket(request.args.get('bucket'))
+
+        with db_pool.connection() as conn:
+            result = analytics.analyze(
+                conn, devices, start, end, bucket_seconds,
+                tariff_service.schedule, request.args.get('source'), timeseries_store
+            )
+    except analytics.AnalyticsError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify(result)
+
+def recent_alerts(conn):
+    """50 dernières alertes"""
     cursor = conn.cursor()
-    
+
     cursor.execute('''
-        SELECT id, timestamp, alert_type, severity, message, resolved
+        SELECT id, timestamp, alert_type, severity, message, resolved, device_id
         FROM alerts
         ORDER BY timestamp DESC
         LIMIT 50
     ''')
-    
+
     rows = cursor.fetchall()
-    conn.close()
     
     alerts = []
     for row in rows:
@@ -626,48 +910,71 @@ def get_alerts():
             'alert_type': row[2],
             'severity': row[3],
             'message': row[4],
-            'resolved': bool(row[5])
+            'resolved': bool(row[5]),
+            'device_id': row[6]
         })
     
-    return jsonify(alerts)
+    return alerts
+
+@app.route('/api/alerts', methods=['GET'])
+@response_cache.cached(('alerts',))
+def get_alerts():
+    """Récupère les alertes"""
+    with db_pool.connection() as conn:
+        return jsonify(recent_alerts(conn))
 
 @app.route('/api/alerts/<int:alert_id>/resolve', methods=['PUT'])
 def resolve_alert(alert_id):
     """Résout une alerte"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        UPDATE alerts
-        SET resolved = 1
-        WHERE id = ?
-    ''', (alert_id,))
-    
-    conn.commit()
-    conn.close()
+    mark_alert_resolved(alert_id, wait=True)
     
     return jsonify({'status': 'success', 'alert_id': alert_id})
 
+@app.route('/api/alerts/rules', methods=['GET'])
+def get_alert_rules():
+    """Règles d'alerte actives et état du moteur"""
+    return jsonify({'rules': alert_engine.describe(), 'stats': alert_engine.stats()})
+
+@app.route('/api/alerts/anomalies', methods=['GET'])
+def get_anomaly_scores():
+    """Scores courants des règles d'anomalie par appareil (?device_id=...)"""
+    device_id = request.args.get('device_id')
+    scores = alert_engine.anomalies(device_id)
+    # Ingestion multi-processus: scores relayés par les workers avec leurs statistiques
+    if ingest_supervisor is not None:
+        for stats in ingest_supervisor.worker_stats.values():
+            scores.extend(score for score in (stats or {}).get('anomalies', ())
+                          if device_id is None or score['device_id'] == device_id)
+    return jsonify({'anomalies': scores, 'stats': alert_engine.stats()})
+
+@app.route('/api/alerts/rules/reload', methods=['POST'])
+def reload_alert_rules():
+    """Recharge immédiatement le fichier de règles"""
+    reloaded = alert_engine.reload(force=True)
+    if not reloaded:
+        return jsonify({'status': 'error', 'error': alert_engine.last_error}), 400
+    return jsonify({'status': 'success', 'stats': alert_engine.stats()})
+
 @app.route('/api/statistics/hourly', methods=['GET'])
+@response_cache.cached(('energy_data',))
 def get_hourly_statistics():
     """Statistiques par heure (dernières 24h)"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT 
-            strftime('%H:00', timestamp) as hour,
-            AVG(power) as avg_power,
-            MAX(power) as max_power,
-            MIN(power) as min_power
-        FROM energy_data
-        WHERE timestamp > datetime('now', '-24 hours')
-        GROUP BY hour
-        ORDER BY hour
-    ''')
+        cursor.execute('''
+            SELECT 
+                substr(bucket, 12, 2) || ':00' as hour,
+                SUM(power_sum) / SUM(samples) as avg_power,
+                MAX(power_max) as max_power,
+                MIN(power_min) as min_power
+            FROM energy_rollup_1h
+            WHERE bucket >= strftime('%Y-%m-%d %H:00:00', 'now', '-23 hours')
+            GROUP BY hour
+            ORDER BY hour
+        ''')
     
-    rows = cursor.fetchall()
-    conn.close()
+        rows = cursor.fetchall()
     
     data = []
     for row in rows:
@@ -681,25 +988,25 @@ def get_hourly_statistics():
     return jsonify(data)
 
 @app.route('/api/statistics/daily', methods=['GET'])
+@response_cache.cached(('energy_data',))
 def get_daily_statistics():
     """Statistiques journalières (derniers 7 jours)"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT 
-            DATE(timestamp) as day,
-            MAX(energy_total) - MIN(energy_total) as daily_energy,
-            MAX(cost) - MIN(cost) as daily_cost,
-            AVG(power) as avg_power
-        FROM energy_data
-        WHERE timestamp > datetime('now', '-7 days')
-        GROUP BY day
-        ORDER BY day
-    ''')
+        cursor.execute('''
+            SELECT 
+                bucket as day,
+                SUM(COALESCE(energy_delta, energy_max - energy_min)) as daily_energy,
+                SUM(cost) as daily_cost,
+                SUM(power_sum) / SUM(samples) as avg_power
+            FROM energy_rollup_1d
+            WHERE bucket >= DATE('now', '-6 days')
+            GROUP BY day
+            ORDER BY day
+        ''')
     
-    rows = cursor.fetchall()
-    conn.close()
+        rows = cursor.fetchall()
     
     data = []
     for row in rows:
@@ -711,42 +1018,509 @@ def get_daily_statistics():
         })
     
     return jsonify(data)
+@app.route('/api/rollups/rebuild', methods=['POST'])
+def rebuild_rollups():
+    """Recalcule les agrégats d'une période depuis les données brutes (?start=YYYY-MM-DD&end=YYYY-MM-DD)"""
+    start_day = request.args.get('start')
+    end_day = request.args.get('end')
+    # Bornes validées avant toute écriture
+    try:
+        bounds = [datetime.strptime(day, '%Y-%m-%d') for day in (start_day, end_day) if day]
+    except ValueError:
+        return jsonify({'status': 'error', 'error': 'start and end must be YYYY-MM-DD'}), 400
+    if start_day and end_day and bounds[0] > bounds[1]:
+        return jsonify({'status': 'error', 'error': 'start must not be after end'}), 400
+
+    # Écriture: une connexion directe par base (les vues de shards sont en lecture seule)
+    replayed = 0
+    try:
+        for database in [DATABASE] + SHARD_DATABASES:
+            conn = db_connect(database)
+            try:
+                replayed += rollups.rebuild(conn, start_day, end_day)
+                # Agrégats reconstruits sans coût: seuls les jours reconstruits sont re-tarifés
+                tariff_service.reprice(conn, database, start=start_day, end=end_day)
+            finally:
+                conn.close()
+    except tariffs.TariffError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+
+    return jsonify({'status': 'success', 'rows_replayed': replayed, 'start': start_day, 'end': end_day})
+
+@app.route('/api/tariffs', methods=['GET'])
+def get_tariffs():
+    """Barème courant (versions, plages, tranches) et état de la tarification"""
+    return jsonify({'tariff': tariff_service.schedule.describe(), 'stats': tariff_service.stats()})
+
+@app.route('/api/tariffs/reprice', methods=['POST'])
+def reprice_tariffs():
+    """Relit le barème et re-tarife les agrégats (?start=YYYY-MM&end=YYYY-MM, tout l'historique par défaut)"""
+    tariff_service.reload(force=True)
+    if tariff_service.last_error:
+        return jsonify({'status': 'error', 'error': tariff_service.last_error}), 400
+    start_month = request.args.get('start')
+    end_month = request.args.get('end')
+
+    reports = {}
+    try:
+        for database in [DATABASE] + SHARD_DATABASES:
+            conn = db_connect(database)
+            try:
+                reports[os.path.basename(database)] = tariff_service.reprice(conn, database, start=start_month, end=end_month)
+            finally:
+                conn.close()
+    except tariffs.TariffError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+
+    return jsonify({'status': 'success', 'fingerprint': tariff_service.schedule.fingerprint, 'databases': reports})
+
+@app.route('/api/forecast', methods=['GET'])
+@response_cache.cached(('forecast',))
+def get_forecast():
+    """Prévisions en cache: modèle et erreur par appareil, 24 h, mois en cours, détail
+    horaire (?device_id=...&hours=N)"""
+    hours = request.args.get('hours', type=int)
+    try:
+        result = forecast_service.forecast(request.args.get('device_id'), hours)
+    except forecast.ForecastError as e:
+        return jsonify({'error': str(e)}), 400
+    if result is None:
+        # Premier calcul en cours (démarrage du processus)
+        forecast_service.request_refresh()
+        return jsonify({'error': 'Forecast not computed yet'}), 503, {'Retry-After': '10'}
+    return jsonify(dict(result, stats=forecast_service.stats()))
+
+@app.route('/api/retention/stats', methods=['GET'])
+def get_retention_stats():
+    """Politique de rétention, lignes purgées et octets récupérés"""
+    return jsonify(retention_service.stats())
+
+@app.route('/api/retention/run', methods=['POST'])
+def run_retention():
+    """Lance immédiatement un passage de rétention"""
+    return jsonify(retention_service.run_once())
+
+@app.route('/api/storage/stats', methods=['GET'])
+def get_storage_stats():
+    """Moteur des séries brutes et volume sur disque"""
+    return jsonify(timeseries_store.stats())
+
 @app.route('/api/status/live', methods=['GET'])
 def get_live_status():
-    return jsonify({
-        'status': device_live_status,
-        #'color': 'green' if device_live_status == 'online' else 'red',
-        'label': 'LIVE' if device_live_status == 'online' else 'DOWN',
-        'last_seen': last_seen
-    })
+    return jsonify(live_status_payload(request.args.get('device_id')))
+
+@app.route('/api/devices', methods=['GET'])
+def get_devices():
+    """Flotte d'appareils (?online=1 ou ?online=0 pour filtrer)"""
+    online = request.args.get('online')
+    fleet = device_registry.list(None if online is None else online in ('1', 'true'))
+    return jsonify({'summary': device_registry.summary(), 'devices': fleet})
+
+@app.route('/api/devices/<device_id>', methods=['GET'])
+def get_device(device_id):
+    """État d'un appareil"""
+    device = device_registry.get(device_id)
+    if device is None:
+        return jsonify({'error': 'Unknown device'}), 404
+    return jsonify(device)
+
+# ==================== TABLEAU DE BORD ====================
+# Section du snapshot -> tables dont elle dépend (l'état des appareils: 'devices')
+DASHBOARD_SECTIONS = {
+    'energy': ('energy_data',),
+    'sensors': ('sensor_readings',),
+    'presence': ('presence_data',),
+    'actuators': ('actuator_states',),
+    'analytics': ('energy_data', 'forecast'),
+    'energy_history': ('energy_data',),
+    'alerts': ('alerts',),
+    'history': ACTIVITY_TABLES,
+    'status': ('devices',),
+}
+DASHBOARD_TABLES = tuple(sorted({table for tables in DASHBOARD_SECTIONS.values() for table in tables}))
+# Sections sur une fenêtre relative à 'now': renvoyées au-delà de RESPONSE_CACHE_TTL même sans écriture
+DASHBOARD_WINDOWED = ('analytics', 'energy_history', 'history')
+DASHBOARD_HISTORY_HOURS = 24
+DASHBOARD_HISTORY_POINTS = 500
+DASHBOARD_ACTIVITY_LIMIT = 20
+
+def dashboard_energy_history(conn):
+    """Courbe de puissance des dernières 24h, sous-échantillonnée (LTTB)"""
+    end = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=1)
+    query = history.HistoryQuery(
+        (end - timedelta(hours=DASHBOARD_HISTORY_HOURS)).strftime('%Y-%m-%d %H:%M:%S'),
+        end.strftime('%Y-%m-%d %H:%M:%S')
+    )
+    return history.records(history.lttb(raw_store(conn), query, DASHBOARD_HISTORY_POINTS))
+
+def dashboard_activity(conn):
+    return activity.latest_events(conn, DASHBOARD_ACTIVITY_LIMIT, [], None, None)[0]
+
+# Sections lues en base, toutes dans la même transaction de lecture
+DASHBOARD_QUERIES = {
+    'analytics': consumption_analytics,
+    'energy_history': dashboard_energy_history,
+    'alerts': recent_alerts,
+    'history': dashboard_activity,
+}
+
+@app.route('/api/dashboard', methods=['GET'])
+def get_dashboard():
+    """Snapshot complet du dashboard en une requête
+
+    ?fields=energy,alerts,... (défaut: toutes les sections), ?since=<generation> (jeton
+    de la réponse précédente: seules les sections modifiées depuis sont renvoyées)
+    """
+    fields = [f for f in request.args.get('fields', '').split(',') if f] or list(DASHBOARD_SECTIONS)
+    unknown = [f for f in fields if f not in DASHBOARD_SECTIONS]
+    if unknown:
+        return jsonify({'error': f"Unknown fields: {', '.join(unknown)}"}), 400
+
+    # Jeton lu avant les données: une écriture pendant la construction sera renvoyée au prochain appel
+    now = int(time.time())
+    token = generations.token(DASHBOARD_TABLES)
+    previous, _, issued = request.args.get('since', '').partition('@')
+    changed = cache.changed_tables(previous, token, DASHBOARD_TABLES) if previous else None
+    if changed is not None:
+        issued = int(issued) if issued.isdigit() else 0
+        refresh = now - issued >= RESPONSE_CACHE_TTL
+        fields = [f for f in fields if changed.intersection(DASHBOARD_SECTIONS[f])
+                  or (refresh and f in DASHBOARD_WINDOWED)]
+        if not refresh:
+            # Fenêtres glissantes pas encore renvoyées: l'échéance reste celle du jeton
+            now = issued
+    generation = f"{token}@{now}"
+
+    snapshot = {'generation': generation}
+    for field in fields:
+        if field in LATEST_KINDS:
+            snapshot[field] = latest_state.get(field)
+        elif field == 'status':
+            snapshot[field] = live_status_payload()
+
+    queries = [f for f in fields if f in DASHBOARD_QUERIES]
+    if queries:
+        with db_pool.connection() as conn:
+            # Une seule transaction: toutes les sections voient le même état de la base
+            conn.execute('BEGIN')
+            try:
+                for field in queries:
+                    snapshot[field] = DASHBOARD_QUERIES[field](conn)
+            finally:
+                conn.rollback()
+    return jsonify(snapshot)
+
+@app.route('/api/stream', methods=['GET'])
+def stream_events():
+    """Flux Server-Sent Events: état initial puis changements poussés à l'ingestion"""
+    initial_events = [('status', live_status_payload())]
+    for kind in ('energy', 'sensors', 'presence', 'actuators'):
+        for device_id in latest_state.devices(kind):
+            snapshot = latest_state.get(kind, device_id)
+            initial_events.append((kind, dict(snapshot, device_id=device_id)))
+
+    subscriber = event_broker.subscribe()
+    return Response(
+        stream_with_context(event_broker.stream(subscriber, initial_events)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/ingest/stats', methods=['GET'])
+def get_ingest_stats():
+    """Statistiques du pipeline d'ingestion (file, pertes, latence)"""
+    stats = dict(ingest_pipeline.stats(), mqtt=dict(mqtt_stats, encodings=payloads.available_encodings()))
+    if ingest_supervisor is not None:
+        stats['shards'] = ingest_supervisor.stats()
+    stats['schema_backfills'] = schema_backfill.stats()
+    stats['response_cache'] = response_cache.stats()
+    stats['compression'] = compression_stats()
+    return jsonify(stats)
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Métriques au format texte Prometheus (tous les processus du déploiement)"""
+    return Response(metrics.render(metrics_exporter.collect()), mimetype=metrics.CONTENT_TYPE)
+
+@app.route('/debug/profile', methods=['GET'])
+def get_profile():
+    """Profil par échantillonnage du processus qui répond (piles « folded » pour flamegraph.pl)"""
+    if not PROFILING_ENABLED:
+        return jsonify({'error': 'Profiling disabled (PROFILING_ENABLED=1)'}), 404
+    seconds = request.args.get('seconds', 30, type=float)
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        return jsonify({'error': f"seconds must be in ]0, {PROFILE_MAX_SECONDS}]"}), 400
+    try:
+        stacks, samples = profiler.run(seconds)
+    except profiling.ProfilerBusy as e:
+        return jsonify({'error': str(e)}), 409
+    return Response(profiling.render(stacks), mimetype='text/plain',
+                    headers={'X-Profile-Pid': str(os.getpid()), 'X-Profile-Samples': str(samples)})
 # ==================== MQTT THREAD ====================
+# Client d'envoi des commandes des workers HTTP non-leader (sans abonnement)
+command_client = None
+_command_lock = threading.Lock()
+
+def publish_command(topic, payload):
+    """Publie une commande: client du leader, sinon client d'envoi ouvert à la demande"""
+    global command_client
+    if leader_lock.held:
+        return mqtt_client.publish(topic, payload)
+    with _command_lock:
+        if command_client is None:
+            command_client = mqtt.Client()
+            command_client.connect(MQTT_BROKER, MQTT_PORT, 60)
+            command_client.loop_start()
+    return command_client.publish(topic, payload)
+
 def mqtt_loop():
     """Thread pour le client MQTT"""
     mqtt_client.on_connect = on_connect
     mqtt_client.on_message = on_message
     
-    print("Connecting to MQTT Broker...")
+    log.info("Connecting to MQTT Broker...")
     try:
         mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
         mqtt_client.loop_forever()
     except Exception as e:
-        print(f"MQTT Error: {e}")
+        log.error("MQTT Error: %s", e)
+
+# ==================== WORKERS D'INGESTION ====================
+# Superviseur des workers (processus de l'API uniquement, INGEST_WORKERS > 0)
+ingest_supervisor = None
+
+LATEST_KINDS = ('energy', 'sensors', 'presence', 'actuators')
+
+def apply_shard_batch(batch):
+    """Applique dans le processus de l'API les mises à jour envoyées par un worker"""
+    for item in batch:
+        if item[0] == 'event':
+            _, event_type, data, key = item
+            if event_type in LATEST_KINDS:
+                snapshot = dict(data)
+                publish_state(event_type, snapshot.pop('device_id'), snapshot)
+            else:
+                if event_type in ('alert', 'alert_resolved'):
+                    generations.bump('alerts')
+                event_broker.publish(event_type, data, key=key)
+        elif item[0] == 'touch':
+            _, device_id, kind, count, legacy, at = item
+            device_registry.touch(device_id, kind, legacy=legacy, now=at, count=count)
+        elif item[0] == 'stats':
+            ingest_supervisor.worker_stats[item[1]] = item[2]
+        elif item[0] == 'commit':
+            generations.bump(*item[1])
+
+def run_ingest_worker(index, count, events):
+    """Processus worker: client MQTT propre, appareils de son segment de l'anneau,
+    écrivain unique sur sa base shard; SSE et registre relayés vers l'API"""
+    global ingest_pipeline, event_broker, device_registry, db_pool, owns_device, mqtt_topics, timeseries_store
+    global alert_writer
+
+    # Ctrl+C est géré par le processus de l'API, qui arrête les workers par SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    ring = sharding.HashRing(count)
+    owns_device = lambda device_id: ring.owner(device_id) == index
+    mqtt_topics = MQTT_DATA_TOPICS
+    db_pool = ConnectionPool(DATABASE, size=2)
+    ingest_pipeline = IngestPipeline(
+        SHARD_DATABASES[index],
+        max_queue=INGEST_QUEUE_SIZE,
+        batch_size=INGEST_BATCH_SIZE,
+        max_latency=INGEST_MAX_LATENCY
+    )
+    ingest_pipeline.add_flush_hook(update_energy_rollups)
+    ingest_pipeline.add_state(energy_counters)
+    ingest_pipeline.add_state(energy_pricer)
+    ingest_pipeline.add_reject_hook(forget_rejected)
+    timeseries_store = open_timeseries_store(index)
+    ingest_pipeline.add_commit_hook(timeseries_store.append)
+    forwarder = sharding.ShardForwarder(
+        events, index, stats=lambda: dict(ingest_pipeline.stats(), mqtt=dict(mqtt_stats), pid=os.getpid(),
+                                          compression=compression_stats(), anomalies=alert_engine.anomalies())
+    )
+    event_broker = device_registry = forwarder
+    # Lots commités dans le shard: le processus de l'API invalide son cache
+    ingest_pipeline.add_commit_hook(forwarder.committed)
+
+    # Alertes dans la base principale, via un écrivain propre au worker
+    alert_writer = IngestPipeline(DATABASE, max_queue=1000, batch_size=50, max_latency=INGEST_MAX_LATENCY)
+    alert_writer.start()
+    load_alert_rules()
+    alert_engine.start()
+    # Coûts du shard re-tarifés par ce worker; le processus de l'API invalide son cache
+    tariff_service.on_repriced = lambda: forwarder.committed({'energy_data': ()})
+    tariff_service.reload(force=True)
+    tariff_service.start([SHARD_DATABASES[index]])
+    ingest_pipeline.start()
+    forwarder.start()
+    metrics_exporter.start()
+
+    client = mqtt.Client(client_id=f"pds32-ingest-{index}-{os.getpid()}")
+    client.on_connect = on_connect
+    client.on_message = on_message
+    signal.signal(signal.SIGTERM, lambda signum, frame: client.disconnect())
+    log.info("✓ Ingest worker %d/%d started (pid %d)", index, count, os.getpid())
+    try:
+        client.connect(MQTT_BROKER, MQTT_PORT, 60)
+        client.loop_forever()
+    except Exception as e:
+        log.error("MQTT Error (worker %d): %s", index, e)
+    finally:
+        # Vider la file d'ingestion et les dernières mises à jour avant de quitter
+        alert_engine.stop()
+        alert_writer.stop()
+        tariff_service.stop()
+        flush_compressors()
+        ingest_pipeline.stop()
+        forwarder.stop()
+        metrics_exporter.stop()
+
+# ==================== SERVICES ====================
+leader_lock = serving.LeaderLock(LEADER_LOCK_FILE)
+change_feed = None
+_services_lock = threading.Lock()
+_services_started = threading.Event()
+_shutdown = threading.Event()
+
+# Nouvelles alertes suivies par les workers HTTP non-leader
+ALERT_FEED_QUERY = ('alerts', 'id, timestamp, alert_type, severity, message, device_id, resolved')
+ALERT_FIELDS = ('id', 'timestamp', 'alert_type', 'severity', 'message', 'device_id', 'resolved')
+
+def start_ingestion():
+    """MQTT, ingestion, alertes et rétention: uniquement dans le processus leader"""
+    global mqtt_topics, ingest_supervisor
+
+    if INGEST_WORKERS:
+        # Les workers reçoivent les données, évaluent les alertes et écrivent leurs shards;
+        # ce processus garde les statuts, les commandes et l'API
+        alert_engine.reload(force=True)
+        mqtt_topics = MQTT_STATUS_TOPICS
+        ingest_supervisor = sharding.ShardSupervisor(
+            multiprocessing.get_context('spawn'), run_ingest_worker, INGEST_WORKERS, apply_shard_batch
+        )
+        ingest_supervisor.start()
+        log.info("✓ %d ingest workers started", INGEST_WORKERS)
+    else:
+        load_alert_rules()
+        alert_engine.start()
+
+        # Démarrer l'écrivain d'ingestion
+        ingest_pipeline.start()
+        log.info("✓ Ingest writer started")
+
+    # Backfills des migrations, puis rétention (purge par lots + VACUUM incrémental)
+    schema_backfill.start()
+    retention_service.start()
+
+    # Tarification: coûts des agrégats de la base principale (les workers tarifent leurs shards)
+    tariff_service.start([DATABASE])
+
+    # Démarrer le thread MQTT
+    mqtt_thread = threading.Thread(target=mqtt_loop, name='mqtt', daemon=True)
+    mqtt_thread.start()
+    log.info("✓ MQTT thread started")
+
+def apply_feed_rows(name, rows):
+    """Worker HTTP non-leader: lignes écrites par le leader -> dernier état, registre, SSE"""
+    generations.bump(FEED_QUERIES[name][0] if name in FEED_QUERIES else name)
+    if name == 'alerts':
+        for row in rows:
+            alert = dict(zip(ALERT_FIELDS, row))
+            alert['resolved'] = bool(alert['resolved'])
+            event_broker.publish('alert', alert)
+        return
+    build = SNAPSHOT_BUILDERS[name]
+    for row in rows:
+        device_registry.touch(row[1], name)
+        publish_state(name, row[1], build(*row[2:]))
+
+def follow_leader():
+    """Worker HTTP non-leader: suit les écritures du leader et prend le relais s'il disparaît"""
+    global change_feed
+    change_feed = serving.ChangeFeed(
+        [DATABASE] + SHARD_DATABASES, dict(FEED_QUERIES, alerts=ALERT_FEED_QUERY),
+        apply_feed_rows, interval=FEED_INTERVAL
+    )
+    change_feed.start()
+    while not _shutdown.wait(LEADER_RETRY):
+        if leader_lock.acquire():
+            change_feed.stop()
+            log.info("✓ Leadership taken over by pid %d", os.getpid())
+            start_ingestion()
+            return
+
+def start_services():
+    """Initialise la base et démarre les tâches de fond (une fois par processus)"""
+    with _services_lock:
+        if _services_started.is_set():
+            return
+        # Plusieurs workers peuvent démarrer ensemble: initialisation sérialisée
+        with serving.exclusive(INIT_LOCK_FILE):
+            init_database()
+            init_shards()
+        rehydrate_latest_state()
+        # Barème rechargé à chaud dans chaque processus; bases re-tarifées par le leader
+        tariff_service.reload(force=True)
+        tariff_service.start()
+        forecast_service.start()
+        device_registry.start()
+        metrics_exporter.start()
+
+        if leader_lock.acquire():
+            log.info("✓ Leader process (pid %d): MQTT and ingestion run here", os.getpid())
+            start_ingestion()
+        else:
+            log.info("✓ Follower process (pid %d): serving the API from the database", os.getpid())
+            threading.Thread(target=follow_leader, name='leader-standby', daemon=True).start()
+        _services_started.set()
+
+def stop_services():
+    """Arrêt propre: plus de nouveaux messages MQTT, puis vidage des files d'ingestion"""
+    if _shutdown.is_set():
+        return
+    _shutdown.set()
+    event_broker.close_all()
+    if leader_lock.held:
+        mqtt_client.disconnect()
+    if command_client is not None:
+        command_client.loop_stop()
+        command_client.disconnect()
+    if change_feed is not None:
+        change_feed.stop()
+    device_registry.stop()
+    alert_engine.stop()
+    tariff_service.stop()
+    forecast_service.stop()
+    retention_service.stop()
+    schema_backfill.stop()
+    flush_compressors()
+    ingest_pipeline.stop()
+    if ingest_supervisor is not None:
+        ingest_supervisor.stop()
+    leader_lock.release()
+    metrics_exporter.stop()
+    db_pool.close_all()
+    log.info("✓ Services stopped (pid %d)", os.getpid())
+
+def create_app():
+    """Fabrique WSGI pour gunicorn: gunicorn -c gunicorn.conf.py 'app:create_app()'"""
+    start_services()
+    return app
 
 # ==================== MAIN ====================
 if __name__ == '__main__':
     print("\n" + "="*50)
     print("  PDS-32: Smart Energy Management Backend")
     print("="*50 + "\n")
-    
-    # Initialiser la base de données
-    init_database()
-    
-    # Démarrer le thread MQTT
-    mqtt_thread = threading.Thread(target=mqtt_loop, daemon=True)
-    mqtt_thread.start()
-    
-    print("✓ MQTT thread started")
-    print("✓ Starting Flask server...\n")
-    
-    # Démarrer le serveur Flask
-    app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
+
+    create_app()
+    log.info("✓ Starting Flask development server (production: gunicorn -c gunicorn.conf.py)...")
+
+    # Serveur de développement Flask (débogueur seulement si FLASK_DEBUG=1)
+    try:
+        app.run(host='0.0.0.0', port=HTTP_PORT, debug=FLASK_DEBUG, use_reloader=False, threaded=True)
+    finally:
+        # Vider la file d'ingestion avant de quitter
+        stop_services()
@@ -0,0 +1,85 @@
+"""
+PDS-32: Benchmark - moteur d'analyse vectorisé sur un mois de données multi-appareils
+
+Usage (depuis backend/):
+    python bench/bench_analytics.py --devices 36 --days 30
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def populate_rollups(conn, devices, days):
+    """Génère des agrégats minute/heure/jour cohérents pour `devices` appareils sur `days` jours"""
+    import rollups
+
+    rng = np.random.default_rng(42)
+    end = datetime.now(timezone.utc).replace(tzinfo=None, second=0, microsecond=0)
+    start = end - timedelta(days=days)
+    minutes = days * 1440
+    stamps = [(start + timedelta(minutes=m)).strftime('%Y-%m-%d %H:%M:%S') for m in range(minutes)]
+
+    counters = rollups.CounterTracker(seed=None)
+    for d in range(devices):
+        device_id = f"ESP32_{d:03d}"
+        power = rng.uniform(50, 2500, minutes)
+        energy = np.cumsum(power / 60 / 1000)
+        # Une remise à zéro du compteur au milieu de la période
+        energy[minutes // 2:] -= energy[minutes // 2 - 1]
+        rows = [
+            (ts, device_id, float(p), 220.0, float(p) / 220, float(e), float(e) * 0.15)
+            for ts, p, e in zip(stamps, power, energy)
+        ]
+        with conn:
+            rollups.apply(conn, rows, counters)
+    return start, end
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=36)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='pds32-bench-')
+    import app as app_module
+    import analytics
+    import tariffs
+
+    app_module.init_database()
+    with app_module.db_pool.connection() as conn:
+        started = time.perf_counter()
+        start, end = populate_rollups(conn, args.devices, args.days)
+        print(f"Agrégats générés: {args.devices} appareils x {args.days} jours "
+              f"({time.perf_counter() - started:.1f}s)")
+        schedule = app_module.tariff_service.schedule
+        report = tariffs.reprice(conn, schedule)
+        print(f"Agrégats tarifés: {report['rows']} lignes, {report['months']} mois ({report['duration_s']:.1f}s)")
+
+        for bucket, source in (('1d', None), ('1h', None), ('1h', '1m')):
+            timings = []
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                result = analytics.analyze(
+                    conn, [], start, end, analytics.parse_bucket(bucket),
+                    schedule, source
+                )
+                timings.append(time.perf_counter() - t0)
+            print(f"  bucket={bucket:>3} source={result['source']:>3}: "
+                  f"médiane {np.median(timings) * 1000:7.1f} ms, "
+                  f"énergie {result['totals']['energy_kwh']:.1f} kWh, "
+                  f"{result['totals']['samples']} échantillons")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+PDS-32: Benchmark - détection d'anomalies en flux (règles zscore, seasonal, flatline)
+
+Génère plusieurs jours de mesures énergie + capteurs toutes les 5 s (profil
+journalier, bruit, appareils qui s'allument), injecte trois pannes le dernier
+jour - appareil bloqué allumé la nuit, dérive lente du courant, capteur de
+température figé - puis rejoue le flux dans le moteur de règles:
+- surcoût par message des règles d'anomalie (règles de alert_rules.json avec
+  et sans elles),
+- délai de détection de chaque panne et alertes sans panne (faux positifs).
+
+Usage (depuis backend/):
+    python bench/bench_anomalies.py --devices 10 --days 7
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from alert_rules import ANOMALY_KINDS, AlertEngine, load_rules  # noqa: E402
+
+VOLTAGE = 220.0
+UTC_OFFSET = 3600
+
+# Pannes injectées le dernier jour: (appareil, règle attendue, heure locale de début, durée en heures)
+FAULTS = (
+    (0, 'power_unusual_for_hour', 2, 3),    # chauffage bloqué allumé la nuit
+    (1, 'current_drift', 8, 6),             # charge de base qui dérive jusqu'à +150 % en 6 h
+    (2, 'temperature_frozen', 12, 2),       # capteur figé
+)
+
+
+def generate(devices, days, interval, seed):
+    """Messages (instant, source, appareil, mesures) dans l'ordre de réception"""
+    rng = random.Random(seed)
+    start = (int(time.time()) // 86400 - days) * 86400 - UTC_OFFSET
+    last_day = start + (days - 1) * 86400
+    profiles = [(rng.uniform(80, 300), rng.uniform(19, 23)) for _ in range(devices)]
+    appliance = [0.0] * devices
+    frozen = [None] * devices
+    messages = []
+    for tick in range(int(days * 86400 / interval)):
+        at = start + tick * interval
+        hour = ((at + UTC_OFFSET) % 86400) / 3600
+        evening = 1 + 0.8 * math.exp(-((hour - 20) ** 2) / 4)
+        for d, (base, comfort) in enumerate(profiles):
+            # Appareil ponctuel (bouilloire, four): 1 à 10 min, ~45 min par jour
+            if appliance[d] > 0:
+                appliance[d] -= interval
+            elif rng.random() < 0.0005:
+                appliance[d] = rng.uniform(60, 600)
+            load = base * evening * rng.gauss(1, 0.05)
+            burst = 1200 if appliance[d] > 0 else 0
+            temperature = round(comfort + 2 * math.sin((hour - 9) / 24 * 2 * math.pi) + rng.gauss(0, 0.15), 1)
+            for device, _, fault_hour, hours in FAULTS:
+                fault_start = last_day + fault_hour * 3600
+                if d != device or not fault_start <= at < fault_start + hours * 3600:
+                    continue
+                if device == 0:
+                    burst += 1500
+                elif device == 1:
+                    load *= 1 + 1.5 * (at - fault_start) / (hours * 3600)
+                else:
+                    frozen[d] = temperature if frozen[d] is None else frozen[d]
+                    temperature = frozen[d]
+            power = load + burst
+            device_id = f"ESP32_{d:03d}"
+            messages.append((at, 'energy', device_id, {'power': power, 'current': round(power / VOLTAGE, 2)}))
+            messages.append((at, 'sensors', device_id, {'temperature': temperature, 'humidity': 50.0}))
+    return messages, last_day
+
+
+def replay(rules, messages):
+    opened = []
+    engine = AlertEngine(
+        lambda rule, device_id, severity, message: opened.append((rule.id, device_id, clock[0])) or len(opened),
+        lambda alert_id: None, utc_offset_hours=UTC_OFFSET // 3600
+    )
+    engine.set_rules(rules)
+    clock = [0.0]
+    evaluate = engine.evaluate
+    started = time.perf_counter()
+    for at, source, device_id, payload in messages:
+        clock[0] = at
+        evaluate(source, device_id, payload, at)
+    return time.perf_counter() - started, opened, engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=10)
+    parser.add_argument('--days', type=int, default=7, help="dont 6 jours d'apprentissage des références")
+    parser.add_argument('--interval', type=float, default=5.0)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    messages, last_day = generate(args.devices, args.days, args.interval, args.seed)
+    print(f"{len(messages):,} messages: {args.devices} appareils x {args.days} jours toutes les {args.interval:g}s "
+          f"({time.perf_counter() - started:.1f}s)")
+
+    rules = load_rules(os.path.join(BACKEND_DIR, 'alert_rules.json'))
+    # Règle d'absence de données: sans objet pour un rejeu
+    rules = [rule for rule in rules if rule.kind != 'missing']
+    baseline_rules = [rule for rule in rules if rule.kind not in ANOMALY_KINDS]
+    anomaly_rules = [rule for rule in rules if rule.kind in ANOMALY_KINDS]
+
+    base_time, _, _ = replay(baseline_rules, messages)
+    full_time, opened, engine = replay(rules, messages)
+    per_message = (full_time - base_time) / len(messages) * 1e6
+    print(f"  seuils seuls {base_time / len(messages) * 1e6:.2f} µs/msg, avec {len(anomaly_rules)} règles "
+          f"d'anomalie {full_time / len(messages) * 1e6:.2f} µs/msg (surcoût {per_message:.2f} µs/msg)")
+
+    anomaly_ids = {rule.id for rule in anomaly_rules}
+    expected = {(f"ESP32_{device:03d}", rule_id): last_day + hour * 3600 for device, rule_id, hour, _ in FAULTS}
+    for (device_id, rule_id), fault_start in expected.items():
+        detections = [at for rule, device, at in opened if rule == rule_id and device == device_id and at >= fault_start]
+        delay = f"détectée en {(detections[0] - fault_start) / 60:.0f} min" if detections else 'NON détectée'
+        print(f"  {rule_id:<24} {device_id}: {delay}")
+    # Alerte hors de toute panne de l'appareil (une panne peut déclencher plusieurs règles)
+    windows = {f"ESP32_{device:03d}": (last_day + hour * 3600, last_day + (hour + hours) * 3600 + 3600)
+               for device, _, hour, hours in FAULTS}
+    false_positives = [(rule, device) for rule, device, at in opened if rule in anomaly_ids
+                       and not (device in windows and windows[device][0] <= at < windows[device][1])]
+    print(f"  fausses alertes d'anomalie: {len(false_positives)} "
+          f"sur {args.devices * len(anomaly_rules)} (appareil, règle) x {args.days} jours")
+    print(f"  états en mémoire: {len(engine.anomalies())} détecteurs")
+
+
+if __name__ == '__main__':
+    main()
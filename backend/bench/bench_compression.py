@@ -0,0 +1,112 @@
+"""
+PDS-32: Benchmark - compression à l'écriture des flux capteurs, présence et actionneurs
+
+Rejoue la flotte simulée (bench/fleet.py) à travers les compresseurs de
+compression.py, puis compare chaque mesure brute à la valeur reconstruite
+depuis les seules lignes écrites: lignes gardées et erreur maximale par mesure.
+
+Usage (depuis backend/):
+    python bench/bench_compression.py --devices 50 --hours 24
+    python bench/bench_compression.py --tolerances 'temperature=0.2,humidity=1%,light_level=3'
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import compression  # noqa: E402
+import fleet  # noqa: E402
+
+COLUMNS = {
+    'sensor_readings': ('temperature', 'humidity', 'light_level'),
+    'presence_data': ('presence',),
+    'actuator_states': ('relay1', 'relay2', 'window', 'auto_mode'),
+}
+
+
+def simulate(devices, hours, interval, seed):
+    """Lignes brutes (timestamp, device_id, valeurs...) par table, dans l'ordre de réception"""
+    rng = random.Random(seed)
+    fleet_devices = [fleet.SimulatedDevice(f"ESP32_{index:03d}", rng) for index in range(devices)]
+    rows = {table: [] for table in COLUMNS}
+    start = int(time.time()) - int(hours * 3600)
+    for tick in range(int(hours * 3600 / interval)):
+        now = start + tick * interval
+        for device in fleet_devices:
+            device.step(interval)
+            documents = device.documents()
+            for table, kind in (('sensor_readings', 'sensors'), ('presence_data', 'presence'),
+                                ('actuator_states', 'actuators')):
+                values = tuple(documents[kind][column] for column in COLUMNS[table])
+                rows[table].append((now, (now, device.device_id) + values))
+    return rows
+
+
+def replay(table, rows, mode, tolerances, heartbeat):
+    """Passe les lignes dans un compresseur; retourne (statistiques, lignes écrites par appareil)"""
+    compressor = compression.StreamCompressor(table, COLUMNS[table], mode, tolerances, heartbeat)
+    started = time.perf_counter()
+    written = []
+    for now, row in rows:
+        written.extend(compressor.offer(row, now))
+    written.extend(compressor.flush())
+    elapsed = time.perf_counter() - started
+    points = {}
+    for row in sorted(written, key=lambda row: row[0]):
+        points.setdefault(row[1], []).append((row[0], row[2:]))
+    return compressor.stats(), points, elapsed
+
+
+def errors(table, rows, points, hold, linear):
+    """Erreur absolue maximale par mesure entre brut et reconstruit"""
+    worst = [0.0] * len(COLUMNS[table])
+    uncovered = 0
+    for _, row in rows:
+        rebuilt = compression.value_at(points[row[1]], row[0], hold, linear)
+        if rebuilt is None:
+            uncovered += 1
+            continue
+        for index, (raw, value) in enumerate(zip(row[2:], rebuilt)):
+            worst[index] = max(worst[index], abs(float(raw) - float(value)))
+    return worst, uncovered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=50)
+    parser.add_argument('--hours', type=float, default=24)
+    parser.add_argument('--interval', type=float, default=5.0, help='secondes entre deux publications')
+    parser.add_argument('--heartbeat', type=int, default=300, help='secondes max entre deux lignes écrites')
+    parser.add_argument('--tolerances', default='temperature=0.3,humidity=2,light_level=5')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    tolerances = compression.parse_tolerances(args.tolerances)
+    hold = compression.max_hold(args.heartbeat)
+    started = time.perf_counter()
+    rows = simulate(args.devices, args.hours, args.interval, args.seed)
+    print(f"Flotte simulée: {args.devices} appareils x {args.hours:g} h toutes les {args.interval:g} s "
+          f"({time.perf_counter() - started:.1f}s)")
+
+    runs = [
+        ('presence_data', 'state', {}),
+        ('actuator_states', 'state', {}),
+        ('sensor_readings', 'deadband', tolerances),
+        ('sensor_readings', 'swinging_door', tolerances),
+    ]
+    for table, mode, table_tolerances in runs:
+        stats, points, elapsed = replay(table, rows[table], mode, table_tolerances, args.heartbeat)
+        worst, uncovered = errors(table, rows[table], points, hold, mode == 'swinging_door')
+        detail = ', '.join(f"{column} {error:.2f}" for column, error in zip(COLUMNS[table], worst))
+        print(f"  {table:<16} {mode:<13}: {stats['received']:>8} -> {stats['written']:>7} lignes "
+              f"(x{stats['ratio']:.1f}), {elapsed / stats['received'] * 1e6:.1f} µs/ligne, "
+              f"erreur max {detail}, {uncovered} non couvertes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+PDS-32: Benchmark - connexion par requête vs pool de connexions persistantes
+
+Usage (depuis backend/):
+    python bench/bench_connections.py --rows 200000 --requests 2000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Les routes appelées à chaque tick du dashboard (static/js/main.js)
+DASHBOARD_ROUTES = [
+    '/api/energy/current',
+    '/api/sensors/current',
+    '/api/presence/current',
+    '/api/actuators/status',
+    '/api/analytics/consumption',
+    '/api/energy/history?hours=1',
+    '/api/alerts',
+    '/api/history?limit=20',
+    '/api/status/live',
+]
+
+
+class ConnectPerRequest:
+    """Comportement d'origine: sqlite3.connect() + close() à chaque requête"""
+
+    def __init__(self, database):
+        self.database = database
+
+    @contextmanager
+    def connection(self):
+        conn = sqlite3.connect(self.database)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+
+def populate(app_module, rows):
+    """Remplit la base avec `rows` mesures réparties sur les 7 derniers jours"""
+    conn = sqlite3.connect(app_module.DATABASE)
+    now = datetime.now(timezone.utc)
+    step = timedelta(days=7) / max(rows, 1)
+    energy = 0.0
+    energy_rows, sensor_rows, presence_rows, actuator_rows = [], [], [], []
+    for i in range(rows):
+        ts = (now - timedelta(days=7) + step * i).strftime('%Y-%m-%d %H:%M:%S')
+        power = random.uniform(50, 2500)
+        energy += power / 3600 / 1000
+        energy_rows.append((ts, 'ESP32_001', power, 220.0, power / 220, energy, energy * 0.15))
+        sensor_rows.append((ts, 'ESP32_001', random.uniform(18, 28), random.uniform(30, 60), random.randint(0, 100)))
+        presence_rows.append((ts, 'ESP32_001', random.random() > 0.5))
+        actuator_rows.append((ts, 'ESP32_001', True, False, False, True))
+    conn.executemany('INSERT INTO energy_data (timestamp, device_id, power, voltage, current, energy_total, cost) VALUES (?, ?, ?, ?, ?, ?, ?)', energy_rows)
+    conn.executemany('INSERT INTO sensor_readings (timestamp, device_id, temperature, humidity, light_level) VALUES (?, ?, ?, ?, ?)', sensor_rows)
+    conn.executemany('INSERT INTO presence_data (timestamp, device_id, presence) VALUES (?, ?, ?)', presence_rows)
+    conn.executemany('INSERT INTO actuator_states (timestamp, device_id, relay1, relay2, window, auto_mode) VALUES (?, ?, ?, ?, ?, ?)', actuator_rows)
+    conn.commit()
+    conn.close()
+
+
+def run(client, routes, requests):
+    """Exécute `requests` requêtes en boucle sur les routes et retourne req/s"""
+    started = time.perf_counter()
+    for i in range(requests):
+        response = client.get(routes[i % len(routes)])
+        response.close()
+    return requests / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50000, help='lignes par table')
+    parser.add_argument('--requests', type=int, default=1000, help='requêtes par mode')
+    parser.add_argument('--routes', default='dashboard', choices=['current', 'dashboard'],
+                        help="'current' = routes /current seules, 'dashboard' = les 9 appels de fetchAllData")
+    args = parser.parse_args()
+
+    os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='pds32-bench-')
+    import app as app_module
+
+    app_module.init_database()
+    populate(app_module, args.rows)
+    client = app_module.app.test_client()
+    routes = DASHBOARD_ROUTES if args.routes == 'dashboard' else DASHBOARD_ROUTES[:4]
+
+    print(f"Base: {app_module.DATABASE} ({args.rows} lignes/table), routes: {args.routes}")
+
+    pool = app_module.db_pool
+    app_module.db_pool = ConnectPerRequest(app_module.DATABASE)
+    run(client, routes, min(50, args.requests))
+    before = run(client, routes, args.requests)
+    print(f"  connexion par requête : {before:8.1f} req/s")
+
+    app_module.db_pool = pool
+    run(client, routes, min(50, args.requests))
+    after = run(client, routes, args.requests)
+    print(f"  pool persistant       : {after:8.1f} req/s  (x{after / before:.2f})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+PDS-32: Benchmark - prévision de consommation (forecast.py)
+
+Génère des agrégats horaires énergie + température pour trois profils
+d'appareils - charge de bureau (profil hebdomadaire), chauffage électrique
+(suit la température extérieure), charge de base bruitée - puis:
+- durée d'un recalcul complet du service (lecture, ajustement, tarification),
+- erreur absolue moyenne sur la semaine suivant l'historique, pour chaque
+  modèle imposé et pour la sélection automatique par appareil,
+- réponse de /api/forecast servie depuis le cache.
+
+Usage (depuis backend/):
+    python bench/bench_forecast.py --devices 30 --days 35
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Tarif heures pleines / heures creuses: le report de consommation a une valeur
+TARIFF = {'versions': [{
+    'from': '2020-01-01', 'name': 'HP/HC', 'price': 0.2,
+    'bands': [{'name': 'HC', 'hours': [22, 6], 'price': 0.14}],
+}]}
+
+
+def populate(conn, devices, days, end):
+    """Agrégats horaires de `days` jours jusqu'à `end` (epoch, heure entière)"""
+    rng = np.random.default_rng(42)
+    hours = days * 24
+    epoch = end - 3600 * np.arange(hours, 0, -1)
+    stamps = np.array(epoch, dtype='datetime64[s]').astype(str)
+    stamps = [stamp.replace('T', ' ') for stamp in stamps]
+    local_hour = (epoch // 3600) % 24
+    weekday = (epoch // 86400 + 3) % 7
+    # Température extérieure: cycle journalier + marche aléatoire d'un jour sur l'autre
+    daily = np.repeat(np.cumsum(rng.normal(0, 1.2, days)) + 8, 24)
+    outdoor = daily + 4 * np.sin((local_hour - 9) / 24 * 2 * np.pi)
+    for d in range(devices):
+        kind = d % 3
+        if kind == 0:
+            working = (weekday < 5) & (local_hour >= 8) & (local_hour < 19)
+            energy = 0.15 + 1.2 * working
+        elif kind == 1:
+            energy = 0.25 * np.maximum(17 - outdoor, 0) + 0.1
+        else:
+            energy = 0.4 + 0.2 * np.sin(local_hour / 24 * 2 * np.pi)
+        energy = np.maximum(energy * rng.normal(1, 0.1, hours), 0)
+        # Quelques heures perdues (appareil hors ligne)
+        energy[rng.random(hours) < 0.02] = np.nan
+        temperature = outdoor + rng.normal(0, 0.3, hours)
+        device_id = f"ESP32_{d:03d}"
+        with conn:
+            conn.executemany('''
+                INSERT INTO energy_rollup_1h (bucket, device_id, samples, energy_delta)
+                VALUES (?, ?, 720, ?)
+            ''', [(s, device_id, float(e)) for s, e in zip(stamps, energy) if not np.isnan(e)])
+            conn.executemany('''
+                INSERT INTO sensor_rollup_1h (bucket, device_id, samples, temperature_avg)
+                VALUES (?, ?, 720, ?)
+            ''', [(s, device_id, float(t)) for s, t in zip(stamps, temperature)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=30)
+    parser.add_argument('--days', type=int, default=35, help="dont la dernière semaine sert à l'évaluation")
+    args = parser.parse_args()
+
+    os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='pds32-bench-')
+    import app as app_module
+    import forecast
+    import tariffs
+
+    app_module.init_database()
+    now = int(time.time())
+    end = now - now % 3600
+    schedule = tariffs.Schedule(TARIFF)
+    with app_module.db_pool.connection() as conn:
+        started = time.perf_counter()
+        populate(conn, args.devices, args.days, end)
+        report = tariffs.reprice(conn, schedule)
+        print(f"Agrégats générés: {args.devices} appareils x {args.days} jours, {report['rows']} lignes tarifées "
+              f"({time.perf_counter() - started:.1f}s)")
+
+        # Erreur hors échantillon: historique jusqu'à une semaine avant la fin
+        cutoff = end - 7 * 86400
+        history = cutoff - (args.days - 7) * 86400
+        devices, energy, temperature = forecast.load_history(conn, history, cutoff)
+        _, actual, _ = forecast.load_history(conn, cutoff, end)
+        kinds = np.arange(len(devices)) % 3
+        print(f"  erreur absolue moyenne sur 7 jours (kWh/h)      bureau  chauffage  base  | durée")
+        for label, models in [(model, ('mean', model)) for model in forecast.MODELS[1:]] + [('auto', forecast.MODELS)]:
+            t0 = time.perf_counter()
+            result = forecast.fit(devices, history, energy, temperature, 7 * 24, models=models)
+            elapsed = time.perf_counter() - t0
+            with np.errstate(invalid='ignore'):
+                mae = np.nanmean(np.abs(result.energy - actual), axis=1)
+            by_kind = '  '.join(f"{mae[kinds == kind].mean():7.3f}" for kind in range(3))
+            print(f"  {label:<16} {by_kind}    | {elapsed * 1000:6.0f} ms")
+        chosen = {kind: {} for kind in range(3)}
+        for kind, model in zip(kinds, result.models):
+            chosen[kind][model] = chosen[kind].get(model, 0) + 1
+        print(f"  modèles choisis: bureau {chosen[0]}, chauffage {chosen[1]}, base {chosen[2]}")
+
+    service = forecast.ForecastService(app_module.db_pool.connection, lambda: schedule)
+    started = time.perf_counter()
+    snapshot = service.refresh(now)
+    totals = snapshot['totals']
+    print(f"Recalcul complet: {time.perf_counter() - started:.2f}s, mois estimé "
+          f"{totals['month']['estimate']['cost']:.2f} (dont {totals['month']['to_date']['cost']:.2f} réel), "
+          f"économie par report en heures creuses {totals['potential_savings']:.2f}")
+
+    timings = []
+    for _ in range(200):
+        t0 = time.perf_counter()
+        service.forecast(hours=24)
+        timings.append(time.perf_counter() - t0)
+    size = len(json.dumps(service.forecast(hours=24)))
+    print(f"Lecture du cache: médiane {np.median(timings) * 1e6:.0f} µs ({size / 1024:.0f} Kio de JSON)")
+
+
+if __name__ == '__main__':
+    main()
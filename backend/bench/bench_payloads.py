@@ -0,0 +1,110 @@
+"""
+PDS-32: Benchmark - coût décodage + stockage par message selon l'encodage
+
+Compare le chemin d'origine (decode() + json.loads + print de chaque message)
+aux encodages JSON, struct binaire, MessagePack et CBOR passant par on_message.
+
+Usage (depuis backend/):
+    python bench/bench_payloads.py --messages 50000
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+class Message:
+    """Message MQTT minimal (topic + octets) comme fourni par paho"""
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+def build_messages(payloads, encoding, count, devices=50):
+    """Messages énergie par appareil dans l'encodage demandé"""
+    rng = random.Random(7)
+    suffix = {'json': '', 'struct': '/bin', 'msgpack': '/msgpack', 'cbor': '/cbor'}[encoding]
+    messages = []
+    for i in range(count):
+        device_id = f"esp32_{i % devices:03d}"
+        record = payloads.RECORDS['energy'](
+            device_id, rng.uniform(50, 1900), 230.0, rng.uniform(0.2, 8), i * 0.001
+        )
+        document = record._asdict()
+        if encoding == 'struct':
+            data = payloads.encode_struct('energy', record)
+        elif encoding == 'msgpack':
+            data = payloads.msgpack.packb(document)
+        elif encoding == 'cbor':
+            data = payloads.cbor2.dumps(document)
+        else:
+            data = json.dumps(document).encode()
+        messages.append(Message(f"home/{device_id}/energy/power{suffix}", data))
+    return messages
+
+
+def legacy_on_message(msg):
+    """Chemin d'origine: texte, JSON, print complet de chaque message"""
+    payload = json.loads(msg.payload.decode())
+    print(f"📨 Received [{msg.topic}]: {payload}")
+    return payload
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=50000)
+    args = parser.parse_args()
+
+    os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='pds32-bench-')
+    os.environ['INGEST_QUEUE_SIZE'] = str(args.messages * 6)
+    import app as app_module
+    import payloads
+
+    app_module.init_database()
+    app_module.ingest_pipeline.start()
+    # Sortie console vers un tampon: on mesure le coût de formatage, pas le terminal
+    sink = io.StringIO()
+
+    print(f"{args.messages} messages énergie, 50 appareils")
+    print(f"  {'format':<16} {'octets/msg':>10} {'décodage µs':>12} {'décodage+stockage µs':>21}")
+    encodings = ['json', 'struct'] + [e for e in ('msgpack', 'cbor') if e in payloads.available_encodings()]
+    for label in ['json (origine)'] + encodings:
+        encoding = 'json' if label.startswith('json') else label
+        messages = build_messages(payloads, encoding, args.messages)
+        size = sum(len(m.payload) for m in messages) / len(messages)
+
+        with contextlib.redirect_stdout(sink):
+            started = time.perf_counter()
+            for msg in messages:
+                if label == 'json (origine)':
+                    legacy_on_message(msg)
+                else:
+                    payloads.decode('energy', encoding, msg.payload, msg.topic.split('/')[1])
+            decode_us = (time.perf_counter() - started) / len(messages) * 1e6
+
+            started = time.perf_counter()
+            for msg in messages:
+                if label == 'json (origine)':
+                    app_module.store_energy_data(payloads.RECORDS['energy'](**legacy_on_message(msg)))
+                else:
+                    app_module.on_message(None, None, msg)
+            total_us = (time.perf_counter() - started) / len(messages) * 1e6
+        sink.seek(0)
+        sink.truncate()
+        print(f"  {label:<16} {size:>10.0f} {decode_us:>12.2f} {total_us:>21.2f}")
+
+    app_module.ingest_pipeline.stop()
+
+
+if __name__ == '__main__':
+    main()
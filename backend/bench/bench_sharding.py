@@ -0,0 +1,207 @@
+"""
+PDS-32: Benchmark - débit d'ingestion selon le nombre de workers (INGEST_WORKERS)
+
+Pour chaque valeur de --workers, lance le backend d'ingestion (sans l'API Flask)
+sur une base temporaire, attend que chaque shard ait reçu une sonde, publie
+--messages trames énergie binaires d'une flotte de --devices appareils, puis
+mesure le temps jusqu'à ce que toutes les lignes soient en base.
+0 worker = ingestion dans le processus de l'API (mode par défaut).
+
+Sans --broker, un broker local (bench/mqtt_broker.py) est démarré.
+Le gain n'est visible qu'avec au moins workers + 2 cœurs (broker et émetteur).
+
+Usage (depuis backend/):
+    python bench/bench_sharding.py --workers 0,1,2,4 --messages 100000
+    python bench/bench_sharding.py --broker 127.0.0.1:1883
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import paho.mqtt.client as mqtt  # noqa: E402
+
+import payloads  # noqa: E402
+import sharding  # noqa: E402
+
+
+def serve():
+    """Mode --serve: backend d'ingestion seul, configuré par l'environnement"""
+    import app
+
+    app.init_database()
+    app.init_shards()
+    app.device_registry.start()
+    if app.INGEST_WORKERS:
+        app.ingest_supervisor = sharding.ShardSupervisor(
+            multiprocessing.get_context('spawn'), app.run_ingest_worker, app.INGEST_WORKERS, app.apply_shard_batch
+        )
+        app.ingest_supervisor.start()
+        stop = app.ingest_supervisor.stop
+    else:
+        app.load_alert_rules()
+        app.alert_engine.start()
+        app.ingest_pipeline.start()
+        client = app.mqtt_client
+        client.on_connect, client.on_message = app.on_connect, app.on_message
+        client.connect(app.MQTT_BROKER, app.MQTT_PORT, 60)
+        client.loop_start()
+        stop = app.ingest_pipeline.stop
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(True))
+    while not stopping:
+        time.sleep(0.2)
+    stop()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def count_rows(databases):
+    total = 0
+    for database in databases:
+        if not os.path.exists(database):
+            return -1
+        conn = sqlite3.connect(database, timeout=30)
+        try:
+            total += conn.execute('SELECT COUNT(*) FROM energy_data').fetchone()[0]
+        except sqlite3.OperationalError:
+            return -1
+        finally:
+            conn.close()
+    return total
+
+
+def frame(rng, device_index):
+    record = payloads.RECORDS['energy'](None, rng.uniform(100, 2500), 230.0, rng.uniform(0.5, 10), 1000.0 + device_index)
+    return payloads.encode_struct('energy', record)
+
+
+def publish(host, port, messages, devices, seed):
+    """Processus émetteur: trames binaires sur home/<device_id>/energy/power/bin"""
+    rng = random.Random(seed)
+    client = mqtt.Client(client_id=f"bench-publisher-{seed}")
+    client.connect(host, port, 60)
+    client.loop_start()
+    for i in range(messages):
+        device = i % devices
+        info = client.publish(f"home/bench_{device:04d}/energy/power/bin", frame(rng, device))
+        if i % 1000 == 999:
+            info.wait_for_publish()
+    client.loop_stop()
+    client.disconnect()
+
+
+def run(workers, args, host, port):
+    data_dir = tempfile.mkdtemp(prefix=f"pds32_shards{workers}_")
+    env = dict(os.environ, DATA_DIR=data_dir, INGEST_WORKERS=str(workers), MQTT_BROKER=host,
+               MQTT_PORT=str(port), MQTT_LOG_SAMPLE='0', RETENTION_INTERVAL='86400')
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve'], cwd=BACKEND_DIR, env=env,
+                              stdout=subprocess.DEVNULL if not args.verbose else None)
+    database = os.path.join(data_dir, 'energy_data.db')
+    databases = [sharding.shard_path(database, i) for i in range(workers)] or [database]
+    try:
+        # Sondes: un appareil par shard, republiées jusqu'à ce que chaque worker écrive
+        ring = sharding.HashRing(max(workers, 1))
+        probes = {}
+        for n in range(10000):
+            probes.setdefault(ring.owner(f"probe_{n}"), f"probe_{n}")
+            if len(probes) == max(workers, 1):
+                break
+        client = mqtt.Client(client_id='bench-probe')
+        client.connect(host, port, 60)
+        client.loop_start()
+        rng = random.Random(0)
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            for device_id in probes.values():
+                client.publish(f"home/{device_id}/energy/power/bin", frame(rng, 0))
+            time.sleep(0.3)
+            if all(count_rows([db]) > 0 for db in databases):
+                break
+        else:
+            raise RuntimeError('workers not ready after 60s')
+        client.loop_stop()
+        client.disconnect()
+        time.sleep(1)
+        baseline = count_rows(databases)
+
+        started = time.perf_counter()
+        publishers = [
+            multiprocessing.Process(target=publish, args=(host, port, args.messages // args.publishers, args.devices, seed))
+            for seed in range(args.publishers)
+        ]
+        for process in publishers:
+            process.start()
+        expected = baseline + args.messages // args.publishers * args.publishers
+        written = baseline
+        deadline = time.monotonic() + args.timeout
+        while written < expected and time.monotonic() < deadline:
+            time.sleep(0.1)
+            written = count_rows(databases)
+        elapsed = time.perf_counter() - started
+        for process in publishers:
+            process.join()
+        return written - baseline, elapsed
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(30)
+
+
+def main():
+    if '--serve' in sys.argv:
+        serve()
+        return
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default='0,1,2', help='nombres de workers à comparer (0 = en processus)')
+    parser.add_argument('--devices', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--publishers', type=int, default=1, help="processus émetteurs")
+    parser.add_argument('--broker', help='host:port d\'un broker existant (sinon broker local)')
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    broker = None
+    if args.broker:
+        host, _, port = args.broker.partition(':')
+        port = int(port or 1883)
+    else:
+        host, port = '127.0.0.1', free_port()
+        broker = subprocess.Popen([sys.executable, os.path.join(BACKEND_DIR, 'bench', 'mqtt_broker.py'),
+                                   '--host', host, '--port', str(port)], stdout=subprocess.DEVNULL)
+        time.sleep(1)
+
+    print(f"{args.messages} messages, {args.devices} appareils, {os.cpu_count()} cœurs, broker {host}:{port}")
+    try:
+        reference = None
+        for workers in [int(w) for w in args.workers.split(',')]:
+            written, elapsed = run(workers, args, host, port)
+            throughput = written / elapsed
+            reference = reference or throughput
+            lost = args.messages // args.publishers * args.publishers - written
+            print(f"  {workers} worker(s): {written} lignes en {elapsed:.2f}s -> {throughput:,.0f} lignes/s "
+                  f"(x{throughput / reference:.2f}){f', {lost} perdues' if lost else ''}")
+    finally:
+        if broker is not None:
+            broker.terminate()
+            broker.wait()
+
+
+if __name__ == '__main__':
+    main()
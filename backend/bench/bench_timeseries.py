@@ -0,0 +1,140 @@
+"""
+PDS-32: Benchmark - moteurs de séries brutes (tables SQLite vs segments colonnes)
+
+Écrit la même flotte (--devices appareils, une mesure énergie toutes les
+--interval secondes pendant --days jours) dans les tables brutes SQLite et
+dans le stockage à segments, puis compare la taille sur disque, la lecture
+des colonnes sur toute la période et l'analyse brute (analytics.analyze).
+
+Usage (depuis backend/):
+    python bench/bench_timeseries.py --devices 20 --days 90 --interval 60
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def day_batches(devices, days, interval, start):
+    """Lignes d'ingestion (timestamp, device_id, power, voltage, current, energy_total, cost), jour par jour"""
+    rng = np.random.default_rng(42)
+    per_day = 86400 // interval
+    counters = np.zeros(devices)
+    for day in range(days):
+        stamps = [(start + timedelta(days=day, seconds=s * interval)).strftime('%Y-%m-%d %H:%M:%S')
+                  for s in range(per_day)]
+        rows = []
+        for d in range(devices):
+            power = np.round(rng.uniform(50, 2500, per_day), 1)
+            energy = counters[d] + np.cumsum(power * interval / 3600 / 1000)
+            counters[d] = energy[-1]
+            device_id = f"ESP32_{d:03d}"
+            rows.extend(
+                (ts, device_id, float(p), 230.0, round(float(p) / 230, 3), float(e), round(float(e) * 0.15, 4))
+                for ts, p, e in zip(stamps, power, energy)
+            )
+        yield rows
+
+
+def directory_bytes(path):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=20)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--interval', type=int, default=60, help='secondes entre deux mesures')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='pds32-bench-')
+    import app as app_module
+    import analytics
+    import tariffs
+    import timeseries
+
+    app_module.init_database()
+    sqlite_store = timeseries.SQLiteStore(app_module.db_pool)
+    segment_store = timeseries.SegmentStore(os.path.join(os.environ['DATA_DIR'], 'segments'))
+
+    start = datetime.now(timezone.utc).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0) \
+        - timedelta(days=args.days)
+    end = start + timedelta(days=args.days)
+    write = {'sqlite': 0.0, 'segments': 0.0}
+    rows_total = 0
+    with app_module.db_pool.connection() as conn:
+        for rows in day_batches(args.devices, args.days, args.interval, start):
+            rows_total += len(rows)
+            started = time.perf_counter()
+            with conn:
+                timeseries.SQLiteStore.write(conn, {'energy_data': rows})
+            write['sqlite'] += time.perf_counter() - started
+            started = time.perf_counter()
+            segment_store.append({'energy_data': rows})
+            write['segments'] += time.perf_counter() - started
+        started = time.perf_counter()
+        segment_store.seal_all(end + timedelta(days=1))
+        write['segments'] += time.perf_counter() - started
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    # Taille de la table brute et de son index (base contenant uniquement energy_data)
+    probe = os.path.join(os.environ['DATA_DIR'], 'energy_only.db')
+    conn = sqlite3.connect(probe)
+    conn.execute(f"ATTACH DATABASE '{app_module.DATABASE}' AS src")
+    conn.execute('CREATE TABLE energy_data AS SELECT * FROM src.energy_data WHERE 0')
+    conn.execute('INSERT INTO energy_data SELECT * FROM src.energy_data')
+    conn.execute('CREATE INDEX idx_energy_timestamp ON energy_data(timestamp)')
+    conn.commit()
+    conn.execute('DETACH DATABASE src')
+    conn.execute('VACUUM')
+    conn.close()
+    sizes = {'sqlite': os.path.getsize(probe), 'segments': directory_bytes(segment_store.root)}
+
+    print(f"{rows_total:,} mesures ({args.devices} appareils, {args.days} jours, pas {args.interval}s)")
+    print(f"  écriture   sqlite {write['sqlite']:.2f}s | segments {write['segments']:.2f}s")
+    print(f"  disque     sqlite {sizes['sqlite'] / 1e6:.1f} Mo | segments {sizes['segments'] / 1e6:.1f} Mo "
+          f"(x{sizes['sqlite'] / sizes['segments']:.1f} plus petit)")
+
+    columns = ('power', 'energy_total')
+    for name, store in (('sqlite', sqlite_store), ('segments', segment_store)):
+        elapsed, data = timed(lambda: store.load('energy_data', start, end, None, columns), args.repeat)
+        print(f"  lecture    {name:8s} {elapsed * 1000:8.0f} ms ({len(data['epoch']):,} lignes)")
+
+    one_device = ['ESP32_000']
+    for name, store in (('sqlite', sqlite_store), ('segments', segment_store)):
+        elapsed, data = timed(lambda: store.load('energy_data', start, end, one_device, columns), args.repeat)
+        print(f"  1 appareil {name:8s} {elapsed * 1000:8.0f} ms ({len(data['epoch']):,} lignes)")
+
+    totals = {}
+    schedule = tariffs.Schedule.hourly([0.15] * 24)
+    with app_module.db_pool.connection() as conn:
+        for name, store in (('sqlite', sqlite_store), ('segments', segment_store)):
+            elapsed, result = timed(lambda: analytics.analyze(
+                conn, None, start, end, 86400, schedule, 'raw', store), args.repeat)
+            totals[name] = result['totals']['energy_kwh']
+            print(f"  analyse    {name:8s} {elapsed * 1000:8.0f} ms (énergie {totals[name]:.3f} kWh)")
+    drift = abs(totals['sqlite'] - totals['segments']) / max(totals['sqlite'], 1e-9)
+    print(f"  écart d'énergie entre moteurs: {drift * 100:.4f}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""
+PDS-32: Vérification des plans de requêtes - aucune route ne doit parcourir une table entière
+
+Appelle chaque route de l'API (et les requêtes de démarrage, d'ingestion et de
+rétention) sur une base de test, capture chaque instruction SQL exécutée puis
+la passe à EXPLAIN QUERY PLAN. Échoue (code de sortie 1) si un plan contient
+un parcours complet d'une table (SCAN <table> sans index).
+
+Sans statistiques ANALYZE, le planificateur de SQLite ne dépend pas du volume:
+une petite base suffit à reproduire les plans de production.
+
+Une nouvelle route doit être ajoutée à ROUTE_CALLS (ou à SKIPPED_ROUTES avec
+la raison).
+
+Usage (depuis backend/):
+    python bench/check_query_plans.py [--verbose]
+
+Exécuté par la suite de tests (tests/test_query_plans.py).
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+TODAY = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+WEEK_AGO = (datetime.now(timezone.utc) - timedelta(days=7)).strftime('%Y-%m-%d')
+
+# Route -> appels (méthode, URL) qui couvrent ses variantes de requêtes
+ROUTE_CALLS = {
+    '/api/energy/current': [('GET', '/api/energy/current')],
+    '/api/energy/history': [
+        ('GET', '/api/energy/history?hours=240'),
+        ('GET', '/api/energy/history?hours=240&device_id=ESP32_001&limit=50'),
+        ('GET', '/api/energy/history?hours=240&downsample=minmax&points=100'),
+        ('GET', '/api/energy/history?hours=240&downsample=lttb&points=100&device_id=ESP32_001'),
+        ('GET', '/api/energy/history?hours=240&format=csv'),
+    ],
+    '/api/history': [
+        ('GET', '/api/history'),
+        ('GET', '/api/history?device_id=ESP32_001&category=energy,sensor'),
+    ],
+    '/api/sensors/current': [('GET', '/api/sensors/current')],
+    '/api/presence/current': [('GET', '/api/presence/current')],
+    '/api/actuators/status': [('GET', '/api/actuators/status')],
+    '/api/analytics/consumption': [('GET', '/api/analytics/consumption')],
+    '/api/analytics/range': [
+        ('GET', '/api/analytics/range'),
+        ('GET', '/api/analytics/range?devices=ESP32_001,ESP32_002&bucket=hour'),
+        ('GET', '/api/analytics/range?source=raw&devices=ESP32_001'),
+        ('GET', '/api/analytics/range?source=minute'),
+    ],
+    '/api/alerts': [('GET', '/api/alerts')],
+    '/api/alerts/<int:alert_id>/resolve': [('PUT', '/api/alerts/1/resolve')],
+    '/api/alerts/rules': [('GET', '/api/alerts/rules')],
+    '/api/alerts/rules/reload': [('POST', '/api/alerts/rules/reload')],
+    '/api/alerts/anomalies': [('GET', '/api/alerts/anomalies'), ('GET', '/api/alerts/anomalies?device_id=ESP32_001')],
+    '/api/statistics/hourly': [('GET', '/api/statistics/hourly')],
+    '/api/statistics/daily': [('GET', '/api/statistics/daily')],
+    '/api/rollups/rebuild': [
+        ('POST', '/api/rollups/rebuild'),
+        ('POST', f'/api/rollups/rebuild?start={WEEK_AGO}&end={TODAY}'),
+    ],
+    '/api/tariffs': [('GET', '/api/tariffs')],
+    '/api/forecast': [('GET', '/api/forecast'), ('GET', '/api/forecast?device_id=ESP32_001&hours=24')],
+    '/api/tariffs/reprice': [
+        ('POST', '/api/tariffs/reprice'),
+        ('POST', f'/api/tariffs/reprice?start={WEEK_AGO[:7]}&end={TODAY[:7]}'),
+    ],
+    '/api/retention/stats': [('GET', '/api/retention/stats')],
+    '/api/retention/run': [('POST', '/api/retention/run')],
+    '/api/storage/stats': [('GET', '/api/storage/stats')],
+    '/api/status/live': [('GET', '/api/status/live')],
+    '/api/devices': [('GET', '/api/devices')],
+    '/api/devices/<device_id>': [('GET', '/api/devices/ESP32_001')],
+    '/api/ingest/stats': [('GET', '/api/ingest/stats')],
+    '/metrics': [('GET', '/metrics')],
+    '/api/dashboard': [
+        ('GET', '/api/dashboard'),
+        ('GET', '/api/dashboard?fields=analytics,energy_history,history'),
+    ],
+}
+
+# Routes sans requête SQL à vérifier
+SKIPPED_ROUTES = {
+    '/': 'page HTML',
+    '/dashboard': 'page HTML',
+    '/static/<path:filename>': 'fichiers statiques',
+    '/api/stream': 'flux SSE servi depuis la mémoire',
+    '/api/control/relay': 'publication MQTT uniquement',
+    '/debug/profile': 'échantillonnage des piles, bloque pendant la mesure',
+}
+
+# Instructions dont le plan est vérifié
+CHECKED = re.compile(r'^\s*(SELECT|WITH|UPDATE|DELETE|INSERT\s.*\bSELECT\b)', re.IGNORECASE | re.DOTALL)
+FULL_SCAN = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+# Parcours acceptés (forme normalisée de la requête -> raison)
+ALLOWED_SCANS = {
+    'SELECT ? FROM energy_rollup_1d LIMIT ?': 'lit une seule ligne (table vide ou non)',
+}
+
+
+class Recorder:
+    """Instructions SQL exécutées, regroupées par contexte (route ou tâche)"""
+
+    def __init__(self):
+        self.context = 'init'
+        # Forme normalisée (littéraux remplacés par ?) -> exemple exécuté, contextes
+        self.examples = {}
+        self.statements = defaultdict(set)
+
+    def __call__(self, statement):
+        if CHECKED.match(statement):
+            statement = ' '.join(statement.split())
+            shape = LITERALS.sub('?', statement)
+            self.examples.setdefault(shape, statement)
+            self.statements[shape].add(self.context)
+
+
+def trace_connections(recorder):
+    """Toutes les connexions ouvertes par db.connect (pool, écrivain, rétention) sont tracées"""
+    import db
+
+    connect = db.connect
+
+    def traced(database):
+        conn = connect(database)
+        conn.set_trace_callback(recorder)
+        return conn
+
+    db.connect = traced
+
+
+def seed(app_module, devices=4, days=10, step=600):
+    """Quelques jours de mesures par appareil, via le vrai chemin d'ingestion"""
+    end = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    start = end - timedelta(days=days)
+    pipeline = app_module.ingest_pipeline
+    pipeline.start()
+    for d in range(devices):
+        device_id = f"ESP32_{d:03d}"
+        at, energy = start, 0.0
+        while at < end:
+            ts = at.strftime('%Y-%m-%d %H:%M:%S')
+            energy += 0.05
+            pipeline.submit('energy_data', (ts, device_id, 500.0 + d, 230.0, 2.2, energy, energy * 0.15))
+            pipeline.submit('sensor_readings', (ts, device_id, 22.5, 45.0, 60))
+            pipeline.submit('presence_data', (ts, device_id, 1))
+            pipeline.submit('actuator_states', (ts, device_id, 1, 0, 0, 1))
+            at += timedelta(seconds=step)
+    pipeline.stop()
+    for d in range(devices):
+        app_module.create_alert('high_power', 'warning', 'test', f"ESP32_{d:03d}", 'power_high')
+
+
+def run_tasks(app_module, recorder):
+    """Requêtes hors routes: démarrage, suivi des lignes, compteurs d'énergie"""
+    import rollups
+    from serving import ChangeFeed
+
+    recorder.context = 'startup'
+    app_module.rehydrate_latest_state()
+    app_module.load_alert_rules()
+
+    recorder.context = 'change-feed'
+    feed = ChangeFeed([app_module.DATABASE], app_module.FEED_QUERIES, lambda name, rows: None)
+    with app_module.db_pool.connection() as conn:
+        for name in app_module.FEED_QUERIES:
+            feed._last_ids[(app_module.DATABASE, name)] = 0
+        feed.poll(app_module.DATABASE, conn)
+
+        recorder.context = 'energy-counters'
+        rollups.last_counter_value(conn, 'ESP32_001')
+        rollups.last_counter_value(conn, 'ESP32_001', TODAY)
+
+        # Estimation du mois sans prévision (avant le premier calcul)
+        recorder.context = 'consumption-fallback'
+        app_module.consumption_analytics(conn)
+
+    recorder.context = 'forecast'
+    app_module.forecast_service.refresh()
+
+
+def call_routes(app_module, recorder):
+    client = app_module.app.test_client()
+    errors = []
+    for rule in app_module.app.url_map.iter_rules():
+        if rule.rule in SKIPPED_ROUTES:
+            continue
+        if rule.rule not in ROUTE_CALLS:
+            errors.append(f"route non couverte: {rule.rule} (ajouter à ROUTE_CALLS ou SKIPPED_ROUTES)")
+            continue
+        for method, url in ROUTE_CALLS[rule.rule]:
+            recorder.context = f"{method} {url}"
+            response = client.open(url, method=method)
+            # Les réponses en flux (CSV, NDJSON) exécutent leurs requêtes pendant la lecture
+            response.get_data()
+            response.close()
+            if response.status_code >= 500:
+                errors.append(f"{method} {url}: HTTP {response.status_code}")
+    return errors
+
+
+def explain(conn, statement):
+    return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + statement)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--verbose', action='store_true', help='affiche le plan de chaque requête')
+    args = parser.parse_args()
+
+    os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='pds32-plans-')
+    recorder = Recorder()
+    trace_connections(recorder)
+    import app as app_module
+
+    app_module.init_database()
+    recorder.context = 'ingest'
+    seed(app_module)
+    run_tasks(app_module, recorder)
+    errors = call_routes(app_module, recorder)
+
+    conn = sqlite3.connect(app_module.DATABASE)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    failures = 0
+    for shape, contexts in sorted(recorder.statements.items()):
+        plan = explain(conn, recorder.examples[shape])
+        scans = [line for line in plan if FULL_SCAN.match(line) and FULL_SCAN.match(line).group(1) in tables]
+        if shape in ALLOWED_SCANS:
+            scans = []
+        if scans:
+            failures += 1
+        if scans or args.verbose:
+            print(f"{'✗' if scans else '✓'} {shape[:160]}")
+            print(f"    depuis: {', '.join(sorted(contexts))}")
+            for line in plan:
+                print(f"    {line}")
+    conn.close()
+
+    for error in errors:
+        print(f"✗ {error}")
+    print(f"{len(recorder.statements)} requêtes vérifiées, {failures} parcours complet(s) de table, "
+          f"{len(errors)} erreur(s)")
+    sys.exit(1 if failures or errors else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""
+PDS-32: Simulateur de flotte ESP32 - mêmes topics et messages que le firmware
+
+Chaque appareil simulé publie toutes les --interval secondes les quatre
+messages de publishData() (énergie, capteurs, présence, puis
+publishActuatorStatus()), avec les mêmes champs et arrondis que
+esp32-firmware/src/main.cpp, et annonce son statut comme au connect() du
+firmware (retenu, 'offline' à l'arrêt). Les appareils sont répartis
+uniformément dans l'intervalle pour une charge régulière.
+
+Topics: 'device' (home/<device_id>/energy/power, ...) ou 'legacy'
+(home/energy/power, identifiant dans le JSON, comme le firmware actuel).
+Encodage: 'json' (firmware) ou 'bin' (trames compactes, topics par appareil).
+
+Usage (depuis backend/):
+    python bench/mqtt_broker.py --port 1883 &
+    python bench/fleet.py --devices 200 --interval 5 --duration 60 --broker 127.0.0.1:1883
+"""
+
+import argparse
+import heapq
+import json
+import os
+import random
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import paho.mqtt.client as mqtt  # noqa: E402
+
+import payloads  # noqa: E402
+
+VOLTAGE = 220.0
+
+# Type de message -> suffixe de topic (firmware: topic_energy, topic_sensors, ...)
+TOPICS = {
+    'energy': 'energy/power',
+    'sensors': 'sensors/environment',
+    'presence': 'sensors/presence',
+    'actuators': 'actuators/status',
+}
+
+# Messages produisant une ligne en base à chaque publication
+ROWS_PER_TICK = len(TOPICS)
+
+
+class SimulatedDevice:
+    """État d'un ESP32: charge, compteur d'énergie, capteurs et relais"""
+
+    def __init__(self, device_id, rng):
+        self.device_id = device_id
+        self.rng = rng
+        self.booted = time.monotonic()
+        self.base_load = rng.uniform(40, 400)
+        self.power = self.base_load
+        self.energy_total = 0.0
+        self.temperature = rng.uniform(19, 27)
+        self.humidity = rng.uniform(35, 65)
+        self.light_level = rng.randint(0, 100)
+        self.presence = False
+        self.relay1 = False
+        self.relay2 = False
+        self.window = False
+        self.auto_mode = True
+
+    def millis(self):
+        return int((time.monotonic() - self.booted) * 1000)
+
+    def step(self, seconds):
+        """Fait évoluer les mesures sur `seconds` secondes"""
+        rng = self.rng
+        if rng.random() < 0.05:
+            self.presence = not self.presence
+        self.relay2 = self.presence and self.light_level < 40
+        self.relay1 = self.temperature > 26 or (self.relay1 and self.temperature > 24)
+        self.power = max(0.0, self.base_load + (1500 if self.relay1 else 0) + (60 if self.relay2 else 0)
+                         + rng.gauss(0, self.base_load * 0.05))
+        self.energy_total += self.power * seconds / 3600 / 1000
+        self.temperature += rng.gauss(0, 0.1) - (0.05 if self.relay1 else 0)
+        self.humidity = min(100.0, max(0.0, self.humidity + rng.gauss(0, 0.3)))
+        self.light_level = min(100, max(0, self.light_level + rng.randint(-3, 3)))
+
+    def documents(self):
+        """Documents JSON de publishData() / publishActuatorStatus()"""
+        current = self.power / VOLTAGE
+        common = {'timestamp': self.millis(), 'device_id': self.device_id}
+        return {
+            'energy': dict(common, power=round(self.power, 2), voltage=VOLTAGE, current=round(current, 2),
+                           energy_total=round(self.energy_total, 3)),
+            'sensors': dict(common, temperature=round(self.temperature, 1), humidity=round(self.humidity, 1),
+                            light_level=self.light_level),
+            'presence': dict(common, presence=self.presence),
+            'actuators': dict(common, relay1=self.relay1, relay2=self.relay2, window=self.window,
+                              auto_mode=self.auto_mode),
+        }
+
+    def messages(self, topics='device', encoding='json'):
+        """(topic, charge utile) des quatre messages d'un cycle de publication"""
+        prefix = f"home/{self.device_id}/" if topics == 'device' else 'home/'
+        result = []
+        for kind, document in self.documents().items():
+            if encoding == 'bin':
+                record = payloads.RECORDS[kind](None, *(document[f] for f in payloads.RECORDS[kind]._fields[1:]))
+                result.append((f"{prefix}{TOPICS[kind]}/bin", payloads.encode_struct(kind, record)))
+            else:
+                result.append((prefix + TOPICS[kind], json.dumps(document, separators=(',', ':'))))
+        return result
+
+    def status_topic(self, topics='device'):
+        return f"home/{self.device_id}/status/device" if topics == 'device' else 'home/status/device'
+
+
+class Fleet:
+    """Flotte de `devices` appareils publiant sur un client MQTT partagé"""
+
+    def __init__(self, host, port, devices, interval=5.0, topics='device', encoding='json',
+                 prefix='esp32_', first=0, seed=0):
+        if encoding == 'bin' and topics != 'device':
+            raise ValueError('binary frames need per-device topics (the device id comes from the topic)')
+        rng = random.Random(seed)
+        self.host = host
+        self.port = port
+        self.interval = interval
+        self.topics = topics
+        self.encoding = encoding
+        self.devices = [SimulatedDevice(f"{prefix}{first + i:04d}", random.Random(rng.random()))
+                        for i in range(devices)]
+        self.published = 0
+        self.late = 0.0
+
+    def run(self, duration, stop=None, progress=None):
+        """Publie pendant `duration` secondes (ou jusqu'à stop.is_set()); retourne le nombre de messages
+
+        `progress(monotonic, published)` est appelé après chaque cycle d'appareil.
+        """
+        client = mqtt.Client(client_id=f"fleet-{self.devices[0].device_id}-{os.getpid()}")
+        client.connect(self.host, self.port, 60)
+        client.loop_start()
+        try:
+            for device in self.devices:
+                client.publish(device.status_topic(self.topics), 'online', qos=1, retain=True)
+
+            started = time.monotonic()
+            end = started + duration
+            # Départs étalés sur l'intervalle: charge régulière, pas de rafales synchronisées
+            spread = self.interval / len(self.devices)
+            schedule = [(started + i * spread, i) for i in range(len(self.devices))]
+            heapq.heapify(schedule)
+            while schedule and not (stop is not None and stop.is_set()):
+                due, index = schedule[0]
+                if due >= end:
+                    break
+                now = time.monotonic()
+                if due > now:
+                    time.sleep(min(due - now, 0.05))
+                    continue
+                self.late = max(self.late, now - due)
+                device = self.devices[index]
+                device.step(self.interval)
+                for topic, payload in device.messages(self.topics, self.encoding):
+                    client.publish(topic, payload)
+                self.published += ROWS_PER_TICK
+                heapq.heapreplace(schedule, (due + self.interval, index))
+                if progress is not None:
+                    progress(time.monotonic(), self.published)
+
+            for device in self.devices:
+                client.publish(device.status_topic(self.topics), 'offline', qos=1, retain=True).wait_for_publish()
+        finally:
+            client.loop_stop()
+            client.disconnect()
+        return self.published
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--broker', default='127.0.0.1:1883', help='host:port')
+    parser.add_argument('--devices', type=int, default=100)
+    parser.add_argument('--interval', type=float, default=5.0, help='secondes entre deux publications (firmware: 5)')
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--topics', choices=('device', 'legacy'), default='device')
+    parser.add_argument('--encoding', choices=('json', 'bin'), default='json')
+    parser.add_argument('--prefix', default='esp32_', help='préfixe des identifiants simulés')
+    args = parser.parse_args()
+
+    host, _, port = args.broker.partition(':')
+    fleet = Fleet(host, int(port or 1883), args.devices, args.interval, args.topics, args.encoding, args.prefix)
+    rate = args.devices * ROWS_PER_TICK / args.interval
+    print(f"{args.devices} appareils, {rate:,.0f} messages/s visés pendant {args.duration:.0f}s -> {args.broker}")
+    started = time.perf_counter()
+    published = fleet.run(args.duration)
+    elapsed = time.perf_counter() - started
+    print(f"  {published:,} messages en {elapsed:.1f}s ({published / elapsed:,.0f}/s), "
+          f"retard max sur le planning {fleet.late * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
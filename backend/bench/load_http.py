@@ -0,0 +1,201 @@
+"""
+PDS-32: Générateur de charge HTTP - M dashboards rejouant fetchAllData()
+
+Chaque client simulé lance, toutes les --period secondes, les requêtes de
+fetchAllData() (static/js/main.js): un snapshot /api/dashboard avec le jeton
+'generation' de la réponse précédente (--routes dashboard), ou les neuf
+routes d'avant en parallèle, comme Promise.all dans le navigateur
+(--routes legacy), sur au plus 6 connexions keep-alive (limite par hôte des
+navigateurs). Les clients démarrent à des instants étalés sur la période.
+Comme le navigateur, chaque client revalide avec If-None-Match le dernier
+ETag reçu et accepte gzip/brotli. Mesure la latence de chaque route
+(p50/p99), les réponses 304 et les erreurs.
+
+Usage (depuis backend/):
+    python bench/load_http.py --url http://127.0.0.1:5000 --clients 20 --period 5 --duration 60
+    python bench/load_http.py --routes legacy      # neuf requêtes par cycle, pour comparer
+"""
+
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlsplit
+
+import numpy as np
+
+# fetchAllData(): un snapshot, sections modifiées seulement après le premier cycle
+DASHBOARD_ROUTES = ['/api/dashboard']
+
+# fetchAllData() avant /api/dashboard: fetchCurrentEnergy, fetchCurrentSensors, ..., updateLiveStatus
+LEGACY_ROUTES = [
+    '/api/energy/current',
+    '/api/sensors/current',
+    '/api/presence/current',
+    '/api/actuators/status',
+    '/api/analytics/consumption',
+    '/api/energy/history?hours=24&points=500',
+    '/api/alerts',
+    '/api/history?limit=20',
+    '/api/status/live',
+]
+
+# Connexions simultanées d'un navigateur vers un même hôte
+BROWSER_CONNECTIONS = 6
+
+
+class DashboardClient:
+    """Un onglet de dashboard: cycles fetchAllData() sur des connexions keep-alive"""
+
+    def __init__(self, base_url, routes, record, timeout=30):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.routes = routes
+        self.record = record
+        self.timeout = timeout
+        self._local = threading.local()
+        self._pool = ThreadPoolExecutor(BROWSER_CONNECTIONS)
+        # Cache HTTP du navigateur: dernier ETag reçu par route
+        self._etags = {}
+        # Dernier jeton 'generation' de /api/dashboard (paramètre since)
+        self._generations = {}
+
+    def _get(self, route):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        headers = {'Accept-Encoding': 'gzip, deflate, br'}
+        etag = self._etags.get(route)
+        if etag:
+            headers['If-None-Match'] = etag
+        url = route
+        if route in self._generations:
+            url += ('&' if '?' in route else '?') + 'since=' + quote(self._generations[route])
+        started = time.perf_counter()
+        try:
+            conn.request('GET', url, headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+            status = response.status
+            if response.getheader('ETag'):
+                self._etags[route] = response.getheader('ETag')
+            if route.startswith('/api/dashboard') and status == 200:
+                self._generations[route] = json.loads(body)['generation']
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            status = None
+        self.record(route, time.perf_counter() - started, status)
+
+    def cycle(self):
+        """Toutes les routes en parallèle; rend la main quand la dernière a répondu"""
+        list(self._pool.map(self._get, self.routes))
+
+    def close(self):
+        self._pool.shutdown()
+
+
+class HttpLoad:
+    """M dashboards, un cycle fetchAllData() toutes les `period` secondes chacun"""
+
+    def __init__(self, base_url, clients=10, period=5.0, routes=DASHBOARD_ROUTES, seed=0):
+        self.base_url = base_url
+        self.clients = clients
+        self.period = period
+        self.routes = routes
+        self.rng = random.Random(seed)
+        self.latencies = {route: [] for route in routes}
+        self.errors = {route: 0 for route in routes}
+        self.not_modified = {route: 0 for route in routes}
+        self.cycles = 0
+        self._lock = threading.Lock()
+
+    def _record(self, route, seconds, status):
+        with self._lock:
+            if status is None or status >= 400:
+                self.errors[route] += 1
+            else:
+                self.latencies[route].append(seconds)
+                if status == 304:
+                    self.not_modified[route] += 1
+
+    def _run_client(self, end, stop, offset):
+        client = DashboardClient(self.base_url, self.routes, self._record)
+        due = time.monotonic() + offset
+        try:
+            while due < end and not stop.is_set():
+                if stop.wait(max(0.0, due - time.monotonic())):
+                    break
+                client.cycle()
+                with self._lock:
+                    self.cycles += 1
+                # Cadence fixe (setInterval): un cycle lent ne décale pas les suivants
+                due += self.period
+                while due < time.monotonic():
+                    due += self.period
+        finally:
+            client.close()
+
+    def run(self, duration, stop=None):
+        stop = stop or threading.Event()
+        end = time.monotonic() + duration
+        threads = [
+            threading.Thread(target=self._run_client, args=(end, stop, self.rng.uniform(0, self.period)), daemon=True)
+            for _ in range(self.clients)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.report()
+
+    def report(self):
+        """Par route: requêtes, erreurs, latences p50/p99/max (ms)"""
+        with self._lock:
+            routes = {}
+            for route in self.routes:
+                samples = np.array(self.latencies[route]) * 1000
+                routes[route] = {
+                    'requests': len(samples),
+                    'errors': self.errors[route],
+                    'not_modified': self.not_modified[route],
+                    'p50_ms': round(float(np.percentile(samples, 50)), 1) if len(samples) else None,
+                    'p99_ms': round(float(np.percentile(samples, 99)), 1) if len(samples) else None,
+                    'max_ms': round(float(samples.max()), 1) if len(samples) else None,
+                }
+            return {'clients': self.clients, 'period_s': self.period, 'cycles': self.cycles, 'routes': routes}
+
+
+def print_report(report, elapsed):
+    requests = sum(r['requests'] for r in report['routes'].values())
+    errors = sum(r['errors'] for r in report['routes'].values())
+    print(f"HTTP: {report['clients']} dashboards, fetchAllData() toutes les {report['period_s']:g}s "
+          f"-> {requests / elapsed:,.1f} req/s, {errors} erreur(s)")
+    print(f"  {'route':42s} {'req':>6s} {'304':>6s} {'p50 ms':>8s} {'p99 ms':>8s} {'max ms':>8s} {'err':>5s}")
+    for route, r in report['routes'].items():
+        print(f"  {route:42s} {r['requests']:6d} {r['not_modified']:6d} {r['p50_ms'] or 0:8.1f} "
+              f"{r['p99_ms'] or 0:8.1f} {r['max_ms'] or 0:8.1f} {r['errors']:5d}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--clients', type=int, default=10)
+    parser.add_argument('--period', type=float, default=5.0, help='secondes entre deux cycles (POLL_INTERVAL: 5)')
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--routes', choices=('dashboard', 'legacy'), default='dashboard')
+    args = parser.parse_args()
+
+    routes = DASHBOARD_ROUTES if args.routes == 'dashboard' else LEGACY_ROUTES
+    load = HttpLoad(args.url, args.clients, args.period, routes)
+    started = time.perf_counter()
+    report = load.run(args.duration)
+    print_report(report, time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,361 @@
+"""
+PDS-32: Test de charge de bout en bout - flotte ESP32 simulée + dashboards
+
+Démarre un broker local (bench/mqtt_broker.py, sauf --broker), le backend sur
+une base temporaire (serveur Flask ou gunicorn), puis pendant --duration
+secondes la flotte simulée (bench/fleet.py) et les dashboards
+(bench/load_http.py), chacun dans son processus. Rapporte:
+
+  - messages/s publiés et lignes/s écrites, messages perdus;
+  - latence d'ingestion (publication -> ligne en base): p50/p99/max, à la
+    période d'échantillonnage près (--sample);
+  - latence p50/p99 de chaque route du dashboard;
+  - croissance de la base (octets par ligne, projection par heure).
+
+Compression à l'écriture désactivée par défaut (une ligne par message: pertes
+et latence se déduisent du nombre de lignes); --compression mesure les lignes
+écrites et la croissance de la base avec la compression de production.
+
+Fonctionne hors ligne. --report écrit le rapport en JSON pour comparer deux runs.
+
+Usage (depuis backend/):
+    python bench/load_test.py --devices 100 --interval 5 --clients 10 --duration 60
+    python bench/load_test.py --server gunicorn --ingest-workers 2 --encoding bin
+    python bench/load_test.py --broker 127.0.0.1:1883     # mosquitto local
+"""
+
+import argparse
+import bisect
+import glob
+import json
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import paho.mqtt.client as mqtt  # noqa: E402
+
+import fleet  # noqa: E402
+import load_http  # noqa: E402
+import sharding  # noqa: E402
+
+RAW_TABLES = ('energy_data', 'sensor_readings', 'presence_data', 'actuator_states')
+PROBE_DEVICE = 'loadtest_probe'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def count_rows(databases):
+    """Lignes des tables brutes (toutes bases); -1 tant qu'une base n'est pas prête"""
+    total = 0
+    for database in databases:
+        if not os.path.exists(database):
+            return -1
+        conn = sqlite3.connect(database, timeout=30)
+        try:
+            for table in RAW_TABLES:
+                total += conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        except sqlite3.OperationalError:
+            return -1
+        finally:
+            conn.close()
+    return total
+
+
+def database_bytes(data_dir, databases):
+    """Taille sur disque après checkpoint (le WAL non reporté fausserait la croissance)"""
+    for database in databases:
+        conn = sqlite3.connect(database, timeout=30)
+        try:
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        finally:
+            conn.close()
+    return sum(os.path.getsize(path) for path in glob.glob(os.path.join(data_dir, '*.db*')))
+
+
+def get_json(url, timeout=5):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def percentiles(values):
+    if not values:
+        return {'p50': None, 'p99': None, 'max': None}
+    values = np.array(values)
+    return {'p50': round(float(np.percentile(values, 50)), 3), 'p99': round(float(np.percentile(values, 99)), 3),
+            'max': round(float(values.max()), 3)}
+
+
+# ==================== PROCESSUS DE CHARGE ====================
+def run_fleet(host, port, args, progress, stop):
+    """Processus flotte: transmet (instant, messages publiés) au fil de l'eau"""
+    simulated = fleet.Fleet(host, port, args.devices, args.interval, args.topics, args.encoding)
+    last = [0.0]
+
+    def report(at, published):
+        if at - last[0] >= 0.01:
+            last[0] = at
+            progress.put((at, published))
+
+    published = simulated.run(args.duration, stop, report)
+    progress.put((time.monotonic(), published))
+    progress.put(('late', simulated.late))
+
+
+def run_http(url, args, results, stop):
+    routes = load_http.DASHBOARD_ROUTES if args.routes == 'dashboard' else load_http.LEGACY_ROUTES
+    load = load_http.HttpLoad(url, args.clients, args.period, routes)
+    results.put(load.run(args.duration, stop))
+
+
+# ==================== SERVEUR ====================
+def start_server(args, data_dir, host, port):
+    http_port = free_port()
+    env = dict(os.environ, DATA_DIR=data_dir, MQTT_BROKER=host, MQTT_PORT=str(port), PORT=str(http_port),
+               INGEST_WORKERS=str(args.ingest_workers), WEB_CONCURRENCY=str(args.web_workers),
+               MQTT_LOG_SAMPLE='0', RETENTION_INTERVAL='86400', PYTHONUNBUFFERED='1',
+               STORAGE_COMPRESSION='1' if args.compression else '0')
+    if args.server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--access-logfile', os.devnull]
+    else:
+        command = [sys.executable, 'app.py']
+    log = open(os.path.join(data_dir, 'server.log'), 'w')
+    # SIGINT rétabli: le serveur Flask s'arrête sur Ctrl+C (vidage de la file d'ingestion)
+    server = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+                              preexec_fn=lambda: signal.signal(signal.SIGINT, signal.SIG_DFL))
+    url = f"http://127.0.0.1:{http_port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"server exited, see {log.name}")
+        try:
+            get_json(url + '/api/status/live', timeout=1)
+            return server, url
+        except OSError:
+            time.sleep(0.3)
+    raise RuntimeError(f"server not ready after 60s, see {log.name}")
+
+
+def wait_subscribed(host, port, databases, timeout=60):
+    """Republie une mesure sonde jusqu'à ce qu'elle soit en base (abonnements MQTT actifs)"""
+    client = mqtt.Client(client_id='loadtest-probe')
+    client.connect(host, port, 60)
+    client.loop_start()
+    probe = fleet.SimulatedDevice(PROBE_DEVICE, random.Random(0))
+    try:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            topic, payload = probe.messages('device', 'json')[0]
+            client.publish(topic, payload)
+            time.sleep(0.5)
+            if count_rows(databases) > 0:
+                time.sleep(1)
+                return
+        raise RuntimeError(f"no probe row after {timeout}s (MQTT subscription?)")
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+
+# ==================== MESURES ====================
+def ingest_lags(published, written):
+    """Latence de chaque échantillon écrit: instant où W lignes sont en base moins
+    instant où le W-ième message a été publié (borne haute, à l'échantillonnage près)"""
+    times = [t for t, _ in published]
+    counts = [n for _, n in published]
+    lags = []
+    previous = 0
+    for at, rows in written:
+        if rows <= previous:
+            continue
+        previous = rows
+        i = bisect.bisect_left(counts, rows)
+        if i < len(counts) and times[i] <= at:
+            lags.append(at - times[i])
+    return lags
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=50)
+    parser.add_argument('--interval', type=float, default=5.0, help='secondes entre deux publications par appareil')
+    parser.add_argument('--topics', choices=('device', 'legacy'), default='device')
+    parser.add_argument('--encoding', choices=('json', 'bin'), default='json')
+    parser.add_argument('--clients', type=int, default=10, help='dashboards simulés')
+    parser.add_argument('--period', type=float, default=5.0, help='secondes entre deux fetchAllData()')
+    parser.add_argument('--routes', choices=('dashboard', 'legacy'), default='dashboard',
+                        help="fetchAllData(): /api/dashboard, ou les neuf routes d'avant")
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--server', choices=('flask', 'gunicorn'), default='flask')
+    parser.add_argument('--web-workers', type=int, default=2, help='workers gunicorn')
+    parser.add_argument('--ingest-workers', type=int, default=0, help='INGEST_WORKERS du backend')
+    parser.add_argument('--broker', help="host:port d'un broker existant (sinon broker local)")
+    parser.add_argument('--compression', action='store_true',
+                        help="compression à l'écriture du backend (sans: une ligne par message)")
+    parser.add_argument('--sample', type=float, default=0.2, help="période d'échantillonnage (s)")
+    parser.add_argument('--drain-timeout', type=float, default=30)
+    parser.add_argument('--report', help='fichier JSON du rapport')
+    args = parser.parse_args()
+
+    broker = None
+    if args.broker:
+        host, _, port = args.broker.partition(':')
+        port = int(port or 1883)
+    else:
+        host, port = '127.0.0.1', free_port()
+        broker = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, 'mqtt_broker.py'),
+                                   '--host', host, '--port', str(port)], stdout=subprocess.DEVNULL)
+        time.sleep(1)
+
+    data_dir = tempfile.mkdtemp(prefix='pds32-load-')
+    database = os.path.join(data_dir, 'energy_data.db')
+    databases = [database] + [sharding.shard_path(database, i) for i in range(args.ingest_workers)]
+    target_rate = args.devices * fleet.ROWS_PER_TICK / args.interval
+    print(f"Flotte: {args.devices} appareils x {fleet.ROWS_PER_TICK} messages / {args.interval:g}s "
+          f"= {target_rate:,.0f} msg/s ({args.topics}, {args.encoding}); {args.clients} dashboards; "
+          f"serveur {args.server}; broker {host}:{port}; {os.cpu_count()} cœur(s); {args.duration:.0f}s")
+
+    server = None
+    workers = []
+    try:
+        server, url = start_server(args, data_dir, host, port)
+        wait_subscribed(host, port, databases)
+        baseline_rows = count_rows(databases)
+        baseline_bytes = database_bytes(data_dir, databases)
+
+        context = multiprocessing.get_context('spawn')
+        stop = context.Event()
+        progress, results = context.Queue(), context.Queue()
+        workers = [
+            context.Process(target=run_fleet, args=(host, port, args, progress, stop), name='fleet'),
+            context.Process(target=run_http, args=(url, args, results, stop), name='dashboards'),
+        ]
+        started = time.monotonic()
+        for process in workers:
+            process.start()
+
+        published, written, queue_depths = [(started, 0)], [], []
+        late = 0.0
+        fleet_done = False
+        next_stats = started
+        drain_deadline = None
+        while True:
+            time.sleep(args.sample)
+            while not progress.empty():
+                item = progress.get()
+                if item[0] == 'late':
+                    late, fleet_done = item[1], True
+                else:
+                    published.append(item)
+            now = time.monotonic()
+            rows = count_rows(databases) - baseline_rows
+            written.append((now, rows))
+            if now >= next_stats:
+                next_stats = now + 1
+                try:
+                    queue_depths.append(get_json(url + '/api/ingest/stats')['queue_depth'])
+                except (OSError, KeyError, ValueError):
+                    pass
+            if fleet_done:
+                drain_deadline = drain_deadline or now + args.drain_timeout
+                if rows >= published[-1][1] or now >= drain_deadline:
+                    break
+                # Compression: moins de lignes que de messages, vidé quand le compte ne bouge plus
+                settled = [count for at, count in written if at >= now - 2]
+                if args.compression and now - published[-1][0] > 2 and min(settled) == rows:
+                    break
+        fleet_elapsed = published[-1][0] - started
+        drained_at = written[-1][0]
+
+        http_report = results.get(timeout=args.duration + 60)
+        for process in workers:
+            process.join(30)
+        http_elapsed = time.monotonic() - started
+
+        total_published = published[-1][1]
+        total_written = written[-1][1]
+        lags = [] if args.compression else ingest_lags(published, written)
+        db_bytes = database_bytes(data_dir, databases)
+        growth = db_bytes - baseline_bytes
+        report = {
+            'config': vars(args),
+            'cpu_count': os.cpu_count(),
+            'ingest': {
+                'published': total_published,
+                'written': total_written,
+                'lost': None if args.compression else max(0, total_published - total_written),
+                'published_per_s': round(total_published / fleet_elapsed, 1),
+                'written_per_s': round(total_written / max(drained_at - started, 1e-9), 1),
+                'drain_s': round(max(0.0, drained_at - published[-1][0]), 3),
+                'lag_s': percentiles(lags),
+                'max_queue_depth': max(queue_depths, default=None),
+                'publisher_max_late_ms': round(late * 1000, 1),
+            },
+            'http': http_report,
+            'database': {
+                'bytes_before': baseline_bytes,
+                'bytes_after': db_bytes,
+                'bytes_per_row': round(growth / total_written, 1) if total_written else None,
+                'bytes_per_hour': round(growth / fleet_elapsed * 3600) if fleet_elapsed else None,
+            },
+        }
+
+        ingest = report['ingest']
+        lag = ingest['lag_s']
+        if args.compression:
+            print(f"Ingestion: {ingest['published']:,} publiés ({ingest['published_per_s']:,.1f}/s), "
+                  f"{ingest['written']:,} lignes écrites ({ingest['written_per_s']:,.1f}/s, "
+                  f"x{ingest['published'] / max(ingest['written'], 1):.1f} de compression)")
+        else:
+            print(f"Ingestion: {ingest['published']:,} publiés ({ingest['published_per_s']:,.1f}/s), "
+                  f"{ingest['written']:,} écrits ({ingest['written_per_s']:,.1f}/s), {ingest['lost']} perdus, "
+                  f"vidage {ingest['drain_s']:.2f}s après la dernière publication")
+        if lag['p50'] is not None:
+            print(f"  latence publication -> base: p50 {lag['p50'] * 1000:.0f} ms, p99 {lag['p99'] * 1000:.0f} ms, "
+                  f"max {lag['max'] * 1000:.0f} ms (résolution {args.sample * 1000:.0f} ms)")
+        print(f"  file d'ingestion max {ingest['max_queue_depth']}, retard max de l'émetteur "
+              f"{ingest['publisher_max_late_ms']:.0f} ms")
+        load_http.print_report(http_report, http_elapsed)
+        db = report['database']
+        print(f"Base: {db['bytes_before'] / 1e6:.2f} Mo -> {db['bytes_after'] / 1e6:.2f} Mo "
+              f"({db['bytes_per_row'] or 0:.0f} octets/ligne, ~{(db['bytes_per_hour'] or 0) / 1e6:.1f} Mo/h à ce rythme)")
+        if args.report:
+            with open(args.report, 'w') as handle:
+                json.dump(report, handle, indent=2)
+            print(f"Rapport: {args.report}")
+    finally:
+        for process in workers:
+            if process.is_alive():
+                process.terminate()
+        if server is not None:
+            # gunicorn: SIGTERM (arrêt gracieux); serveur Flask: Ctrl+C
+            server.send_signal(signal.SIGTERM if args.server == 'gunicorn' else signal.SIGINT)
+            try:
+                server.wait(60)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        if broker is not None:
+            broker.terminate()
+            broker.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""
+PDS-32: Broker MQTT 3.1.1 minimal pour les benchmarks (remplaçant local de mosquitto)
+
+Prend en charge CONNECT, PUBLISH QoS 0/1 (livré en QoS 0), SUBSCRIBE avec
+jokers + et #, abonnements partagés $share/<groupe>/<filtre> (tourniquet),
+messages retenus, PING et DISCONNECT. Pas de sessions persistantes, pas
+d'authentification: réservé aux tests de charge sur la machine locale.
+
+Usage (depuis backend/):
+    python bench/mqtt_broker.py --port 1883
+"""
+
+import argparse
+import asyncio
+import itertools
+import struct
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+# Au-delà de ce tampon d'émission vers un abonné, l'émetteur attend (contre-pression)
+HIGH_WATER = 1 << 20
+
+
+def encode_length(length):
+    out = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        out.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(out)
+
+
+def packet(kind, body=b'', flags=0):
+    return bytes([kind << 4 | flags]) + encode_length(len(body)) + body
+
+
+def encode_string(text):
+    data = text.encode()
+    return struct.pack('!H', len(data)) + data
+
+
+def topic_matches(pattern, topic):
+    """Filtre MQTT (+ et #) appliqué à un nom de topic"""
+    pattern_parts, topic_parts = pattern.split('/'), topic.split('/')
+    for i, part in enumerate(pattern_parts):
+        if part == '#':
+            return True
+        if i >= len(topic_parts) or (part != '+' and part != topic_parts[i]):
+            return False
+    return len(pattern_parts) == len(topic_parts)
+
+
+class Session:
+    def __init__(self, writer):
+        self.writer = writer
+        self.client_id = None
+
+
+class Broker:
+    def __init__(self):
+        self.subscriptions = {}      # filtre -> {session: None}
+        self.shared = {}             # (groupe, filtre) -> [sessions]
+        self._rotation = {}          # (groupe, filtre) -> compteur du tourniquet
+        self.retained = {}
+        self._routes = {}            # cache topic -> (sessions, groupes partagés)
+        self.published = 0
+        self.delivered = 0
+
+    # ---------- Abonnements ----------
+    def subscribe(self, session, pattern):
+        if pattern.startswith('$share/'):
+            _, group, pattern = pattern.split('/', 2)
+            members = self.shared.setdefault((group, pattern), [])
+            if session not in members:
+                members.append(session)
+            self._rotation.setdefault((group, pattern), itertools.count())
+        else:
+            self.subscriptions.setdefault(pattern, {})[session] = None
+        self._routes.clear()
+        return pattern
+
+    def unsubscribe(self, session, pattern):
+        if pattern.startswith('$share/'):
+            _, group, pattern = pattern.split('/', 2)
+            members = self.shared.get((group, pattern), [])
+            if session in members:
+                members.remove(session)
+        else:
+            self.subscriptions.get(pattern, {}).pop(session, None)
+        self._routes.clear()
+
+    def drop(self, session):
+        for sessions in self.subscriptions.values():
+            sessions.pop(session, None)
+        for members in self.shared.values():
+            if session in members:
+                members.remove(session)
+        self._routes.clear()
+
+    def subscription_count(self):
+        return sum(len(s) for s in self.subscriptions.values()) + sum(len(m) for m in self.shared.values())
+
+    # ---------- Routage ----------
+    def _route(self, topic):
+        route = self._routes.get(topic)
+        if route is None:
+            sessions = {}
+            for pattern, subscribers in self.subscriptions.items():
+                if topic_matches(pattern, topic):
+                    sessions.update(subscribers)
+            groups = [key for key, members in self.shared.items() if members and topic_matches(key[1], topic)]
+            route = self._routes[topic] = (list(sessions), groups)
+        return route
+
+    async def publish(self, topic, payload, retain=False):
+        self.published += 1
+        if retain:
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+        sessions, groups = self._route(topic)
+        targets = list(sessions)
+        for key in groups:
+            members = self.shared[key]
+            if members:
+                targets.append(members[next(self._rotation[key]) % len(members)])
+        if not targets:
+            return
+        frame = packet(PUBLISH, encode_string(topic) + payload)
+        for session in targets:
+            session.writer.write(frame)
+            self.delivered += 1
+        for session in targets:
+            if session.writer.transport.get_write_buffer_size() > HIGH_WATER:
+                try:
+                    await session.writer.drain()
+                except ConnectionError:
+                    pass
+
+    # ---------- Connexions ----------
+    async def handle(self, reader, writer):
+        session = Session(writer)
+        try:
+            while True:
+                header = await reader.readexactly(1)
+                length, multiplier = 0, 1
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length) if length else b''
+                kind, flags = header[0] >> 4, header[0] & 0x0F
+                if kind == PUBLISH:
+                    qos = (flags >> 1) & 3
+                    size = struct.unpack_from('!H', body)[0]
+                    topic = body[2:2 + size].decode()
+                    offset = 2 + size
+                    if qos:
+                        writer.write(packet(PUBACK, body[offset:offset + 2]))
+                        offset += 2
+                    await self.publish(topic, body[offset:], retain=bool(flags & 1))
+                elif kind == CONNECT:
+                    size = struct.unpack_from('!H', body)[0]
+                    offset = 2 + size + 4
+                    client_size = struct.unpack_from('!H', body, offset)[0]
+                    session.client_id = body[offset + 2:offset + 2 + client_size].decode()
+                    writer.write(packet(CONNACK, b'\x00\x00'))
+                elif kind == SUBSCRIBE:
+                    packet_id, offset, granted, patterns = body[:2], 2, bytearray(), []
+                    while offset < len(body):
+                        size = struct.unpack_from('!H', body, offset)[0]
+                        patterns.append(self.subscribe(session, body[offset + 2:offset + 2 + size].decode()))
+                        granted.append(0)
+                        offset += 2 + size + 1
+                    writer.write(packet(SUBACK, packet_id + bytes(granted)))
+                    for topic, payload in list(self.retained.items()):
+                        if any(topic_matches(pattern, topic) for pattern in patterns):
+                            writer.write(packet(PUBLISH, encode_string(topic) + payload, flags=1))
+                elif kind == UNSUBSCRIBE:
+                    offset = 2
+                    while offset < len(body):
+                        size = struct.unpack_from('!H', body, offset)[0]
+                        self.unsubscribe(session, body[offset + 2:offset + 2 + size].decode())
+                        offset += 2 + size
+                    writer.write(packet(UNSUBACK, body[:2]))
+                elif kind == PINGREQ:
+                    writer.write(packet(PINGRESP))
+                elif kind == DISCONNECT:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.drop(session)
+            writer.close()
+
+
+async def serve(host, port, ready=None):
+    broker = Broker()
+    server = await asyncio.start_server(broker.handle, host, port)
+    print(f"✓ Stand-in MQTT broker listening on {host}:{port}", flush=True)
+    if ready is not None:
+        ready(broker)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1883)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""
+PDS-32: Cache des réponses de l'API - invalidation par générations de tables,
+TTL + LRU, ETag fort / 304 et corps pré-compressés (gzip, brotli si installé)
+"""
+
+import gzip
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # dépendance optionnelle
+    brotli = None
+
+# Corps plus petits: la compression ne vaut pas son en-tête
+MIN_COMPRESS_BYTES = 1024
+
+
+class Generations:
+    """Compteur par table, incrémenté après chaque commit qui la modifie"""
+
+    def __init__(self):
+        self._counters = {}
+        # Incrémentée par bump_all(): invalide aussi les tables jamais modifiées
+        self._epoch = 0
+        self._lock = threading.Lock()
+        # Les compteurs sont propres au processus: un jeton d'un autre processus est ignoré
+        self.instance = os.urandom(4).hex()
+
+    def bump(self, *tables):
+        with self._lock:
+            for table in tables:
+                self._counters[table] = self._counters.get(table, 0) + 1
+
+    def bump_all(self):
+        with self._lock:
+            self._epoch += 1
+
+    def vector(self, tables):
+        with self._lock:
+            return (self._epoch,) + tuple(self._counters.get(table, 0) for table in tables)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counters, epoch=self._epoch)
+
+    def token(self, tables):
+        """Jeton opaque de l'état de `tables` dans ce processus"""
+        return '.'.join([self.instance] + [str(value) for value in self.vector(tables)])
+
+
+def changed_tables(previous, current, tables):
+    """Tables modifiées entre deux jetons de Generations.token(tables); None si
+    `previous` est inutilisable (autre processus, bump_all(), jeton invalide)"""
+    old, new = (previous or '').split('.'), current.split('.')
+    if len(old) != len(new) or old[:2] != new[:2]:
+        return None
+    return {table for table, before, after in zip(tables, old[2:], new[2:]) if before != after}
+
+
+class Entry:
+    __slots__ = ('generation', 'created', 'etag', 'mimetype', 'headers', 'bodies')
+
+    def __init__(self, generation, body, mimetype, headers):
+        self.generation = generation
+        self.created = time.monotonic()
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.mimetype = mimetype
+        self.headers = headers
+        # Encodage -> corps, compressé une fois à la mise en cache
+        self.bodies = {'identity': body}
+        if len(body) >= MIN_COMPRESS_BYTES:
+            self.bodies['gzip'] = gzip.compress(body, 6)
+            if brotli is not None:
+                self.bodies['br'] = brotli.compress(body, quality=5)
+
+    def etag_for(self, encoding):
+        """ETag fort propre à chaque représentation (identité, gzip, br)"""
+        return f'"{self.etag}"' if encoding == 'identity' else f'"{self.etag}-{encoding}"'
+
+    def matches(self, if_none_match):
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        return any(self.etag_for(encoding) in tags for encoding in self.bodies)
+
+
+def accepted_encoding(header, available):
+    """Meilleur encodage disponible parmi Accept-Encoding (br > gzip > identité)"""
+    accepted = set()
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(name.strip().lower())
+    for encoding in ('br', 'gzip'):
+        if encoding in available and (encoding in accepted or '*' in accepted):
+            return encoding
+    return 'identity'
+
+
+class ResponseCache:
+    """Réponses GET mises en cache par chemin + paramètres, valides tant que les
+    tables dont elles dépendent n'ont pas changé (et au plus `ttl` secondes:
+    fenêtres glissantes sur 'now')"""
+
+    def __init__(self, generations, max_entries=256, ttl=10.0, max_body=1024 * 1024, on_result=None):
+        self.generations = generations
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_body = max_body
+        # on_result(route, 'hit' | 'miss' | 'not_modified' | 'bypass'): compteurs d'usage
+        self.on_result = on_result
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    def _get(self, key, generation):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.generation != generation or time.monotonic() - entry.created > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _respond(self, entry, route, result):
+        """304 si le client a déjà cette version, sinon le corps dans le meilleur encodage"""
+        if entry.matches(request.headers.get('If-None-Match')):
+            result = 'not_modified'
+        with self._lock:
+            if result == 'hit':
+                self.hits += 1
+            elif result == 'miss':
+                self.misses += 1
+            else:
+                self.not_modified += 1
+        if self.on_result is not None:
+            self.on_result(route, result)
+
+        encoding = accepted_encoding(request.headers.get('Accept-Encoding'), entry.bodies)
+        headers = dict(entry.headers)
+        headers.update({'ETag': entry.etag_for(encoding), 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'})
+        if result == 'not_modified':
+            return Response(status=304, headers=headers)
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return Response(entry.bodies[encoding], mimetype=entry.mimetype, headers=headers)
+
+    def cached(self, tables, condition=None):
+        """Décorateur de route GET: `tables` dont dépend la réponse, `condition(args)`
+        pour ne mettre en cache que les requêtes de taille bornée"""
+        tables = tuple(tables)
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                route = request.url_rule.rule
+                if condition is not None and not condition(request.args):
+                    if self.on_result is not None:
+                        self.on_result(route, 'bypass')
+                    return view(*args, **kwargs)
+                key = (request.path, tuple(sorted(request.args.items(multi=True))))
+                # Génération lue avant le calcul: un commit pendant le calcul invalide l'entrée
+                generation = self.generations.vector(tables)
+                entry = self._get(key, generation)
+                if entry is not None:
+                    return self._respond(entry, route, 'hit')
+
+                response = view(*args, **kwargs)
+                if not isinstance(response, Response) or response.status_code != 200:
+                    return response
+                # Flux (historique sous-échantillonné): lu en entier, sa taille est bornée
+                body = response.get_data()
+                response.close()
+                if len(body) > self.max_body:
+                    return Response(body, status=200, mimetype=response.mimetype, headers=response.headers)
+                headers = {name: value for name, value in response.headers.items()
+                           if name.lower() not in ('content-type', 'content-length', 'cache-control')}
+                entry = Entry(generation, body, response.mimetype, headers)
+                self._put(key, entry)
+                return self._respond(entry, route, 'miss')
+            return wrapper
+        return decorator
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_s': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'evictions': self.evictions,
+                'generations': self.generations.snapshot(),
+                'brotli': brotli is not None,
+            }
@@ -0,0 +1,320 @@
+"""
+PDS-32: Compression à l'écriture des flux capteurs, présence et actionneurs -
+transitions d'état (booléens), bande morte ou porte battante (valeurs analogiques)
+
+Une ligne n'est écrite que lorsqu'une mesure de l'appareil sort de sa tolérance,
+et au moins toutes les `heartbeat` secondes. Les lectures reconstruisent les
+valeurs en escalier: chaque ligne vaut jusqu'à la suivante du même appareil, au
+plus `max_hold` secondes (au-delà, l'appareil s'est tu). En porte battante, les
+valeurs sont interpolées linéairement entre deux lignes.
+"""
+
+import bisect
+import threading
+import time
+
+MODES = ('state', 'deadband', 'swinging_door')
+
+
+class CompressionError(ValueError):
+    """Mode ou tolérances de compression invalides"""
+
+
+class Tolerance:
+    """Écart toléré autour de la dernière valeur écrite: absolu et/ou en % de cette valeur"""
+
+    __slots__ = ('absolute', 'percent')
+
+    def __init__(self, absolute=0.0, percent=0.0):
+        self.absolute = absolute
+        self.percent = percent
+
+    def band(self, reference):
+        return max(self.absolute, abs(reference) * self.percent / 100)
+
+    def __repr__(self):
+        return f"{self.percent:g}%" if self.percent else f"{self.absolute:g}"
+
+
+def parse_tolerances(spec):
+    """'temperature=0.3,humidity=2%' -> {'temperature': Tolerance(0.3), 'humidity': Tolerance(percent=2)}"""
+    tolerances = {}
+    for part in (spec or '').split(','):
+        if not part.strip():
+            continue
+        name, _, value = part.partition('=')
+        value = value.strip()
+        try:
+            if value.endswith('%'):
+                tolerance = Tolerance(percent=float(value[:-1]))
+            else:
+                tolerance = Tolerance(absolute=float(value))
+        except ValueError:
+            raise CompressionError(f"Invalid tolerance: {part.strip()}")
+        if tolerance.absolute < 0 or tolerance.percent < 0:
+            raise CompressionError(f"Invalid tolerance: {part.strip()}")
+        tolerances[name.strip()] = tolerance
+    return tolerances
+
+
+def max_hold(heartbeat):
+    """Durée de validité d'une ligne à la lecture: deux battements manqués = appareil muet"""
+    return 2 * heartbeat
+
+
+# ==================== COMPRESSION À L'ÉCRITURE ====================
+class _Stream:
+    """État d'un appareil: dernière ligne écrite et, en porte battante, ligne en attente"""
+
+    __slots__ = ('written_at', 'written', 'pending_at', 'pending', 'upper', 'lower')
+
+    def __init__(self, at, row):
+        self.written_at = at
+        self.written = row
+        self.pending_at = None
+        self.pending = None
+        self.upper = None
+        self.lower = None
+
+    def copy(self):
+        stream = _Stream(self.written_at, self.written)
+        stream.pending_at, stream.pending = self.pending_at, self.pending
+        stream.upper = None if self.upper is None else list(self.upper)
+        stream.lower = None if self.lower is None else list(self.lower)
+        return stream
+
+
+class StreamCompressor:
+    """Filtre les lignes (timestamp, device_id, valeurs...) d'une table avant l'ingestion
+
+    - 'state': ligne écrite à chaque transition (flux booléens: présence, relais...)
+    - 'deadband': ligne écrite quand une mesure s'écarte de plus que sa tolérance
+      de la dernière valeur écrite
+    - 'swinging_door': la ligne précédente est écrite dès que le segment tiré de la
+      dernière ligne écrite jusqu'à la nouvelle mesure s'écarte de plus que la
+      tolérance d'une mesure reçue entre les deux (interpolation linéaire à la lecture)
+
+    Une mesure sans tolérance est comparée à l'égalité. Les tolérances portent sur
+    chaque mesure, mais la ligne écrite contient toujours toutes les colonnes.
+    """
+
+    def __init__(self, table, columns, mode='state', tolerances=None, heartbeat=300):
+        if mode not in MODES:
+            raise CompressionError(f"Unknown compression mode: {mode}")
+        self.table = table
+        self.columns = tuple(columns)
+        self.mode = mode
+        self.heartbeat = heartbeat
+        tolerances = tolerances or {}
+        unknown = set(tolerances) - set(self.columns)
+        if unknown:
+            raise CompressionError(f"Unknown column for {table}: {', '.join(sorted(unknown))}")
+        exact = Tolerance()
+        self.tolerances = tuple(tolerances.get(column, exact) for column in self.columns)
+        self._streams = {}
+        self._lock = threading.Lock()
+        self.received = 0
+        self.written = 0
+
+    def offer(self, row, now=None, write=None):
+        """Lignes à écrire pour une nouvelle mesure: aucune, celle-ci et/ou la précédente
+
+        Avec `write(row) -> bool` (ex: IngestPipeline.submit), les lignes sont écrites
+        sous le verrou et l'état de l'appareil n'avance que jusqu'à la dernière ligne
+        acceptée: une ligne refusée (file pleine) n'est pas tenue pour écrite, la
+        transition sera réécrite à la mesure suivante. Retourne les lignes écrites.
+        """
+        now = time.time() if now is None else now
+        device_id = row[1]
+        with self._lock:
+            self.received += 1
+            stream = self._streams.get(device_id)
+            saved = stream.copy() if write is not None and stream is not None else None
+            rows = self._offer(stream, device_id, now, row)
+            if write is not None:
+                for index, kept in enumerate(rows):
+                    if not write(kept):
+                        self._rollback(device_id, saved, rows, index)
+                        rows = rows[:index]
+                        break
+            self.written += len(rows)
+            return rows
+
+    def _rollback(self, device_id, saved, rows, index):
+        """État de l'appareil après les `index` premières lignes de `rows` seulement"""
+        if index == 0:
+            if saved is None:
+                del self._streams[device_id]
+            else:
+                self._streams[device_id] = saved
+        else:
+            # Porte battante: ligne en attente écrite (nouvelle origine), mesure refusée
+            self._streams[device_id] = _Stream(saved.pending_at, rows[0])
+
+    def forget(self, rows):
+        """Lignes que l'écrivain n'a pas pu stocker (lot annulé): l'état de leurs appareils
+        est oublié, leur prochaine mesure est écrite telle quelle"""
+        with self._lock:
+            for row in rows:
+                self._streams.pop(row[1], None)
+                self.written -= 1
+
+    def _offer(self, stream, device_id, now, row):
+        if stream is None:
+            # Premier message de l'appareil: écrit tel quel
+            self._streams[device_id] = _Stream(now, row)
+            return [row]
+        if self.mode == 'swinging_door':
+            return self._swinging_door(stream, now, row)
+        if now - stream.written_at >= self.heartbeat or self._changed(stream.written, row):
+            self._streams[device_id] = _Stream(now, row)
+            return [row]
+        return []
+
+    def _changed(self, reference, row):
+        for tolerance, before, after in zip(self.tolerances, reference[2:], row[2:]):
+            if before is None or after is None:
+                if before is not after:
+                    return True
+            elif abs(after - before) > tolerance.band(before):
+                return True
+        return False
+
+    def _open_door(self, stream, now, row):
+        """Pentes extrêmes des droites issues de la ligne écrite, à la tolérance de `row` près"""
+        elapsed = now - stream.written_at
+        stream.upper, stream.lower = [], []
+        for tolerance, origin, value in zip(self.tolerances, stream.written[2:], row[2:]):
+            if origin is None or value is None:
+                stream.upper.append(None)
+                stream.lower.append(None)
+                continue
+            band = tolerance.band(origin)
+            stream.upper.append((value + band - origin) / elapsed)
+            stream.lower.append((value - band - origin) / elapsed)
+        stream.pending_at, stream.pending = now, row
+
+    def _door_closed(self, stream, now, row):
+        elapsed = now - stream.written_at
+        closed = False
+        for index, (tolerance, origin, value) in enumerate(zip(self.tolerances, stream.written[2:], row[2:])):
+            if origin is None or value is None or stream.upper[index] is None:
+                if value is not origin or stream.upper[index] is not None:
+                    closed = True
+                continue
+            # Le segment origine -> `row` doit rester dans la tolérance des lignes en attente
+            slope = (value - origin) / elapsed
+            if not stream.lower[index] <= slope <= stream.upper[index]:
+                closed = True
+            band = tolerance.band(origin)
+            stream.upper[index] = min(stream.upper[index], (value + band - origin) / elapsed)
+            stream.lower[index] = max(stream.lower[index], (value - band - origin) / elapsed)
+        return closed
+
+    def _swinging_door(self, stream, now, row):
+        rows = []
+        if stream.pending is not None and (self._door_closed(stream, now, row)
+                                           or now - stream.written_at >= self.heartbeat):
+            # Porte fermée ou battement: la ligne précédente est écrite et devient l'origine
+            rows.append(stream.pending)
+            stream.written_at, stream.written = stream.pending_at, stream.pending
+            stream.pending = None
+        if now - stream.written_at >= self.heartbeat or now <= stream.written_at:
+            # Appareil muet depuis un battement, ou même instant que l'origine (pas de pente)
+            if now > stream.written_at or self._changed(stream.written, row):
+                self._restart(stream, now, row)
+                rows.append(row)
+        elif stream.pending is None:
+            self._open_door(stream, now, row)
+        else:
+            stream.pending_at, stream.pending = now, row
+        return rows
+
+    def _restart(self, stream, now, row):
+        stream.written_at, stream.written = now, row
+        stream.pending_at = stream.pending = stream.upper = stream.lower = None
+
+    def flush(self):
+        """Lignes en attente de la porte battante (arrêt du service)"""
+        with self._lock:
+            rows = []
+            for stream in self._streams.values():
+                if stream.pending is not None:
+                    rows.append(stream.pending)
+                    self._restart(stream, stream.pending_at, stream.pending)
+            self.written += len(rows)
+            return rows
+
+    def stats(self):
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'tolerances': {column: repr(tolerance) for column, tolerance in zip(self.columns, self.tolerances)
+                               if tolerance.absolute or tolerance.percent},
+                'heartbeat_s': self.heartbeat,
+                'devices': len(self._streams),
+                'received': self.received,
+                'written': self.written,
+                'ratio': round(self.received / self.written, 2) if self.written else None,
+            }
+
+
+# ==================== RECONSTRUCTION À LA LECTURE ====================
+def segments(points, hold, linear=False):
+    """Intervalles (début, fin, valeurs au début, valeurs à la fin) couverts par les
+    lignes triées [(epoch, valeurs)] d'un appareil: en escalier, ou linéaires entre
+    deux lignes distantes d'au plus `hold` secondes"""
+    for index, (start, values) in enumerate(points):
+        if index + 1 < len(points) and points[index + 1][0] - start <= hold:
+            end, following = points[index + 1]
+            yield start, end, values, following if linear else values
+        else:
+            yield start, start + hold, values, values
+
+
+def bucket_stats(points, start, end, width, hold, linear=False):
+    """Statistiques pondérées par le temps, par seau de `width` secondes de [start, end):
+    {début du seau: (lignes, [(durée couverte, somme, min, max) ou None par mesure])}"""
+    buckets = {}
+    for t, _ in points:
+        if start <= t < end:
+            bucket = t - t % width
+            buckets.setdefault(bucket, [0, None])[0] += 1
+    for first, last, before, after in segments(points, hold, linear):
+        low, high = max(first, start), min(last, end)
+        if high <= low:
+            continue
+        bucket = low - low % width
+        while bucket < high:
+            a, b = max(low, bucket), min(high, bucket + width)
+            entry = buckets.setdefault(bucket, [0, None])
+            if entry[1] is None:
+                entry[1] = [None] * len(before)
+            for index, (v0, v1) in enumerate(zip(before, after)):
+                if v0 is None or v1 is None:
+                    continue
+                slope = (v1 - v0) / (last - first) if last > first else 0.0
+                va, vb = v0 + slope * (a - first), v0 + slope * (b - first)
+                stats = entry[1][index]
+                area = (va + vb) / 2 * (b - a)
+                if stats is None:
+                    entry[1][index] = (b - a, area, min(va, vb), max(va, vb))
+                else:
+                    entry[1][index] = (stats[0] + b - a, stats[1] + area,
+                                       min(stats[2], va, vb), max(stats[3], va, vb))
+            bucket += width
+    return {bucket: (count, metrics) for bucket, (count, metrics) in buckets.items() if metrics is not None}
+
+
+def value_at(points, at, hold, linear=False):
+    """Valeurs reconstruites d'un appareil à l'instant `at` (None hors couverture)"""
+    index = bisect.bisect_right(points, at, key=lambda point: point[0]) - 1
+    if index < 0 or at - points[index][0] >= hold:
+        return None
+    start, values = points[index]
+    if not linear or index + 1 == len(points) or points[index + 1][0] - start > hold:
+        return values
+    end, following = points[index + 1]
+    ratio = (at - start) / (end - start)
+    return tuple(None if v0 is None or v1 is None else v0 + (v1 - v0) * ratio
+                 for v0, v1 in zip(values, following))
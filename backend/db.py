@@ -0,0 +1,86 @@
+"""
+PDS-32: Couche de connexions SQLite - connexions persistantes et réglées
+"""
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Réglages appliqués à chaque nouvelle connexion
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',          # lecteurs et écrivain en parallèle
+    'PRAGMA synchronous=NORMAL',        # fsync au checkpoint, pas à chaque commit
+    'PRAGMA mmap_size=268435456',       # 256 Mo mappés en mémoire
+    'PRAGMA cache_size=-16000',         # ~16 Mo de cache de pages par connexion
+    'PRAGMA temp_store=MEMORY',
+)
+
+# Nombre d'instructions préparées gardées en cache par connexion
+STATEMENT_CACHE_SIZE = 256
+
+
+def connect(database):
+    """Ouvre une connexion SQLite réglée (WAL, synchronous=NORMAL, mmap, cache)"""
+    conn = sqlite3.connect(
+        database,
+        timeout=30,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """Pool de connexions réutilisables partagé par les threads de l'API"""
+
+    def __init__(self, database, size=8, setup=None):
+        self.database = database
+        self.size = size
+        # Appelé sur chaque nouvelle connexion (ex: ATTACH des shards d'ingestion)
+        self.setup = setup
+        self._idle = []
+        self._lock = threading.Lock()
+        self._opened = 0
+
+    @contextmanager
+    def connection(self):
+        """Emprunte une connexion au pool et la rend à la sortie du bloc"""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+            self._opened += 1
+        conn = connect(self.database)
+        if self.setup is not None:
+            self.setup(conn)
+        return conn
+
+    def _release(self, conn):
+        # Ne jamais rendre une connexion avec une transaction ouverte
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close_all(self):
+        """Ferme toutes les connexions inactives"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        """Taille du pool et nombre de connexions ouvertes depuis le démarrage"""
+        with self._lock:
+            return {'idle': len(self._idle), 'size': self.size, 'opened': self._opened}
@@ -0,0 +1,293 @@
+"""
+PDS-32: Registre des appareils - état en ligne, dernière activité (UTC), débits,
+firmware, et détection des appareils muets par roue temporelle
+"""
+
+import json
+import math
+import threading
+import time
+from datetime import datetime, timezone
+
+import logs
+
+log = logs.get('devices')
+
+# Suffixe de topic -> type de message. Les topics historiques (home/<suffixe>)
+# portent l'identifiant dans le JSON; les topics par appareil le portent dans
+# le chemin: home/<device_id>/<suffixe>.
+TOPIC_KINDS = {
+    'energy/power': 'energy',
+    'sensors/environment': 'sensors',
+    'sensors/presence': 'presence',
+    'actuators/status': 'actuators',
+    'status/device': 'status',
+}
+
+# Constante de temps de la moyenne glissante des débits (secondes)
+RATE_WINDOW = 60
+
+# Champs d'un message de statut JSON conservés comme informations firmware
+INFO_FIELDS = ('firmware', 'version', 'hardware', 'ip', 'mac', 'rssi', 'uptime')
+
+
+def subscriptions(qos=0):
+    """Abonnements MQTT: topics historiques + jokers par appareil"""
+    topics = []
+    for suffix in TOPIC_KINDS:
+        topics.append((f"home/{suffix}", qos))
+        topics.append((f"home/+/{suffix}", qos))
+    return topics
+
+
+def parse_topic(topic):
+    """'home/energy/power' -> (None, 'energy'); 'home/esp32_001/energy/power' -> ('esp32_001', 'energy')"""
+    parts = topic.split('/')
+    if len(parts) == 3 and parts[0] == 'home':
+        return None, TOPIC_KINDS.get(parts[1] + '/' + parts[2])
+    if len(parts) == 4 and parts[0] == 'home':
+        return parts[1], TOPIC_KINDS.get(parts[2] + '/' + parts[3])
+    return None, None
+
+
+def parse_status(raw_payload):
+    """Statut 'online'/'offline' en texte brut, ou JSON {"status": ..., "device_id": ..., "firmware": ...}"""
+    text = raw_payload.strip()
+    if text.startswith('{'):
+        try:
+            document = json.loads(text)
+        except json.JSONDecodeError:
+            document = None
+        if isinstance(document, dict):
+            info = {k: document[k] for k in INFO_FIELDS if k in document}
+            return str(document.get('status', 'online')).lower(), document.get('device_id'), info
+    return text.lower(), None, {}
+
+
+def format_utc(epoch):
+    """Horodatage epoch -> 'YYYY-MM-DD HH:MM:SS' UTC (formaté à la lecture, pas à chaque message)"""
+    if epoch is None:
+        return None
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class TimerWheel:
+    """Roue temporelle hachée: planification et annulation en O(1), expiration
+    proportionnelle aux seuls délais échus (pas de parcours de tous les appareils)"""
+
+    def __init__(self, tick=1.0, slots=512, start=None):
+        self.tick = tick
+        self.slots = [dict() for _ in range(slots)]
+        self._deadlines = {}
+        # Dernière case traitée
+        self._current = self._tick_of(time.time() if start is None else start)
+
+    def _tick_of(self, when):
+        return int(when // self.tick)
+
+    def schedule(self, key, when):
+        """(Re)programme l'expiration de `key`; la planification précédente est annulée"""
+        tick = self._tick_of(when)
+        if tick <= self._current:
+            tick = self._current + 1
+        previous = self._deadlines.get(key)
+        if previous is not None:
+            self.slots[previous % len(self.slots)].pop(key, None)
+        self._deadlines[key] = tick
+        self.slots[tick % len(self.slots)][key] = tick
+
+    def cancel(self, key):
+        tick = self._deadlines.pop(key, None)
+        if tick is not None:
+            self.slots[tick % len(self.slots)].pop(key, None)
+
+    def advance(self, now):
+        """Avance la roue jusqu'à `now` et retourne les clés échues"""
+        target = self._tick_of(now)
+        expired = []
+        # Au-delà d'un tour complet, chaque case n'a besoin d'être visitée qu'une fois
+        start = max(self._current + 1, target - len(self.slots) + 1)
+        for tick in range(start, target + 1):
+            slot = self.slots[tick % len(self.slots)]
+            if not slot:
+                continue
+            for key, deadline in list(slot.items()):
+                # Les délais d'un tour ultérieur restent dans la case
+                if deadline <= target:
+                    del slot[key]
+                    del self._deadlines[key]
+                    expired.append(key)
+        self._current = target
+        return expired
+
+    def __len__(self):
+        return len(self._deadlines)
+
+
+class Device:
+    """État connu d'un appareil"""
+
+    __slots__ = ('device_id', 'status', 'online', 'first_seen', 'last_seen', 'last_status_at',
+                 'messages', 'by_kind', 'rate', '_rate_at', 'info')
+
+    def __init__(self, device_id):
+        self.device_id = device_id
+        self.status = 'unknown'
+        self.online = False
+        self.first_seen = None
+        self.last_seen = None
+        self.last_status_at = None
+        self.messages = 0
+        self.by_kind = {}
+        self.rate = 0.0
+        self._rate_at = None
+        self.info = {}
+
+    def count(self, now, n=1):
+        """Compteurs et débit moyen exponentiel (messages/s sur ~RATE_WINDOW)"""
+        self.messages += n
+        if self._rate_at is not None:
+            self.rate *= math.exp(-max(0.0, now - self._rate_at) / RATE_WINDOW)
+        self.rate += n / RATE_WINDOW
+        self._rate_at = now
+
+    def as_dict(self, now=None):
+        rate = self.rate
+        if now is not None and self._rate_at is not None:
+            rate *= math.exp(-max(0.0, now - self._rate_at) / RATE_WINDOW)
+        return {
+            'device_id': self.device_id,
+            'status': self.status,
+            'online': self.online,
+            'first_seen': format_utc(self.first_seen),
+            'last_seen': format_utc(self.last_seen),
+            'last_status_at': format_utc(self.last_status_at),
+            'messages': self.messages,
+            'messages_by_kind': dict(self.by_kind),
+            'rate_per_min': round(rate * 60, 2),
+            'info': dict(self.info),
+        }
+
+
+class DeviceRegistry:
+    """Flotte d'appareils indexée par identifiant (recherche O(1))"""
+
+    def __init__(self, stale_after=120, on_change=None, tick=1.0):
+        self.stale_after = stale_after
+        self.on_change = on_change
+        self.tick = tick
+        self._devices = {}
+        self._wheel = TimerWheel(tick=tick)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        # Dernier appareil vu sur un topic historique (statut sans identifiant)
+        self.legacy_device = None
+
+    # ---------- Cycle de vie ----------
+    def start(self):
+        """Démarre la roue temporelle de détection des appareils muets"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='device-registry', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.tick):
+            try:
+                self.expire()
+            except Exception as e:
+                log.exception("✗ Device registry error: %s", e)
+
+    # ---------- Mises à jour ----------
+    def _device(self, device_id):
+        device = self._devices.get(device_id)
+        if device is None:
+            device = self._devices[device_id] = Device(device_id)
+        return device
+
+    def touch(self, device_id, kind, legacy=False, now=None, count=1):
+        """Enregistre `count` messages de données reçus d'un appareil"""
+        if device_id is None:
+            return
+        if now is None:
+            now = time.time()
+        changed = None
+        with self._lock:
+            device = self._device(device_id)
+            device.count(now, count)
+            device.by_kind[kind] = device.by_kind.get(kind, 0) + count
+            device.last_seen = now
+            if device.first_seen is None:
+                device.first_seen = device.last_seen
+            if not device.online:
+                device.online, device.status = True, 'online'
+                changed = device.as_dict(now)
+            if legacy:
+                self.legacy_device = device_id
+            self._wheel.schedule(device_id, now + self.stale_after)
+        if changed and self.on_change:
+            self.on_change(changed)
+
+    def set_status(self, device_id, status, info=None, now=None):
+        """Statut publié par l'appareil (message retenu / testament 'offline')"""
+        if device_id is None:
+            device_id = self.legacy_device or 'unknown'
+        if now is None:
+            now = time.time()
+        with self._lock:
+            device = self._device(device_id)
+            device.status = status
+            device.online = status == 'online'
+            device.last_status_at = now
+            if info:
+                device.info.update(info)
+            if device.online:
+                device.last_seen = device.last_status_at
+                if device.first_seen is None:
+                    device.first_seen = device.last_seen
+                self._wheel.schedule(device_id, now + self.stale_after)
+            else:
+                self._wheel.cancel(device_id)
+            changed = device.as_dict(now)
+        if self.on_change:
+            self.on_change(changed)
+
+    def expire(self, now=None):
+        """Passe hors ligne les appareils sans message depuis stale_after secondes"""
+        if now is None:
+            now = time.time()
+        changed = []
+        with self._lock:
+            for device_id in self._wheel.advance(now):
+                device = self._devices.get(device_id)
+                if device is not None and device.online:
+                    device.online, device.status = False, 'stale'
+                    changed.append(device.as_dict(now))
+        if self.on_change:
+            for device in changed:
+                self.on_change(device)
+        return len(changed)
+
+    # ---------- Lecture ----------
+    def get(self, device_id):
+        with self._lock:
+            device = self._devices.get(device_id)
+            return device.as_dict(time.time()) if device else None
+
+    def list(self, online=None):
+        now = time.time()
+        with self._lock:
+            devices = [d.as_dict(now) for d in self._devices.values() if online is None or d.online == online]
+        return sorted(devices, key=lambda d: d['device_id'])
+
+    def summary(self):
+        """Vue agrégée de la flotte (en ligne / total / dernière activité)"""
+        with self._lock:
+            online = sum(1 for d in self._devices.values() if d.online)
+            last_seen = max((d.last_seen for d in self._devices.values() if d.last_seen), default=None)
+            return {'online': online, 'total': len(self._devices), 'last_seen': format_utc(last_seen)}
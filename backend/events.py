@@ -0,0 +1,135 @@
+"""
+PDS-32: Diffusion des événements d'ingestion vers les dashboards (Server-Sent Events)
+"""
+
+import itertools
+import json
+import threading
+from collections import OrderedDict
+
+# Intervalle des commentaires keep-alive envoyés aux clients inactifs (secondes)
+HEARTBEAT_INTERVAL = 15
+
+
+class Subscriber:
+    """File d'un client: les événements de même clé sont fusionnés (le plus récent gagne)"""
+
+    def __init__(self, max_pending):
+        self.max_pending = max_pending
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._unique = itertools.count()
+        self.coalesced = 0
+        self.overflowed = False
+
+    def push(self, key, event):
+        """Ajoute un événement sans jamais bloquer l'émetteur"""
+        with self._cond:
+            if self._closed:
+                return
+            if key is None:
+                key = ('unique', next(self._unique))
+            elif key in self._pending:
+                del self._pending[key]
+                self.coalesced += 1
+            self._pending[key] = event
+            # Client trop lent: on jette les plus anciens et on demande une resynchro
+            while len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)
+                self.overflowed = True
+            self._cond.notify()
+
+    def drain(self, timeout):
+        """Attend des événements et retourne (événements, débordement)"""
+        with self._cond:
+            if not self._pending and not self._closed:
+                self._cond.wait(timeout)
+            events = list(self._pending.values())
+            self._pending.clear()
+            overflowed, self.overflowed = self.overflowed, False
+            return events, overflowed
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    @property
+    def closed(self):
+        return self._closed
+
+
+class EventBroker:
+    """Publie chaque événement d'ingestion à tous les clients abonnés"""
+
+    def __init__(self, max_pending=256):
+        self.max_pending = max_pending
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._sequence = itertools.count(1)
+        self._published = 0
+
+    def subscribe(self):
+        subscriber = Subscriber(self.max_pending)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscriber.close()
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event_type, data, key=None):
+        """Diffuse un événement; `key` permet de fusionner les mises à jour successives"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+            event_id = next(self._sequence)
+            self._published += 1
+        if not subscribers:
+            return
+        event = (event_id, event_type, data)
+        for subscriber in subscribers:
+            subscriber.push(key, event)
+
+    def close_all(self):
+        """Termine tous les flux (arrêt du serveur: les clients se reconnectent ailleurs)"""
+        with self._lock:
+            subscribers, self._subscribers = list(self._subscribers), set()
+        for subscriber in subscribers:
+            subscriber.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'published': self._published,
+                'coalesced': sum(s.coalesced for s in self._subscribers),
+            }
+
+    def stream(self, subscriber, initial_events=()):
+        """Générateur de trames SSE pour un abonné (à passer à une Response Flask)"""
+        try:
+            yield 'retry: 3000\n\n'
+            for event_type, data in initial_events:
+                yield format_sse(event_type, data)
+            while not subscriber.closed:
+                events, overflowed = subscriber.drain(HEARTBEAT_INTERVAL)
+                if overflowed:
+                    yield format_sse('resync', {})
+                if not events:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield ''.join(format_sse(event_type, data, event_id)
+                              for event_id, event_type, data in events)
+        finally:
+            self.unsubscribe(subscriber)
+
+
+def format_sse(event_type, data, event_id=None):
+    """Formate une trame text/event-stream"""
+    frame = f"event: {event_type}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+    if event_id is not None:
+        frame = f"id: {event_id}\n" + frame
+    return frame
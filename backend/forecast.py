@@ -0,0 +1,509 @@
+"""
+PDS-32: Prévision de consommation - modèles légers par appareil sur les agrégats
+horaires, recalculés en tâche de fond et servis depuis un cache
+
+Modèles (ajustés pour tous les appareils à la fois, NumPy):
+- 'mean': consommation horaire moyenne (historique trop court)
+- 'seasonal_naive': même heure de la semaine précédente (de la veille si < 2 semaines)
+- 'holt_winters': lissage exponentiel additif, tendance amortie, saison journalière
+- 'ridge': régression ridge sur l'heure de la semaine et les degrés-heures de
+  chauffage/climatisation (température du capteur de l'appareil)
+
+Chaque appareil garde le modèle à la plus faible erreur absolue moyenne sur la
+dernière semaine (ou le dernier jour) mise de côté, puis réajusté sur tout
+l'historique; un appareil muet depuis une semaine ('inactive') ne consomme plus. Les coûts prévus suivent le barème (tariffs.py), consommation du
+mois comprise.
+"""
+
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+import compression
+import logs
+import rollups
+import tariffs
+
+log = logs.get('forecast')
+
+MODELS = ('mean', 'seasonal_naive', 'holt_winters', 'ridge')
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+WEEK = 168
+DAY = 24
+
+# Holt-Winters: grille (alpha, beta, gamma) choisie par appareil sur l'erreur à un pas
+HW_GRID = [(a, b, g) for a in (0.05, 0.2, 0.5) for b in (0.0, 0.05) for g in (0.05, 0.2)]
+HW_DAMPING = 0.98
+
+# Ridge: pénalité, températures de confort (degrés-heures au-delà)
+RIDGE_LAMBDA = 1.0
+HEATING_BELOW = 18.0
+COOLING_ABOVE = 24.0
+# Part minimale d'heures avec une température pour l'utiliser comme variable
+MIN_TEMPERATURE_COVERAGE = 0.5
+
+
+class ForecastError(ValueError):
+    """Paramètres de prévision invalides (renvoyés en 400 par l'API)"""
+
+
+def _str(epoch):
+    return datetime.fromtimestamp(int(epoch), timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+# ==================== HISTORIQUE ====================
+def load_history(conn, start, end, sensor_hold=600, sensor_linear=False):
+    """Consommation et température horaires de [start, end) (epochs sur des heures
+    entières): (appareils, matrice énergie, matrice température), NaN si absente"""
+    hours = (end - start) // 3600
+    rows = conn.execute('''
+        SELECT bucket, device_id, COALESCE(energy_delta, energy_max - energy_min)
+        FROM energy_rollup_1h
+        WHERE bucket >= ? AND bucket < ?
+    ''', (_str(start), _str(end))).fetchall()
+    devices = sorted({row[1] for row in rows})
+    index = {device: i for i, device in enumerate(devices)}
+    energy = np.full((len(devices), hours), np.nan)
+    if rows:
+        buckets, names, values = zip(*rows)
+        column = (np.array(buckets, dtype='datetime64[s]').astype(np.int64) - start) // 3600
+        energy[[index[name] for name in names], column] = np.array(values, dtype=float)
+
+    # Température: moyennes horaires sous-échantillonnées (lectures purgées), puis
+    # lectures brutes encore présentes (écrites par changement: moyennes pondérées)
+    temperature = np.full((len(devices), hours), np.nan)
+    for bucket, device_id, value in conn.execute('''
+        SELECT bucket, device_id, temperature_avg FROM sensor_rollup_1h
+        WHERE bucket >= ? AND bucket < ?
+    ''', (_str(start), _str(end))):
+        if device_id in index and value is not None:
+            temperature[index[device_id], (_epoch(bucket) - start) // 3600] = value
+    points = {}
+    window = (_str(start - sensor_hold), _str(end))
+    for device_id, at, value, *_ in conn.execute(rollups.SENSOR_POINTS, window):
+        if device_id in index:
+            points.setdefault(device_id, []).append((at, (value,)))
+    for device_id, device_points in points.items():
+        for bucket, (_, stats) in compression.bucket_stats(device_points, start, end, 3600,
+                                                            sensor_hold, sensor_linear).items():
+            if stats[0] is not None:
+                covered, area, _, _ = stats[0]
+                temperature[index[device_id], (bucket - start) // 3600] = area / covered
+    return devices, energy, temperature
+
+
+def _epoch(bucket):
+    return int(np.datetime64(bucket, 's').astype(np.int64))
+
+
+def _hour_profile(values, hour_of_day):
+    """Moyenne par heure de la journée de chaque ligne (NaN ignorés, 0 sans donnée)"""
+    profile = np.zeros((values.shape[0], DAY))
+    for hour in range(DAY):
+        column = values[:, hour_of_day == hour]
+        known = ~np.isnan(column)
+        count = known.sum(axis=1)
+        profile[:, hour] = np.where(count > 0, np.where(known, column, 0.0).sum(axis=1) / np.maximum(count, 1), 0.0)
+    return profile
+
+
+def fill_missing(values, hour_of_day):
+    """Heures sans donnée remplacées par la moyenne de la même heure de la journée"""
+    profile = _hour_profile(values, hour_of_day)
+    return np.where(np.isnan(values), profile[:, hour_of_day], values)
+
+
+# ==================== MODÈLES ====================
+def forecast_mean(y, horizon, **_):
+    return np.repeat(y.mean(axis=1, keepdims=True), horizon, axis=1)
+
+
+def forecast_seasonal_naive(y, horizon, **_):
+    season = WEEK if y.shape[1] >= 2 * WEEK else DAY
+    if y.shape[1] < season:
+        return None
+    last = y[:, -season:]
+    return last[:, np.arange(horizon) % season]
+
+
+def forecast_holt_winters(y, horizon, **_):
+    """Lissage exponentiel additif (ETS A,Ad,A), vectorisé sur appareils x grille"""
+    devices, length = y.shape
+    if length < 2 * DAY:
+        return None
+    alpha, beta, gamma = (np.array(values)[:, None] for values in zip(*HW_GRID))
+    first, second = y[:, :DAY].mean(axis=1), y[:, DAY:2 * DAY].mean(axis=1)
+    level = np.tile(first, (len(HW_GRID), 1))
+    trend = np.tile((second - first) / DAY, (len(HW_GRID), 1))
+    season = np.tile(y[:, :DAY] - first[:, None], (len(HW_GRID), 1, 1))
+    sse = np.zeros((len(HW_GRID), devices))
+    for t in range(DAY, length):
+        slot = t % DAY
+        error = y[:, t] - (level + HW_DAMPING * trend + season[:, :, slot])
+        sse += error * error
+        level = level + HW_DAMPING * trend + alpha * error
+        trend = HW_DAMPING * trend + alpha * beta * error
+        season[:, :, slot] += gamma * error
+    best = np.argmin(sse, axis=0)
+    rows = np.arange(devices)
+    damping = np.cumsum(HW_DAMPING ** np.arange(1, horizon + 1))
+    slots = (length + np.arange(horizon)) % DAY
+    return (level[best, rows][:, None] + damping * trend[best, rows][:, None]
+            + season[best, rows][:, slots])
+
+
+def _design(hour_of_week, temperature, season):
+    """Indicatrices d'heure (de la semaine ou de la journée) + degrés-heures"""
+    columns = np.eye(season)[hour_of_week % season]
+    if temperature is None:
+        return columns
+    return np.column_stack([columns, np.maximum(temperature - COOLING_ABOVE, 0),
+                            np.maximum(HEATING_BELOW - temperature, 0)])
+
+
+def forecast_ridge(y, horizon, hour_of_week, future_hour_of_week, temperature, future_temperature, **_):
+    devices, length = y.shape
+    if length < 2 * DAY:
+        return None
+    season = WEEK if length >= 2 * WEEK else DAY
+    result = np.empty((devices, horizon))
+    for d in range(devices):
+        known = temperature is not None and temperature[d] is not None
+        x = _design(hour_of_week, temperature[d] if known else None, season)
+        future = _design(future_hour_of_week, future_temperature[d] if known else None, season)
+        coefficients = np.linalg.solve(x.T @ x + RIDGE_LAMBDA * np.eye(x.shape[1]), x.T @ y[d])
+        result[d] = future @ coefficients
+    return result
+
+
+FORECASTERS = {
+    'mean': forecast_mean,
+    'seasonal_naive': forecast_seasonal_naive,
+    'holt_winters': forecast_holt_winters,
+    'ridge': forecast_ridge,
+}
+
+
+# ==================== AJUSTEMENT ====================
+class Fit:
+    """Prévisions horaires de chaque appareil à partir de `start` (epoch, heure entière)"""
+
+    def __init__(self, devices, start, energy, models, errors):
+        self.devices = devices
+        self.start = start
+        self.energy = energy
+        self.models = models
+        self.errors = errors
+
+
+def _temperature_inputs(temperature, hour_of_day, future_hour_of_day):
+    """Températures passées complétées et futures (profil des 7 derniers jours); None
+    pour un appareil sans capteur suffisamment renseigné"""
+    coverage = (~np.isnan(temperature)).mean(axis=1) if temperature.shape[1] else np.zeros(len(temperature))
+    filled = fill_missing(temperature, hour_of_day)
+    recent = _hour_profile(temperature[:, -7 * DAY:], hour_of_day[-7 * DAY:])
+    past = [filled[d] if coverage[d] >= MIN_TEMPERATURE_COVERAGE else None for d in range(len(temperature))]
+    future = [recent[d][future_hour_of_day] if past[d] is not None else None for d in range(len(temperature))]
+    return past, future
+
+
+def fit(devices, start, energy, temperature, horizon, utc_offset=0, models=MODELS):
+    """Choisit le modèle de chaque appareil (parmi `models`) sur une période mise de
+    côté, puis prévoit `horizon` heures après l'historique [start, start + n heures)"""
+    length = energy.shape[1]
+    local = start + utc_offset + 3600 * np.arange(length + horizon)
+    hour_of_day = (local // 3600) % DAY
+    hour_of_week = ((local // 86400 + 3) % 7) * DAY + hour_of_day  # 0 = lundi 00h
+    observed = ~np.isnan(energy)
+    y = fill_missing(energy, hour_of_day[:length])
+
+    def run(model, end, steps):
+        past, future = _temperature_inputs(temperature[:, :end], hour_of_day[:end], hour_of_day[end:end + steps])
+        return FORECASTERS[model](
+            y[:, :end], steps, hour_of_week=hour_of_week[:end], future_hour_of_week=hour_of_week[end:end + steps],
+            temperature=past, future_temperature=future
+        )
+
+    # Période mise de côté: une semaine si l'historique le permet, sinon un jour
+    holdout = WEEK if length >= 3 * WEEK else DAY if length >= 3 * DAY else 0
+    errors = {model: np.full(len(devices), np.inf) for model in MODELS}
+    if holdout:
+        actual = energy[:, length - holdout:]
+        for model in models:
+            predicted = run(model, length - holdout, holdout)
+            if predicted is None:
+                continue
+            known = observed[:, length - holdout:]
+            absolute = np.where(known, np.abs(predicted - np.nan_to_num(actual)), 0.0).sum(axis=1)
+            count = known.sum(axis=1)
+            errors[model] = np.where(count > 0, absolute / np.maximum(count, 1), np.inf)
+    else:
+        fallback = 'seasonal_naive' if length >= DAY and 'seasonal_naive' in models else 'mean'
+        errors[fallback][:] = 0.0
+
+    table = np.vstack([errors[model] for model in MODELS])
+    choice = np.argmin(table, axis=0)
+    forecasts = np.zeros((len(devices), horizon))
+    for index, model in enumerate(MODELS):
+        chosen = choice == index
+        if not chosen.any():
+            continue
+        predicted = run(model, length, horizon)
+        forecasts[chosen] = predicted[chosen]
+    # Appareil muet depuis une semaine (retiré, hors service): rien de prévu
+    active = observed[:, -WEEK:].any(axis=1)
+    forecasts[~active] = 0.0
+    models = [MODELS[index] if active[d] else 'inactive' for d, index in enumerate(choice)]
+    device_errors = [{model: (round(float(errors[model][d]), 5) if np.isfinite(errors[model][d]) else None)
+                      for model in MODELS} for d in range(len(devices))]
+    return Fit(devices, start + length * 3600, np.maximum(forecasts, 0.0), models, device_errors)
+
+
+# ==================== COÛTS ====================
+def month_to_date(conn, schedule, end):
+    """Consommation et coût réels par appareil du mois local en cours, jusqu'à `end`"""
+    month = int(schedule.month_of(end - 1))
+    start, _ = schedule.month_bounds(month)
+    rows = conn.execute('''
+        SELECT device_id, SUM(COALESCE(energy_delta, energy_max - energy_min)), SUM(cost)
+        FROM energy_rollup_1h
+        WHERE bucket >= ? AND bucket < ?
+        GROUP BY device_id
+    ''', (start, _str(end))).fetchall()
+    return month, {device_id: (energy or 0.0, cost or 0.0) for device_id, energy, cost in rows}
+
+
+def price_forecast(schedule, fit_result, consumed):
+    """Coûts horaires prévus: barème de chaque heure, tranches selon la consommation
+    du mois (réelle puis prévue); remise à zéro aux changements de mois"""
+    devices, horizon = fit_result.energy.shape
+    epoch = fit_result.start + 3600 * np.arange(horizon)
+    month = schedule.month_of(epoch)
+    codes = np.repeat(np.arange(devices), horizon)
+    flat_epoch = np.tile(epoch, devices)
+    flat_month = np.tile(month, devices)
+    energy = fit_result.energy.ravel()
+    mtd = tariffs.running_before(codes * (1 << 32) + flat_month, energy)
+    opening = np.array([consumed.get(device, (0.0, 0.0))[0] for device in fit_result.devices])
+    mtd = mtd + np.where(flat_month == month[0], opening[codes], 0.0)
+    costs = schedule.costs(flat_epoch, energy, mtd).reshape(devices, horizon)
+    # Prix du kWh à chaque heure hors tranches (tarif horaire): base du report de consommation
+    prices = schedule.costs(flat_epoch, np.ones(len(flat_epoch)), np.zeros(len(flat_epoch))).reshape(devices, horizon)
+    return costs, prices
+
+
+def shift_savings(schedule, fit_result, costs, prices, mask):
+    """Économie possible en reportant la consommation prévue de chaque jour local
+    vers son heure la moins chère (nulle avec un tarif unique ou par tranches)"""
+    epoch = fit_result.start + 3600 * np.arange(fit_result.energy.shape[1])
+    day = (epoch + schedule.utc_offset) // 86400
+    savings = 0.0
+    for value in np.unique(day[mask]):
+        hours = mask & (day == value)
+        cheapest = prices[:, hours].min(axis=1)
+        savings += float(costs[:, hours].sum() - (fit_result.energy[:, hours].sum(axis=1) * cheapest).sum())
+    return max(savings, 0.0)
+
+
+# ==================== SERVICE ====================
+class ForecastService:
+    """Prévisions recalculées en tâche de fond et servies depuis la mémoire
+
+    Recalcul quand une nouvelle heure est close, quand le barème change, ou quand
+    des données sont arrivées (data_version) et que la dernière prévision a plus
+    de `refresh_interval` secondes (mesures en retard, reconstruction d'agrégats).
+    """
+
+    def __init__(self, connection, schedule, history_days=28, horizon_hours=48, refresh_interval=900,
+                 check_interval=30, sensor_hold=600, sensor_linear=False, data_version=None, on_refresh=None):
+        # connection(): gestionnaire de contexte d'une connexion de lecture (db_pool.connection)
+        self.connection = connection
+        # schedule(): barème courant (tariffs.TariffService)
+        self.schedule = schedule
+        self.history_days = history_days
+        self.horizon_hours = horizon_hours
+        self.refresh_interval = refresh_interval
+        self.check_interval = check_interval
+        self.sensor_hold = sensor_hold
+        self.sensor_linear = sensor_linear
+        # data_version(): change à chaque commit des tables lues (cache.Generations.vector)
+        self.data_version = data_version or (lambda: None)
+        # on_refresh(): nouvelle prévision disponible (invalidation des réponses en cache)
+        self.on_refresh = on_refresh
+        self._snapshot = None
+        self._key = None
+        self._version = None
+        self._computed_at = 0.0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.runs = 0
+        self.last_duration = None
+        self.last_error = None
+
+    # ---------- Cycle de vie ----------
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='forecast', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def request_refresh(self):
+        """Recalcul au prochain tour de la boucle (première requête, reconstruction)"""
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if self.stale():
+                    self.refresh()
+            except Exception as e:
+                self.last_error = str(e)
+                log.exception("✗ Forecast failed: %s", e)
+            self._wake.wait(self.check_interval)
+            self._wake.clear()
+
+    def _current_key(self, now):
+        return now - now % 3600, self.schedule().fingerprint
+
+    def stale(self, now=None):
+        now = int(time.time() if now is None else now)
+        if self._snapshot is None or self._key != self._current_key(now):
+            return True
+        return self.data_version() != self._version and time.time() - self._computed_at >= self.refresh_interval
+
+    # ---------- Calcul ----------
+    def refresh(self, now=None):
+        """Recalcule toutes les prévisions; retourne l'instantané"""
+        now = int(time.time() if now is None else now)
+        started = time.perf_counter()
+        version = self.data_version()
+        key = self._current_key(now)
+        schedule = self.schedule()
+        end = key[0]
+        start = end - self.history_days * 86400
+        with self.connection() as conn:
+            devices, energy, temperature = load_history(conn, start, end, self.sensor_hold, self.sensor_linear)
+            month, consumed = month_to_date(conn, schedule, end)
+        snapshot = self._build(schedule, devices, start, end, energy, temperature, month, consumed, now)
+        with self._lock:
+            self._snapshot, self._key, self._version = snapshot, key, version
+            self._computed_at = time.time()
+            self.runs += 1
+            self.last_duration = round(time.perf_counter() - started, 3)
+            self.last_error = None
+        log.info("📈 Forecast refreshed: %d devices in %.2fs", len(devices), self.last_duration)
+        if self.on_refresh is not None:
+            self.on_refresh()
+        return snapshot
+
+    def _build(self, schedule, devices, start, end, energy, temperature, month, consumed, now):
+        _, month_end = schedule.month_bounds(month)
+        remaining = max(0, (_epoch(month_end) - end) // 3600)
+        horizon = max(self.horizon_hours, remaining)
+        snapshot = {
+            'computed_at': _str(now),
+            'data_until': _str(end),
+            'history_days': self.history_days,
+            'horizon_hours': self.horizon_hours,
+            'tariff': schedule.fingerprint,
+            'devices': {},
+            'totals': None,
+        }
+        if not devices:
+            return snapshot
+        result = fit(devices, start, energy, temperature, horizon, schedule.utc_offset)
+        costs, prices = price_forecast(schedule, result, consumed)
+        in_month = np.arange(horizon) < remaining
+        epochs = end + 3600 * np.arange(self.horizon_hours)
+
+        def summary(energy_kwh, cost):
+            return {'energy_kwh': round(float(energy_kwh), 3), 'cost': round(float(cost), 3)}
+
+        month_label = str(np.datetime64(month, 'M'))
+        for d, device in enumerate(devices):
+            actual_energy, actual_cost = consumed.get(device, (0.0, 0.0))
+            future_energy = result.energy[d, in_month].sum()
+            future_cost = costs[d, in_month].sum()
+            snapshot['devices'][device] = {
+                'model': result.models[d],
+                'errors_mae_kwh': result.errors[d],
+                'next_24h': summary(result.energy[d, :DAY].sum(), costs[d, :DAY].sum()),
+                'month': {
+                    'month': month_label,
+                    'to_date': summary(actual_energy, actual_cost),
+                    'remaining': summary(future_energy, future_cost),
+                    'estimate': summary(actual_energy + future_energy, actual_cost + future_cost),
+                },
+                'hourly': [
+                    {'start': _str(at), 'energy_kwh': round(float(e), 4), 'cost': round(float(c), 4)}
+                    for at, e, c in zip(epochs, result.energy[d, :self.horizon_hours], costs[d, :self.horizon_hours])
+                ],
+            }
+
+        actual_energy = sum(energy_kwh for energy_kwh, _ in consumed.values())
+        actual_cost = sum(cost for _, cost in consumed.values())
+        future_energy, future_cost = result.energy[:, in_month].sum(), costs[:, in_month].sum()
+        snapshot['totals'] = {
+            'next_24h': summary(result.energy[:, :DAY].sum(), costs[:, :DAY].sum()),
+            'month': {
+                'month': month_label,
+                'to_date': summary(actual_energy, actual_cost),
+                'remaining': summary(future_energy, future_cost),
+                'estimate': summary(actual_energy + future_energy, actual_cost + future_cost),
+            },
+            'potential_savings': round(shift_savings(schedule, result, costs, prices, in_month), 3),
+            'models': {model: result.models.count(model) for model in MODELS + ('inactive',)},
+            'hourly': [
+                {'start': _str(at), 'energy_kwh': round(float(e), 4), 'cost': round(float(c), 4)}
+                for at, e, c in zip(epochs, result.energy[:, :self.horizon_hours].sum(axis=0),
+                                    costs[:, :self.horizon_hours].sum(axis=0))
+            ],
+        }
+        return snapshot
+
+    # ---------- Lecture ----------
+    def snapshot(self):
+        with self._lock:
+            return self._snapshot
+
+    def forecast(self, device_id=None, hours=None):
+        """Prévision en cache (None si pas encore calculée), pour un appareil et/ou
+        limitée aux `hours` premières heures"""
+        snapshot = self.snapshot()
+        if snapshot is None:
+            return None
+        if hours is not None and not 1 <= hours <= self.horizon_hours:
+            raise ForecastError(f"hours must be between 1 and {self.horizon_hours}")
+        result = dict(snapshot)
+        if device_id is not None:
+            if device_id not in snapshot['devices']:
+                raise ForecastError(f"No forecast for device {device_id}")
+            result['devices'] = {device_id: snapshot['devices'][device_id]}
+        if hours is not None:
+            result['devices'] = {device: dict(entry, hourly=entry['hourly'][:hours])
+                                 for device, entry in result['devices'].items()}
+            if result['totals'] is not None:
+                result['totals'] = dict(result['totals'], hourly=result['totals']['hourly'][:hours])
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'runs': self.runs,
+                'computed_at': self._snapshot['computed_at'] if self._snapshot else None,
+                'devices': len(self._snapshot['devices']) if self._snapshot else 0,
+                'last_duration_s': self.last_duration,
+                'last_error': self.last_error,
+                'refresh_interval_s': self.refresh_interval,
+            }
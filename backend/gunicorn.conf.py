@@ -0,0 +1,47 @@
+"""
+PDS-32: Configuration gunicorn (production)
+
+    gunicorn -c gunicorn.conf.py
+
+Workers à threads (gthread): chaque requête, y compris un flux SSE, occupe un
+thread; les lectures passent par le pool de connexions SQLite (WAL, lecteurs
+jamais bloqués par l'écrivain). Un seul worker, le leader, reçoit MQTT et
+écrit en base; les autres suivent les nouvelles lignes (voir serving.py).
+"""
+
+import os
+import signal
+import threading
+
+wsgi_app = 'app:create_app()'
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+keepalive = 5
+timeout = 60
+# Délai laissé aux requêtes en cours et au vidage de la file d'ingestion
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+accesslog = '-'
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    """SIGTERM: fermer d'abord les flux SSE, sinon l'arrêt attend graceful_timeout"""
+    handle_exit = worker.handle_exit
+
+    def on_term(signum, frame):
+        import app
+        threading.Thread(target=app.event_broker.close_all, daemon=True).start()
+        handle_exit(signum, frame)
+
+    signal.signal(signal.SIGTERM, on_term)
+
+
+def worker_exit(server, worker):
+    """Arrêt du worker: MQTT coupé puis file d'ingestion vidée en base"""
+    # Ce hook est aussi appelé dans l'arbitre quand il récupère un worker
+    if os.getpid() != worker.pid:
+        return
+    import app
+    app.stop_services()
@@ -0,0 +1,276 @@
+"""
+PDS-32: Historique énergétique en flux - pagination par curseur (timestamp, id),
+formats compacts et sous-échantillonnage côté serveur (LTTB / min-max)
+
+Les pages brutes sont lues dans energy_data (curseurs sur l'id des lignes); les
+courbes sous-échantillonnées passent par le moteur de séries (timeseries.py).
+"""
+
+import base64
+import csv
+import io
+import json
+from datetime import datetime
+
+import numpy as np
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+COLUMNS = ('timestamp', 'power', 'energy_total')
+
+FORMATS = {
+    'json': 'application/json',
+    'columnar': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+DOWNSAMPLERS = ('lttb', 'minmax')
+
+# Lignes lues par requête SQL: borne la mémoire quelle que soit la plage
+CHUNK_SIZE = 2000
+
+# Taille maximale d'une page (et page par défaut du format columnar, non streamable)
+MAX_PAGE = 50000
+
+# Nombre maximal de points après sous-échantillonnage
+MAX_POINTS = 10000
+
+
+class HistoryError(ValueError):
+    """Paramètres d'historique invalides (renvoyés en 400 par l'API)"""
+
+
+# ==================== CURSEURS ====================
+def encode_cursor(timestamp, row_id):
+    """Curseur opaque à partir de la clé (timestamp, id) de la dernière ligne servie"""
+    return base64.urlsafe_b64encode(f"{timestamp}|{row_id}".encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, row_id = raw.rsplit('|', 1)
+        return timestamp, int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HistoryError(f"Invalid cursor: {cursor}")
+
+
+# ==================== REQUÊTE ====================
+class HistoryQuery:
+    """Fenêtre demandée: [start, end), appareil optionnel, reprise après un curseur"""
+
+    def __init__(self, start, end, device_id=None, after=None, limit=None):
+        self.start = start
+        self.end = end
+        self.device_id = device_id
+        self.after = after
+        self.limit = limit
+
+    def where(self, after=None):
+        """Clause WHERE de la fenêtre, reprise strictement après la clé `after`"""
+        start = self.start
+        if after is not None and after[0] > start:
+            # Borne basse unique: avec deux bornes, SQLite parcourt l'index depuis la première
+            start = after[0]
+        clauses = ['timestamp >= ?', 'timestamp < ?']
+        params = [start, self.end]
+        if after is not None:
+            clauses.append('(timestamp, id) > (?, ?)')
+            params.extend(after)
+        if self.device_id:
+            clauses.append('device_id = ?')
+            params.append(self.device_id)
+        return ' AND '.join(clauses), params
+
+    def next_cursor(self, conn):
+        """Clé de la dernière ligne de la page, ou None si la page va jusqu'au bout"""
+        if not self.limit:
+            return None
+        where, params = self.where(self.after)
+        # Dernière ligne de la page et, s'il y en a une, la suivante
+        rows = conn.execute(f'''
+            SELECT timestamp, id FROM energy_data
+            WHERE {where}
+            ORDER BY timestamp, id
+            LIMIT 2 OFFSET ?
+        ''', params + [self.limit - 1]).fetchall()
+        if len(rows) < 2:
+            return None
+        return encode_cursor(*rows[0])
+
+
+def iter_rows(conn, query):
+    """Parcourt la fenêtre par tranches de CHUNK_SIZE (pagination par clé, jamais d'OFFSET)
+
+    Chaque tranche est une requête courte: aucune transaction de lecture n'est
+    tenue pendant l'envoi, ce qui laisse les checkpoints WAL progresser.
+    """
+    after = query.after
+    remaining = query.limit
+    while remaining is None or remaining > 0:
+        size = CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining)
+        where, params = query.where(after)
+        chunk = conn.execute(f'''
+            SELECT id, timestamp, power, energy_total
+            FROM energy_data
+            WHERE {where}
+            ORDER BY timestamp, id
+            LIMIT ?
+        ''', params + [size]).fetchall()
+        for row in chunk:
+            yield row
+        if len(chunk) < size:
+            return
+        after = (chunk[-1][1], chunk[-1][0])
+        if remaining is not None:
+            remaining -= len(chunk)
+
+
+# ==================== SOUS-ÉCHANTILLONNAGE ====================
+def _series(store, query):
+    """Mesures de puissance de la fenêtre lues via le moteur de séries, triées par temps"""
+    data = store.load(
+        'energy_data', datetime.strptime(query.start, TIMESTAMP_FORMAT), datetime.strptime(query.end, TIMESTAMP_FORMAT),
+        [query.device_id] if query.device_id else None, ('power', 'energy_total')
+    )
+    if data is None:
+        return None
+    valid = ~np.isnan(data['power'])
+    order = np.lexsort((data['device_idx'][valid], data['epoch'][valid]))
+    return data['epoch'][valid][order], data['power'][valid][order], data['energy_total'][valid][order]
+
+
+def _bucket_ids(epoch, points):
+    """Seau temporel de chaque mesure, pour environ `points` seaux"""
+    width = max(1, -(-(int(epoch[-1]) - int(epoch[0]) + 1) // points))
+    return (epoch - epoch[0]) // width
+
+
+def _rows(series, kept):
+    """Lignes (id, timestamp, power, energy_total) des mesures retenues (sans id: moteur de séries)"""
+    epoch, power, energy = (column[kept] for column in series)
+    stamps = np.array(epoch, dtype='datetime64[s]').astype(str)
+    for stamp, watts, total in zip(stamps, power.tolist(), energy.tolist()):
+        yield None, stamp.replace('T', ' '), watts, None if total != total else total
+
+
+def minmax(store, query, points):
+    """Garde le minimum et le maximum de puissance de chaque seau, dans l'ordre du temps"""
+    series = _series(store, query)
+    if series is None:
+        return iter(())
+    epoch, power, _ = series
+    bucket = _bucket_ids(epoch, max(1, points // 2))
+    # Par seau: première ligne = minimum, dernière = maximum (à égalité, la plus ancienne)
+    order = np.lexsort((np.arange(len(power)), power, bucket))
+    starts = np.flatnonzero(np.r_[True, bucket[order][1:] != bucket[order][:-1]])
+    ends = np.r_[starts[1:], len(order)] - 1
+    return _rows(series, np.union1d(order[starts], order[ends]))
+
+
+def lttb(store, query, points):
+    """Largest-Triangle-Three-Buckets sur des seaux temporels
+
+    Première et dernière mesures toujours conservées; dans chaque seau, la mesure
+    qui forme le plus grand triangle avec la précédente retenue et la moyenne du
+    seau suivant.
+    """
+    series = _series(store, query)
+    if series is None:
+        return iter(())
+    epoch, power, _ = series
+    if len(epoch) <= 2:
+        return _rows(series, np.arange(len(epoch)))
+    inner = np.arange(1, len(epoch) - 1)
+    bucket = _bucket_ids(epoch, max(1, points - 2))[inner]
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], len(inner)]
+    counts = ends - starts
+    x = epoch[inner].astype(float)
+    y = power[inner]
+    mean_x = np.add.reduceat(x, starts) / counts
+    mean_y = np.add.reduceat(y, starts) / counts
+
+    kept = [0]
+    ax, ay = float(epoch[0]), float(power[0])
+    for index, (lo, hi) in enumerate(zip(starts, ends)):
+        if index + 1 < len(starts):
+            tx, ty = mean_x[index + 1], mean_y[index + 1]
+        else:
+            tx, ty = float(epoch[-1]), float(power[-1])
+        area = np.abs((ax - tx) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (ty - ay))
+        best = lo + int(np.argmax(area))
+        kept.append(inner[best])
+        ax, ay = x[best], y[best]
+    kept.append(len(epoch) - 1)
+    return _rows(series, np.array(kept))
+
+
+# ==================== FORMATS ====================
+def _record(row):
+    return {'timestamp': row[1], 'power': row[2], 'energy_total': row[3]}
+
+
+def records(rows):
+    """Lignes -> objets du format JSON (sans passer par le flux)"""
+    return [_record(row) for row in rows]
+
+
+def _batches(rows, size=500):
+    batch = []
+    for row in rows:
+        batch.append(_record(row))
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stream_json(rows):
+    """Tableau JSON d'objets, émis par lots (format historique de l'API)"""
+    yield '['
+    separator = ''
+    for batch in _batches(rows):
+        # Un seul appel à json.dumps par lot: les crochets sont retirés puis recollés
+        yield separator + json.dumps(batch, separators=(',', ':'))[1:-1]
+        separator = ','
+    yield ']'
+
+
+def stream_ndjson(rows):
+    for batch in _batches(rows):
+        yield ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in batch)
+
+
+def stream_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(COLUMNS)
+    for row in rows:
+        writer.writerow(row[1:4])
+        if buffer.tell() > 16384:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_columnar(rows, next_cursor=None):
+    """Un tableau par colonne; réservé aux pages bornées (les colonnes sont assemblées en mémoire)"""
+    columns = {name: [] for name in COLUMNS}
+    for row in rows:
+        for name, value in zip(COLUMNS, row[1:4]):
+            columns[name].append(value)
+    yield json.dumps(dict(columns, count=len(columns['timestamp']), next_cursor=next_cursor),
+                     separators=(',', ':'))
+
+
+STREAMERS = {
+    'json': stream_json,
+    'ndjson': stream_ndjson,
+    'csv': stream_csv,
+}
@@ -0,0 +1,340 @@
+"""
+PDS-32: Pipeline d'ingestion MQTT - file bornée + thread écrivain unique
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+
+from db import connect
+from timeseries import SQLiteStore
+import logs
+import metrics
+
+log = logs.get('ingest')
+
+INSERT_SECONDS = metrics.Histogram(
+    'pds32_ingest_insert_seconds', "Lot d'ingestion: agrégats et executemany, avant le commit")
+COMMIT_SECONDS = metrics.Histogram('pds32_ingest_commit_seconds', "Lot d'ingestion: durée du commit SQLite")
+BATCH_ROWS = metrics.Histogram('pds32_ingest_batch_rows', "Lignes par lot d'ingestion", buckets=metrics.SIZE_BUCKETS)
+
+_STOP = object()
+# Réveil de l'écrivain: une écriture ponctuelle attend dans sa file
+_WAKE = object()
+
+
+class _Task:
+    """Écriture ponctuelle (ex: alerte) exécutée par l'écrivain dans la transaction d'un lot"""
+
+    __slots__ = ('run', 'on_commit')
+
+    def __init__(self, run, on_commit):
+        self.run = run
+        self.on_commit = on_commit
+
+
+class IngestPipeline:
+    """File d'attente bornée vidée par un écrivain SQLite unique (group commit)"""
+
+    def __init__(self, database, max_queue=10000, batch_size=500, max_latency=0.5, max_tasks=1000):
+        self.database = database
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self._queue = queue.Queue(maxsize=max_queue)
+        # Écritures ponctuelles (alertes): file à part, vidée à chaque lot, jamais
+        # bloquée derrière des lignes de mesures
+        self._tasks = queue.Queue(maxsize=max_tasks)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._flush_hooks = []
+        self._commit_hooks = []
+        self._reject_hooks = []
+        self._states = []
+
+        # Compteurs exposés par stats()
+        self._received = 0
+        self._dropped = 0
+        self._tasks_dropped = 0
+        self._written = 0
+        self._failed = 0
+        self._batches = 0
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+        self._last_flush_at = None
+
+    # ---------- Cycle de vie ----------
+    def start(self):
+        """Démarre le thread écrivain"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """Vide la file puis arrête le thread écrivain"""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def add_flush_hook(self, hook):
+        """Enregistre hook(conn, rows_by_table), exécuté dans la transaction de chaque lot,
+        juste avant l'insertion des lignes brutes"""
+        self._flush_hooks.append(hook)
+
+    def add_commit_hook(self, hook):
+        """Enregistre hook(rows_by_table), exécuté après le commit réussi de chaque lot
+        (copies hors SQLite, ex: segments colonnes)"""
+        self._commit_hooks.append(hook)
+
+    def add_reject_hook(self, hook):
+        """Enregistre hook(table, rows), appelé avec les lignes abandonnées par l'écrivain
+        (lot annulé): ex. compresseurs qui les croyaient écrites"""
+        self._reject_hooks.append(hook)
+
+    def add_state(self, state):
+        """Enregistre un état en mémoire modifié par les hooks de flush (compteurs, tarif):
+        state.commit() après le commit de chaque transaction, state.rollback() si elle est annulée"""
+        self._states.append(state)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    # ---------- Producteur (thread réseau MQTT) ----------
+    def submit(self, table, row):
+        """Ajoute une ligne à écrire; ne bloque jamais (retourne False si la file est pleine)"""
+        try:
+            self._queue.put_nowait((table, row))
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+            return False
+        with self._lock:
+            self._received += 1
+        return True
+
+    def submit_task(self, table, run, on_commit=None):
+        """Confie une écriture à l'écrivain: run(conn) dans la transaction du prochain lot,
+        après ses lignes, puis on_commit() après le commit (`table` est signalée aux hooks
+        de commit). Ne bloque jamais: retourne False si la file des tâches est pleine."""
+        try:
+            self._tasks.put_nowait((table, _Task(run, on_commit)))
+        except queue.Full:
+            with self._lock:
+                self._tasks_dropped += 1
+            return False
+        with self._lock:
+            self._received += 1
+        try:
+            self._queue.put_nowait(_WAKE)
+        except queue.Full:
+            # Écrivain occupé: la tâche part avec son prochain lot
+            pass
+        return True
+
+    def stats(self):
+        """Profondeur de file, pertes et latence des flushs"""
+        with self._lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'queue_capacity': self._queue.maxsize,
+                'received': self._received,
+                'dropped': self._dropped,
+                'task_queue_depth': self._tasks.qsize(),
+                'tasks_dropped': self._tasks_dropped,
+                'written': self._written,
+                'failed': self._failed,
+                'batches': self._batches,
+                'flush_latency_ms': {
+                    'last': round(self._last_flush_ms, 3),
+                    'avg': round(self._total_flush_ms / self._batches, 3) if self._batches else 0,
+                    'max': round(self._max_flush_ms, 3),
+                },
+                'last_flush_at': self._last_flush_at,
+            }
+
+    # ---------- Consommateur (thread écrivain) ----------
+    def _run(self):
+        conn = connect(self.database)
+        try:
+            stopping = False
+            while not stopping:
+                batch = []
+                item = self._queue.get()
+                if item is _STOP:
+                    break
+                if item is not _WAKE:
+                    batch.append(item)
+                deadline = time.monotonic() + self.max_latency
+
+                # Accumuler jusqu'à batch_size ou max_latency (tâche seule: écrite tout de suite)
+                while batch and len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    if item is not _WAKE:
+                        batch.append(item)
+
+                self._flush(conn, batch + self._pending_tasks())
+
+            # Vider ce qui reste avant de quitter
+            remaining_items = []
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _STOP and item is not _WAKE:
+                    remaining_items.append(item)
+            remaining_items += self._pending_tasks()
+            for start in range(0, len(remaining_items), self.batch_size):
+                self._flush(conn, remaining_items[start:start + self.batch_size])
+        finally:
+            conn.close()
+
+    def _pending_tasks(self):
+        tasks = []
+        while True:
+            try:
+                tasks.append(self._tasks.get_nowait())
+            except queue.Empty:
+                return tasks
+
+    def _transaction(self, conn, items):
+        """Écrit des lignes et tâches dans une transaction; retourne None, ou l'erreur
+        qui l'a annulée (états en mémoire des hooks remis à leur dernier commit)"""
+        rows_by_table = {}
+        tasks = []
+        for table, row in items:
+            if isinstance(row, _Task):
+                tasks.append(row)
+            else:
+                rows_by_table.setdefault(table, []).append(row)
+        started = time.perf_counter()
+        try:
+            with conn:
+                for hook in self._flush_hooks:
+                    hook(conn, rows_by_table)
+                SQLiteStore.write(conn, rows_by_table)
+                for task in tasks:
+                    task.run(conn)
+                inserted = time.perf_counter()
+        except Exception as e:
+            for state in self._states:
+                state.rollback()
+            return e
+        INSERT_SECONDS.observe(inserted - started)
+        COMMIT_SECONDS.observe(time.perf_counter() - inserted)
+        for state in self._states:
+            state.commit()
+        return None
+
+    def _bisect(self, conn, items, written):
+        """Lot annulé par une ligne invalide: moitiés rejouées chacune dans sa transaction
+        jusqu'à isoler les lignes fautives; retourne les lignes abandonnées"""
+        if len(items) == 1:
+            return list(items)
+        rejected = []
+        middle = len(items) // 2
+        for half in (items[:middle], items[middle:]):
+            error = self._transaction(conn, half)
+            if error is None:
+                written.extend(half)
+            elif len(half) == 1:
+                log.error("✗ Ingest row rejected (%s %r): %s", half[0][0], half[0][1], error)
+                rejected.extend(half)
+            else:
+                rejected.extend(self._bisect(conn, half, written))
+        return rejected
+
+    def _flush(self, conn, batch):
+        """Écrit un lot: un executemany par table, un seul commit
+
+        Lot annulé: erreur transitoire (base verrouillée, disque) -> lot abandonné;
+        sinon (contrainte, valeur qu'un hook refuse) -> rejoué par moitiés, seules les
+        lignes fautives sont abandonnées. Les écritures ponctuelles sont rejouées seules.
+        """
+        if not batch:
+            return
+        rows = [item for item in batch if not isinstance(item[1], _Task)]
+        tasks = [item for item in batch if isinstance(item[1], _Task)]
+
+        started = time.perf_counter()
+        error = self._transaction(conn, batch)
+        if error is None:
+            written, rejected = batch, []
+            BATCH_ROWS.observe(len(batch))
+        else:
+            if isinstance(error, sqlite3.OperationalError):
+                log.error("✗ Ingest flush failed (%d rows): %s", len(batch), error)
+                written, rejected = [], rows
+            else:
+                # Bug d'un hook: trace complète
+                log.error("✗ Ingest flush failed (%d rows), retrying by halves: %s", len(batch), error,
+                          exc_info=None if isinstance(error, sqlite3.Error) else error)
+                written = []
+                rejected = self._bisect(conn, rows, written) if rows else []
+            if tasks:
+                task_error = self._transaction(conn, tasks)
+                if task_error is None:
+                    written.extend(tasks)
+                else:
+                    log.error("✗ Ingest tasks failed (%d): %s", len(tasks), task_error)
+                    rejected.extend(tasks)
+
+        self._committed(written)
+        self._rejected(rejected)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        with self._lock:
+            self._written += len(written)
+            self._failed += len(rejected)
+            self._batches += 1
+            self._last_flush_ms = elapsed_ms
+            self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+            self._total_flush_ms += elapsed_ms
+            self._last_flush_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+
+    def _committed(self, items):
+        """Callbacks des tâches et hooks de commit pour les lignes écrites"""
+        if not items:
+            return
+        rows_by_table = {}
+        for table, row in items:
+            if isinstance(row, _Task):
+                rows_by_table.setdefault(table, [])
+                if row.on_commit is not None:
+                    try:
+                        row.on_commit()
+                    except Exception as e:
+                        log.error("✗ Ingest task callback failed: %s", e)
+            else:
+                rows_by_table.setdefault(table, []).append(row)
+        for hook in self._commit_hooks:
+            try:
+                hook(rows_by_table)
+            except Exception as e:
+                log.error("✗ Ingest commit hook failed (%d rows): %s", len(items), e)
+
+    def _rejected(self, items):
+        rows_by_table = {}
+        for table, row in items:
+            if not isinstance(row, _Task):
+                rows_by_table.setdefault(table, []).append(row)
+        for table, rows in rows_by_table.items():
+            for hook in self._reject_hooks:
+                try:
+                    hook(table, rows)
+                except Exception as e:
+                    log.error("✗ Ingest reject hook failed (%s): %s", table, e)
@@ -0,0 +1,100 @@
+"""
+PDS-32: Journalisation - niveaux, sortie texte ou JSON, limitation des messages répétés
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')  # 'text' ou 'json' (une ligne par événement)
+# Au plus N messages de même modèle par fenêtre, les suivants sont comptés puis résumés
+LOG_RATE_LIMIT = int(os.environ.get('LOG_RATE_LIMIT', 20))
+LOG_RATE_WINDOW = float(os.environ.get('LOG_RATE_WINDOW', 60))  # secondes
+
+ROOT_LOGGER = 'pds32'
+
+
+class RateLimitFilter(logging.Filter):
+    """Limite chaque modèle de message (logger + format, hors arguments) par fenêtre de temps"""
+
+    def __init__(self, limit=LOG_RATE_LIMIT, window=LOG_RATE_WINDOW):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not self.limit:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._windows.get(key)
+            if entry is None or now - entry[0] >= self.window:
+                suppressed = entry[2] if entry is not None else 0
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if entry[1] < self.limit:
+                entry[1] += 1
+                return True
+            entry[2] += 1
+            return False
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)-7s %(name)s [%(process)d] %(message)s', '%Y-%m-%d %H:%M:%S')
+
+    def format(self, record):
+        line = super().format(record)
+        if getattr(record, 'suppressed', 0):
+            line += f" ({record.suppressed} similar messages suppressed)"
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """Une ligne JSON par événement; les champs passés par extra= sont conservés"""
+
+    RESERVED = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'suppressed'}
+
+    def format(self, record):
+        event = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        event.update((name, value) for name, value in vars(record).items() if name not in self.RESERVED)
+        if getattr(record, 'suppressed', 0):
+            event['suppressed'] = record.suppressed
+        if record.exc_info:
+            event['exception'] = self.formatException(record.exc_info)
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+
+def setup():
+    """Configure le logger 'pds32' une fois par processus (sans toucher aux loggers de gunicorn/werkzeug)"""
+    logger = logging.getLogger(ROOT_LOGGER)
+    if logger.handlers:
+        return logger
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else TextFormatter())
+    handler.addFilter(RateLimitFilter())
+    logger.addHandler(handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    return logger
+
+
+def get(name):
+    """Logger d'un module: logs.get('ingest') -> 'pds32.ingest'"""
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
@@ -0,0 +1,296 @@
+"""
+PDS-32: Métriques d'exécution - compteurs, jauges et histogrammes au format texte Prometheus
+
+Chaque processus (workers gunicorn, workers d'ingestion) tient son propre
+registre et en écrit un instantané dans un répertoire partagé; /metrics
+additionne les instantanés des processus vivants.
+"""
+
+import bisect
+import json
+import os
+import threading
+
+# Bornes des histogrammes de latence (secondes)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+# Bornes des histogrammes de taille de lot (lignes)
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Registry:
+    """Ensemble des métriques d'un processus"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self):
+        """{nom: {type, help, labels, samples: [[valeurs d'étiquettes, valeur]]}} (sérialisable JSON)"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labels=(), function=None, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # function() -> valeur, ou {valeurs d'étiquettes: valeur}: lue à chaque collecte
+        self.function = function
+        self._children = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def child(self, *values):
+        """Série d'une combinaison d'étiquettes (à garder pour les chemins chauds)"""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def snapshot(self):
+        if self.function is not None:
+            values = self.function()
+            if not isinstance(values, dict):
+                values = {(): values}
+            samples = [[list(key), value] for key, value in values.items()]
+        else:
+            samples = [[list(key), child.value()] for key, child in list(self._children.items())]
+        return {'type': self.type, 'help': self.help, 'labels': list(self.labels), 'samples': samples}
+
+
+class _Value:
+    __slots__ = ('_value', '_lock')
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def set(self, value):
+        self._value = value
+
+    def value(self):
+        return self._value
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.child().inc(amount)
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self.child().set(value)
+
+
+class _Buckets:
+    __slots__ = ('bounds', 'counts', 'sum', '_lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def value(self):
+        with self._lock:
+            return [list(self.counts), self.sum]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labels, registry=registry)
+
+    def _new_child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value):
+        self.child().observe(value)
+
+    def snapshot(self):
+        return dict(super().snapshot(), buckets=list(self.buckets))
+
+
+# ==================== EXPORT MULTI-PROCESSUS ====================
+def merge(snapshots):
+    """Additionne les instantanés de plusieurs processus (compteurs, jauges et histogrammes)"""
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, dict(metric, samples={}))
+            for key, value in metric['samples']:
+                key = tuple(key)
+                current = target['samples'].get(key)
+                if current is None:
+                    target['samples'][key] = value
+                elif metric['type'] == 'histogram':
+                    counts = [a + b for a, b in zip(current[0], value[0])]
+                    target['samples'][key] = [counts, current[1] + value[1]]
+                else:
+                    target['samples'][key] = current + value
+    return merged
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def render(merged):
+    """Format d'exposition texte Prometheus 0.0.4"""
+    lines = []
+    for name in sorted(merged):
+        metric = merged[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for key, value in sorted(metric['samples'].items()):
+            if metric['type'] == 'histogram':
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(metric['buckets'] + [float('inf')], counts):
+                    cumulative += count
+                    le = (('le', _number(bound)),)
+                    lines.append(f"{name}_bucket{_labels(metric['labels'], key, le)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(metric['labels'], key)} {_number(total)}")
+                lines.append(f"{name}_count{_labels(metric['labels'], key)} {cumulative}")
+            else:
+                lines.append(f"{name}{_labels(metric['labels'], key)} {_number(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SnapshotExporter:
+    """Écrit périodiquement l'instantané du registre dans <directory>/<pid>.json"""
+
+    def __init__(self, directory, interval=5.0, registry=REGISTRY):
+        self.directory = directory
+        self.interval = interval
+        self.registry = registry
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f"{os.getpid()}.json")
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='metrics-exporter', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Arrêt du processus: son instantané disparaît avec lui"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(2)
+            self._thread = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def write(self):
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump(self.registry.snapshot(), f, separators=(',', ':'))
+        os.replace(temporary, self.path)
+
+    def _loop(self):
+        while True:
+            try:
+                self.write()
+            except OSError:
+                pass
+            if self._stop.wait(self.interval):
+                return
+
+    def collect(self):
+        """Instantané frais de ce processus + derniers instantanés des autres processus vivants"""
+        snapshots = [self.registry.snapshot()]
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            names = []
+        for name in names:
+            pid, _, extension = name.partition('.')
+            if extension != 'json' or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            path = os.path.join(self.directory, name)
+            if not _alive(int(pid)):
+                # Processus disparu sans arrêt propre (kill -9): instantané abandonné
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return merge(snapshots)
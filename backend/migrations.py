@@ -0,0 +1,364 @@
+"""
+PDS-32: Migrations de schéma versionnées (PRAGMA user_version)
+
+Chaque migration s'exécute une seule fois par base, au démarrage
+(init_database), dans sa propre transaction avec le nouveau numéro de version:
+une base n'est jamais laissée entre deux versions. Les chemins d'ingestion et
+de lecture ne consultent jamais le schéma: les colonnes sont connues ici.
+
+Les reprises de données volumineuses ne bloquent pas le démarrage: la
+migration enregistre un backfill, traité ensuite en tâche de fond par lots
+commités avec leur position (reprise après redémarrage, écrivain d'ingestion
+jamais bloqué plus d'un lot).
+"""
+
+import threading
+import time
+
+from db import connect
+import logs
+import rollups
+
+log = logs.get('migrations')
+
+
+class MigrationError(RuntimeError):
+    """Base dans une version inconnue de ce code, ou schéma différent de COLUMNS"""
+
+
+# ==================== SCHÉMA COURANT ====================
+ENERGY_ROLLUP_COLUMNS = (
+    'bucket', 'device_id', 'samples', 'power_sum', 'power_min', 'power_max', 'power_max_at',
+    'energy_min', 'energy_max', 'cost_min', 'cost_max', 'energy_delta', 'cost',
+)
+SENSOR_ROLLUP_COLUMNS = (
+    'bucket', 'device_id', 'samples', 'temperature_avg', 'temperature_min', 'temperature_max',
+    'humidity_avg', 'humidity_min', 'humidity_max', 'light_level_avg',
+)
+
+# Colonnes de chaque table après toutes les migrations, dans l'ordre physique
+# (les colonnes ajoutées par ALTER TABLE sont en dernier)
+COLUMNS = {
+    'energy_data': ('id', 'timestamp', 'device_id', 'power', 'voltage', 'current', 'energy_total', 'cost'),
+    'sensor_readings': ('id', 'timestamp', 'device_id', 'temperature', 'humidity', 'light_level'),
+    'presence_data': ('id', 'timestamp', 'device_id', 'presence'),
+    'actuator_states': ('id', 'timestamp', 'device_id', 'relay1', 'relay2', 'auto_mode', 'window'),
+    'alerts': ('id', 'timestamp', 'alert_type', 'severity', 'message', 'resolved', 'device_id', 'rule_id'),
+    **{table: ENERGY_ROLLUP_COLUMNS for table in rollups.ROLLUP_TABLES},
+    **{table: SENSOR_ROLLUP_COLUMNS for table in rollups.SENSOR_ROLLUP_TABLES},
+}
+
+BACKFILL_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS schema_backfills (
+        name TEXT PRIMARY KEY,
+        position INTEGER NOT NULL,
+        high_water INTEGER NOT NULL
+    )
+'''
+
+
+# ==================== MIGRATIONS ====================
+# Empreinte du barème avec lequel la colonne cost des agrégats a été calculée
+TARIFF_PRICING_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS tariff_pricing (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        fingerprint TEXT NOT NULL,
+        priced_at TEXT NOT NULL
+    )
+'''
+
+
+def _add_column(conn, table, column, declaration):
+    """Ajoute une colonne si elle manque; True si ajoutée
+
+    Seules les bases antérieures au versionnage (user_version 0) peuvent déjà
+    l'avoir: c'est la seule introspection du schéma, et elle n'a lieu qu'ici.
+    """
+    if column in [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]:
+        return False
+    conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
+    return True
+
+
+def _base_tables(conn):
+    """Tables brutes et alertes, colonnes ajoutées après coup comprises"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS energy_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            device_id TEXT,
+            power REAL,
+            voltage REAL,
+            current REAL,
+            energy_total REAL,
+            cost REAL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sensor_readings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            device_id TEXT,
+            temperature REAL,
+            humidity REAL,
+            light_level INTEGER
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS presence_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            device_id TEXT,
+            presence BOOLEAN
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS actuator_states (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            device_id TEXT,
+            relay1 BOOLEAN,
+            relay2 BOOLEAN,
+            auto_mode BOOLEAN
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            alert_type TEXT,
+            severity TEXT,
+            message TEXT,
+            resolved BOOLEAN DEFAULT 0
+        )
+    ''')
+    _add_column(conn, 'actuator_states', 'window', 'BOOLEAN DEFAULT 0')
+    # Alertes produites par le moteur de règles
+    _add_column(conn, 'alerts', 'device_id', 'TEXT')
+    _add_column(conn, 'alerts', 'rule_id', 'TEXT')
+
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_energy_timestamp ON energy_data(timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sensors_timestamp ON sensor_readings(timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_presence_timestamp ON presence_data(timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_actuators_timestamp ON actuator_states(timestamp)')
+
+
+def _rollup_tables(conn):
+    """Agrégats énergie (1 min / 1 h / 1 jour) et moyennes capteurs (1 min / 1 h)"""
+    outdated = False
+    for table in rollups.ROLLUP_TABLES:
+        conn.execute(rollups.ROLLUP_SCHEMA.format(table=table))
+        # Agrégats créés avant la colonne energy_delta: à recalculer
+        outdated |= _add_column(conn, table, 'energy_delta', 'REAL')
+    for table in rollups.SENSOR_ROLLUP_TABLES:
+        conn.execute(rollups.SENSOR_ROLLUP_SCHEMA.format(table=table))
+    conn.execute(BACKFILL_SCHEMA)
+    if outdated or conn.execute('SELECT 1 FROM energy_rollup_1d LIMIT 1').fetchone() is None:
+        schedule_backfill(conn, 'energy_rollups')
+
+
+def _composite_indexes(conn):
+    """Filtre par appareil puis plage de temps; alertes récentes et alertes ouvertes"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_energy_device_timestamp ON energy_data(device_id, timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sensors_device_timestamp ON sensor_readings(device_id, timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_presence_device_timestamp ON presence_data(device_id, timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_actuators_device_timestamp ON actuator_states(device_id, timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_alerts_timestamp ON alerts(timestamp)')
+    # Index partiel couvrant: reprise des alertes ouvertes du moteur de règles
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_alerts_open ON alerts(rule_id, device_id) WHERE resolved = 0')
+
+
+# (version, description, fonction): ne jamais modifier une migration publiée, en ajouter une
+def _rollup_costs(conn):
+    """Coût tarifé des agrégats énergie; calculé par le service de tarification (absence d'empreinte)"""
+    for table in rollups.ROLLUP_TABLES:
+        _add_column(conn, table, 'cost', 'REAL')
+    conn.execute(TARIFF_PRICING_SCHEMA)
+
+
+MIGRATIONS = (
+    (1, 'raw tables and alerts', _base_tables),
+    (2, 'energy and sensor rollups', _rollup_tables),
+    (3, 'device/time and alert indexes', _composite_indexes),
+    (4, 'tariff costs on energy rollups', _rollup_costs),
+)
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """Applique les migrations manquantes; retourne les versions appliquées"""
+    version = schema_version(conn)
+    if version > SCHEMA_VERSION:
+        raise MigrationError(f"Database schema version {version} is newer than this code ({SCHEMA_VERSION})")
+    applied = []
+    for number, description, migration in MIGRATIONS:
+        if number <= version:
+            continue
+        # BEGIN IMMEDIATE: un seul processus migre, les autres revoient la version ensuite
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if schema_version(conn) >= number:
+                conn.rollback()
+                continue
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {number}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(number)
+        log.info("✓ Migration %d: %s", number, description)
+    check_columns(conn)
+    return applied
+
+
+def check_columns(conn):
+    """Vérifie (une fois, au démarrage) que la base correspond au schéma connu du code"""
+    for table, columns in COLUMNS.items():
+        actual = tuple(row[1] for row in conn.execute(f'PRAGMA table_info({table})'))
+        if actual != columns:
+            raise MigrationError(f"Table {table} has columns {actual}, expected {columns}")
+
+
+# ==================== BACKFILLS EN LIGNE ====================
+def _counter_at(conn, device_id, position):
+    """Dernier compteur energy_total d'un appareil déjà rejoué (ids <= position)"""
+    if not position:
+        return None
+    row = conn.execute(
+        'SELECT energy_total FROM energy_data WHERE device_id IS ? AND id <= ? ORDER BY id DESC LIMIT 1',
+        (device_id, position)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def _prepare_energy_rollups(conn):
+    """Efface les agrégats à recalculer (jamais ceux des jours dont les lignes brutes sont purgées)"""
+    first_raw_day = conn.execute('SELECT DATE(MIN(timestamp)) FROM energy_data').fetchone()[0]
+    if first_raw_day is not None:
+        for table in rollups.ROLLUP_TABLES:
+            conn.execute(f'DELETE FROM {table} WHERE bucket >= ?', (first_raw_day,))
+
+
+def _replay_energy_rollups(conn, position, high_water, limit, state):
+    """Rejoue un lot de energy_data dans les agrégats, dans l'ordre des ids (comme rollups.rebuild)
+
+    Les lignes arrivées après la migration (id > high_water) sont agrégées par
+    l'ingestion: la fusion des agrégats étant commutative, le résultat final
+    est celui d'un recalcul complet.
+    """
+    if 'counters' not in state:
+        state['counters'] = rollups.CounterTracker(lambda c, device_id: _counter_at(c, device_id, position))
+    rows = conn.execute('''
+        SELECT id, timestamp, device_id, power, voltage, current, energy_total, cost
+        FROM energy_data
+        WHERE id > ? AND id <= ?
+        ORDER BY id
+        LIMIT ?
+    ''', (position, high_water, limit)).fetchall()
+    if rows:
+        rollups.apply(conn, [row[1:] for row in rows], state['counters'])
+    return (rows[-1][0] if rows else high_water), len(rows)
+
+
+# Nom -> (table source, préparation dans la migration, traitement d'un lot)
+BACKFILLS = {
+    'energy_rollups': ('energy_data', _prepare_energy_rollups, _replay_energy_rollups),
+}
+
+
+def schedule_backfill(conn, name):
+    """Enregistre un backfill des lignes existantes (à appeler dans une migration)"""
+    table, prepare, _ = BACKFILLS[name]
+    prepare(conn)
+    high_water = conn.execute(f'SELECT MAX(id) FROM {table}').fetchone()[0]
+    if high_water is None:
+        conn.execute('DELETE FROM schema_backfills WHERE name = ?', (name,))
+        return
+    conn.execute(
+        'INSERT OR REPLACE INTO schema_backfills (name, position, high_water) VALUES (?, 0, ?)',
+        (name, high_water)
+    )
+
+
+def backfill_pending(conn, table):
+    """True si un backfill doit encore relire `table` (la rétention ne la purge pas d'ici là)"""
+    names = [name for name, (source, _, _) in BACKFILLS.items() if source == table]
+    if not names:
+        return False
+    return conn.execute(
+        f"SELECT 1 FROM schema_backfills WHERE name IN ({','.join('?' * len(names))}) LIMIT 1", names
+    ).fetchone() is not None
+
+
+class BackfillRunner:
+    """Tâche de fond: traite par lots les backfills enregistrés par les migrations"""
+
+    def __init__(self, databases, chunk_size=5000, pause=0.05):
+        self.databases = list(databases)
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self._thread = None
+        self._stop = threading.Event()
+        self._progress = {}
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='schema-backfill', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5)
+            self._thread = None
+
+    def stats(self):
+        """Backfills en cours ou terminés depuis le démarrage: lignes rejouées, position"""
+        return {key: dict(value) for key, value in self._progress.items()}
+
+    def _loop(self):
+        for database in self.databases:
+            conn = connect(database)
+            try:
+                self.run(conn, database)
+            except Exception as e:
+                log.exception("✗ Schema backfill failed (%s): %s", database, e)
+            finally:
+                conn.close()
+            if self._stop.is_set():
+                return
+
+    def run(self, conn, database):
+        """Traite tous les backfills en attente d'une base, lot par lot"""
+        pending = conn.execute('SELECT name, position, high_water FROM schema_backfills').fetchall()
+        for name, position, high_water in pending:
+            _, _, step = BACKFILLS[name]
+            progress = self._progress[f"{database}:{name}"] = {
+                'position': position, 'high_water': high_water, 'rows': 0, 'done': False
+            }
+            state = {}
+            started = time.perf_counter()
+            while not self._stop.is_set():
+                # Lot et position commités ensemble: reprise exacte après un arrêt
+                with conn:
+                    position, count = step(conn, position, high_water, self.chunk_size, state)
+                    if position >= high_water:
+                        conn.execute('DELETE FROM schema_backfills WHERE name = ?', (name,))
+                    else:
+                        conn.execute('UPDATE schema_backfills SET position = ? WHERE name = ?', (position, name))
+                progress['position'] = position
+                progress['rows'] += count
+                if position >= high_water:
+                    progress['done'] = True
+                    log.info("✓ Schema backfill %s: %d rows in %.1fs", name, progress['rows'],
+                             time.perf_counter() - started)
+                    break
+                time.sleep(self.pause)
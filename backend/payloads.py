@@ -0,0 +1,227 @@
+"""
+PDS-32: Décodage des messages MQTT - JSON (par défaut), struct binaire compact,
+MessagePack et CBOR, directement en enregistrements typés
+"""
+
+import json
+import math
+import struct
+from collections import namedtuple
+
+try:
+    import msgpack
+except ImportError:  # dépendance optionnelle
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # dépendance optionnelle
+    cbor2 = None
+
+
+class PayloadError(ValueError):
+    """Message illisible ou encodage non pris en charge"""
+
+
+class _Record:
+    """Accès par nom façon dict (utilisé par le moteur de règles d'alerte)"""
+
+    __slots__ = ()
+
+    def get(self, name, default=None):
+        value = getattr(self, name, default)
+        return default if value is None else value
+
+
+def _record(name, fields):
+    return type(name, (_Record, namedtuple(name + 'Fields', fields)), {'__slots__': ()})
+
+
+# Enregistrements par type de message (ordre des colonnes des tables brutes)
+RECORDS = {
+    'energy': _record('EnergyRecord', 'device_id power voltage current energy_total'),
+    'sensors': _record('SensorRecord', 'device_id temperature humidity light_level'),
+    'presence': _record('PresenceRecord', 'device_id presence'),
+    'actuators': _record('ActuatorRecord', 'device_id relay1 relay2 window auto_mode'),
+}
+
+# Types dont les champs sont des mesures numériques (les autres sont des états booléens)
+NUMERIC_KINDS = ('energy', 'sensors')
+
+# Valeurs par défaut des champs absents d'un message
+DEFAULTS = {
+    ('actuators', 'window'): False,
+}
+
+# Trames binaires fixes, petit-boutistes; NaN = valeur absente.
+# L'identifiant de l'appareil vient du topic (home/<device_id>/...).
+#   energy:    power, voltage, current, energy_total       4 x float32 (16 octets)
+#   sensors:   temperature, humidity (float32), light (u16)  10 octets
+#   presence:  présence (u8)                                   1 octet
+#   actuators: bits relay1, relay2, window, auto_mode (u8)     1 octet
+STRUCTS = {
+    'energy': struct.Struct('<4f'),
+    'sensors': struct.Struct('<2fH'),
+    'presence': struct.Struct('<B'),
+    'actuators': struct.Struct('<B'),
+}
+
+# Dernier segment de topic -> encodage (home/<device_id>/energy/power/bin)
+TOPIC_SUFFIXES = {
+    'json': 'json',
+    'bin': 'struct',
+    'msgpack': 'msgpack',
+    'cbor': 'cbor',
+}
+
+# Content-Type MQTT 5 (propriété ou user property 'content-type') -> encodage
+CONTENT_TYPES = {
+    'application/json': 'json',
+    'application/octet-stream': 'struct',
+    'application/x-pds32-struct': 'struct',
+    'application/msgpack': 'msgpack',
+    'application/x-msgpack': 'msgpack',
+    'application/cbor': 'cbor',
+}
+
+
+def available_encodings():
+    """Encodages acceptés par ce serveur (annoncés aux appareils)"""
+    encodings = ['json', 'struct']
+    if msgpack is not None:
+        encodings.append('msgpack')
+    if cbor2 is not None:
+        encodings.append('cbor')
+    return encodings
+
+
+def split_encoding(topic):
+    """'home/esp32_001/energy/power/bin' -> ('home/esp32_001/energy/power', 'struct')"""
+    base, _, suffix = topic.rpartition('/')
+    encoding = TOPIC_SUFFIXES.get(suffix)
+    if encoding is None or not base:
+        return topic, None
+    return base, encoding
+
+
+def content_type_encoding(properties):
+    """Encodage annoncé par les propriétés MQTT 5 du message, s'il y en a"""
+    if properties is None:
+        return None
+    content_type = getattr(properties, 'ContentType', None)
+    if not content_type:
+        for key, value in getattr(properties, 'UserProperty', None) or ():
+            if key.lower() == 'content-type':
+                content_type = value
+                break
+    if not content_type:
+        return None
+    encoding = CONTENT_TYPES.get(content_type.split(';')[0].strip().lower())
+    if encoding is None:
+        raise PayloadError(f"Unsupported content type: {content_type}")
+    return encoding
+
+
+def subscriptions(topics, qos=0):
+    """Ajoute à chaque topic le joker de suffixe d'encodage (home/.../energy/power/+)"""
+    return [(topic, qos) for topic, _ in topics] + [(topic + '/+', qos) for topic, _ in topics]
+
+
+def _nan_to_none(value):
+    return None if math.isnan(value) else value
+
+
+def _field(kind, field, value):
+    """Valeur d'un champ d'un message JSON/MessagePack/CBOR: nombre fini (NaN = absente)
+    pour l'énergie et les capteurs, booléen ou entier pour les états"""
+    if value is None:
+        return None
+    if kind in NUMERIC_KINDS:
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise PayloadError(f"{kind}.{field}: expected a number, got {type(value).__name__}")
+        if isinstance(value, float) and math.isnan(value):
+            return None
+        if math.isinf(value):
+            raise PayloadError(f"{kind}.{field}: expected a finite number")
+        return value
+    if not isinstance(value, (bool, int)):
+        raise PayloadError(f"{kind}.{field}: expected a boolean, got {type(value).__name__}")
+    return value
+
+
+def _from_mapping(kind, document, device_id):
+    if not isinstance(document, dict):
+        raise PayloadError(f"Expected an object, got {type(document).__name__}")
+    record = RECORDS[kind]
+    values = []
+    for field in record._fields:
+        if field == 'device_id':
+            values.append(device_id if device_id is not None else document.get('device_id'))
+        else:
+            values.append(_field(kind, field, document.get(field, DEFAULTS.get((kind, field)))))
+    return record._make(values)
+
+
+def _from_struct(kind, data, device_id):
+    if device_id is None:
+        raise PayloadError("Binary payloads need the device id in the topic")
+    layout = STRUCTS[kind]
+    try:
+        fields = layout.unpack(data)
+    except struct.error as e:
+        raise PayloadError(f"Bad {kind} frame ({len(data)} bytes): {e}")
+    record = RECORDS[kind]
+    if kind == 'energy':
+        return record(device_id, *map(_nan_to_none, fields))
+    if kind == 'sensors':
+        temperature, humidity, light = fields
+        return record(device_id, _nan_to_none(temperature), _nan_to_none(humidity), light)
+    if kind == 'presence':
+        return record(device_id, bool(fields[0]))
+    bits = fields[0]
+    return record(device_id, bool(bits & 1), bool(bits & 2), bool(bits & 4), bool(bits & 8))
+
+
+def decode(kind, encoding, data, device_id=None):
+    """Décode un message en enregistrement typé; `device_id` (topic) prime sur le contenu"""
+    if kind not in RECORDS:
+        raise PayloadError(f"Unknown message kind: {kind}")
+    encoding = encoding or 'json'
+    if encoding == 'json':
+        try:
+            # json.loads accepte directement les octets (pas de decode() intermédiaire)
+            document = json.loads(data)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise PayloadError(f"Invalid JSON: {e}")
+        return _from_mapping(kind, document, device_id)
+    if encoding == 'struct':
+        return _from_struct(kind, data, device_id)
+    if encoding == 'msgpack' and msgpack is not None:
+        try:
+            document = msgpack.unpackb(data)
+        except Exception as e:
+            raise PayloadError(f"Invalid MessagePack: {e}")
+        return _from_mapping(kind, document, device_id)
+    if encoding == 'cbor' and cbor2 is not None:
+        try:
+            document = cbor2.loads(data)
+        except Exception as e:
+            raise PayloadError(f"Invalid CBOR: {e}")
+        return _from_mapping(kind, document, device_id)
+    raise PayloadError(f"Unsupported encoding: {encoding}")
+
+
+def encode_struct(kind, record):
+    """Trame binaire d'un enregistrement (simulateurs, tests de charge)"""
+    layout = STRUCTS[kind]
+    values = record[1:]
+    if kind == 'energy':
+        return layout.pack(*(math.nan if v is None else v for v in values))
+    if kind == 'sensors':
+        temperature, humidity, light = values
+        return layout.pack(math.nan if temperature is None else temperature,
+                           math.nan if humidity is None else humidity, int(light or 0))
+    if kind == 'presence':
+        return layout.pack(1 if values[0] else 0)
+    relay1, relay2, window, auto_mode = values
+    return layout.pack((1 if relay1 else 0) | (2 if relay2 else 0) | (4 if window else 0) | (8 if auto_mode else 0))
@@ -0,0 +1,73 @@
+"""
+PDS-32: Profileur par échantillonnage - piles de tous les threads au format « folded »
+
+Sortie compatible flamegraph.pl / speedscope / inferno: une ligne par pile
+distincte, cadres séparés par ';' (racine d'abord, nom du thread en tête),
+suivie du nombre d'échantillons.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+class SamplingProfiler:
+    """Échantillonne sys._current_frames() à intervalle fixe depuis le thread appelant"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._lock.locked()
+
+    def run(self, seconds):
+        """Bloque `seconds` secondes et retourne (Counter des piles, nombre d'échantillons)"""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy('a profile is already running in this process')
+        try:
+            stacks = Counter()
+            samples = 0
+            own = threading.get_ident()
+            end = time.monotonic() + seconds
+            next_sample = time.monotonic()
+            while next_sample < end:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident != own:
+                        stacks[fold(names.get(ident, f"thread-{ident}"), frame)] += 1
+                samples += 1
+                next_sample += self.interval
+                delay = next_sample - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            return stacks, samples
+        finally:
+            self._lock.release()
+
+
+def frame_label(frame):
+    code = frame.f_code
+    module = frame.f_globals.get('__name__') or os.path.basename(code.co_filename)
+    return f"{module}:{code.co_name}"
+
+
+def fold(thread_name, frame):
+    """Pile d'un thread: 'thread;module:fonction;...' (racine d'abord)"""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name.replace(';', ':').replace(' ', '_'))
+    return ';'.join(reversed(labels))
+
+
+def render(stacks):
+    return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
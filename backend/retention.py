@@ -0,0 +1,226 @@
+"""
+PDS-32: Service de rétention - sous-échantillonnage, purge par lots et VACUUM incrémental
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from db import connect
+import logs
+import migrations
+import rollups
+
+log = logs.get('retention')
+
+# Colonne de temps utilisée pour la purge de chaque table
+TIME_COLUMNS = {
+    'energy_data': 'timestamp',
+    'sensor_readings': 'timestamp',
+    'presence_data': 'timestamp',
+    'actuator_states': 'timestamp',
+    'energy_rollup_1m': 'bucket',
+    'energy_rollup_1h': 'bucket',
+    'energy_rollup_1d': 'bucket',
+    'sensor_rollup_1m': 'bucket',
+    'sensor_rollup_1h': 'bucket',
+}
+
+# Tables sans rowid: purge par clé primaire
+WITHOUT_ROWID_KEYS = {
+    'energy_rollup_1m': 'bucket, device_id',
+    'energy_rollup_1h': 'bucket, device_id',
+    'energy_rollup_1d': 'bucket, device_id',
+    'sensor_rollup_1m': 'bucket, device_id',
+    'sensor_rollup_1h': 'bucket, device_id',
+}
+
+
+def default_policy(raw_days=7, minute_days=90):
+    """Politique par défaut: brut N jours, moyennes minute M jours, horaires/journalières sans limite"""
+    return {
+        'energy_data': raw_days,
+        'sensor_readings': raw_days,
+        'presence_data': raw_days,
+        'actuator_states': raw_days,
+        'energy_rollup_1m': minute_days,
+        'sensor_rollup_1m': minute_days,
+        'energy_rollup_1h': None,
+        'energy_rollup_1d': None,
+        'sensor_rollup_1h': None,
+    }
+
+
+class RetentionService:
+    """Tâche de fond qui applique la politique de rétention sans bloquer l'écrivain"""
+
+    def __init__(self, database, policy, interval=3600, chunk_size=5000,
+                 pause=0.05, vacuum_pages=1000, sensor_hold=600, sensor_linear=False):
+        # Une base, ou plusieurs (base principale + shards d'ingestion)
+        self.databases = [database] if isinstance(database, str) else list(database)
+        self.policy = policy
+        self.interval = interval
+        # Reconstruction des lectures compressées (compression.py) pour les moyennes capteurs
+        self.sensor_hold = sensor_hold
+        self.sensor_linear = sensor_linear
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        self._thread = None
+        self._stop = threading.Event()
+        self._run_lock = threading.Lock()
+        self._tasks = []
+        self._last_report = None
+        self._totals = {'runs': 0, 'rows_pruned': 0, 'bytes_reclaimed': 0}
+
+    # ---------- Cycle de vie ----------
+    def start(self):
+        """Démarre la tâche périodique"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='retention', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def add_task(self, name, task):
+        """Tâche supplémentaire de chaque passage (ex: purge des segments colonnes);
+        son résultat est rapporté sous report[name]"""
+        self._tasks.append((name, task))
+
+    def _loop(self):
+        # Laisser le démarrage se terminer avant le premier passage
+        while not self._stop.wait(min(60, self.interval)):
+            try:
+                self.run_once()
+            except Exception as e:
+                log.exception("✗ Retention run failed: %s", e)
+            if self._stop.wait(self.interval):
+                break
+
+    def stats(self):
+        """Dernier rapport et cumul depuis le démarrage"""
+        return {
+            'policy_days': self.policy,
+            'interval_seconds': self.interval,
+            'totals': dict(self._totals),
+            'last_run': self._last_report,
+        }
+
+    # ---------- Passage de rétention ----------
+    def run_once(self):
+        """Sous-échantillonne, purge puis récupère l'espace; retourne le rapport"""
+        with self._run_lock:
+            started = time.perf_counter()
+            now = datetime.now(timezone.utc)
+            report = {'pruned': {}, 'downsampled_hours': 0, 'vacuum_pages': 0}
+            bytes_before = bytes_after = 0
+            for database in self.databases:
+                conn = connect(database)
+                try:
+                    bytes_before += self._database_bytes(conn)
+                    self._run_database(conn, now, report)
+                    report['vacuum_pages'] += self._incremental_vacuum(conn)
+                    bytes_after += self._database_bytes(conn)
+                finally:
+                    conn.close()
+
+            for name, task in self._tasks:
+                report[name] = task()
+
+            report['rows_pruned'] = sum(report['pruned'].values())
+            report['bytes_reclaimed'] = max(0, bytes_before - bytes_after)
+            report['database_bytes'] = bytes_after
+            report['duration_s'] = round(time.perf_counter() - started, 3)
+            report['finished_at'] = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+            self._last_report = report
+            self._totals['runs'] += 1
+            self._totals['rows_pruned'] += report['rows_pruned']
+            self._totals['bytes_reclaimed'] += report['bytes_reclaimed']
+
+            if report['rows_pruned']:
+                log.info("🧹 Retention: %d rows pruned, %d bytes reclaimed",
+                         report['rows_pruned'], report['bytes_reclaimed'])
+            return report
+
+    def _run_database(self, conn, now, report):
+        """Applique la politique à une base; cumule le résultat dans `report`"""
+        for table, days in self.policy.items():
+            if days is None:
+                continue
+            # Lignes brutes encore à relire par un backfill de migration: purge reportée
+            if migrations.backfill_pending(conn, table):
+                continue
+            # Coupure alignée sur le jour: les données brutes restantes
+            # commencent toujours sur un jour complet
+            cutoff = (now - timedelta(days=days)).strftime('%Y-%m-%d')
+            if table == 'sensor_readings':
+                report['downsampled_hours'] += self._downsample_sensors(conn, cutoff)
+            report['pruned'][table] = report['pruned'].get(table, 0) + self._prune(conn, table, cutoff)
+
+    def _downsample_sensors(self, conn, cutoff):
+        """Calcule les moyennes capteurs, heure par heure, des lectures bientôt purgées"""
+        first = conn.execute('SELECT MIN(timestamp) FROM sensor_readings').fetchone()[0]
+        if first is None or first >= cutoff:
+            return 0
+        hour = datetime.strptime(first[:13], '%Y-%m-%d %H')
+        end = datetime.strptime(cutoff, '%Y-%m-%d')
+        hours = 0
+        while hour < end and not self._stop.is_set():
+            next_hour = hour + timedelta(hours=1)
+            rollups.downsample_sensors(
+                conn,
+                hour.strftime('%Y-%m-%d %H:%M:%S'),
+                next_hour.strftime('%Y-%m-%d %H:%M:%S'),
+                self.sensor_hold,
+                self.sensor_linear
+            )
+            hour = next_hour
+            hours += 1
+            time.sleep(self.pause)
+        return hours
+
+    def _prune(self, conn, table, cutoff):
+        """Supprime par petits lots pour ne jamais tenir le verrou d'écriture longtemps"""
+        column = TIME_COLUMNS[table]
+        key = WITHOUT_ROWID_KEYS.get(table, 'rowid')
+        statement = f'''
+            DELETE FROM {table}
+            WHERE ({key}) IN (
+                SELECT {key} FROM {table} WHERE {column} < ? LIMIT ?
+            )
+        '''
+        pruned = 0
+        while not self._stop.is_set():
+            with conn:
+                deleted = conn.execute(statement, (cutoff, self.chunk_size)).rowcount
+            pruned += deleted
+            if deleted < self.chunk_size:
+                break
+            time.sleep(self.pause)
+        return pruned
+
+    def _incremental_vacuum(self, conn):
+        """Rend les pages libres au système par tranches de vacuum_pages"""
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            return 0
+        released = 0
+        while not self._stop.is_set():
+            free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if free == 0:
+                break
+            step = min(free, self.vacuum_pages)
+            # executescript exécute le PRAGMA jusqu'au bout (une page libérée par étape)
+            conn.executescript(f'PRAGMA incremental_vacuum({step})')
+            released += step
+            time.sleep(self.pause)
+        return released
+
+    @staticmethod
+    def _database_bytes(conn):
+        page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        return page_count * page_size
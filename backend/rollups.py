@@ -0,0 +1,337 @@
+"""
+PDS-32: Agrégats pré-calculés - énergie (1 min / 1 h / 1 jour) mise à jour à l'ingestion,
+capteurs (1 min / 1 h) sous-échantillonnés avant purge
+"""
+
+import time
+from datetime import datetime, timedelta, timezone
+
+import compression
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Tables d'agrégats et fonction de calcul du seau à partir d'un horodatage SQLite
+ROLLUP_TABLES = {
+    'energy_rollup_1m': lambda ts: ts[:16] + ':00',      # 'YYYY-MM-DD HH:MM:00'
+    'energy_rollup_1h': lambda ts: ts[:13] + ':00:00',   # 'YYYY-MM-DD HH:00:00'
+    'energy_rollup_1d': lambda ts: ts[:10],              # 'YYYY-MM-DD'
+}
+
+ROLLUP_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        bucket TEXT NOT NULL,
+        device_id TEXT NOT NULL,
+        samples INTEGER NOT NULL,
+        power_sum REAL,
+        power_min REAL,
+        power_max REAL,
+        power_max_at TEXT,
+        energy_min REAL,
+        energy_max REAL,
+        cost_min REAL,
+        cost_max REAL,
+        energy_delta REAL,
+        cost REAL,
+        PRIMARY KEY (bucket, device_id)
+    ) WITHOUT ROWID
+'''
+
+# Fusion d'un agrégat partiel dans le seau existant. Toutes les opérations
+# sont commutatives: une mesure arrivée en retard corrige son seau d'origine.
+UPSERT = '''
+    INSERT INTO {table} (
+        bucket, device_id, samples, power_sum, power_min, power_max, power_max_at,
+        energy_min, energy_max, cost_min, cost_max, energy_delta, cost
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (bucket, device_id) DO UPDATE SET
+        samples = samples + excluded.samples,
+        power_sum = COALESCE(power_sum, 0) + COALESCE(excluded.power_sum, 0),
+        power_min = MIN(COALESCE(power_min, excluded.power_min), COALESCE(excluded.power_min, power_min)),
+        power_max_at = CASE
+            WHEN power_max IS NULL OR excluded.power_max > power_max THEN excluded.power_max_at
+            ELSE power_max_at
+        END,
+        power_max = MAX(COALESCE(power_max, excluded.power_max), COALESCE(excluded.power_max, power_max)),
+        energy_min = MIN(COALESCE(energy_min, excluded.energy_min), COALESCE(excluded.energy_min, energy_min)),
+        energy_max = MAX(COALESCE(energy_max, excluded.energy_max), COALESCE(excluded.energy_max, energy_max)),
+        cost_min = MIN(COALESCE(cost_min, excluded.cost_min), COALESCE(excluded.cost_min, cost_min)),
+        cost_max = MAX(COALESCE(cost_max, excluded.cost_max), COALESCE(excluded.cost_max, cost_max)),
+        energy_delta = COALESCE(energy_delta, 0) + COALESCE(excluded.energy_delta, 0),
+        cost = CASE
+            WHEN cost IS NULL AND excluded.cost IS NULL THEN NULL
+            ELSE COALESCE(cost, 0) + COALESCE(excluded.cost, 0)
+        END
+'''
+
+# Lignes de energy_data rejouées par transaction lors d'une reconstruction
+# (l'écrivain d'ingestion peut commiter entre deux lots)
+REBUILD_CHUNK = 5000
+
+
+def _merge_min(current, value):
+    if value is None:
+        return current
+    return value if current is None or value < current else current
+
+
+def _merge_max(current, value):
+    if value is None:
+        return current
+    return value if current is None or value > current else current
+
+
+def last_counter_value(conn, device_id, before=None):
+    """Dernière valeur energy_total connue d'un appareil (optionnellement avant un horodatage)"""
+    if before is None:
+        row = conn.execute(
+            'SELECT energy_total FROM energy_data WHERE device_id IS ? ORDER BY timestamp DESC, id DESC LIMIT 1',
+            (device_id,)
+        ).fetchone()
+    else:
+        row = conn.execute(
+            'SELECT energy_total FROM energy_data WHERE device_id IS ? AND timestamp < ? ORDER BY timestamp DESC, id DESC LIMIT 1',
+            (device_id, before)
+        ).fetchone()
+    return row[0] if row else None
+
+
+class CounterTracker:
+    """Suit le compteur energy_total de chaque appareil pour en déduire la consommation
+
+    Une baisse du compteur est traitée comme une remise à zéro (redémarrage
+    de l'ESP32): la consommation de l'intervalle vaut la nouvelle valeur.
+
+    Les valeurs vues depuis le dernier commit() restent provisoires: rollback()
+    (transaction annulée) les oublie, la consommation de l'intervalle revient
+    alors au delta suivant au lieu d'être perdue.
+    """
+
+    def __init__(self, seed=last_counter_value):
+        self._last = {}
+        self._pending = {}
+        self._seed = seed
+
+    def delta(self, conn, device_id, value):
+        if value is None:
+            return 0.0
+        if device_id in self._pending:
+            previous = self._pending[device_id]
+        elif device_id in self._last:
+            previous = self._last[device_id]
+        else:
+            previous = self._seed(conn, device_id) if self._seed else None
+        self._pending[device_id] = value
+        if previous is None:
+            return 0.0
+        return value - previous if value >= previous else value
+
+    def commit(self):
+        self._last.update(self._pending)
+        self._pending.clear()
+
+    def rollback(self):
+        self._pending.clear()
+
+
+def aggregate(conn, rows, counters, pricer=None):
+    """Agrège des lignes energy_data en agrégats partiels par (table, seau, appareil)
+
+    Chaque ligne a la forme (timestamp, device_id, power, voltage, current, energy_total, cost).
+    `pricer` (tariffs.Pricer) tarife chaque delta de compteur; sans lui, cost reste NULL.
+    """
+    partials = {table: {} for table in ROLLUP_TABLES}
+    for timestamp, device_id, power, _voltage, _current, energy_total, cost in rows:
+        delta = counters.delta(conn, device_id, energy_total)
+        if device_id is None:
+            device_id = ''
+        priced = pricer.cost(conn, device_id, timestamp, delta) if pricer is not None else None
+        for table, bucket_of in ROLLUP_TABLES.items():
+            key = (bucket_of(timestamp), device_id)
+            p = partials[table].get(key)
+            if p is None:
+                # [samples, power_sum, power_min, power_max, power_max_at,
+                #  energy_min, energy_max, cost_min, cost_max, energy_delta, cost]
+                p = partials[table][key] = [0, None, None, None, None, None, None, None, None, 0.0, None]
+            p[0] += 1
+            if power is not None:
+                p[1] = (p[1] or 0) + power
+                p[2] = _merge_min(p[2], power)
+                if p[3] is None or power > p[3]:
+                    p[3] = power
+                    p[4] = timestamp
+            p[5] = _merge_min(p[5], energy_total)
+            p[6] = _merge_max(p[6], energy_total)
+            p[7] = _merge_min(p[7], cost)
+            p[8] = _merge_max(p[8], cost)
+            p[9] += delta
+            if priced is not None:
+                p[10] = (p[10] or 0.0) + priced
+    return partials
+
+
+def apply(conn, rows, counters, pricer=None):
+    """Fusionne un lot de lignes energy_data dans les trois tables d'agrégats
+
+    À appeler avant l'insertion des lignes brutes du lot, pour que le compteur
+    précédent d'un appareil inconnu puisse être relu dans energy_data.
+    """
+    if not rows:
+        return
+    for table, buckets in aggregate(conn, rows, counters, pricer).items():
+        conn.executemany(
+            UPSERT.format(table=table),
+            [(bucket, device_id, *values) for (bucket, device_id), values in buckets.items()]
+        )
+
+
+def rebuild(conn, start_day=None, end_day=None):
+    """Recalcule les agrégats depuis energy_data (jours entiers, bornes incluses)
+
+    Sert au remplissage initial et à la correction après import ou modification
+    de données brutes. Retourne le nombre de lignes brutes relues.
+
+    Effacement puis rejeu par lots de REBUILD_CHUNK lignes, chacun dans sa
+    transaction: l'ingestion n'attend jamais plus d'un lot. Comme pour le
+    backfill en ligne (migrations.py), seules les lignes présentes à
+    l'effacement (id <= high_water) sont rejouées, les suivantes étant agrégées
+    par l'ingestion. Pendant le rejeu, les agrégats de la période sont partiels.
+    """
+    # Ne jamais effacer les agrégats de jours dont les lignes brutes ont été purgées
+    first_raw_day = conn.execute('SELECT DATE(MIN(timestamp)) FROM energy_data').fetchone()[0]
+    if first_raw_day is None:
+        return 0
+    if start_day is None or start_day < first_raw_day:
+        start_day = first_raw_day
+
+    where, params = [], []
+    if start_day:
+        where.append('timestamp >= ?')
+        params.append(start_day)
+    if end_day:
+        where.append("timestamp < date(?, '+1 day')")
+        params.append(end_day)
+    raw_filter = (' AND ' + ' AND '.join(where)) if where else ''
+
+    with conn:
+        for table in ROLLUP_TABLES:
+            bucket_filter = []
+            if start_day:
+                bucket_filter.append('bucket >= ?')
+            if end_day:
+                bucket_filter.append("bucket < date(?, '+1 day')")
+            conn.execute(
+                f"DELETE FROM {table}" + (' WHERE ' + ' AND '.join(bucket_filter) if bucket_filter else ''),
+                params
+            )
+        high_water = conn.execute('SELECT MAX(id) FROM energy_data').fetchone()[0]
+
+    # Compteurs de départ: dernière valeur avant le début de la période
+    counters = CounterTracker(lambda c, device_id: last_counter_value(c, device_id, start_day))
+    replayed = 0
+    last_id = 0
+    while True:
+        with conn:
+            chunk = conn.execute(f'''
+                SELECT id, timestamp, device_id, power, voltage, current, energy_total, cost
+                FROM energy_data
+                WHERE id > ? AND id <= ?{raw_filter}
+                ORDER BY id
+                LIMIT ?
+            ''', [last_id, high_water] + params + [REBUILD_CHUNK]).fetchall()
+            if not chunk:
+                break
+            last_id = chunk[-1][0]
+            apply(conn, [row[1:] for row in chunk], counters)
+        replayed += len(chunk)
+    return replayed
+
+
+# ==================== CAPTEURS (sous-échantillonnage) ====================
+# Moyennes des capteurs d'environnement, calculées par le service de rétention
+# avant la suppression des lectures brutes.
+SENSOR_ROLLUP_TABLES = {
+    'sensor_rollup_1m': '%Y-%m-%d %H:%M:00',
+    'sensor_rollup_1h': '%Y-%m-%d %H:00:00',
+}
+
+SENSOR_ROLLUP_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        bucket TEXT NOT NULL,
+        device_id TEXT NOT NULL,
+        samples INTEGER NOT NULL,
+        temperature_avg REAL,
+        temperature_min REAL,
+        temperature_max REAL,
+        humidity_avg REAL,
+        humidity_min REAL,
+        humidity_max REAL,
+        light_level_avg REAL,
+        PRIMARY KEY (bucket, device_id)
+    ) WITHOUT ROWID
+'''
+
+# Lignes écrites par changement (compression.py): chaque ligne vaut jusqu'à la
+# suivante, d'où la lecture des lignes précédant (et suivant) la fenêtre
+SENSOR_POINTS = '''
+    SELECT COALESCE(device_id, ''), CAST(strftime('%s', timestamp) AS INTEGER),
+           temperature, humidity, light_level
+    FROM sensor_readings
+    WHERE timestamp >= ? AND timestamp < ?
+    ORDER BY timestamp
+'''
+
+SENSOR_DOWNSAMPLE = '''
+    INSERT OR REPLACE INTO {table} (
+        bucket, device_id, samples,
+        temperature_avg, temperature_min, temperature_max,
+        humidity_avg, humidity_min, humidity_max, light_level_avg
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+SENSOR_BUCKET_SECONDS = {
+    'sensor_rollup_1m': 60,
+    'sensor_rollup_1h': 3600,
+}
+
+
+def _summary(metric):
+    """(moyenne pondérée, min, max) d'une mesure sur un seau"""
+    if metric is None:
+        return None, None, None
+    covered, area, low, high = metric
+    return area / covered, low, high
+
+
+def _sensor_rollup_rows(table, device_id, points, start, end, hold, linear):
+    fmt = SENSOR_ROLLUP_TABLES[table]
+    buckets = compression.bucket_stats(points, start, end, SENSOR_BUCKET_SECONDS[table], hold, linear)
+    for bucket, (samples, stats) in sorted(buckets.items()):
+        temperature, humidity, light = (_summary(metric) for metric in stats)
+        yield (time.strftime(fmt, time.gmtime(bucket)), device_id, samples) + temperature + humidity + light[:1]
+
+
+def downsample_sensors(conn, start, end, hold=600, linear=False):
+    """Calcule les moyennes 1 min / 1 h des lectures brutes de [start, end)
+
+    Moyennes pondérées par la durée de chaque valeur: une lecture vaut jusqu'à
+    la suivante de l'appareil, au plus `hold` secondes (interpolée linéairement
+    si `linear`). Les bornes doivent tomber sur des heures entières pour ne
+    produire que des seaux complets. Idempotent: relancer sur la même fenêtre
+    donne le même résultat.
+    """
+    start_at = datetime.strptime(start, TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+    end_at = datetime.strptime(end, TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+    margin = timedelta(seconds=hold)
+    window = ((start_at - margin).strftime(TIMESTAMP_FORMAT), (end_at + margin).strftime(TIMESTAMP_FORMAT))
+    first, last = int(start_at.timestamp()), int(end_at.timestamp())
+    points = {}
+    for device_id, at, *values in conn.execute(SENSOR_POINTS, window):
+        points.setdefault(device_id, []).append((at, tuple(values)))
+    with conn:
+        for table in SENSOR_ROLLUP_TABLES:
+            conn.executemany(SENSOR_DOWNSAMPLE.format(table=table), [
+                row
+                for device_id, device_points in points.items()
+                for row in _sensor_rollup_rows(table, device_id, device_points, first, last, hold, linear)
+            ])
@@ -0,0 +1,127 @@
+"""
+PDS-32: Mode production - verrou de leader (MQTT et ingestion démarrés une seule
+fois par déploiement) et suivi des nouvelles lignes pour les autres workers HTTP
+"""
+
+import fcntl
+import os
+import threading
+from contextlib import contextmanager
+
+from db import connect
+import logs
+
+log = logs.get('serving')
+
+
+class LeaderLock:
+    """Verrou fichier non bloquant: un seul processus du déploiement le détient
+    (libéré par le système si le processus meurt)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    @property
+    def held(self):
+        return self._file is not None
+
+    def acquire(self):
+        """Tente de prendre le verrou; True si ce processus est (ou devient) leader"""
+        if self._file is not None:
+            return True
+        handle = open(self.path, 'a+')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        handle.seek(0)
+        handle.truncate()
+        handle.write(str(os.getpid()))
+        handle.flush()
+        self._file = handle
+        return True
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+class ChangeFeed:
+    """Suit les nouvelles lignes (id > dernier vu) de chaque table, dans chaque base
+
+    Utilisé par les workers HTTP qui ne sont pas leader pour tenir à jour leur
+    dernier état et leurs flux SSE sans client MQTT. Les ids sont suivis par
+    base: les shards d'ingestion ont chacun leur propre plage d'ids.
+    """
+
+    def __init__(self, databases, queries, on_rows, interval=1.0, batch_size=5000):
+        self.databases = list(databases)
+        # nom -> (table, colonnes); la première colonne doit être l'id
+        self.queries = queries
+        self.on_rows = on_rows
+        self.interval = interval
+        self.batch_size = batch_size
+        self._last_ids = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='change-feed', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5)
+            self._thread = None
+
+    def _loop(self):
+        conns = {database: connect(database) for database in self.databases}
+        try:
+            # Seules les lignes arrivées après le démarrage sont suivies
+            for database, conn in conns.items():
+                for name, (table, _) in self.queries.items():
+                    self._last_ids[(database, name)] = conn.execute(f'SELECT MAX(id) FROM {table}').fetchone()[0] or 0
+            while not self._stop.wait(self.interval):
+                try:
+                    for database, conn in conns.items():
+                        self.poll(database, conn)
+                except Exception as e:
+                    log.exception("✗ Change feed error: %s", e)
+        finally:
+            for conn in conns.values():
+                conn.close()
+
+    def poll(self, database, conn):
+        """Lit et transmet les lignes ajoutées depuis le dernier passage"""
+        for name, (table, columns) in self.queries.items():
+            key = (database, name)
+            while True:
+                rows = conn.execute(
+                    f'SELECT {columns} FROM {table} WHERE id > ? ORDER BY id LIMIT ?',
+                    (self._last_ids[key], self.batch_size)
+                ).fetchall()
+                if not rows:
+                    break
+                self._last_ids[key] = rows[-1][0]
+                self.on_rows(name, rows)
+                if len(rows) < self.batch_size:
+                    break
+
+
+@contextmanager
+def exclusive(path):
+    """Verrou fichier bloquant (ex: initialisation de la base par un seul worker à la fois)"""
+    with open(path, 'a') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
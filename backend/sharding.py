@@ -0,0 +1,262 @@
+"""
+PDS-32: Ingestion multi-processus - répartition des appareils par hachage consistant,
+une base par shard, et vues UNION ALL pour que l'API interroge tous les shards
+"""
+
+import bisect
+import hashlib
+import os
+import queue
+import threading
+import time
+
+import logs
+import migrations
+
+log = logs.get('sharding')
+
+# Tables écrites par les workers (les alertes restent dans la base principale)
+SHARDED_TABLES = (
+    'energy_data', 'sensor_readings', 'presence_data', 'actuator_states',
+    'energy_rollup_1m', 'energy_rollup_1h', 'energy_rollup_1d',
+    'sensor_rollup_1m', 'sensor_rollup_1h',
+)
+
+# Tables à identifiant AUTOINCREMENT: chaque shard a sa propre plage d'ids,
+# pour que (timestamp, id) reste une clé unique à travers les shards
+ID_TABLES = ('energy_data', 'sensor_readings', 'presence_data', 'actuator_states')
+ID_SPAN = 10 ** 12
+
+# Période d'envoi des mises à jour d'un worker vers le processus API (secondes)
+FORWARD_INTERVAL = 0.1
+STATS_INTERVAL = 1.0
+
+# Limite SQLite par défaut: 10 bases attachées par connexion
+MAX_SHARDS = 10
+
+
+def shard_path(database, index):
+    """energy_data.db -> energy_data.shard0.db"""
+    root, ext = os.path.splitext(database)
+    return f"{root}.shard{index}{ext}"
+
+
+def _hash(text):
+    # crc32 répartit mal des identifiants voisins (esp_1, esp_2...): blake2b 64 bits
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Anneau de hachage consistant (nœuds virtuels): ajouter un worker
+    ne déplace qu'environ 1/N des appareils"""
+
+    def __init__(self, nodes, vnodes=128):
+        self._ring = sorted(
+            (_hash(f"{node}#{v}"), node)
+            for node in range(nodes) for v in range(vnodes)
+        )
+        self._keys = [h for h, _ in self._ring]
+        self._cache = {}
+
+    def owner(self, key):
+        """Indice du worker propriétaire d'un identifiant d'appareil"""
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        i = bisect.bisect(self._keys, _hash(str(key))) % len(self._keys)
+        node = self._cache[key] = self._ring[i][1]
+        return node
+
+
+def seed_id_range(conn, index):
+    """Place les ids AUTOINCREMENT d'un shard dans sa propre plage"""
+    base = (index + 1) * ID_SPAN
+    for table in ID_TABLES:
+        row = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+        if row is None:
+            conn.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table, base))
+        elif row[0] < base:
+            conn.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ?', (base, table))
+    conn.commit()
+
+
+def attach_shards(conn, paths):
+    """Attache les shards et masque chaque table par une vue TEMP UNION ALL
+
+    Les vues TEMP sont résolues avant les tables de main: les requêtes
+    existantes de l'API lisent ainsi tous les shards sans modification.
+    """
+    for index, path in enumerate(paths):
+        conn.execute('ATTACH DATABASE ? AS ?', (path, f"shard{index}"))
+    for table in SHARDED_TABLES:
+        columns = ', '.join(migrations.COLUMNS[table])
+        arms = [f'SELECT {columns} FROM main.{table}']
+        arms += [f'SELECT {columns} FROM shard{index}.{table}' for index in range(len(paths))]
+        conn.execute(f'CREATE TEMP VIEW IF NOT EXISTS {table} AS ' + ' UNION ALL '.join(arms))
+
+
+class ShardForwarder:
+    """Côté worker: remplace le broker d'événements et le registre d'appareils,
+    fusionne les mises à jour et les envoie au processus API par lots"""
+
+    def __init__(self, events, index, stats=None):
+        self.events = events
+        self.index = index
+        # Fonction retournant les statistiques du worker, envoyées chaque seconde
+        self.stats = stats
+        self.legacy_device = None
+        self._keyed = {}
+        self._unkeyed = []
+        self._touches = {}
+        self._committed = set()
+        self._stats = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='shard-forwarder', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(2)
+        self.flush()
+
+    # Interface EventBroker
+    def publish(self, event_type, data, key=None):
+        with self._lock:
+            if key is None:
+                self._unkeyed.append((event_type, data))
+            else:
+                self._keyed[key] = (event_type, data)
+
+    # Hook de commit de l'IngestPipeline
+    def committed(self, rows_by_table):
+        with self._lock:
+            self._committed.update(rows_by_table)
+
+    # Interface DeviceRegistry
+    def touch(self, device_id, kind, legacy=False, now=None):
+        if device_id is None:
+            return
+        with self._lock:
+            entry = self._touches.get((device_id, kind))
+            if entry is None:
+                entry = self._touches[(device_id, kind)] = [0, legacy, None]
+            entry[0] += 1
+            entry[2] = time.time() if now is None else now
+
+    def flush(self):
+        with self._lock:
+            batch = [('event', event_type, data, None) for event_type, data in self._unkeyed]
+            batch += [('event', event_type, data, key) for key, (event_type, data) in self._keyed.items()]
+            batch += [('touch', device_id, kind, count, legacy, at)
+                      for (device_id, kind), (count, legacy, at) in self._touches.items()]
+            if self._committed:
+                batch.append(('commit', tuple(self._committed)))
+            if self._stats is not None:
+                batch.append(('stats', self.index, self._stats))
+            self._keyed, self._unkeyed, self._touches, self._stats = {}, [], {}, None
+            self._committed = set()
+        if batch:
+            self.events.put(batch)
+
+    def _loop(self):
+        next_stats = time.monotonic()
+        while not self._stop.wait(FORWARD_INTERVAL):
+            try:
+                if self.stats is not None and time.monotonic() >= next_stats:
+                    next_stats = time.monotonic() + STATS_INTERVAL
+                    stats = self.stats()
+                    with self._lock:
+                        self._stats = stats
+                self.flush()
+            except Exception as e:
+                log.exception("✗ Shard %d forwarder error: %s", self.index, e)
+
+
+class ShardSupervisor:
+    """Côté API: lance les workers, relance ceux qui meurent et applique leurs mises à jour"""
+
+    def __init__(self, context, target, count, on_batch):
+        self.context = context
+        self.target = target
+        self.count = count
+        self.on_batch = on_batch
+        self.events = context.Queue()
+        self.processes = [None] * count
+        self.restarts = 0
+        self.worker_stats = {}
+        self._stopping = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        for index in range(self.count):
+            self._spawn(index)
+        self._thread = threading.Thread(target=self._loop, name='shard-supervisor', daemon=True)
+        self._thread.start()
+
+    def _spawn(self, index):
+        process = self.context.Process(
+            target=self.target, args=(index, self.count, self.events),
+            name=f"ingest-worker-{index}", daemon=True
+        )
+        process.start()
+        self.processes[index] = process
+
+    def stop(self, timeout=15):
+        """Demande l'arrêt (SIGTERM: chaque worker vide sa file) puis attend"""
+        # La lecture continue pendant l'arrêt: un worker ne se termine
+        # qu'une fois ses derniers lots transmis
+        self._stopping = True
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            if process is not None:
+                process.join(timeout)
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(2)
+        self._drain()
+
+    def _drain(self):
+        while True:
+            try:
+                self.on_batch(self.events.get_nowait())
+            except queue.Empty:
+                return
+
+    def _loop(self):
+        next_check = time.monotonic() + 1
+        while not self._stop.is_set():
+            try:
+                batch = self.events.get(timeout=0.5)
+            except queue.Empty:
+                batch = None
+            except (EOFError, OSError):
+                break
+            if batch:
+                try:
+                    self.on_batch(batch)
+                except Exception as e:
+                    log.exception("✗ Shard batch error: %s", e)
+            if time.monotonic() >= next_check:
+                next_check = time.monotonic() + 1
+                for index, process in enumerate(self.processes):
+                    if not self._stopping and not process.is_alive():
+                        log.error("✗ Ingest worker %d exited (%s), restarting", index, process.exitcode)
+                        self.restarts += 1
+                        self._spawn(index)
+
+    def stats(self):
+        return {
+            'workers': self.count,
+            'alive': sum(1 for p in self.processes if p is not None and p.is_alive()),
+            'restarts': self.restarts,
+            'per_worker': [self.worker_stats.get(index) for index in range(self.count)],
+        }
@@ -0,0 +1,128 @@
+"""
+PDS-32: Dernier état connu par appareil (cache mémoire des routes /current)
+"""
+
+import threading
+
+# Requêtes de réhydratation: dernière ligne de chaque appareil
+REHYDRATE_QUERIES = {
+    'energy': '''
+        SELECT device_id, power, voltage, current, energy_total, timestamp
+        FROM energy_data
+        WHERE id IN (SELECT MAX(id) FROM energy_data GROUP BY device_id)
+        ORDER BY id
+    ''',
+    'sensors': '''
+        SELECT device_id, temperature, humidity, light_level, timestamp
+        FROM sensor_readings
+        WHERE id IN (SELECT MAX(id) FROM sensor_readings GROUP BY device_id)
+        ORDER BY id
+    ''',
+    'presence': '''
+        SELECT device_id, presence, timestamp
+        FROM presence_data
+        WHERE id IN (SELECT MAX(id) FROM presence_data GROUP BY device_id)
+        ORDER BY id
+    ''',
+    'actuators': '''
+        SELECT device_id, relay1, relay2, window, auto_mode, timestamp
+        FROM actuator_states
+        WHERE id IN (SELECT MAX(id) FROM actuator_states GROUP BY device_id)
+        ORDER BY id
+    ''',
+}
+
+# Suivi des nouvelles lignes (workers HTTP non-leader): table et colonnes id, device_id, ..., timestamp
+FEED_QUERIES = {
+    'energy': ('energy_data', 'id, device_id, power, voltage, current, energy_total, timestamp'),
+    'sensors': ('sensor_readings', 'id, device_id, temperature, humidity, light_level, timestamp'),
+    'presence': ('presence_data', 'id, device_id, presence, timestamp'),
+    'actuators': ('actuator_states', 'id, device_id, relay1, relay2, window, auto_mode, timestamp'),
+}
+
+
+def energy_snapshot(power, voltage, current, energy_total, timestamp):
+    """Instantané énergie (même forme que /api/energy/current); le coût est celui des agrégats"""
+    return {
+        'power': power,
+        'voltage': voltage,
+        'current': current,
+        'energy_total': energy_total,
+        'timestamp': timestamp
+    }
+
+
+def sensors_snapshot(temperature, humidity, light_level, timestamp):
+    """Instantané capteurs (même forme que /api/sensors/current)"""
+    return {
+        'temperature': temperature,
+        'humidity': humidity,
+        'light_level': light_level,
+        'timestamp': timestamp
+    }
+
+
+def presence_snapshot(presence, timestamp):
+    """Instantané présence (même forme que /api/presence/current)"""
+    return {
+        'presence': bool(presence),
+        'timestamp': timestamp
+    }
+
+
+def actuators_snapshot(relay1, relay2, window, auto_mode, timestamp):
+    """Instantané actionneurs (même forme que /api/actuators/status)"""
+    return {
+        'relay1': bool(relay1),
+        'relay2': bool(relay2),
+        'window': bool(window),
+        'auto_mode': bool(auto_mode),
+        'timestamp': timestamp
+    }
+
+
+SNAPSHOT_BUILDERS = {
+    'energy': energy_snapshot,
+    'sensors': sensors_snapshot,
+    'presence': presence_snapshot,
+    'actuators': actuators_snapshot,
+}
+
+
+class LatestState:
+    """Dernier instantané par (type, appareil), lu en O(1) par les routes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshots = {kind: {} for kind in SNAPSHOT_BUILDERS}
+        self._last_device = {}
+
+    def update(self, kind, device_id, snapshot):
+        """Remplace l'instantané d'un appareil (appelé par le chemin d'ingestion)"""
+        with self._lock:
+            self._snapshots[kind][device_id] = snapshot
+            self._last_device[kind] = device_id
+
+    def get(self, kind, device_id=None):
+        """Instantané d'un appareil, ou du dernier appareil ayant publié"""
+        with self._lock:
+            if device_id is None:
+                if kind not in self._last_device:
+                    return None
+                device_id = self._last_device[kind]
+            return self._snapshots[kind].get(device_id)
+
+    def devices(self, kind):
+        """Appareils connus pour un type de mesure"""
+        with self._lock:
+            return list(self._snapshots[kind])
+
+    def rehydrate(self, conn):
+        """Recharge le dernier état de chaque appareil depuis la base (démarrage à froid)"""
+        loaded = 0
+        for kind, query in REHYDRATE_QUERIES.items():
+            build = SNAPSHOT_BUILDERS[kind]
+            for row in conn.execute(query):
+                self.update(kind, row[0], build(*row[1:]))
+                loaded += 1
+        return loaded
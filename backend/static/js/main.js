@@ -1,6 +1,11 @@
 // ==================== CONFIGURATION ====================
 const API_BASE = window.location.origin + "/api";
+const POLL_INTERVAL = 5000; // Polling de secours (ms)
+const AGGREGATE_REFRESH_INTERVAL = 30000; // Panneaux agrégés quand le flux est actif (ms)
 let powerChart, environmentChart;
+let eventSource = null;
+let pollTimer = null;
+let aggregateTimer = null;
 
 // ==================== INITIALIZATION ====================
 document.addEventListener("DOMContentLoaded", function () {
@@ -8,8 +13,12 @@ document.addEventListener("DOMContentLoaded", function () {
   initCharts();
   fetchAllData();
 
-  // Auto-refresh every 5 seconds
-  setInterval(fetchAllData, 5000);
+  // Flux temps réel, avec repli sur le polling toutes les 5 secondes
+  if (window.EventSource) {
+    startStream();
+  } else {
+    startPolling();
+  }
 });
 
 // ==================== INITIALIZE CHARTS ====================
@@ -125,138 +134,207 @@ function initCharts() {
 }
 
 // ==================== FETCH ALL DATA ====================
-async function fetchAllData() {
-  try {
-    await Promise.all([
-      fetchCurrentEnergy(),
-      fetchCurrentSensors(),
-      fetchCurrentPresence(),
-      fetchActuatorsStatus(),
-      fetchAnalytics(),
-      fetchEnergyHistory(),
-      fetchAlerts(),
-      fetchDeviceHistory(),
-      updateLiveStatus(),
-    ]);
+// Sections de /api/dashboard -> fonction d'affichage
+const DASHBOARD_RENDERERS = {
+  energy: renderCurrentEnergy,
+  sensors: renderCurrentSensors,
+  presence: renderCurrentPresence,
+  actuators: renderActuatorsStatus,
+  analytics: renderAnalytics,
+  energy_history: renderEnergyHistory,
+  alerts: renderAlerts,
+  history: renderDeviceHistory,
+  status: renderLiveStatus,
+};
+const AGGREGATE_SECTIONS = ["analytics", "energy_history", "history"];
+
+// Dernier jeton "generation" par jeu de sections: le serveur ne renvoie que ce qui a changé
+let dashboardGenerations = {};
+
+async function fetchDashboard(fields) {
+  const key = fields ? fields.join(",") : "";
+  const params = new URLSearchParams();
+  if (fields) params.set("fields", key);
+  if (dashboardGenerations[key]) params.set("since", dashboardGenerations[key]);
+
+  const response = await fetch(`${API_BASE}/dashboard?${params}`);
+  if (!response.ok) return;
+
+  const snapshot = await response.json();
+  dashboardGenerations[key] = snapshot.generation;
+  for (const [section, render] of Object.entries(DASHBOARD_RENDERERS)) {
+    // Section absente: inchangée; null: pas encore de données
+    if (snapshot[section]) render(snapshot[section]);
+  }
+}
 
+async function fetchAllData(resync = false) {
+  try {
+    if (resync) dashboardGenerations = {};
+    await fetchDashboard();
     updateLastUpdateTime();
   } catch (error) {
     console.error("❌ Error fetching data:", error);
   }
 }
 
-// ==================== API CALLS ====================
-// ... après fetchAlerts() ...
+// ==================== REAL-TIME STREAM ====================
+function startStream() {
+  eventSource = new EventSource(`${API_BASE}/stream`);
 
-async function updateLiveStatus() {
-  try {
-    // Utilise directement API_BASE + le chemin
-    const response = await fetch(`${API_BASE}/status/live`);
-    const data = await response.json();
-    console.log("Statut reçu du serveur:", data);
-
-    const container = document.getElementById("deviceStatusContainer");
-    const dot = document.getElementById("statusDot");
-    const text = document.getElementById("statusText");
-    const lastSeenEl = document.getElementById("lastSeenDisplay");
-
-    // DEBUG : Ajoute ce log pour voir ce que le JS reçoit vraiment
-
-    if (lastSeenEl) {
-      lastSeenEl.innerText = `Dernière activité : ${data.last_seen}`;
+  eventSource.onopen = () => {
+    console.log("✓ Stream connected");
+    stopPolling();
+    if (!aggregateTimer) {
+      aggregateTimer = setInterval(fetchAggregates, AGGREGATE_REFRESH_INTERVAL);
     }
+  };
+
+  eventSource.onerror = () => {
+    // EventSource se reconnecte seul; en attendant on repasse en polling
+    console.warn("⚠ Stream interrupted, falling back to polling");
+    clearInterval(aggregateTimer);
+    aggregateTimer = null;
+    startPolling();
+  };
+
+  eventSource.addEventListener("energy", (e) => {
+    const data = JSON.parse(e.data);
+    renderCurrentEnergy(data);
+    appendPowerPoint(data);
+    updateLastUpdateTime();
+  });
+  eventSource.addEventListener("sensors", (e) => {
+    renderCurrentSensors(JSON.parse(e.data));
+    updateLastUpdateTime();
+  });
+  eventSource.addEventListener("presence", (e) => {
+    renderCurrentPresence(JSON.parse(e.data));
+  });
+  eventSource.addEventListener("actuators", (e) => {
+    renderActuatorsStatus(JSON.parse(e.data));
+  });
+  eventSource.addEventListener("status", (e) => {
+    renderLiveStatus(JSON.parse(e.data));
+  });
+  eventSource.addEventListener("alert", () => fetchAlerts());
+  eventSource.addEventListener("alert_resolved", () => fetchAlerts());
 
-    if (data.status === "online") {
-      container.style.backgroundColor = "#10b981"; // Vert
-      text.innerText = "LIVE";
-      dot.classList.add("pulse-dot");
-    } else {
-      container.style.backgroundColor = "#ef4444"; // Rouge
-      text.innerText = "DOWN";
-      dot.classList.remove("pulse-dot");
-    }
-    text.style.color = "#ffffff";
-    dot.style.backgroundColor = "#ffffff";
-  } catch (err) {
-    console.error("Erreur Fetch Statut:", err);
+  // Le serveur a dû jeter des événements (client trop lent): tout recharger
+  eventSource.addEventListener("resync", () => fetchAllData(true));
+}
+
+function startPolling() {
+  if (!pollTimer) {
+    pollTimer = setInterval(fetchAllData, POLL_INTERVAL);
   }
 }
-async function fetchCurrentEnergy() {
-  try {
-    const response = await fetch(`${API_BASE}/energy/current`);
-    if (!response.ok) return;
 
-    const data = await response.json();
-
-    document.getElementById("currentPower").innerHTML = `${data.power.toFixed(
-      2
-    )}<span class="metric-unit">W</span>`;
-    document.getElementById(
-      "currentCurrent"
-    ).innerHTML = `${data.current.toFixed(
-      2
-    )}<span class="metric-unit">A</span>`;
-    document.getElementById(
-      "totalEnergy"
-    ).innerHTML = `${data.energy_total.toFixed(
-      3
-    )}<span class="metric-unit">kWh</span>`;
-    document.getElementById("currentCost").innerHTML = `${data.cost.toFixed(
-      3
-    )}<span class="metric-unit">TND</span>`;
-
-    highlightElement("currentPower");
+function stopPolling() {
+  clearInterval(pollTimer);
+  pollTimer = null;
+}
+
+// Panneaux calculés côté serveur, rafraîchis moins souvent quand le flux est actif
+async function fetchAggregates() {
+  try {
+    await fetchDashboard(AGGREGATE_SECTIONS);
   } catch (error) {
-    console.error("Error fetching energy:", error);
+    console.error("❌ Error fetching aggregates:", error);
   }
 }
 
-async function fetchCurrentSensors() {
-  try {
-    const response = await fetch(`${API_BASE}/sensors/current`);
-    if (!response.ok) return;
+function appendPowerPoint(data) {
+  const date = new Date(data.timestamp);
+  powerChart.data.labels.push(
+    date.toLocaleTimeString("fr-FR", { hour: "2-digit", minute: "2-digit" })
+  );
+  powerChart.data.datasets[0].data.push(data.power);
+  powerChart.update("none");
+}
 
-    const data = await response.json();
-
-    document.getElementById(
-      "temperature"
-    ).innerHTML = `${data.temperature.toFixed(
-      1
-    )}<span class="metric-unit">°C</span>`;
-    document.getElementById("humidity").innerHTML = `${data.humidity.toFixed(
-      1
-    )}<span class="metric-unit">%</span>`;
-    document.getElementById(
-      "lightLevel"
-    ).innerHTML = `${data.light_level.toFixed(
-      2
-    )}<span class="metric-unit">%</span>`;
-  } catch (error) {
-    console.error("Error fetching sensors:", error);
+// ==================== API CALLS ====================
+// Routes agrégées mises en cache côté serveur (ETag): le navigateur revalide
+// avec If-None-Match et un panneau inchangé ne coûte qu'un 304 sans corps
+function fetchConditional(path) {
+  return fetch(`${API_BASE}${path}`, { cache: "no-cache" });
+}
+
+function renderLiveStatus(data) {
+  const container = document.getElementById("deviceStatusContainer");
+  const dot = document.getElementById("statusDot");
+  const text = document.getElementById("statusText");
+  const lastSeenEl = document.getElementById("lastSeenDisplay");
+
+  // DEBUG : Ajoute ce log pour voir ce que le JS reçoit vraiment
+
+  if (lastSeenEl) {
+    // Horodatage UTC du serveur, affiché à l'heure locale du navigateur
+    const lastSeen = data.last_seen && data.last_seen !== "Jamais"
+      ? new Date(data.last_seen.replace(" ", "T") + "Z").toLocaleTimeString("fr-FR")
+      : "Jamais";
+    lastSeenEl.innerText = `Dernière activité : ${lastSeen}`;
+  }
+
+  if (data.status === "online") {
+    container.style.backgroundColor = "#10b981"; // Vert
+    text.innerText = "LIVE";
+    dot.classList.add("pulse-dot");
+  } else {
+    container.style.backgroundColor = "#ef4444"; // Rouge
+    text.innerText = "DOWN";
+    dot.classList.remove("pulse-dot");
   }
+  text.style.color = "#ffffff";
+  dot.style.backgroundColor = "#ffffff";
 }
 
-async function fetchCurrentPresence() {
-  try {
-    const response = await fetch(`${API_BASE}/presence/current`);
-    if (!response.ok) return;
+function renderCurrentEnergy(data) {
+  document.getElementById("currentPower").innerHTML = `${data.power.toFixed(
+    2
+  )}<span class="metric-unit">W</span>`;
+  document.getElementById(
+    "currentCurrent"
+  ).innerHTML = `${data.current.toFixed(
+    2
+  )}<span class="metric-unit">A</span>`;
+  document.getElementById(
+    "totalEnergy"
+  ).innerHTML = `${data.energy_total.toFixed(
+    3
+  )}<span class="metric-unit">kWh</span>`;
+
+  highlightElement("currentPower");
+}
 
-    const data = await response.json();
+function renderCurrentSensors(data) {
+  document.getElementById(
+    "temperature"
+  ).innerHTML = `${data.temperature.toFixed(
+    1
+  )}<span class="metric-unit">°C</span>`;
+  document.getElementById("humidity").innerHTML = `${data.humidity.toFixed(
+    1
+  )}<span class="metric-unit">%</span>`;
+  document.getElementById(
+    "lightLevel"
+  ).innerHTML = `${data.light_level.toFixed(
+    2
+  )}<span class="metric-unit">%</span>`;
+}
 
-    const indicator = document.getElementById("presenceIndicator");
-    const text = document.getElementById("presenceText");
+function renderCurrentPresence(data) {
+  const indicator = document.getElementById("presenceIndicator");
+  const text = document.getElementById("presenceText");
 
-    if (data.presence) {
-      indicator.className = "status-indicator status-on";
-      text.textContent = "Détectée";
-      text.style.color = "#10b981";
-    } else {
-      indicator.className = "status-indicator status-off";
-      text.textContent = "Absente";
-      text.style.color = "#ef4444";
-    }
-  } catch (error) {
-    console.error("Error fetching presence:", error);
+  if (data.presence) {
+    indicator.className = "status-indicator status-on";
+    text.textContent = "Détectée";
+    text.style.color = "#10b981";
+  } else {
+    indicator.className = "status-indicator status-off";
+    text.textContent = "Absente";
+    text.style.color = "#ef4444";
   }
 }
 
@@ -265,25 +343,27 @@ async function fetchActuatorsStatus() {
     const response = await fetch(`${API_BASE}/actuators/status`);
     if (!response.ok) return;
 
-    const data = await response.json();
-
-    updateRelayStatus("relay1", data.relay1);
-    updateRelayStatus("relay2", data.relay2);
-    updateRelayStatus("window", data.window || false);
-
-    const autoStatus = document.getElementById("autoModeStatus");
-    if (data.auto_mode) {
-      autoStatus.innerHTML =
-        '<span style="color: #10b981; font-weight: bold;">✓ ACTIF</span>';
-    } else {
-      autoStatus.innerHTML =
-        '<span style="color: #ef4444; font-weight: bold;">✗ INACTIF</span>';
-    }
+    renderActuatorsStatus(await response.json());
   } catch (error) {
     console.error("Error fetching actuators:", error);
   }
 }
 
+function renderActuatorsStatus(data) {
+  updateRelayStatus("relay1", data.relay1);
+  updateRelayStatus("relay2", data.relay2);
+  updateRelayStatus("window", data.window || false);
+
+  const autoStatus = document.getElementById("autoModeStatus");
+  if (data.auto_mode) {
+    autoStatus.innerHTML =
+      '<span style="color: #10b981; font-weight: bold;">✓ ACTIF</span>';
+  } else {
+    autoStatus.innerHTML =
+      '<span style="color: #ef4444; font-weight: bold;">✗ INACTIF</span>';
+  }
+}
+
 function updateRelayStatus(relayId, state) {
   const indicator = document.getElementById(`${relayId}Indicator`);
   const status = document.getElementById(`${relayId}Status`);
@@ -299,135 +379,109 @@ function updateRelayStatus(relayId, state) {
   }
 }
 
-async function fetchAnalytics() {
-  try {
-    const response = await fetch(`${API_BASE}/analytics/consumption`);
-    if (!response.ok) return;
-
-    const data = await response.json();
-
-    document.getElementById(
-      "todayEnergy"
-    ).innerHTML = `${data.today.energy.toFixed(
-      3
-    )}<span class="metric-unit">kWh</span>`;
-    document.getElementById("todayCost").innerHTML = `${data.today.cost.toFixed(
-      3
-    )}<span class="metric-unit">TND</span>`;
-    document.getElementById(
-      "monthlyEstimate"
-    ).innerHTML = `${data.monthly_estimate.toFixed(
-      2
-    )}<span class="metric-unit">TND</span>`;
-    document.getElementById(
-      "potentialSavings"
-    ).innerHTML = `${data.potential_savings.toFixed(
-      3
-    )}<span class="metric-unit">TND</span>`;
-
-    document.getElementById(
-      "avgPower"
-    ).innerHTML = `${data.average_power.toFixed(
-      2
-    )}<span class="metric-unit">W</span>`;
-    document.getElementById("peakPower").innerHTML = `${data.peak.power.toFixed(
-      2
-    )}<span class="metric-unit">W</span>`;
-
-    if (data.peak.time) {
-      const time = new Date(data.peak.time).toLocaleTimeString("fr-FR", {
-        hour: "2-digit",
-        minute: "2-digit",
-      });
-      document.getElementById("peakTime").textContent = time;
-    }
+function renderAnalytics(data) {
+  document.getElementById(
+    "todayEnergy"
+  ).innerHTML = `${data.today.energy.toFixed(
+    3
+  )}<span class="metric-unit">kWh</span>`;
+  document.getElementById("todayCost").innerHTML = `${data.today.cost.toFixed(
+    3
+  )}<span class="metric-unit">TND</span>`;
+  document.getElementById(
+    "monthlyEstimate"
+  ).innerHTML = `${data.monthly_estimate.toFixed(
+    2
+  )}<span class="metric-unit">TND</span>`;
+  document.getElementById(
+    "potentialSavings"
+  ).innerHTML = `${data.potential_savings.toFixed(
+    3
+  )}<span class="metric-unit">TND</span>`;
 
-    // Comparison
-    const diff = data.today.energy - data.yesterday.energy;
-    const percentage =
-      data.yesterday.energy > 0
-        ? ((diff / data.yesterday.energy) * 100).toFixed(1)
-        : 0;
-    const comparisonEl = document.getElementById("comparison");
-
-    if (diff > 0) {
-      comparisonEl.innerHTML = `<span style="color: #ef4444;">+${percentage}%</span>`;
-    } else {
-      comparisonEl.innerHTML = `<span style="color: #10b981;">${percentage}%</span>`;
-    }
-  } catch (error) {
-    console.error("Error fetching analytics:", error);
+  document.getElementById(
+    "avgPower"
+  ).innerHTML = `${data.average_power.toFixed(
+    2
+  )}<span class="metric-unit">W</span>`;
+  document.getElementById("peakPower").innerHTML = `${data.peak.power.toFixed(
+    2
+  )}<span class="metric-unit">W</span>`;
+
+  if (data.peak.time) {
+    const time = new Date(data.peak.time).toLocaleTimeString("fr-FR", {
+      hour: "2-digit",
+      minute: "2-digit",
+    });
+    document.getElementById("peakTime").textContent = time;
   }
-}
 
-async function fetchEnergyHistory() {
-  try {
-    const response = await fetch(`${API_BASE}/energy/history?hours=24`);
-    if (!response.ok) return;
+  // Comparison
+  const diff = data.today.energy - data.yesterday.energy;
+  const percentage =
+    data.yesterday.energy > 0
+      ? ((diff / data.yesterday.energy) * 100).toFixed(1)
+      : 0;
+  const comparisonEl = document.getElementById("comparison");
 
-    const data = await response.json();
+  if (diff > 0) {
+    comparisonEl.innerHTML = `<span style="color: #ef4444;">+${percentage}%</span>`;
+  } else {
+    comparisonEl.innerHTML = `<span style="color: #10b981;">${percentage}%</span>`;
+  }
+}
 
-    if (data.length === 0) return;
+function renderEnergyHistory(data) {
+  if (data.length === 0) return;
 
-    const labels = data.map((item) => {
-      const date = new Date(item.timestamp);
-      return date.toLocaleTimeString("fr-FR", {
-        hour: "2-digit",
-        minute: "2-digit",
-      });
+  const labels = data.map((item) => {
+    const date = new Date(item.timestamp);
+    return date.toLocaleTimeString("fr-FR", {
+      hour: "2-digit",
+      minute: "2-digit",
     });
+  });
 
-    const powers = data.map((item) => item.power);
+  const powers = data.map((item) => item.power);
 
-    powerChart.data.labels = labels;
-    powerChart.data.datasets[0].data = powers;
-    powerChart.update("none");
-  } catch (error) {
-    console.error("Error fetching history:", error);
-  }
+  powerChart.data.labels = labels;
+  powerChart.data.datasets[0].data = powers;
+  powerChart.update("none");
 }
 
 
-async function fetchDeviceHistory() {
-  try {
-    const response = await fetch(`${API_BASE}/history?limit=20`);
-    if (!response.ok) return;
+function renderDeviceHistory(events) {
+  const container = document.getElementById("historyContainer");
 
-    const events = await response.json();
-    const container = document.getElementById("historyContainer");
+  if (!container) return;
 
-    if (!container) return;
-
-    if (events.length === 0) {
-      container.innerHTML =
-        '<div class="alert alert-info">Aucun historique disponible pour le moment.</div>';
-      return;
-    }
+  if (events.length === 0) {
+    container.innerHTML =
+      '<div class="alert alert-info">Aucun historique disponible pour le moment.</div>';
+    return;
+  }
 
-    container.innerHTML = "";
+  container.innerHTML = "";
 
-    events.forEach((event) => {
-      const item = document.createElement("div");
-      item.className = "history-item";
+  events.forEach((event) => {
+    const item = document.createElement("div");
+    item.className = "history-item";
 
-      const badgeClass = `history-badge history-${event.category}`;
-      const badgeLabel = getHistoryLabel(event.category);
-      const time = new Date(event.timestamp).toLocaleString("fr-FR");
+    const badgeClass = `history-badge history-${event.category}`;
+    const badgeLabel = getHistoryLabel(event.category);
+    const time = new Date(event.timestamp).toLocaleString("fr-FR");
 
-      item.innerHTML = `
-        <div class="history-top-row">
-          <span class="${badgeClass}">${badgeLabel}</span>
-          <span class="history-time">${time}</span>
-        </div>
-        <div class="history-details">${event.details}</div>
-        <div class="history-device">Appareil: ${event.device_id || "N/A"}</div>
-      `;
+    item.innerHTML = `
+      <div class="history-top-row">
+        <span class="${badgeClass}">${badgeLabel}</span>
+        <span class="history-time">${time}</span>
+      </div>
+      <div class="history-details">${event.details}</div>
+      <div class="history-device">Appareil: ${event.device_id || "N/A"}</div>
+    `;
 
-      container.appendChild(item);
-    });
-  } catch (error) {
-    console.error("Error fetching device history:", error);
-  }
+    container.appendChild(item);
+  });
 }
 
 function getHistoryLabel(category) {
@@ -447,46 +501,48 @@ function getHistoryLabel(category) {
 
 async function fetchAlerts() {
   try {
-    const response = await fetch(`${API_BASE}/alerts`);
+    const response = await fetchConditional("/alerts");
     if (!response.ok) return;
 
-    const alerts = await response.json();
-
-    const container = document.getElementById("alertsContainer");
-
-    if (alerts.length === 0) {
-      container.innerHTML =
-        '<div class="alert alert-info">✓ Aucune alerte active</div>';
-      return;
-    }
-
-    container.innerHTML = "";
-    alerts.slice(0, 5).forEach((alert) => {
-      const alertDiv = document.createElement("div");
-      alertDiv.className = `alert alert-${alert.severity.toLowerCase()}`;
-      const time = new Date(alert.timestamp).toLocaleString("fr-FR");
-
-      alertDiv.innerHTML = `
-                    <div class="alert-message">
-                        <strong>${getAlertIcon(alert.severity)} ${
-        alert.message
-      }</strong>
-                        <div class="alert-time">${time}</div>
-                    </div>
-                    ${
-                      !alert.resolved
-                        ? `<button class="btn-resolve" onclick="resolveAlert(${alert.id})">Résoudre</button>`
-                        : '<span style="color: #10b981; font-weight: bold;">✓ Résolu</span>'
-                    }
-                `;
-
-      container.appendChild(alertDiv);
-    });
+    renderAlerts(await response.json());
   } catch (error) {
     console.error("Error fetching alerts:", error);
   }
 }
 
+function renderAlerts(alerts) {
+  const container = document.getElementById("alertsContainer");
+
+  if (alerts.length === 0) {
+    container.innerHTML =
+      '<div class="alert alert-info">✓ Aucune alerte active</div>';
+    return;
+  }
+
+  container.innerHTML = "";
+  alerts.slice(0, 5).forEach((alert) => {
+    const alertDiv = document.createElement("div");
+    alertDiv.className = `alert alert-${alert.severity.toLowerCase()}`;
+    const time = new Date(alert.timestamp).toLocaleString("fr-FR");
+
+    alertDiv.innerHTML = `
+                  <div class="alert-message">
+                      <strong>${getAlertIcon(alert.severity)} ${
+      alert.message
+    }</strong>
+                      <div class="alert-time">${time}</div>
+                  </div>
+                  ${
+                    !alert.resolved
+                      ? `<button class="btn-resolve" onclick="resolveAlert(${alert.id})">Résoudre</button>`
+                      : '<span style="color: #10b981; font-weight: bold;">✓ Résolu</span>'
+                  }
+              `;
+
+    container.appendChild(alertDiv);
+  });
+}
+
 function getAlertIcon(severity) {
   switch (severity.toUpperCase()) {
     case "CRITICAL":
@@ -0,0 +1,668 @@
+"""
+PDS-32: Tarification - barèmes versionnés par plages horaires (heures pleines/creuses,
+saisons) ou par tranches de consommation mensuelle, et re-tarification vectorisée
+
+Fichier JSON (TARIFF_FILE), relu à chaud:
+
+    {"versions": [
+        {"from": "2024-01-01", "name": "Tarif unique", "price": 0.15},
+        {"from": "2025-01-01", "name": "Heures pleines/creuses", "price": 0.18,
+         "bands": [{"name": "pointe été", "months": [6, 7, 8], "hours": [18, 22], "price": 0.35},
+                   {"name": "nuit", "days": ["sat", "sun"], "hours": [22, 7], "price": 0.11}]},
+        {"from": "2026-01-01", "name": "Tranches", "tiers": [
+            {"up_to": 50, "price": 0.062}, {"up_to": 100, "price": 0.096},
+            {"up_to": 200, "price": 0.176}, {"price": 0.218}]}
+    ]}
+
+Une version s'applique à partir de sa date (heure locale). Plages: la première
+qui correspond l'emporte, `price` sinon; heures entières [début, fin[ (fin < début:
+à cheval sur minuit). Tranches: prix marginal de la consommation du mois (heure
+locale) de chaque appareil, l'appareil étant le compteur.
+
+Le coût des agrégats énergie (colonne cost) est calculé à l'ingestion à partir des
+deltas du compteur, puis recalculé en bloc (reprice) quand le barème change.
+"""
+
+import calendar
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from db import connect
+import logs
+import migrations
+
+log = logs.get('tariffs')
+
+DAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Clé de groupe (appareil, heure ou mois) sur un entier
+_GROUP_SHIFT = 1 << 32
+
+
+class TariffError(ValueError):
+    """Barème invalide, ou paramètres de re-tarification invalides"""
+
+
+def _number(spec, key, where):
+    value = spec.get(key)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+        raise TariffError(f"{where}: '{key}' must be a non-negative number")
+    return float(value)
+
+
+def _entries(spec, key, where):
+    """Plages ou tranches d'une version: liste d'objets JSON"""
+    entries = spec.get(key, [])
+    if not isinstance(entries, list) or not all(isinstance(entry, dict) for entry in entries):
+        raise TariffError(f"{where}: '{key}' must be a list of objects")
+    return entries
+
+
+def _hours(spec, where):
+    try:
+        start, end = spec.get('hours', (0, 24))
+    except (TypeError, ValueError):
+        raise TariffError(f"{where}: 'hours' must be [start, end] whole hours")
+    if not (isinstance(start, int) and isinstance(end, int) and 0 <= start <= 23 and 0 <= end <= 24):
+        raise TariffError(f"{where}: 'hours' must be [start, end] whole hours")
+    if start < end:
+        return list(range(start, end))
+    return list(range(start, 24)) + list(range(0, end))
+
+
+def _day_indexes(spec, where):
+    days = spec.get('days', DAYS)
+    try:
+        return [DAYS.index(day.lower()[:3]) for day in days]
+    except (AttributeError, TypeError, ValueError):
+        raise TariffError(f"{where}: 'days' must be among {', '.join(DAYS)}")
+
+
+def _month_indexes(spec, where):
+    months = spec.get('months', range(1, 13))
+    if not isinstance(months, (list, range)) or not all(
+            isinstance(month, int) and 1 <= month <= 12 for month in months):
+        raise TariffError(f"{where}: 'months' must be between 1 and 12")
+    return [month - 1 for month in months]
+
+
+# ==================== BARÈME ====================
+class Version:
+    """Période d'un barème: prix par (mois, jour, heure) locaux, ou tranches mensuelles"""
+
+    def __init__(self, spec):
+        if not isinstance(spec, dict):
+            raise TariffError(f"Invalid version: {spec!r} (object expected)")
+        self.start = spec.get('from')
+        try:
+            self.start_local = calendar.timegm(time.strptime(self.start, '%Y-%m-%d'))
+        except (TypeError, ValueError):
+            raise TariffError(f"Invalid version date: {self.start!r} (YYYY-MM-DD)")
+        self.name = spec.get('name', self.start)
+        where = f"Version {self.start}"
+        bands, tiers = _entries(spec, 'bands', where), _entries(spec, 'tiers', where)
+        if bands and tiers:
+            raise TariffError(f"{where}: time bands and tiers cannot be combined")
+
+        self.tiers = None
+        if tiers:
+            bounds, prices = [0.0], []
+            for index, tier in enumerate(tiers):
+                prices.append(_number(tier, 'price', f"{where}, tier {index + 1}"))
+                if index < len(tiers) - 1:
+                    up_to = _number(tier, 'up_to', f"{where}, tier {index + 1}")
+                    if up_to <= bounds[-1]:
+                        raise TariffError(f"{where}: tier bounds must increase")
+                    bounds.append(up_to)
+            self.tiers = prices
+            self._bounds = np.array(bounds)
+            # Coût cumulé à chaque borne: coût(x) = interpolation linéaire entre bornes
+            self._cumulative = np.concatenate(([0.0], np.cumsum(np.diff(self._bounds) * prices[:-1])))
+            self.price = prices[0]
+            return
+
+        self.price = _number(spec, 'price', where)
+        self.bands = bands
+        # [mois, jour de semaine, heure] -> prix; première plage prioritaire (appliquée en dernier)
+        self._prices = np.full((12, 7, 24), self.price)
+        for index, band in reversed(list(enumerate(bands))):
+            band_where = f"{where}, band {band.get('name', index + 1)}"
+            price = _number(band, 'price', band_where)
+            grid = np.ix_(_month_indexes(band, band_where), _day_indexes(band, band_where), _hours(band, band_where))
+            self._prices[grid] = price
+
+    def _tier_cost(self, consumed):
+        """Coût cumulé des `consumed` premiers kWh du mois"""
+        bounds, last = self._bounds, self.tiers[-1]
+        return np.interp(consumed, bounds, self._cumulative) + np.maximum(consumed - bounds[-1], 0) * last
+
+    def costs(self, local, energy, month_to_date):
+        """Coût de chaque consommation `energy` débutant à l'instant local `local`"""
+        if self.tiers is not None:
+            return self._tier_cost(month_to_date + energy) - self._tier_cost(month_to_date)
+        month = local.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64) % 12
+        weekday = (local // 86400 + 3) % 7  # 1970-01-01 était un jeudi
+        hour = (local // 3600) % 24
+        return energy * self._prices[month, weekday, hour]
+
+    def unit_price(self, local, month_to_date=0.0):
+        """Prix marginal du kWh à l'instant local `local`"""
+        if self.tiers is not None:
+            index = int(np.searchsorted(self._bounds, month_to_date, side='right')) - 1
+            return self.tiers[min(index, len(self.tiers) - 1)]
+        moment = time.gmtime(local)
+        return float(self._prices[moment.tm_mon - 1, moment.tm_wday, moment.tm_hour])
+
+
+class Schedule:
+    """Barème versionné; `utc_offset_hours` fixe l'heure locale des plages et des mois"""
+
+    def __init__(self, document, utc_offset_hours=0):
+        specs = document.get('versions') if isinstance(document, dict) else None
+        if not specs or not isinstance(specs, list):
+            raise TariffError("A tariff needs a list of at least one version")
+        self.versions = [Version(spec) for spec in specs]
+        self._starts = np.array([version.start_local for version in self.versions])
+        if np.any(np.diff(self._starts) <= 0):
+            raise TariffError("Version dates must be strictly increasing")
+        self.document = document
+        self.utc_offset = int(utc_offset_hours) * 3600
+        canonical = json.dumps({'versions': specs, 'utc_offset_hours': utc_offset_hours}, sort_keys=True)
+        self.fingerprint = hashlib.blake2b(canonical.encode(), digest_size=8).hexdigest()
+
+    @classmethod
+    def hourly(cls, prices, utc_offset_hours=0):
+        """Barème unique à 24 prix horaires (TOU_PRICES), sans date de début"""
+        if len(prices) != 24:
+            raise TariffError("24 hourly prices expected")
+        if len(set(prices)) == 1:
+            version = {'from': '1970-01-01', 'name': 'Tarif unique', 'price': prices[0]}
+        else:
+            version = {'from': '1970-01-01', 'name': 'Prix horaires', 'price': prices[0], 'bands': [
+                {'name': f"{hour:02d}h", 'hours': [hour, hour + 1], 'price': price} for hour, price in enumerate(prices)
+            ]}
+        return cls({'versions': [version]}, utc_offset_hours)
+
+    def _version_index(self, local):
+        # Avant la première version: la première s'applique
+        return np.clip(np.searchsorted(self._starts, local, side='right') - 1, 0, None)
+
+    def costs(self, epoch, energy, month_to_date):
+        """Coûts vectorisés: instants UTC (s), consommations (kWh), consommation du mois avant chacune"""
+        epoch = np.asarray(epoch, dtype=np.int64)
+        energy = np.nan_to_num(np.asarray(energy, dtype=float))
+        month_to_date = np.asarray(month_to_date, dtype=float)
+        local = epoch + self.utc_offset
+        if len(self.versions) == 1:
+            return self.versions[0].costs(local, energy, month_to_date)
+        index = self._version_index(local)
+        costs = np.zeros(len(epoch))
+        for number in np.unique(index):
+            mask = index == number
+            costs[mask] = self.versions[number].costs(local[mask], energy[mask], month_to_date[mask])
+        return costs
+
+    def cost(self, epoch, energy, month_to_date=0.0):
+        """Coût d'une consommation (ingestion)"""
+        return float(self.costs(np.array([epoch]), np.array([energy]), np.array([month_to_date]))[0])
+
+    def version_at(self, epoch):
+        return self.versions[int(self._version_index(np.array([epoch + self.utc_offset]))[0])]
+
+    def unit_price(self, epoch, month_to_date=0.0):
+        return self.version_at(epoch).unit_price(epoch + self.utc_offset, month_to_date)
+
+    def month_of(self, epoch):
+        """Mois local (mois depuis 1970-01) des instants UTC `epoch`"""
+        local = np.asarray(epoch, dtype=np.int64) + self.utc_offset
+        return local.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64)
+
+    def month_bounds(self, month):
+        """[début, fin[ UTC ('YYYY-MM-DD HH:MM:SS') du mois local `month`"""
+        start = np.datetime64(int(month), 'M').astype('datetime64[s]').astype(np.int64) - self.utc_offset
+        end = np.datetime64(int(month) + 1, 'M').astype('datetime64[s]').astype(np.int64) - self.utc_offset
+        return _epoch_to_str(start), _epoch_to_str(end)
+
+    def describe(self):
+        return {
+            'fingerprint': self.fingerprint,
+            'utc_offset_hours': self.utc_offset // 3600,
+            'versions': self.document['versions'],
+        }
+
+
+def load_schedule(path, utc_offset_hours=0):
+    try:
+        with open(path, encoding='utf-8') as f:
+            document = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        raise TariffError(f"Cannot load {path}: {e}")
+    return Schedule(document, utc_offset_hours)
+
+
+# ==================== CONSOMMATION DU MOIS ====================
+def _to_epoch(timestamps):
+    return np.array(timestamps, dtype='datetime64[s]').astype(np.int64)
+
+
+def _epoch_to_str(epoch):
+    return datetime.fromtimestamp(int(epoch), timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+def running_before(groups, energy):
+    """Consommation des lignes précédentes du même groupe (lignes triées par groupe puis temps)"""
+    if not len(energy):
+        return np.zeros(0)
+    total = np.cumsum(energy) - energy
+    starts = np.r_[True, groups[1:] != groups[:-1]]
+    first = np.maximum.accumulate(np.where(starts, np.arange(len(groups)), 0))
+    return total - total[first]
+
+
+class HourlyBase:
+    """Consommation du mois de chaque appareil au début de chaque heure (agrégats 1 h),
+    pour tarifer des mesures plus fines sans relire le début du mois
+
+    `opening` (par code d'appareil): consommation du mois avant la première heure
+    lue, quand les heures ne partent pas du début du mois (re-tarification par lots).
+    """
+
+    def __init__(self, schedule, codes, epoch, energy, opening=None):
+        # Lignes triées par (appareil, temps); order les ramène à l'ordre de lecture
+        self.order = order = np.lexsort((epoch, codes))
+        self.codes, self.epoch, self.energy = codes[order], epoch[order], energy[order]
+        self.month = schedule.month_of(self.epoch)
+        self.mtd = running_before(self.codes * _GROUP_SHIFT + self.month, self.energy)
+        self.opening = opening
+        if opening is not None:
+            self.mtd += opening[self.codes]
+        self.keys = self.codes * _GROUP_SHIFT + self.epoch // 3600
+
+    def _opening(self, codes):
+        return np.zeros(len(codes)) if self.opening is None else self.opening[codes]
+
+    def at(self, codes, epoch, month):
+        """Consommation du mois au début de l'heure de chaque instant"""
+        if not len(self.keys):
+            return self._opening(codes)
+        keys = codes * _GROUP_SHIFT + epoch // 3600
+        position = np.searchsorted(self.keys, keys)
+        exact = np.minimum(position, len(self.keys) - 1)
+        found = self.keys[exact] == keys
+        # Heure absente des agrégats: fin de la dernière heure connue du même mois
+        previous = np.maximum(position - 1, 0)
+        same = (position > 0) & (self.codes[previous] == codes) & (self.month[previous] == month)
+        return np.where(found, self.mtd[exact],
+                        np.where(same, self.mtd[previous] + self.energy[previous], self._opening(codes)))
+
+
+def _hourly_rows(conn, start, end):
+    return conn.execute('''
+        SELECT bucket, device_id, COALESCE(energy_delta, energy_max - energy_min, 0)
+        FROM energy_rollup_1h
+        WHERE bucket >= ? AND bucket < ?
+    ''', (start, end)).fetchall()
+
+
+def price_samples(conn, schedule, device_names, device_idx, epoch, energy):
+    """Coûts de mesures brutes (analyses à la demande): consommation du mois relue
+    dans les agrégats horaires, puis cumulée dans l'heure"""
+    if not len(epoch):
+        return np.zeros(0)
+    month = schedule.month_of(epoch)
+    start, _ = schedule.month_bounds(month.min())
+    rows = _hourly_rows(conn, start, _epoch_to_str(int(epoch.max()) + 3600))
+    names = {str(name): code for code, name in enumerate(device_names)}
+    known = [row for row in rows if row[1] in names]
+    if known:
+        columns = list(zip(*known))
+        base = HourlyBase(schedule, np.array([names[name] for name in columns[1]]),
+                          _to_epoch(columns[0]), np.array(columns[2], dtype=float))
+    else:
+        base = HourlyBase(schedule, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0))
+    codes = np.asarray(device_idx, dtype=np.int64)
+    order = np.lexsort((epoch, codes))
+    within = np.empty(len(epoch))
+    within[order] = running_before(codes[order] * _GROUP_SHIFT + epoch[order] // 3600, energy[order])
+    return schedule.costs(epoch, energy, base.at(codes, epoch, month) + within)
+
+
+# ==================== TARIFICATION À L'INGESTION ====================
+class Pricer:
+    """Coût de chaque delta de compteur, dans le thread écrivain (rollups.apply)
+
+    La consommation du mois de chaque appareil est relue une fois dans les
+    agrégats horaires, puis tenue à jour en mémoire; provisoire jusqu'au commit()
+    de la transaction, oubliée par rollback() (comme rollups.CounterTracker).
+    """
+
+    def __init__(self, schedule):
+        # schedule() -> barème courant (rechargé à chaud)
+        self._schedule = schedule
+        self._months = {}
+        self._pending = {}
+        self._epochs = {}
+
+    def _epoch(self, timestamp):
+        epoch = self._epochs.get(timestamp)
+        if epoch is None:
+            if len(self._epochs) > 4096:
+                self._epochs.clear()
+            epoch = self._epochs[timestamp] = calendar.timegm(time.strptime(timestamp[:19], TIMESTAMP_FORMAT))
+        return epoch
+
+    def cost(self, conn, device_id, timestamp, delta):
+        schedule = self._schedule()
+        epoch = self._epoch(timestamp)
+        month = int(schedule.month_of(epoch))
+        state = self._pending.get(device_id)
+        if state is None:
+            state = self._months.get(device_id)
+            if state is not None:
+                state = self._pending[device_id] = list(state)
+        if state is None or state[0] != month:
+            start, end = schedule.month_bounds(month)
+            consumed = conn.execute('''
+                SELECT SUM(COALESCE(energy_delta, 0)) FROM energy_rollup_1h
+                WHERE bucket >= ? AND bucket < ? AND device_id = ?
+            ''', (start, end, device_id)).fetchone()[0]
+            state = self._pending[device_id] = [month, consumed or 0.0]
+        cost = schedule.cost(epoch, delta, state[1])
+        state[1] += delta
+        return cost
+
+    def commit(self):
+        self._months.update(self._pending)
+        self._pending.clear()
+
+    def rollback(self):
+        self._pending.clear()
+
+
+# ==================== RE-TARIFICATION ====================
+# Lignes d'agrégats visées par transaction de re-tarification: l'écrivain d'ingestion
+# attend au plus un lot (la fenêtre horaire d'un lot s'adapte au nombre d'appareils)
+REPRICE_CHUNK_ROWS = 20000
+
+
+def _bound(schedule, value, end=False):
+    """Borne de re-tarification (epoch): 'YYYY-MM' mois local, 'YYYY-MM-DD' jour UTC
+    (comme la reconstruction des agrégats); `end`: borne incluse, retourne sa fin"""
+    try:
+        if len(value) == 7:
+            month = np.datetime64(value, 'M').astype(np.int64) + end
+            return int(_to_epoch([schedule.month_bounds(month)[0]])[0])
+        return calendar.timegm(time.strptime(value, '%Y-%m-%d')) + 86400 * end
+    except (TypeError, ValueError):
+        raise TariffError(f"Invalid bound: {value!r} (YYYY-MM or YYYY-MM-DD)")
+
+
+def _month_start(schedule, month):
+    return int(_to_epoch([schedule.month_bounds(month)[0]])[0])
+
+
+def _segments(conn, schedule, start=None, end=None):
+    """Périodes (début du mois local, début, fin) à re-tarifer, en epochs, découpées aux
+    mois locaux; par défaut tout l'historique"""
+    low = _bound(schedule, start) if start else None
+    high = _bound(schedule, end, end=True) if end else None
+    # MIN et MAX séparés: chacun lu en bout d'index, sans parcourir la table
+    first = conn.execute('SELECT MIN(bucket) FROM energy_rollup_1h').fetchone()[0]
+    last = conn.execute('SELECT MAX(bucket) FROM energy_rollup_1h').fetchone()[0]
+    if first is None:
+        return []
+    if low is None:
+        low = _month_start(schedule, schedule.month_of(_to_epoch([first])[0]))
+    if high is None:
+        high = _month_start(schedule, schedule.month_of(_to_epoch([last])[0]) + 1)
+    elif any(version.tiers is not None for version in schedule.versions):
+        # Tranches: la fin du mois dépend de la consommation re-tarifée avant elle
+        high = _month_start(schedule, schedule.month_of(high - 1) + 1)
+    segments = []
+    month = int(schedule.month_of(low))
+    while _month_start(schedule, month) < high:
+        month_start = _month_start(schedule, month)
+        segments.append((month_start, max(low, month_start), min(high, _month_start(schedule, month + 1))))
+        month += 1
+    return segments
+
+
+def _names(*columns):
+    names = sorted(set().union(*columns))
+    return {name: code for code, name in enumerate(names)}
+
+
+def _energy_before(conn, start, end):
+    """Consommation par appareil des heures [start, end) (début du mois avant une période)"""
+    return dict(conn.execute('''
+        SELECT device_id, SUM(COALESCE(energy_delta, energy_max - energy_min, 0))
+        FROM energy_rollup_1h
+        WHERE bucket >= ? AND bucket < ?
+        GROUP BY device_id
+    ''', (start, end)).fetchall())
+
+
+def _reprice_chunk(conn, schedule, start, end, opening):
+    """Re-tarife les heures [start, end) d'un même mois local (epochs, heures entières)
+    dans la transaction d'écriture ouverte; `opening`: consommation du mois de chaque
+    appareil avant `start`, mise à jour pour le lot suivant. Retourne les lignes mises à jour."""
+    start_str, end_str = _epoch_to_str(start), _epoch_to_str(end)
+    hourly = _hourly_rows(conn, start_str, end_str)
+    minutes = conn.execute('''
+        SELECT bucket, device_id, COALESCE(energy_delta, energy_max - energy_min, 0)
+        FROM energy_rollup_1m
+        WHERE bucket >= ? AND bucket < ?
+    ''', (start_str, end_str)).fetchall()
+    if not hourly and not minutes:
+        return 0
+    codes = _names([row[1] for row in hourly], [row[1] for row in minutes])
+    before = np.array([opening.get(name, 0.0) for name in codes])
+    updated = 0
+
+    # Mises à jour dans l'ordre de lecture (clé primaire): pages B-tree parcourues une fois
+    update = 'UPDATE {table} SET cost = ? WHERE bucket = ? AND device_id = ?'
+
+    # Heures: consommation du mois cumulée par appareil, depuis celle des lots précédents
+    if hourly:
+        buckets, devices, energy = zip(*hourly)
+        base = HourlyBase(schedule, np.array([codes[name] for name in devices]),
+                          _to_epoch(buckets), np.array(energy, dtype=float), before)
+        costs = np.empty(len(hourly))
+        costs[base.order] = schedule.costs(base.epoch, base.energy, base.mtd)
+        conn.executemany(update.format(table='energy_rollup_1h'), zip(costs.tolist(), buckets, devices))
+        updated += len(hourly)
+    else:
+        base = HourlyBase(schedule, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0), before)
+
+    # Minutes: début de l'heure (agrégats 1 h) + minutes précédentes de l'heure
+    if minutes:
+        buckets, devices, energy = zip(*minutes)
+        minute_codes = np.array([codes[name] for name in devices])
+        epoch = _to_epoch(buckets)
+        energy = np.array(energy, dtype=float)
+        order = np.lexsort((epoch, minute_codes))
+        minute_codes, epoch, energy = minute_codes[order], epoch[order], energy[order]
+        mtd = base.at(minute_codes, epoch, schedule.month_of(epoch))
+        mtd += running_before(minute_codes * _GROUP_SHIFT + epoch // 3600, energy)
+        costs = np.empty(len(minutes))
+        costs[order] = schedule.costs(epoch, energy, mtd)
+        conn.executemany(update.format(table='energy_rollup_1m'), zip(costs.tolist(), buckets, devices))
+        updated += len(minutes)
+
+    # Report au lot suivant
+    totals = np.bincount(base.codes, weights=base.energy, minlength=len(codes))
+    for name, code in codes.items():
+        opening[name] = opening.get(name, 0.0) + float(totals[code])
+
+    # Jours (UTC) touchant le lot: somme de leurs heures (recalculée au lot suivant s'il
+    # reste des heures du jour à re-tarifer)
+    first_day, last_day = start_str[:10], _epoch_to_str(end - 1)[:10]
+    days = conn.execute('''
+        SELECT substr(bucket, 1, 10), device_id, SUM(cost)
+        FROM energy_rollup_1h
+        WHERE bucket >= ? AND bucket < date(?, '+1 day')
+        GROUP BY 1, 2
+    ''', (first_day, last_day)).fetchall()
+    conn.executemany(update.format(table='energy_rollup_1d'), [(cost, day, device_id) for day, device_id, cost in days])
+    return updated + len(days)
+
+
+def reprice(conn, schedule, start=None, end=None, stop=None):
+    """Recalcule la colonne cost des agrégats énergie sur [start, end]: mois locaux
+    ('YYYY-MM') ou jours UTC ('YYYY-MM-DD'), par défaut tout l'historique
+
+    Chaque mois est découpé en lots de quelques heures (environ REPRICE_CHUNK_ROWS
+    lignes), chacun dans sa transaction BEGIN IMMEDIATE: l'écrivain d'ingestion
+    n'attend jamais plus d'un lot, et ses lots suivants sont tarifés avec le barème
+    courant. La consommation du mois (tranches) est reportée d'un lot au suivant,
+    et relue dans les agrégats horaires quand la période commence en cours de mois.
+    """
+    started = time.perf_counter()
+    segments = _segments(conn, schedule, start, end)
+    rows = chunks = 0
+    hours = 24
+    for month_start, at, segment_end in segments:
+        opening = _energy_before(conn, _epoch_to_str(month_start), _epoch_to_str(at)) if at > month_start else {}
+        while at < segment_end:
+            if stop is not None and stop.is_set():
+                break
+            chunk_end = min(segment_end, at + hours * 3600)
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                count = _reprice_chunk(conn, schedule, at, chunk_end, opening)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            rows += count
+            chunks += 1
+            # Fenêtre suivante ajustée sur les lignes de celle-ci (entre 1 et 24 heures)
+            hours = min(24, max(1, hours * REPRICE_CHUNK_ROWS // max(count, 1)))
+            at = chunk_end
+    return {'months': len(segments), 'chunks': chunks, 'rows': rows,
+            'duration_s': round(time.perf_counter() - started, 3)}
+
+
+def priced_fingerprint(conn):
+    row = conn.execute('SELECT fingerprint FROM tariff_pricing WHERE id = 1').fetchone()
+    return row[0] if row else None
+
+
+def mark_priced(conn, schedule):
+    with conn:
+        conn.execute('INSERT OR REPLACE INTO tariff_pricing (id, fingerprint, priced_at) VALUES (1, ?, ?)',
+                     (schedule.fingerprint, datetime.now(timezone.utc).strftime(TIMESTAMP_FORMAT)))
+
+
+# ==================== SERVICE ====================
+class TariffService:
+    """Barème courant (fichier relu à chaud) et re-tarification des bases écrites par
+    ce processus quand leur dernier barème appliqué n'est plus le barème courant"""
+
+    def __init__(self, path, utc_offset_hours=0, fallback=None, reload_interval=5, on_repriced=None):
+        self.path = path
+        self.utc_offset_hours = utc_offset_hours
+        self.reload_interval = reload_interval
+        # on_repriced(): agrégats modifiés (invalidation des caches)
+        self.on_repriced = on_repriced
+        self.schedule = fallback or Schedule.hourly([0.0] * 24, utc_offset_hours)
+        self.databases = []
+        self.last_error = None
+        self._mtime = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._reprice_lock = threading.Lock()
+        self._last_reprice = None
+
+    def reload(self, force=False):
+        """Recharge le fichier s'il a changé; retourne True si le barème a été remplacé"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            # Pas de fichier: barème de repli (TOU_PRICES)
+            return False
+        if not force and mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        try:
+            schedule = load_schedule(self.path, self.utc_offset_hours)
+        except TariffError as e:
+            self.last_error = str(e)
+            log.warning("✗ Tariff not reloaded: %s", e)
+            return False
+        self.last_error = None
+        changed = schedule.fingerprint != self.schedule.fingerprint
+        self.schedule = schedule
+        if changed:
+            log.info("✓ Tariff loaded: %d version(s) from %s (%s)", len(schedule.versions), self.path,
+                     schedule.fingerprint)
+        return changed
+
+    # ---------- Cycle de vie ----------
+    def start(self, databases=()):
+        """Rechargement à chaud; re-tarification des `databases` (bases écrites par ce processus)"""
+        self.databases = list(databases)
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='tariffs', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while True:
+            try:
+                self.reload()
+                self.reprice_stale()
+            except Exception as e:
+                log.exception("✗ Tariff service error: %s", e)
+            if self._stop.wait(self.reload_interval):
+                return
+
+    # ---------- Re-tarification ----------
+    def reprice_stale(self):
+        """Re-tarife les bases dont les coûts ont été calculés avec un autre barème"""
+        for database in self.databases:
+            conn = connect(database)
+            try:
+                # Agrégats en cours de reconstruction: tarifés une fois le backfill terminé
+                if migrations.backfill_pending(conn, 'energy_data'):
+                    continue
+                schedule = self.schedule
+                if priced_fingerprint(conn) != schedule.fingerprint:
+                    self.reprice(conn, database, schedule)
+            finally:
+                conn.close()
+
+    def reprice(self, conn, database, schedule=None, start=None, end=None):
+        """Re-tarife une base (tout l'historique, ou [start, end]: mois ou jours, voir reprice)"""
+        schedule = schedule or self.schedule
+        with self._reprice_lock:
+            report = reprice(conn, schedule, start, end, self._stop)
+            if start is None and end is None and not self._stop.is_set():
+                mark_priced(conn, schedule)
+            self._last_reprice = dict(report, database=os.path.basename(database), fingerprint=schedule.fingerprint)
+        log.info("💱 Repriced %s: %d months, %d rollup rows in %.2fs", os.path.basename(database),
+                 report['months'], report['rows'], report['duration_s'])
+        if self.on_repriced is not None:
+            self.on_repriced()
+        return report
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'fingerprint': self.schedule.fingerprint,
+            'last_error': self.last_error,
+            'databases': [os.path.basename(database) for database in self.databases],
+            'last_reprice': self._last_reprice,
+        }
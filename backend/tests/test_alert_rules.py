@@ -0,0 +1,65 @@
+"""
+PDS-32: Transitions des règles de seuil (hystérésis, durée minimale)
+"""
+
+from alert_rules import FIRING, OK, PENDING, AlertEngine, Rule
+
+
+def make_engine(**spec):
+    events = []
+
+    def on_open(rule, device_id, severity, message):
+        events.append(('open', device_id, message))
+        return len(events)
+
+    engine = AlertEngine(on_open, lambda alert: events.append(('resolve', alert)))
+    engine.set_rules([Rule(dict({'id': 'hot', 'source': 'energy', 'metric': 'power', 'value': 100}, **spec))])
+    return engine, events
+
+
+def state(engine, device_id='esp32'):
+    return engine._machines[('hot', device_id)].state
+
+
+def test_hysteresis_delays_resolution():
+    engine, events = make_engine(hysteresis=10)
+    engine.evaluate('energy', 'esp32', {'power': 120}, now=0)
+    assert state(engine) == FIRING
+    assert events == [('open', 'esp32', 'HOT (esp32)')]
+
+    # Sous le seuil mais dans la bande d'hystérésis: l'alerte reste ouverte
+    engine.evaluate('energy', 'esp32', {'power': 95}, now=1)
+    assert state(engine) == FIRING
+    engine.evaluate('energy', 'esp32', {'power': 89}, now=2)
+    assert state(engine) == OK
+    assert events[1:] == [('resolve', 1)]
+
+
+def test_for_seconds_requires_sustained_breach():
+    engine, events = make_engine(for_seconds=30)
+    engine.evaluate('energy', 'esp32', {'power': 120}, now=0)
+    assert state(engine) == PENDING
+    engine.evaluate('energy', 'esp32', {'power': 120}, now=29)
+    assert state(engine) == PENDING
+    assert events == []
+
+    # Retour sous le seuil avant la durée minimale: le délai repart de zéro
+    engine.evaluate('energy', 'esp32', {'power': 50}, now=31)
+    assert state(engine) == OK
+    engine.evaluate('energy', 'esp32', {'power': 120}, now=40)
+    engine.evaluate('energy', 'esp32', {'power': 120}, now=69)
+    assert state(engine) == PENDING
+    engine.evaluate('energy', 'esp32', {'power': 120}, now=70)
+    assert state(engine) == FIRING
+    assert engine.opened == 1 and len(events) == 1
+
+
+def test_devices_have_independent_machines():
+    engine, events = make_engine()
+    engine.evaluate('energy', 'a', {'power': 120}, now=0)
+    engine.evaluate('energy', 'b', {'power': 50}, now=0)
+    assert state(engine, 'a') == FIRING
+    assert state(engine, 'b') == OK
+    # Mesure non numérique ignorée
+    engine.evaluate('energy', 'a', {'power': None}, now=1)
+    assert state(engine, 'a') == FIRING
@@ -0,0 +1,28 @@
+"""
+PDS-32: Reconstruction des valeurs compressées (compression.value_at)
+"""
+
+from compression import value_at
+
+POINTS = [(0, (10.0, 1.0)), (60, (20.0, None)), (300, (30.0, 3.0))]
+
+
+def test_step_holds_previous_value():
+    assert value_at(POINTS, 0, hold=120) == (10.0, 1.0)
+    assert value_at(POINTS, 59, hold=120) == (10.0, 1.0)
+    assert value_at(POINTS, 60, hold=120) == (20.0, None)
+
+
+def test_outside_coverage():
+    assert value_at(POINTS, -1, hold=120) is None
+    # Au-delà de `hold` après le dernier point reçu
+    assert value_at(POINTS, 180, hold=120) is None
+    assert value_at(POINTS, 419, hold=120) == (30.0, 3.0)
+    assert value_at(POINTS, 420, hold=120) is None
+
+
+def test_linear_interpolates_within_hold():
+    assert value_at(POINTS, 30, hold=120, linear=True) == (15.0, None)
+    # Point suivant plus loin que `hold`: valeur en escalier
+    assert value_at(POINTS, 90, hold=120, linear=True) == (20.0, None)
+    assert value_at(POINTS, 90, hold=300, linear=True) == (21.25, None)
@@ -0,0 +1,16 @@
+"""
+PDS-32: Aucune route ne parcourt une table entière (bench/check_query_plans.py)
+"""
+
+import os
+import subprocess
+import sys
+
+from tests.conftest import BACKEND_DIR
+
+
+def test_no_full_table_scan():
+    # Processus séparé: le script trace les connexions et importe app sur sa propre base
+    result = subprocess.run([sys.executable, os.path.join('bench', 'check_query_plans.py')],
+                            cwd=BACKEND_DIR, capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stdout + result.stderr
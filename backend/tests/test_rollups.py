@@ -0,0 +1,39 @@
+"""
+PDS-32: Consommation déduite du compteur (rollups.CounterTracker)
+"""
+
+from rollups import CounterTracker
+
+
+def test_delta_follows_counter():
+    counters = CounterTracker(seed=None)
+    assert counters.delta(None, 'esp32', 10.0) == 0.0
+    assert counters.delta(None, 'esp32', 12.5) == 2.5
+    assert counters.delta(None, 'esp32', None) == 0.0
+    assert counters.delta(None, 'esp32', 13.0) == 0.5
+
+
+def test_counter_reset_counts_new_value():
+    counters = CounterTracker(seed=None)
+    counters.delta(None, 'esp32', 100.0)
+    # Redémarrage de l'ESP32: le compteur repart de zéro
+    assert counters.delta(None, 'esp32', 1.5) == 1.5
+    assert counters.delta(None, 'esp32', 2.0) == 0.5
+
+
+def test_seed_reads_previous_counter():
+    counters = CounterTracker(seed=lambda conn, device_id: {'a': 40.0}.get(device_id))
+    assert counters.delta(None, 'a', 42.0) == 2.0
+    assert counters.delta(None, 'b', 42.0) == 0.0
+
+
+def test_rollback_keeps_interval_consumption():
+    counters = CounterTracker(seed=None)
+    counters.delta(None, 'esp32', 10.0)
+    counters.commit()
+    assert counters.delta(None, 'esp32', 15.0) == 5.0
+    counters.rollback()
+    # Lot rejoué: le delta est recalculé depuis la dernière valeur validée
+    assert counters.delta(None, 'esp32', 15.0) == 5.0
+    counters.commit()
+    assert counters.delta(None, 'esp32', 16.0) == 1.0
@@ -0,0 +1,109 @@
+"""
+PDS-32: Coûts des agrégats énergie - tarification à l'ingestion (tariffs.Pricer) et
+re-tarification complète ou partielle (tariffs.reprice) donnent les mêmes coûts
+"""
+
+import calendar
+import time
+
+import pytest
+
+import migrations
+import rollups
+import tariffs
+from db import connect
+
+# Tranches mensuelles puis, à partir du 15 janvier (heure locale), plages horaires
+DOCUMENT = {'versions': [
+    {'from': '2025-12-01', 'name': 'Tranches', 'tiers': [
+        {'up_to': 50, 'price': 0.062}, {'up_to': 120, 'price': 0.096}, {'price': 0.218}]},
+    {'from': '2026-01-15', 'name': 'Heures pleines/creuses', 'price': 0.18, 'bands': [
+        {'name': 'nuit', 'hours': [22, 7], 'price': 0.11},
+        {'name': 'week-end', 'days': ['sat', 'sun'], 'hours': [0, 24], 'price': 0.09}]},
+]}
+
+START = calendar.timegm(time.strptime('2025-11-27 20:00:00', tariffs.TIMESTAMP_FORMAT))
+STEP = 600
+SAMPLES = 54 * 86400 // STEP
+
+COST_QUERY = 'SELECT bucket, device_id, cost FROM {table} ORDER BY bucket, device_id'
+
+
+def samples():
+    """Lignes energy_data de deux appareils, dont une remise à zéro du compteur"""
+    counters = {'esp32-a': 0.0, 'esp32-b': 3.0}
+    for index in range(SAMPLES):
+        timestamp = time.strftime(tariffs.TIMESTAMP_FORMAT, time.gmtime(START + index * STEP))
+        for number, device_id in enumerate(sorted(counters)):
+            counters[device_id] += 0.02 + 0.03 * ((index + number) % 7) / 6
+            if device_id == 'esp32-b' and index == SAMPLES // 2:
+                counters[device_id] = 0.4
+            yield timestamp, device_id, 500.0, 230.0, 2.2, round(counters[device_id], 4), None
+
+
+def costs(conn):
+    return {table: conn.execute(COST_QUERY.format(table=table)).fetchall() for table in rollups.ROLLUP_TABLES}
+
+
+def assert_same_costs(actual, expected):
+    for table, rows in expected.items():
+        assert len(actual[table]) == len(rows), table
+        for got, want in zip(actual[table], rows):
+            assert got[:2] == want[:2]
+            assert got[2] == pytest.approx(want[2], abs=1e-9), (table, got, want)
+
+
+@pytest.fixture
+def priced(tmp_path):
+    """Base dont les agrégats sont tarifés à l'ingestion, par lots d'une journée"""
+    conn = connect(str(tmp_path / 'energy.db'))
+    migrations.migrate(conn)
+    schedule = tariffs.Schedule(DOCUMENT, utc_offset_hours=2)
+    counters, pricer = rollups.CounterTracker(seed=None), tariffs.Pricer(lambda: schedule)
+    rows = list(samples())
+    per_day = 2 * 86400 // STEP
+    for offset in range(0, len(rows), per_day):
+        with conn:
+            rollups.apply(conn, rows[offset:offset + per_day], counters, pricer)
+        counters.commit()
+        pricer.commit()
+    yield conn, schedule
+    conn.close()
+
+
+def test_ingest_prices_every_bucket(priced):
+    conn, _ = priced
+    for table, rows in costs(conn).items():
+        assert rows and all(cost is not None for _, _, cost in rows), table
+    # Les tranches supérieures sont atteintes avant le changement de version
+    hourly = conn.execute('''
+        SELECT MAX(cost / energy_delta) FROM energy_rollup_1h
+        WHERE bucket < '2026-01-01' AND energy_delta > 0
+    ''').fetchone()[0]
+    assert hourly == pytest.approx(0.218)
+
+
+def test_full_reprice_matches_ingest(priced):
+    conn, schedule = priced
+    expected = costs(conn)
+    conn.execute('UPDATE energy_rollup_1h SET cost = NULL')
+    conn.execute('UPDATE energy_rollup_1m SET cost = NULL')
+    conn.execute('UPDATE energy_rollup_1d SET cost = NULL')
+    conn.commit()
+    result = tariffs.reprice(conn, schedule)
+    assert result['months'] == 3
+    assert_same_costs(costs(conn), expected)
+
+
+def test_partial_reprice_carries_month_to_date(priced, monkeypatch):
+    conn, schedule = priced
+    expected = costs(conn)
+    # Petits lots: la consommation du mois est reportée d'un lot au suivant
+    monkeypatch.setattr(tariffs, 'REPRICE_CHUNK_ROWS', 500)
+    for table in rollups.ROLLUP_TABLES:
+        conn.execute(f"UPDATE {table} SET cost = NULL WHERE bucket >= '2025-12-17'")
+    conn.commit()
+    # Période commencée en cours de mois: le début du mois est relu dans les agrégats horaires
+    result = tariffs.reprice(conn, schedule, start='2025-12-17')
+    assert result['chunks'] > result['months']
+    assert_same_costs(costs(conn), expected)
@@ -0,0 +1,455 @@
+"""
+PDS-32: Stockage des séries temporelles brutes - interface commune, moteur SQLite
+(tables existantes) et moteur à segments colonnes (NumPy, partitions jour/appareil)
+"""
+
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+# Colonnes stockées par table (ordre des lignes d'ingestion après timestamp, device_id).
+# Compteur energy_total en float64: en float32, les deltas d'un compteur à 5 chiffres
+# perdraient leur précision.
+SCHEMAS = {
+    'energy_data': (
+        ('power', '<f4'), ('voltage', '<f4'), ('current', '<f4'),
+        ('energy_total', '<f8'), ('cost', '<f4'),
+    ),
+    'sensor_readings': (
+        ('temperature', '<f4'), ('humidity', '<f4'), ('light_level', '<f4'),
+    ),
+}
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+DAY_SECONDS = 86400
+
+# Requêtes d'insertion par table (une seule instruction préparée par table)
+INSERT_STATEMENTS = {
+    'energy_data': '''
+        INSERT INTO energy_data (timestamp, device_id, power, voltage, current, energy_total, cost)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''',
+    'sensor_readings': '''
+        INSERT INTO sensor_readings (timestamp, device_id, temperature, humidity, light_level)
+        VALUES (?, ?, ?, ?, ?)
+    ''',
+    'presence_data': '''
+        INSERT INTO presence_data (timestamp, device_id, presence)
+        VALUES (?, ?, ?)
+    ''',
+    'actuator_states': '''
+        INSERT INTO actuator_states (timestamp, device_id, relay1, relay2, window, auto_mode)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''',
+}
+
+
+class StorageError(ValueError):
+    """Table ou colonne inconnue du stockage de séries"""
+
+
+def _epoch(value):
+    """datetime naïf UTC -> secondes"""
+    return int(value.replace(tzinfo=timezone.utc).timestamp())
+
+
+def _check(table, columns):
+    schema = dict(SCHEMAS.get(table, ()))
+    if not schema:
+        raise StorageError(f"Unknown table: {table}")
+    for column in columns:
+        if column not in schema:
+            raise StorageError(f"Unknown column: {table}.{column}")
+
+
+def _result(names, device_idx, epoch, values):
+    """Forme commune des lectures: noms triés des appareils et indices 0..k-1 par ligne"""
+    names, inverse = np.unique(names, return_inverse=True)
+    data = {'device_names': names, 'device_idx': inverse[device_idx], 'epoch': epoch}
+    data.update(values)
+    return data
+
+
+class TimeSeriesStore:
+    """Interface des moteurs de séries brutes
+
+    - append(rows_by_table): lignes (timestamp, device_id, valeurs...) d'un lot commité
+    - load(table, start, end, devices, columns): colonnes NumPy sur [start, end)
+      -> {'device_names', 'device_idx', 'epoch', <colonnes>} ou None
+    - first_time(table): premier horodatage disponible (str UTC) ou None
+    - stats(): taille sur disque et volumétrie
+    """
+
+    name = None
+    # Budget de lignes au-delà duquel l'analyse bascule sur les agrégats
+    max_scan_rows = 200000
+
+    def append(self, rows_by_table):
+        raise NotImplementedError
+
+    def load(self, table, start, end, devices=None, columns=()):
+        raise NotImplementedError
+
+    def first_time(self, table):
+        raise NotImplementedError
+
+    def stats(self):
+        return {'backend': self.name}
+
+
+class SQLiteStore(TimeSeriesStore):
+    """Tables brutes existantes (une ligne REAL par mesure), écrites par le pipeline d'ingestion"""
+
+    name = 'sqlite'
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    @classmethod
+    def from_connection(cls, conn):
+        """Moteur sur une connexion déjà ouverte (appelants sans pool)"""
+        return cls(_SingleConnection(conn))
+
+    @staticmethod
+    def write(conn, rows_by_table):
+        """Insère les lignes brutes d'un lot dans la transaction ouverte de `conn`: chemin
+        d'écriture de toutes les mesures (écrivain d'ingestion, quel que soit le moteur de lecture)"""
+        for table, rows in rows_by_table.items():
+            conn.executemany(INSERT_STATEMENTS[table], rows)
+
+    def append(self, rows_by_table):
+        # Les lignes sont déjà dans les tables brutes (write, même transaction que les agrégats)
+        return 0
+
+    def load(self, table, start, end, devices=None, columns=()):
+        _check(table, columns)
+        device_filter, params = '', [start.strftime(TIMESTAMP_FORMAT), end.strftime(TIMESTAMP_FORMAT)]
+        if devices:
+            device_filter = f" AND device_id IN ({','.join('?' * len(devices))})"
+            params += list(devices)
+        with self.pool.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT device_id, timestamp{''.join(', ' + c for c in columns)}
+                FROM {table}
+                WHERE timestamp >= ? AND timestamp < ?{device_filter}
+            ''', params).fetchall()
+        if not rows:
+            return None
+        fields = list(zip(*rows))
+        names, device_idx = np.unique(np.array(fields[0], dtype=object).astype(str), return_inverse=True)
+        values = {column: np.array(fields[2 + i], dtype=float) for i, column in enumerate(columns)}
+        return _result(names, device_idx, np.array(fields[1], dtype='datetime64[s]').astype(np.int64), values)
+
+    def first_time(self, table):
+        with self.pool.connection() as conn:
+            return conn.execute(f'SELECT MIN(timestamp) FROM {table}').fetchone()[0]
+
+    def stats(self):
+        with self.pool.connection() as conn:
+            page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+            page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        return {'backend': self.name, 'database_bytes': page_count * page_size}
+
+
+class _SingleConnection:
+    """Connexion unique présentée comme un pool"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    @contextmanager
+    def connection(self):
+        yield self.conn
+
+
+class SegmentStore(TimeSeriesStore):
+    """Segments colonnes en ajout seul, partitionnés par jour puis par appareil
+
+    <root>/<table>/<YYYY-MM-DD>/
+        epoch.bin, device.bin, <colonne>.bin   jour ouvert: colonnes brutes en ajout
+        segment.npz                            jour scellé: trié par (appareil, temps),
+                                               compressé, offsets par appareil
+    <root>/devices.json                        dictionnaire appareil -> indice uint16
+
+    Un jour est scellé dès qu'un lot d'un jour plus récent arrive. Une lecture
+    ne décompresse que les colonnes et les jours demandés; les jours scellés
+    (immuables) sont gardés en cache dans la limite de cache_bytes.
+    Plusieurs racines en lecture: une par shard d'ingestion (écriture sur la première).
+    """
+
+    name = 'segments'
+    max_scan_rows = 20000000
+
+    def __init__(self, roots, cache_bytes=256 * 1024 * 1024):
+        self.roots = [roots] if isinstance(roots, str) else list(roots)
+        self.root = self.roots[0]
+        self.cache_bytes = cache_bytes
+        # Réentrant: le scellement est appelé pendant un ajout
+        self._lock = threading.RLock()
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self._open_days = {}
+        self._dictionaries = {}
+        os.makedirs(self.root, exist_ok=True)
+        self._devices = self._read_devices(self.root)
+
+    # ---------- Dictionnaire des appareils ----------
+    @staticmethod
+    def _read_devices(root):
+        path = os.path.join(root, 'devices.json')
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return {name: i for i, name in enumerate(json.load(f))}
+
+    def _dictionary(self, root):
+        """Noms des appareils d'une racine par indice (relu si un autre processus l'a modifié)"""
+        path = os.path.join(root, 'devices.json')
+        if not os.path.exists(path):
+            return []
+        mtime = os.path.getmtime(path)
+        cached = self._dictionaries.get(root)
+        if cached is None or cached[0] != mtime:
+            dictionary = self._read_devices(root)
+            cached = self._dictionaries[root] = (mtime, sorted(dictionary, key=dictionary.get))
+        return cached[1]
+
+    def _device_index(self, names):
+        """Indices uint16 des appareils d'un lot (nouveaux appareils ajoutés au dictionnaire)"""
+        added = False
+        for name in names:
+            if name not in self._devices:
+                self._devices[name] = len(self._devices)
+                added = True
+        if added:
+            path = os.path.join(self.root, 'devices.json')
+            with open(path + '.tmp', 'w') as f:
+                json.dump(sorted(self._devices, key=self._devices.get), f)
+            os.replace(path + '.tmp', path)
+        return np.array([self._devices[name] for name in names], dtype='<u2')
+
+    # ---------- Écriture ----------
+    def append(self, rows_by_table):
+        """Ajoute les lignes d'un lot commité; scelle les jours révolus"""
+        written = 0
+        with self._lock:
+            for table, rows in rows_by_table.items():
+                if table not in SCHEMAS or not rows:
+                    continue
+                fields = list(zip(*rows))
+                epoch = np.array(fields[0], dtype='datetime64[s]').astype(np.int64)
+                device = self._device_index([str(d) for d in fields[1]])
+                values = [np.array(fields[2 + i], dtype=float) for i in range(len(SCHEMAS[table]))]
+                day = epoch // DAY_SECONDS
+                for d in np.unique(day):
+                    mask = day == d
+                    self._append_day(table, int(d), epoch[mask], device[mask], [v[mask] for v in values])
+                newest = int(day.max())
+                if self._open_days.get(table, newest) < newest:
+                    self._seal_before(table, newest)
+                self._open_days[table] = max(newest, self._open_days.get(table, newest))
+                written += len(rows)
+        return written
+
+    def _day_dir(self, root, table, day):
+        name = (datetime(1970, 1, 1) + timedelta(days=day)).strftime('%Y-%m-%d')
+        return os.path.join(root, table, name)
+
+    def _append_day(self, table, day, epoch, device, values):
+        directory = self._day_dir(self.root, table, day)
+        os.makedirs(directory, exist_ok=True)
+        columns = [('epoch', epoch.astype('<i8')), ('device', device)]
+        columns += [(name, v.astype(dtype)) for (name, dtype), v in zip(SCHEMAS[table], values)]
+        for name, array in columns:
+            with open(os.path.join(directory, name + '.bin'), 'ab') as f:
+                f.write(array.tobytes())
+
+    def _seal_before(self, table, day):
+        """Scelle les jours ouverts antérieurs à `day`"""
+        base = os.path.join(self.root, table)
+        if not os.path.isdir(base):
+            return
+        limit = self._day_dir(self.root, table, day)
+        for name in sorted(os.listdir(base)):
+            directory = os.path.join(base, name)
+            if directory < limit and os.path.exists(os.path.join(directory, 'epoch.bin')):
+                self.seal(table, directory)
+
+    def seal(self, table, directory):
+        """Réécrit un jour en segment compressé trié par (appareil, temps)"""
+        columns = self._read_open(table, directory, [name for name, _ in SCHEMAS[table]])
+        sealed = os.path.join(directory, 'segment.npz')
+        if os.path.exists(sealed):
+            with np.load(sealed) as previous:
+                old = self._expand(previous, [name for name, _ in SCHEMAS[table]])
+            columns = {k: np.concatenate([old[k], columns[k]]) for k in columns}
+        order = np.lexsort((columns['epoch'], columns['device']))
+        device = columns['device'][order]
+        day_start = int(columns['epoch'].min()) // DAY_SECONDS * DAY_SECONDS if len(order) else 0
+        devices = np.unique(device)
+        arrays = {
+            'day_start': np.array([day_start], dtype='<i8'),
+            # Secondes depuis le début du jour: 4 octets au lieu de 8, très compressibles une fois triées
+            'epoch': (columns['epoch'][order] - day_start).astype('<u4'),
+            'devices': devices.astype('<u2'),
+            'offsets': np.searchsorted(device, np.append(devices, np.iinfo(np.uint32).max)).astype('<u4'),
+        }
+        for name, dtype in SCHEMAS[table]:
+            arrays[name] = columns[name][order].astype(dtype)
+        np.savez_compressed(sealed + '.tmp.npz', **arrays)
+        os.replace(sealed + '.tmp.npz', sealed)
+        for name in ['epoch', 'device'] + [n for n, _ in SCHEMAS[table]]:
+            path = os.path.join(directory, name + '.bin')
+            if os.path.exists(path):
+                os.remove(path)
+        with self._lock:
+            self._evict(directory)
+
+    def seal_all(self, before=None):
+        """Scelle tous les jours ouverts antérieurs à `before` (aujourd'hui UTC par défaut)"""
+        day = _epoch(before or datetime.now(timezone.utc).replace(tzinfo=None)) // DAY_SECONDS
+        with self._lock:
+            for table in SCHEMAS:
+                self._seal_before(table, day)
+
+    def prune(self, days):
+        """Supprime les jours plus anciens que `days` jours; retourne le nombre de jours supprimés"""
+        limit = (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%d')
+        removed = 0
+        with self._lock:
+            for table in SCHEMAS:
+                base = os.path.join(self.root, table)
+                if not os.path.isdir(base):
+                    continue
+                for name in sorted(os.listdir(base)):
+                    if name >= limit:
+                        break
+                    shutil.rmtree(os.path.join(base, name))
+                    self._evict(os.path.join(base, name))
+                    removed += 1
+        return removed
+
+    # ---------- Lecture ----------
+    @staticmethod
+    def _read_open(table, directory, columns):
+        """Colonnes brutes d'un jour ouvert (longueur commune: un ajout interrompu est ignoré)"""
+        dtypes = dict(SCHEMAS[table], epoch='<i8', device='<u2')
+        arrays = {}
+        for name in ['epoch', 'device'] + list(columns):
+            path = os.path.join(directory, name + '.bin')
+            arrays[name] = np.fromfile(path, dtype=dtypes[name]) if os.path.exists(path) else np.empty(0, dtypes[name])
+        length = min(len(a) for a in arrays.values())
+        return {name: a[:length] for name, a in arrays.items()}
+
+    @staticmethod
+    def _expand(segment, columns):
+        """Segment scellé -> colonnes (epoch absolu, indice d'appareil par ligne)"""
+        counts = np.diff(segment['offsets'])
+        arrays = {
+            'epoch': segment['epoch'].astype(np.int64) + int(segment['day_start'][0]),
+            'device': np.repeat(segment['devices'], counts),
+        }
+        for name in columns:
+            arrays[name] = segment[name]
+        return arrays
+
+    def _sealed(self, table, directory, columns):
+        """Colonnes d'un jour scellé, via le cache (segment immuable tant que sa date
+        de modification ne change pas, y compris s'il est réécrit par un autre processus)"""
+        path = os.path.join(directory, 'segment.npz')
+        mtime = os.path.getmtime(path)
+        with self._lock:
+            cached = self._cache.get(directory)
+            if cached is not None and cached[0] != mtime:
+                self._evict(directory)
+                cached = None
+            if cached is not None and all(c in cached[1] for c in columns):
+                self._cache.move_to_end(directory)
+                return cached[1]
+        with np.load(path) as segment:
+            arrays = self._expand(segment, set(columns) | set(cached[1] if cached else ()))
+        with self._lock:
+            self._evict(directory)
+            self._cache[directory] = (mtime, arrays)
+            self._cached_bytes += sum(a.nbytes for a in arrays.values())
+            while self._cached_bytes > self.cache_bytes and len(self._cache) > 1:
+                _, (_, old) = self._cache.popitem(last=False)
+                self._cached_bytes -= sum(a.nbytes for a in old.values())
+        return arrays
+
+    def _evict(self, directory):
+        old = self._cache.pop(directory, None)
+        if old is not None:
+            self._cached_bytes -= sum(a.nbytes for a in old[1].values())
+
+    def load(self, table, start, end, devices=None, columns=()):
+        _check(table, columns)
+        start_epoch, end_epoch = _epoch(start), _epoch(end)
+        first_day, last_day = start_epoch // DAY_SECONDS, (end_epoch - 1) // DAY_SECONDS
+        wanted = set(devices) if devices else None
+
+        parts, names, offset = [], [], 0
+        for root in self.roots:
+            # Dictionnaire écrit avant les données: tout indice lu y figure
+            root_names = self._dictionary(root)
+            if not root_names:
+                continue
+            keep = None
+            if wanted is not None:
+                keep = np.array([name in wanted for name in root_names])
+                if not keep.any():
+                    continue
+            for day in range(first_day, last_day + 1):
+                directory = self._day_dir(root, table, day)
+                if not os.path.isdir(directory):
+                    continue
+                pieces = []
+                if os.path.exists(os.path.join(directory, 'segment.npz')):
+                    pieces.append(self._sealed(table, directory, columns))
+                if os.path.exists(os.path.join(directory, 'epoch.bin')):
+                    with self._lock:
+                        pieces.append(self._read_open(table, directory, columns))
+                for arrays in pieces:
+                    mask = (arrays['epoch'] >= start_epoch) & (arrays['epoch'] < end_epoch)
+                    if keep is not None:
+                        mask &= keep[arrays['device']]
+                    if not mask.any():
+                        continue
+                    part = {name: arrays[name][mask] for name in ['epoch'] + list(columns)}
+                    part['device'] = arrays['device'][mask].astype(np.int64) + offset
+                    parts.append(part)
+            names.extend(root_names)
+            offset += len(root_names)
+
+        if not parts:
+            return None
+        values = {name: np.concatenate([p[name] for p in parts]).astype(float) for name in columns}
+        return _result(np.array(names, dtype=str), np.concatenate([p['device'] for p in parts]),
+                       np.concatenate([p['epoch'] for p in parts]).astype(np.int64), values)
+
+    def first_time(self, table):
+        first = None
+        for root in self.roots:
+            base = os.path.join(root, table)
+            if os.path.isdir(base):
+                days = sorted(os.listdir(base))
+                if days and (first is None or days[0] < first):
+                    first = days[0]
+        return f"{first} 00:00:00" if first else None
+
+    def stats(self):
+        total, days = 0, 0
+        for root in self.roots:
+            for directory, _, files in os.walk(root):
+                total += sum(os.path.getsize(os.path.join(directory, f)) for f in files)
+                days += 'epoch.bin' in files or 'segment.npz' in files
+        with self._lock:
+            cached = self._cached_bytes
+        return {'backend': self.name, 'segment_bytes': total, 'days': days, 'cache_bytes': cached}
+